@@ -0,0 +1,217 @@
+"""
+HTTP-Server des LLM-Gateways.
+
+OpenAI-kompatibler Endpunkt, den API und Worker statt api.openai.com aufrufen
+(LLM_GATEWAY_URL, siehe utils/llm_backend.py in beiden Diensten):
+
+    POST /v1/chat/completions   Chat-Completion (auch "stream": true, als SSE durchgereicht)
+    GET  /v1/usage              Nutzungszähler je Modell und Aufrufer
+    GET  /ping                  Liveness
+    GET  /health                Zustand (Cache, laufende Anfragen, Upstream)
+
+Header der Anfrage:
+    Authorization: Bearer <GATEWAY_TOKEN>   nur wenn GATEWAY_TOKEN gesetzt ist
+    X-Gateway-Cache: use                    Antwort aus dem Cache lesen bzw. ablegen
+    X-Gateway-Caller: api|worker|...        Aufrufer für die Nutzungszähler
+
+Header der Antwort:
+    X-Gateway-Cache: hit|miss|coalesced|bypass
+
+Der Server nutzt nur die Standardbibliothek (ThreadingHTTPServer, ein Thread
+pro Verbindung); die Upstream-Verbindungen teilen sich einen httpx-Pool.
+
+Aufruf:
+    python app.py --port 8090
+"""
+import argparse
+import hmac
+import json
+import logging
+import os
+import sys
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, Optional
+
+sys.path.insert(0, os.path.abspath(os.path.dirname(__file__)))
+
+from gateway import Gateway  # noqa: E402
+from rate_limit import RateLimitExceeded  # noqa: E402
+from upstream import UpstreamError  # noqa: E402
+
+logger = logging.getLogger(__name__)
+
+GATEWAY_HOST = os.environ.get('GATEWAY_HOST', '0.0.0.0')
+GATEWAY_PORT = int(os.environ.get('GATEWAY_PORT', 8090))
+# Gemeinsames Geheimnis von API/Worker und Gateway (leer = keine Prüfung, nur im internen Netz)
+GATEWAY_TOKEN = os.environ.get('GATEWAY_TOKEN', '')
+# Größter angenommener Anfragekörper (Bytes)
+MAX_BODY_BYTES = int(os.environ.get('GATEWAY_MAX_BODY_BYTES', 8 * 1024 * 1024))
+
+
+def _error_body(message: str, code: Optional[str] = None, error_type: str = 'gateway_error') -> Dict[str, Any]:
+    """Fehlerobjekt im Format der OpenAI-API, damit Clients es unverändert auswerten."""
+    return {'error': {'message': message, 'type': error_type, 'code': code}}
+
+
+def make_handler(gateway: Gateway, token: str = GATEWAY_TOKEN):
+    """Erzeugt die Handler-Klasse für eine Gateway-Instanz."""
+
+    class GatewayHandler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+        server_version = 'HackTheStudyLLMGateway/1.0'
+
+        def log_message(self, format, *args):  # noqa: A002 - Signatur der Basisklasse
+            logger.debug("[GATEWAY] " + format % args)
+
+        def _send_json(self, status: int, payload: Dict[str, Any], headers: Optional[Dict[str, str]] = None):
+            data = json.dumps(payload).encode('utf-8')
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(data)))
+            for name, value in (headers or {}).items():
+                self.send_header(name, value)
+            self.end_headers()
+            self.wfile.write(data)
+
+        def _authorized(self) -> bool:
+            if not token:
+                return True
+            supplied = self.headers.get('Authorization', '')
+            return hmac.compare_digest(supplied, f"Bearer {token}")
+
+        def do_GET(self):
+            if self.path == '/ping':
+                self._send_json(200, {'status': 'ok'})
+            elif self.path == '/health':
+                self._send_json(200, {
+                    'status': 'ok',
+                    'upstream': gateway.upstream.base_url,
+                    'cache_entries': len(gateway.cache),
+                    'in_flight': gateway.limiter.in_flight,
+                })
+            elif self.path == '/v1/usage':
+                if not self._authorized():
+                    self._send_json(401, _error_body('Ungültiges Gateway-Token', 'invalid_api_key'))
+                    return
+                self._send_json(200, gateway.usage.snapshot())
+            else:
+                self._send_json(404, _error_body(f"Unbekannter Pfad {self.path}", 'not_found'))
+
+        def do_POST(self):
+            if self.path.rstrip('/') not in ('/v1/chat/completions', '/chat/completions'):
+                self._send_json(404, _error_body(f"Unbekannter Pfad {self.path}", 'not_found'))
+                return
+            if not self._authorized():
+                self._send_json(401, _error_body('Ungültiges Gateway-Token', 'invalid_api_key'))
+                return
+
+            length = int(self.headers.get('Content-Length') or 0)
+            if length <= 0 or length > MAX_BODY_BYTES:
+                self._send_json(413 if length > 0 else 400, _error_body('Ungültige Anfragegröße', 'invalid_request_error'))
+                return
+            try:
+                body = json.loads(self.rfile.read(length))
+            except ValueError:
+                self._send_json(400, _error_body('Ungültiges JSON', 'invalid_request_error'))
+                return
+            if not isinstance(body, dict) or not body.get('model') or not body.get('messages'):
+                self._send_json(400, _error_body("'model' und 'messages' sind erforderlich", 'invalid_request_error'))
+                return
+
+            caller = self.headers.get('X-Gateway-Caller') or self.client_address[0]
+            use_cache = self.headers.get('X-Gateway-Cache', '').lower() == 'use'
+            try:
+                if body.get('stream'):
+                    self._stream(body, caller)
+                    return
+                response, cache_status = gateway.complete(body, caller=caller, use_cache=use_cache)
+            except RateLimitExceeded as e:
+                self._send_json(429, _error_body(str(e), 'rate_limit_exceeded', 'rate_limit_error'),
+                                {'Retry-After': str(max(1, round(e.retry_after)))})
+                return
+            except UpstreamError as e:
+                self._send_upstream_error(e)
+                return
+            self._send_json(200, response, {'X-Gateway-Cache': cache_status})
+
+        def _send_upstream_error(self, error: UpstreamError):
+            headers = {}
+            retry_after = getattr(getattr(error, 'response', None), 'headers', {}).get('retry-after')
+            if retry_after:
+                headers['Retry-After'] = retry_after
+            # Ohne Upstream-Antwort (Timeout, Verbindungsabbruch): 502, damit der Aufrufer wiederholt
+            payload = {'error': error.body} if error.body else _error_body(str(error), error.code)
+            self._send_json(error.status_code or 502, payload, headers)
+
+        def _stream(self, body: Dict[str, Any], caller: str):
+            """Reicht die SSE-Zeilen des Upstreams durch (chunked, ohne Pufferung)."""
+            lines = gateway.stream(body, caller=caller)
+            try:
+                # Die erste Zeile abwarten, damit Fehler vor Beginn noch als Statuscode ankommen
+                first = next(lines, None)
+            except RateLimitExceeded as e:
+                self._send_json(429, _error_body(str(e), 'rate_limit_exceeded', 'rate_limit_error'),
+                                {'Retry-After': str(max(1, round(e.retry_after)))})
+                return
+            except UpstreamError as e:
+                self._send_upstream_error(e)
+                return
+
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/event-stream')
+            self.send_header('Cache-Control', 'no-cache')
+            self.send_header('Transfer-Encoding', 'chunked')
+            self.send_header('X-Gateway-Cache', 'bypass')
+            self.end_headers()
+            try:
+                if first is not None:
+                    self._write_chunk(first)
+                for line in lines:
+                    self._write_chunk(line)
+            except (UpstreamError, RateLimitExceeded) as e:
+                # Status ist bereits gesendet; der Abbruch wird als Fehler-Event gemeldet
+                self._write_chunk('data: ' + json.dumps(_error_body(str(e), getattr(e, 'code', None))))
+            except (BrokenPipeError, ConnectionResetError):
+                logger.info(f"[GATEWAY] Client {caller} hat den Stream abgebrochen.")
+                lines.close()
+                return
+            self.wfile.write(b'0\r\n\r\n')
+
+        def _write_chunk(self, line: str):
+            # SSE: jede Zeile mit Zeilenumbruch, Leerzeilen trennen Events
+            data = (line + '\n').encode('utf-8')
+            self.wfile.write(f"{len(data):x}\r\n".encode('ascii') + data + b'\r\n')
+            self.wfile.flush()
+
+    return GatewayHandler
+
+
+def create_server(host: str = GATEWAY_HOST, port: int = GATEWAY_PORT, gateway: Optional[Gateway] = None,
+                  token: str = GATEWAY_TOKEN) -> ThreadingHTTPServer:
+    """Erzeugt den Gateway-Server (noch nicht gestartet)."""
+    server = ThreadingHTTPServer((host, port), make_handler(gateway or Gateway(), token))
+    server.daemon_threads = True
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--host', default=GATEWAY_HOST)
+    parser.add_argument('--port', type=int, default=GATEWAY_PORT)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=os.environ.get('LOG_LEVEL', 'INFO'),
+                        format='%(asctime)s %(levelname)s %(name)s: %(message)s')
+    gateway = Gateway()
+    server = create_server(args.host, args.port, gateway)
+    logger.info(f"[GATEWAY] Lauscht auf {args.host}:{args.port}, Upstream {gateway.upstream.base_url}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,169 @@
+#!/usr/bin/env python
+"""
+Benchmark: LLM-Gateway gegen direkte Upstream-Aufrufe.
+
+Startet den simulierten Upstream (fake_upstream.py) und das Gateway im selben
+Prozess und schickt dieselbe Last zweimal ab:
+
+    direkt   jeder Client-Thread ruft den Upstream selbst auf (eigener Client,
+             bis zu zwei Wiederholungen mit Retry-After, wie bisher pro Prozess)
+    gateway  alle Client-Threads gehen über das Gateway (gemeinsamer Pool,
+             Cache, Single-Flight, globales Limit, Wiederholungen)
+
+Ein Anteil der Anfragen (--duplicates) verwendet Prompts aus einem kleinen
+Pool und fordert den Cache an, wie wiederholte Uploads desselben Dokuments.
+Ausgegeben werden Upstream-Anfragen, injizierte 429, höchste Parallelität am
+Upstream, beim Client angekommene Fehler und Latenzen.
+
+Aufruf:
+    python benchmarks/gateway_load.py --requests 400 --clients 40 --duplicates 0.5 --rate-429 0.1
+"""
+import argparse
+import logging
+import os
+import random
+import statistics
+import sys
+import threading
+import time
+
+import httpx
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from app import create_server as create_gateway_server  # noqa: E402
+from fake_upstream import FakeUpstreamState, create_server as create_upstream_server  # noqa: E402
+from gateway import Gateway, ResponseCache, UsageRecorder  # noqa: E402
+from rate_limit import RateLimiter  # noqa: E402
+from upstream import UpstreamClient  # noqa: E402
+
+DIRECT_MAX_RETRIES = 2
+
+
+def build_requests(count, duplicates, pool_size, seed):
+    """Liste von (Anfrage, Cache gewünscht); Duplikate stammen aus einem kleinen Prompt-Pool."""
+    rng = random.Random(seed)
+    requests = []
+    for index in range(count):
+        if rng.random() < duplicates:
+            prompt = f"Erstelle Lernkarten zu Dokument {rng.randrange(pool_size)}. " + 'Inhalt ' * 200
+            use_cache = True
+        else:
+            prompt = f"Einmalige Anfrage {index}. " + 'Inhalt ' * 200
+            use_cache = False
+        requests.append(({'model': 'gpt-4o-mini', 'temperature': 0 if use_cache else 0.7, 'max_tokens': 200,
+                          'messages': [{'role': 'user', 'content': prompt}]}, use_cache))
+    return requests
+
+
+def start(server):
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return f"http://127.0.0.1:{server.server_address[1]}"
+
+
+def run_load(requests, clients, send):
+    """Verteilt die Anfragen auf Client-Threads. Rückgabe: (Latenzen in ms, Fehler, Dauer in s)."""
+    latencies, errors = [], []
+    lock = threading.Lock()
+    queue = list(enumerate(requests))
+
+    def worker():
+        with httpx.Client(timeout=120) as client:
+            while True:
+                with lock:
+                    if not queue:
+                        return
+                    _, (body, use_cache) = queue.pop()
+                started = time.perf_counter()
+                status = send(client, body, use_cache)
+                elapsed = (time.perf_counter() - started) * 1000
+                with lock:
+                    latencies.append(elapsed)
+                    if status != 200:
+                        errors.append(status)
+
+    started = time.perf_counter()
+    threads = [threading.Thread(target=worker) for _ in range(clients)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return latencies, errors, time.perf_counter() - started
+
+
+def send_direct(upstream_url):
+    def send(client, body, use_cache):
+        for attempt in range(DIRECT_MAX_RETRIES + 1):
+            response = client.post(f"{upstream_url}/v1/chat/completions", json=body)
+            if response.status_code not in (429, 500) or attempt == DIRECT_MAX_RETRIES:
+                return response.status_code
+            retry_after = response.headers.get('retry-after-ms')
+            time.sleep(float(retry_after) / 1000 if retry_after else 0.5 * 2 ** attempt)
+        return response.status_code
+    return send
+
+
+def send_gateway(gateway_url):
+    def send(client, body, use_cache):
+        headers = {'X-Gateway-Caller': 'benchmark'}
+        if use_cache:
+            headers['X-Gateway-Cache'] = 'use'
+        return client.post(f"{gateway_url}/v1/chat/completions", json=body, headers=headers).status_code
+    return send
+
+
+def report(name, latencies, errors, duration, stats):
+    latencies = sorted(latencies)
+    p95 = latencies[int(len(latencies) * 0.95) - 1] if latencies else 0.0
+    print(f"\n{name}:")
+    print(f"  Dauer {duration:.1f}s, Latenz p50 {statistics.median(latencies):.0f} ms, p95 {p95:.0f} ms")
+    print(f"  Upstream: {stats['requests']} Anfragen, {stats['errors_429']} x 429, {stats['errors_500']} x 500, "
+          f"höchstens {stats['max_in_flight']} gleichzeitig, "
+          f"{stats['prompt_tokens'] + stats['completion_tokens']} Tokens")
+    print(f"  Beim Client gescheitert: {len(errors)}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--requests', type=int, default=400)
+    parser.add_argument('--clients', type=int, default=40, help='Gleichzeitige Client-Threads (Prozesse)')
+    parser.add_argument('--duplicates', type=float, default=0.5, help='Anteil wiederholter, cachebarer Anfragen')
+    parser.add_argument('--pool', type=int, default=20, help='Anzahl unterschiedlicher Duplikat-Prompts')
+    parser.add_argument('--latency-ms', type=float, default=100.0, help='Latenz des simulierten Upstreams')
+    parser.add_argument('--rate-429', type=float, default=0.1, help='Anteil der Upstream-Antworten mit 429')
+    parser.add_argument('--rate-500', type=float, default=0.02, help='Anteil der Upstream-Antworten mit 500')
+    parser.add_argument('--max-concurrency', type=int, default=16, help='Parallelitätslimit des Gateways')
+    parser.add_argument('--seed', type=int, default=7)
+    args = parser.parse_args()
+
+    # Wiederholungen des Gateways nicht einzeln ausgeben
+    logging.basicConfig(level=logging.ERROR)
+    state = FakeUpstreamState(args.latency_ms, args.rate_429, args.rate_500, seed=args.seed)
+    upstream_url = start(create_upstream_server('127.0.0.1', 0, state))
+    requests = build_requests(args.requests, args.duplicates, args.pool, args.seed)
+    print(f"{len(requests)} Anfragen, {args.clients} Clients, {args.duplicates:.0%} Duplikate aus {args.pool} Prompts, "
+          f"Upstream {args.latency_ms:.0f} ms, {args.rate_429:.0%} 429, {args.rate_500:.0%} 500")
+
+    latencies, errors, duration = run_load(requests, args.clients, send_direct(upstream_url))
+    report('Direkt', latencies, errors, duration, state.stats())
+
+    state.reset()
+    gateway = Gateway(
+        upstream=UpstreamClient(base_url=f"{upstream_url}/v1", api_key=''),
+        limiter=RateLimiter(requests_per_minute=0, tokens_per_minute=0, max_concurrency=args.max_concurrency,
+                            wait_seconds=60),
+        cache=ResponseCache(),
+        usage=UsageRecorder(usage_file=''),
+        max_retries=4,
+    )
+    gateway_url = start(create_gateway_server('127.0.0.1', 0, gateway, token=''))
+    latencies, errors, duration = run_load(requests, args.clients, send_gateway(gateway_url))
+    report('Gateway', latencies, errors, duration, state.stats())
+    totals = gateway.usage.snapshot()['totals']
+    print(f"  Gateway: {totals['cache_hits']} Cache-Treffer, {totals['coalesced']} zusammengelegt, "
+          f"{totals['retries']} Wiederholungen, {totals['saved_tokens']} Tokens eingespart")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,186 @@
+"""
+Simulierter OpenAI-kompatibler Upstream für Benchmarks und lokale Versuche.
+
+Antwortet auf POST /v1/chat/completions nach einer einstellbaren Latenz mit
+einer deterministischen Antwort (auch gestreamt) und injiziert auf Wunsch
+Fehler: einen Anteil von 429 (mit Retry-After) bzw. 500. GET /stats liefert
+die Anzahl der Anfragen, der injizierten Fehler und die höchste Zahl
+gleichzeitig laufender Anfragen; POST /stats/reset setzt sie zurück.
+
+Aufruf:
+    python fake_upstream.py --port 8091 --latency-ms 300 --rate-429 0.1
+"""
+import argparse
+import json
+import os
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict
+
+
+class FakeUpstreamState:
+    """Einstellungen und Zähler des simulierten Upstreams."""
+
+    def __init__(self, latency_ms: float = 200.0, rate_429: float = 0.0, rate_500: float = 0.0,
+                 retry_after: float = 0.2, seed: int = 0):
+        self.latency_ms = latency_ms
+        self.rate_429 = rate_429
+        self.rate_500 = rate_500
+        self.retry_after = retry_after
+        self.rng = random.Random(seed)
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.requests = 0
+            self.errors_429 = 0
+            self.errors_500 = 0
+            self.in_flight = 0
+            self.max_in_flight = 0
+            self.prompt_tokens = 0
+            self.completion_tokens = 0
+
+    def stats(self) -> Dict[str, Any]:
+        with self.lock:
+            return {
+                'requests': self.requests, 'errors_429': self.errors_429, 'errors_500': self.errors_500,
+                'max_in_flight': self.max_in_flight, 'prompt_tokens': self.prompt_tokens,
+                'completion_tokens': self.completion_tokens,
+            }
+
+
+def _answer(body: Dict[str, Any]) -> str:
+    prompt = ' '.join(str(m.get('content', '')) for m in body.get('messages') or [] if isinstance(m, dict))
+    return f"Antwort auf {len(prompt)} Zeichen: " + prompt[:40]
+
+
+def make_handler(state: FakeUpstreamState):
+
+    class FakeUpstreamHandler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def log_message(self, format, *args):  # noqa: A002 - Signatur der Basisklasse
+            pass
+
+        def _send_json(self, status: int, payload: Dict[str, Any], headers: Dict[str, str] = None):
+            data = json.dumps(payload).encode('utf-8')
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(data)))
+            for name, value in (headers or {}).items():
+                self.send_header(name, value)
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_GET(self):
+            if self.path == '/stats':
+                self._send_json(200, state.stats())
+            else:
+                self._send_json(404, {'error': {'message': 'not found', 'code': 'not_found'}})
+
+        def do_POST(self):
+            length = int(self.headers.get('Content-Length') or 0)
+            raw = self.rfile.read(length) if length else b''
+            if self.path == '/stats/reset':
+                state.reset()
+                self._send_json(200, {'status': 'ok'})
+                return
+            if self.path.rstrip('/') not in ('/v1/chat/completions', '/chat/completions'):
+                self._send_json(404, {'error': {'message': 'not found', 'code': 'not_found'}})
+                return
+            body = json.loads(raw or b'{}')
+
+            with state.lock:
+                state.requests += 1
+                state.in_flight += 1
+                state.max_in_flight = max(state.max_in_flight, state.in_flight)
+                roll = state.rng.random()
+            try:
+                time.sleep(state.latency_ms / 1000)
+                if roll < state.rate_429:
+                    with state.lock:
+                        state.errors_429 += 1
+                    self._send_json(429, {'error': {'message': 'Rate limit reached', 'type': 'requests',
+                                                    'code': 'rate_limit_exceeded'}},
+                                    {'retry-after-ms': str(int(state.retry_after * 1000))})
+                    return
+                if roll < state.rate_429 + state.rate_500:
+                    with state.lock:
+                        state.errors_500 += 1
+                    self._send_json(500, {'error': {'message': 'Internal server error', 'type': 'server_error',
+                                                    'code': None}})
+                    return
+
+                content = _answer(body)
+                usage = {
+                    'prompt_tokens': sum(len(str(m.get('content', ''))) for m in body.get('messages') or []) // 4 + 1,
+                    'completion_tokens': len(content) // 4 + 1,
+                }
+                usage['total_tokens'] = usage['prompt_tokens'] + usage['completion_tokens']
+                with state.lock:
+                    state.prompt_tokens += usage['prompt_tokens']
+                    state.completion_tokens += usage['completion_tokens']
+                if body.get('stream'):
+                    self._stream(body, content, usage)
+                    return
+                self._send_json(200, {
+                    'id': f"chatcmpl-fake-{state.requests}",
+                    'object': 'chat.completion',
+                    'model': body.get('model'),
+                    'choices': [{'index': 0, 'message': {'role': 'assistant', 'content': content},
+                                 'finish_reason': 'stop'}],
+                    'usage': usage,
+                })
+            finally:
+                with state.lock:
+                    state.in_flight -= 1
+
+        def _stream(self, body: Dict[str, Any], content: str, usage: Dict[str, int]):
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/event-stream')
+            self.send_header('Transfer-Encoding', 'chunked')
+            self.end_headers()
+            chunks = [{'choices': [{'index': 0, 'delta': {'content': word + ' '}, 'finish_reason': None}]}
+                      for word in content.split(' ')]
+            chunks.append({'choices': [{'index': 0, 'delta': {}, 'finish_reason': 'stop'}]})
+            if (body.get('stream_options') or {}).get('include_usage'):
+                chunks.append({'choices': [], 'usage': usage})
+            events = [f"data: {json.dumps(dict(chunk, model=body.get('model')))}\n\n" for chunk in chunks]
+            events.append("data: [DONE]\n\n")
+            for event in events:
+                data = event.encode('utf-8')
+                self.wfile.write(f"{len(data):x}\r\n".encode('ascii') + data + b'\r\n')
+            self.wfile.write(b'0\r\n\r\n')
+
+    return FakeUpstreamHandler
+
+
+def create_server(host: str = '127.0.0.1', port: int = 8091, state: FakeUpstreamState = None) -> ThreadingHTTPServer:
+    server = ThreadingHTTPServer((host, port), make_handler(state or FakeUpstreamState()))
+    server.daemon_threads = True
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=int(os.environ.get('FAKE_UPSTREAM_PORT', 8091)))
+    parser.add_argument('--latency-ms', type=float, default=200.0)
+    parser.add_argument('--rate-429', type=float, default=0.0, help='Anteil der Anfragen mit 429')
+    parser.add_argument('--rate-500', type=float, default=0.0, help='Anteil der Anfragen mit 500')
+    args = parser.parse_args()
+    server = create_server(args.host, args.port,
+                           FakeUpstreamState(args.latency_ms, args.rate_429, args.rate_500))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,368 @@
+"""
+Kern des LLM-Gateways: Cache, Single-Flight, Limits, Wiederholungen und Nutzung.
+
+Vorher hielt jeder API- und Worker-Prozess eigene OpenAI-Clients, eigene
+Caches (OpenAICache, Redis-Antwortcache), eigene Wiederholungslogik und kein
+gemeinsames Rate-Limit. Das Gateway bündelt diese Aufgaben an einer Stelle:
+
+- Antwort-Cache: LRU mit TTL im Speicher. Nur Anfragen mit dem Header
+  `X-Gateway-Cache: use` werden gelesen bzw. abgelegt, weil identische
+  Anfragen mit Temperatur > 0 sonst stets dieselbe Antwort erhielten.
+- Single-Flight: identische, gleichzeitig laufende Anfragen (mit Cache oder
+  Temperatur 0) gehen nur einmal an den Upstream; alle Wartenden erhalten
+  dieselbe Antwort.
+- Limits: globales Anfragen-, Token- und Parallelitätslimit (rate_limit.py).
+- Wiederholungen: vorübergehende Fehler (utils/openai_errors.py) mit
+  Full-Jitter-Backoff bzw. Retry-After; Streams nur vor dem ersten Chunk.
+- Nutzung: Zähler je Modell und Aufrufer (X-Gateway-Caller), eine Logzeile pro
+  Anfrage und optional eine JSONL-Datei (GATEWAY_USAGE_FILE). Die
+  Guthabenabrechnung pro Benutzer bleibt in API und Worker, weil nur sie den
+  Benutzer kennen.
+"""
+import hashlib
+import json
+import logging
+import os
+import random
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Iterator, Optional, Tuple
+
+from rate_limit import RateLimiter, RateLimitExceeded
+from upstream import UpstreamClient, UpstreamError, usage_from_stream_line
+from utils.openai_errors import is_retryable_error, retry_after_seconds
+
+logger = logging.getLogger(__name__)
+
+# Lebensdauer eines Cache-Eintrags (Sekunden)
+CACHE_TTL = int(os.environ.get('GATEWAY_CACHE_TTL', 86400))
+# Höchstzahl der Cache-Einträge (älteste werden verdrängt)
+CACHE_MAX_ENTRIES = int(os.environ.get('GATEWAY_CACHE_MAX_ENTRIES', 5000))
+# Wiederholungen vorübergehender Upstream-Fehler
+MAX_RETRIES = int(os.environ.get('GATEWAY_MAX_RETRIES', 4))
+# Gesamtzeit für Wiederholungen einer Anfrage (Sekunden)
+RETRY_MAX_TIME = float(os.environ.get('GATEWAY_RETRY_MAX_TIME', 60))
+# Basis und Obergrenze des exponentiellen Backoffs (Sekunden)
+RETRY_BASE_DELAY = float(os.environ.get('GATEWAY_RETRY_BASE_DELAY', 1))
+RETRY_MAX_DELAY = float(os.environ.get('GATEWAY_RETRY_MAX_DELAY', 20))
+# Angenommene Antwortlänge, wenn die Anfrage kein max_tokens setzt (für das Token-Limit)
+DEFAULT_COMPLETION_TOKENS = int(os.environ.get('GATEWAY_DEFAULT_COMPLETION_TOKENS', 1000))
+# Optionale JSONL-Datei mit einem Eintrag pro Anfrage
+USAGE_FILE = os.environ.get('GATEWAY_USAGE_FILE', '')
+
+
+def request_key(body: Dict[str, Any]) -> str:
+    """Schlüssel einer Anfrage (SHA-256 des kanonischen JSON ohne Stream-Optionen)."""
+    canonical = {k: v for k, v in body.items() if k not in ('stream', 'stream_options')}
+    return hashlib.sha256(
+        json.dumps(canonical, sort_keys=True, separators=(',', ':'), ensure_ascii=False).encode('utf-8')
+    ).hexdigest()
+
+
+def estimate_tokens(body: Dict[str, Any]) -> int:
+    """Grobe Token-Schätzung einer Anfrage (4 Zeichen pro Token plus erwartete Antwort)."""
+    chars = 0
+    for message in body.get('messages') or []:
+        content = message.get('content') if isinstance(message, dict) else None
+        if isinstance(content, str):
+            chars += len(content)
+        elif isinstance(content, list):
+            chars += sum(len(part.get('text') or '') for part in content if isinstance(part, dict))
+    max_tokens = body.get('max_tokens') or body.get('max_completion_tokens') or DEFAULT_COMPLETION_TOKENS
+    return chars // 4 + int(max_tokens)
+
+
+def _total_tokens(usage: Optional[Dict[str, Any]]) -> int:
+    if not isinstance(usage, dict):
+        return 0
+    return int(usage.get('total_tokens') or
+               (usage.get('prompt_tokens') or 0) + (usage.get('completion_tokens') or 0))
+
+
+class ResponseCache:
+    """Threadsicherer LRU-Cache mit TTL für vollständige Antworten."""
+
+    def __init__(self, ttl: int = CACHE_TTL, max_entries: int = CACHE_MAX_ENTRIES):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries: 'OrderedDict[str, Tuple[float, Dict[str, Any]]]' = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires, response = entry
+            if expires < time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return response
+
+    def set(self, key: str, response: Dict[str, Any]):
+        if self.max_entries <= 0 or self.ttl <= 0:
+            return
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, response)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class _Flight:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error: Optional[BaseException] = None
+
+
+class SingleFlight:
+    """Führt gleichzeitige Aufrufe mit gleichem Schlüssel nur einmal aus."""
+
+    def __init__(self):
+        self._flights: Dict[str, _Flight] = {}
+        self._lock = threading.Lock()
+
+    def do(self, key: str, fn: Callable[[], Any]) -> Tuple[Any, bool]:
+        """
+        Returns:
+            tuple: (Ergebnis, True wenn dieser Aufruf fn ausgeführt hat)
+
+        Raises:
+            Den Fehler von fn, auch für alle Wartenden
+        """
+        with self._lock:
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = _Flight()
+        if not leader:
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.result, False
+        try:
+            flight.result = fn()
+            return flight.result, True
+        except BaseException as e:
+            flight.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._flights[key]
+            flight.done.set()
+
+
+class UsageRecorder:
+    """Nutzungszähler je Modell und Aufrufer, optional als JSONL-Protokoll."""
+
+    COUNTERS = ('requests', 'upstream_calls', 'prompt_tokens', 'completion_tokens', 'cached_tokens',
+                'cache_hits', 'coalesced', 'saved_tokens', 'retries', 'errors', 'rate_limited')
+
+    def __init__(self, usage_file: str = USAGE_FILE):
+        self.usage_file = usage_file
+        self._lock = threading.Lock()
+        self._totals = dict.fromkeys(self.COUNTERS, 0)
+        self._by_model: Dict[str, Dict[str, int]] = {}
+        self._by_caller: Dict[str, Dict[str, int]] = {}
+
+    def _add(self, model: str, caller: str, **counts: int):
+        for bucket in (self._totals,
+                       self._by_model.setdefault(model, dict.fromkeys(self.COUNTERS, 0)),
+                       self._by_caller.setdefault(caller, dict.fromkeys(self.COUNTERS, 0))):
+            for name, value in counts.items():
+                bucket[name] += value
+
+    def record(self, model: str, caller: str, cache_status: str, usage: Optional[Dict[str, Any]] = None,
+               latency_ms: float = 0.0, retries: int = 0, error: Optional[str] = None, rate_limited: bool = False):
+        """
+        Verbucht eine Anfrage.
+
+        Token werden nur für tatsächliche Upstream-Aufrufe gezählt; bei Cache-Treffern
+        und zusammengelegten Anfragen erscheinen sie unter saved_tokens.
+        """
+        usage = usage if isinstance(usage, dict) else {}
+        upstream = cache_status in ('miss', 'bypass', 'stream') and error is None
+        details = usage.get('prompt_tokens_details') or {}
+        counts = {
+            'requests': 1,
+            'upstream_calls': 1 if upstream else 0,
+            'prompt_tokens': int(usage.get('prompt_tokens') or 0) if upstream else 0,
+            'completion_tokens': int(usage.get('completion_tokens') or 0) if upstream else 0,
+            'cached_tokens': int(details.get('cached_tokens') or 0) if upstream else 0,
+            'cache_hits': 1 if cache_status == 'hit' else 0,
+            'coalesced': 1 if cache_status == 'coalesced' else 0,
+            'saved_tokens': _total_tokens(usage) if cache_status in ('hit', 'coalesced') else 0,
+            'retries': retries,
+            'errors': 1 if error and not rate_limited else 0,
+            'rate_limited': 1 if rate_limited else 0,
+        }
+        with self._lock:
+            self._add(model or 'unknown', caller or 'unknown', **counts)
+
+        logger.info(f"[GATEWAY] {caller} {model} cache={cache_status} tokens={_total_tokens(usage)} "
+                    f"retries={retries} {latency_ms:.0f}ms" + (f" Fehler: {error}" if error else ""))
+        if self.usage_file:
+            entry = {'ts': time.time(), 'model': model, 'caller': caller, 'cache': cache_status,
+                     'prompt_tokens': usage.get('prompt_tokens'), 'completion_tokens': usage.get('completion_tokens'),
+                     'latency_ms': round(latency_ms, 1), 'retries': retries, 'error': error}
+            try:
+                with self._lock, open(self.usage_file, 'a', encoding='utf-8') as f:
+                    f.write(json.dumps(entry) + '\n')
+            except OSError as e:
+                logger.warning(f"[GATEWAY] Nutzungsprotokoll nicht schreibbar: {e}")
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                'totals': dict(self._totals),
+                'by_model': {k: dict(v) for k, v in self._by_model.items()},
+                'by_caller': {k: dict(v) for k, v in self._by_caller.items()},
+            }
+
+
+class Gateway:
+    """Leitet Chat-Completions an den Upstream weiter."""
+
+    def __init__(self, upstream: Optional[UpstreamClient] = None, limiter: Optional[RateLimiter] = None,
+                 cache: Optional[ResponseCache] = None, usage: Optional[UsageRecorder] = None,
+                 max_retries: int = MAX_RETRIES, retry_max_time: float = RETRY_MAX_TIME):
+        self.upstream = upstream or UpstreamClient()
+        self.limiter = limiter or RateLimiter()
+        self.cache = cache or ResponseCache()
+        self.usage = usage or UsageRecorder()
+        self.flights = SingleFlight()
+        self.max_retries = max_retries
+        self.retry_max_time = retry_max_time
+
+    def _retry_delay(self, error: BaseException, attempt: int, started: float) -> Optional[float]:
+        """Wartezeit vor der nächsten Wiederholung; None, wenn nicht (mehr) wiederholt wird."""
+        if attempt >= self.max_retries or not is_retryable_error(error):
+            return None
+        delay = retry_after_seconds(error)
+        if delay is None:
+            # Full Jitter: verteilt gleichzeitig gescheiterte Anfragen über das Intervall
+            delay = random.uniform(0, min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * 2 ** attempt))
+        if time.monotonic() - started + delay > self.retry_max_time:
+            return None
+        return delay
+
+    def _call_upstream(self, body: Dict[str, Any]) -> Tuple[Dict[str, Any], int]:
+        """Eine Completion mit Limits und Wiederholungen. Rückgabe: (Antwort, Wiederholungen)."""
+        started = time.monotonic()
+        estimate = estimate_tokens(body)
+        attempt = 0
+        while True:
+            try:
+                with self.limiter.acquire(estimate) as reservation:
+                    response = self.upstream.chat(body)
+                    reservation.settle(_total_tokens(response.get('usage')))
+                return response, attempt
+            except UpstreamError as e:
+                delay = self._retry_delay(e, attempt, started)
+                if delay is None:
+                    e.retries = attempt
+                    raise
+                attempt += 1
+                logger.warning(f"[GATEWAY] {e} – Wiederholung {attempt}/{self.max_retries} in {delay:.1f}s")
+                time.sleep(delay)
+
+    def complete(self, body: Dict[str, Any], caller: str = 'unknown',
+                 use_cache: bool = False) -> Tuple[Dict[str, Any], str]:
+        """
+        Führt eine (nicht gestreamte) Chat-Completion aus.
+
+        Args:
+            body: Anfrage im Format der OpenAI-API
+            caller: Aufrufender Dienst (für die Nutzungszähler)
+            use_cache: Antwort aus dem Cache lesen bzw. dort ablegen
+
+        Returns:
+            tuple: (Antwort, Cache-Status 'hit' | 'miss' | 'coalesced' | 'bypass')
+
+        Raises:
+            UpstreamError: Wenn der Upstream endgültig scheitert
+            RateLimitExceeded: Wenn das Gateway-Limit nicht rechtzeitig frei wird
+        """
+        started = time.monotonic()
+        model = body.get('model', '')
+        key = request_key(body)
+        if use_cache:
+            cached = self.cache.get(key)
+            if cached is not None:
+                self.usage.record(model, caller, 'hit', cached.get('usage'), (time.monotonic() - started) * 1000)
+                return cached, 'hit'
+
+        retries = 0
+
+        def call():
+            nonlocal retries
+            response, retries = self._call_upstream(body)
+            return response
+
+        try:
+            if use_cache or body.get('temperature') == 0:
+                response, leader = self.flights.do(key, call)
+            else:
+                response, leader = call(), True
+        except Exception as e:
+            self.usage.record(model, caller, 'miss' if use_cache else 'bypass', None,
+                              (time.monotonic() - started) * 1000, retries=getattr(e, 'retries', 0),
+                              error=str(e), rate_limited=isinstance(e, RateLimitExceeded))
+            raise
+
+        if not leader:
+            status = 'coalesced'
+        elif use_cache:
+            status = 'miss'
+            self.cache.set(key, response)
+        else:
+            status = 'bypass'
+        self.usage.record(model, caller, status, response.get('usage'), (time.monotonic() - started) * 1000,
+                          retries=retries)
+        return response, status
+
+    def stream(self, body: Dict[str, Any], caller: str = 'unknown') -> Iterator[str]:
+        """
+        Führt eine gestreamte Chat-Completion aus und liefert die SSE-Zeilen des Upstreams.
+
+        Wiederholt wird nur, solange noch keine Zeile weitergegeben wurde; danach
+        hat der Aufrufer bereits Teile der Antwort und bricht selbst ab.
+        """
+        body = dict(body, stream=True, stream_options={**(body.get('stream_options') or {}), 'include_usage': True})
+        model = body.get('model', '')
+        started = time.monotonic()
+        estimate = estimate_tokens(body)
+        attempt = 0
+        while True:
+            forwarded = False
+            usage = None
+            try:
+                with self.limiter.acquire(estimate) as reservation:
+                    with self.upstream.stream(body) as lines:
+                        for line in lines:
+                            usage = usage_from_stream_line(line) or usage
+                            forwarded = True
+                            yield line
+                    reservation.settle(_total_tokens(usage))
+                self.usage.record(model, caller, 'stream', usage, (time.monotonic() - started) * 1000,
+                                  retries=attempt)
+                return
+            except UpstreamError as e:
+                delay = None if forwarded else self._retry_delay(e, attempt, started)
+                if delay is None:
+                    self.usage.record(model, caller, 'stream', usage, (time.monotonic() - started) * 1000,
+                                      retries=attempt, error=str(e))
+                    raise
+                attempt += 1
+                logger.warning(f"[GATEWAY] Stream: {e} – Wiederholung {attempt}/{self.max_retries} in {delay:.1f}s")
+                time.sleep(delay)
+            except Exception as e:
+                self.usage.record(model, caller, 'stream', usage, (time.monotonic() - started) * 1000,
+                                  retries=attempt, error=str(e), rate_limited=isinstance(e, RateLimitExceeded))
+                raise
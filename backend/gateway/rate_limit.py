@@ -0,0 +1,145 @@
+"""
+Globale Limits des Gateways.
+
+Alle API- und Worker-Prozesse teilen sich ein Kontingent beim Provider. Statt
+dass jeder Prozess für sich drosselt (und die Summe trotzdem das Limit
+überschreitet), begrenzt das Gateway zentral:
+
+- Anfragen pro Minute und Tokens pro Minute (Token-Buckets)
+- gleichzeitig laufende Upstream-Anfragen (Semaphore)
+
+Eine Anfrage wartet höchstens GATEWAY_LIMIT_WAIT_SECONDS auf freie Kapazität;
+danach antwortet das Gateway mit 429 und Retry-After, und der Aufrufer plant
+sich über seine übliche Wiederholungslogik neu ein.
+"""
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Iterator, Optional
+
+# Anfragen pro Minute an den Upstream (0 = unbegrenzt)
+REQUESTS_PER_MINUTE = int(os.environ.get('GATEWAY_REQUESTS_PER_MINUTE', 3000))
+# Tokens (Prompt + max_tokens) pro Minute an den Upstream (0 = unbegrenzt)
+TOKENS_PER_MINUTE = int(os.environ.get('GATEWAY_TOKENS_PER_MINUTE', 1000000))
+# Gleichzeitig laufende Upstream-Anfragen
+MAX_CONCURRENCY = int(os.environ.get('GATEWAY_MAX_CONCURRENCY', 32))
+# Höchste Wartezeit auf freie Kapazität, bevor mit 429 geantwortet wird (Sekunden)
+LIMIT_WAIT_SECONDS = float(os.environ.get('GATEWAY_LIMIT_WAIT_SECONDS', 20))
+
+
+class RateLimitExceeded(Exception):
+    """Keine freie Kapazität innerhalb der Wartezeit."""
+
+    def __init__(self, message: str, retry_after: float):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class TokenBucket:
+    """Token-Bucket mit Kapazität pro Minute und gleichmäßiger Auffüllung."""
+
+    def __init__(self, per_minute: int):
+        self.capacity = float(per_minute)
+        self.rate = per_minute / 60.0
+        self.level = self.capacity
+        self.updated = time.monotonic()
+
+    @property
+    def unlimited(self) -> bool:
+        return self.capacity <= 0
+
+    def _refill(self, now: float):
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount: float, now: float) -> float:
+        """Sekunden, bis amount verfügbar ist (0 = sofort). Nicht threadsicher, Aufrufer hält die Sperre."""
+        if self.unlimited:
+            return 0.0
+        self._refill(now)
+        # Anfragen über der Kapazität würden nie passen; sie warten auf einen vollen Bucket
+        amount = min(amount, self.capacity)
+        return 0.0 if self.level >= amount else (amount - self.level) / self.rate
+
+    def take(self, amount: float):
+        if not self.unlimited:
+            self.level -= min(amount, self.capacity)
+
+    def adjust(self, delta: float):
+        """Korrigiert eine Reservierung nachträglich (positiv: Rückgabe, negativ: Nachbelastung)."""
+        if not self.unlimited:
+            self.level = min(self.capacity, self.level + delta)
+
+
+class RateLimiter:
+    """Anfragen-, Token- und Parallelitätslimit des Gateways."""
+
+    def __init__(self, requests_per_minute: int = REQUESTS_PER_MINUTE, tokens_per_minute: int = TOKENS_PER_MINUTE,
+                 max_concurrency: int = MAX_CONCURRENCY, wait_seconds: float = LIMIT_WAIT_SECONDS):
+        self.requests = TokenBucket(requests_per_minute)
+        self.tokens = TokenBucket(tokens_per_minute)
+        self.wait_seconds = wait_seconds
+        self._lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(max(max_concurrency, 1))
+        self.in_flight = 0
+
+    def _reserve(self, tokens: int, deadline: float):
+        """Reserviert eine Anfrage und ihre Tokens, sobald beide Buckets genug enthalten."""
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                wait = max(self.requests.wait_time(1, now), self.tokens.wait_time(tokens, now))
+                if wait <= 0:
+                    self.requests.take(1)
+                    self.tokens.take(tokens)
+                    return
+            if now + wait > deadline:
+                raise RateLimitExceeded("Gateway-Limit erreicht (Anfragen bzw. Tokens pro Minute)", retry_after=wait)
+            time.sleep(min(wait, 1.0))
+
+    @contextmanager
+    def acquire(self, tokens: int, wait_seconds: Optional[float] = None) -> Iterator['Reservation']:
+        """
+        Wartet auf freie Kapazität und hält einen Slot für die Dauer der Upstream-Anfrage.
+
+        Args:
+            tokens: Geschätzte Tokens der Anfrage (Prompt + max_tokens)
+            wait_seconds: Höchste Wartezeit (Standard: GATEWAY_LIMIT_WAIT_SECONDS)
+
+        Raises:
+            RateLimitExceeded: Wenn innerhalb der Wartezeit keine Kapazität frei wird
+        """
+        deadline = time.monotonic() + (self.wait_seconds if wait_seconds is None else wait_seconds)
+        self._reserve(tokens, deadline)
+        if not self._slots.acquire(timeout=max(deadline - time.monotonic(), 0)):
+            with self._lock:
+                self.requests.adjust(1)
+                self.tokens.adjust(tokens)
+            raise RateLimitExceeded("Gateway-Limit erreicht (gleichzeitige Anfragen)", retry_after=1.0)
+        with self._lock:
+            self.in_flight += 1
+        reservation = Reservation(self, tokens)
+        try:
+            yield reservation
+        finally:
+            with self._lock:
+                self.in_flight -= 1
+            self._slots.release()
+
+    def settle(self, reserved: int, used: int):
+        """Gleicht die Token-Reservierung mit der tatsächlichen Nutzung ab."""
+        with self._lock:
+            self.tokens.adjust(reserved - used)
+
+
+class Reservation:
+    """Reservierung einer Anfrage; settle() gleicht sie mit der gemeldeten Nutzung ab."""
+
+    def __init__(self, limiter: RateLimiter, tokens: int):
+        self.limiter = limiter
+        self.tokens = tokens
+
+    def settle(self, used_tokens: Optional[int]):
+        if used_tokens:
+            self.limiter.settle(self.tokens, used_tokens)
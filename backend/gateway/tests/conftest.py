@@ -0,0 +1,57 @@
+"""
+Gemeinsame Test-Konfiguration für das LLM-Gateway.
+
+Startet den simulierten Upstream (fake_upstream.py) und das Gateway im selben
+Prozess wie benchmarks/gateway_load.py; jeder Test bekommt frische Server.
+"""
+import os
+import sys
+import threading
+
+import pytest
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from app import create_server as create_gateway_server  # noqa: E402
+from fake_upstream import FakeUpstreamState, create_server as create_upstream_server  # noqa: E402
+from gateway import Gateway, ResponseCache, UsageRecorder  # noqa: E402
+from rate_limit import RateLimiter  # noqa: E402
+from upstream import UpstreamClient  # noqa: E402
+
+
+def _start(server):
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return f"http://127.0.0.1:{server.server_address[1]}"
+
+
+@pytest.fixture
+def upstream_state():
+    """Simulierter Upstream ohne Fehler; Tests stellen latency_ms/rate_500 bei Bedarf um."""
+    return FakeUpstreamState(latency_ms=20, seed=1)
+
+
+@pytest.fixture
+def start_gateway(upstream_state):
+    """Startet Upstream und Gateway; Rückgabe: (Gateway-URL, Gateway)."""
+    servers = []
+
+    def start(limiter=None, max_retries=2):
+        upstream = create_upstream_server('127.0.0.1', 0, upstream_state)
+        upstream_url = _start(upstream)
+        gateway = Gateway(
+            upstream=UpstreamClient(base_url=f"{upstream_url}/v1", api_key=''),
+            limiter=limiter or RateLimiter(requests_per_minute=0, tokens_per_minute=0, max_concurrency=16,
+                                           wait_seconds=5),
+            cache=ResponseCache(),
+            usage=UsageRecorder(usage_file=''),
+            max_retries=max_retries,
+            retry_max_time=10,
+        )
+        server = create_gateway_server('127.0.0.1', 0, gateway, token='')
+        servers.extend([upstream, server])
+        return _start(server), gateway
+
+    yield start
+    for server in servers:
+        server.shutdown()
+        server.server_close()
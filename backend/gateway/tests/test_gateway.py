@@ -0,0 +1,120 @@
+"""
+Tests des LLM-Gateways gegen den simulierten Upstream: Cache, Single-Flight,
+Token-Limit (429), Wiederholung bei 5xx und Nutzungszähler.
+"""
+from concurrent.futures import ThreadPoolExecutor
+
+import httpx
+
+import gateway as gateway_module
+from rate_limit import RateLimiter
+
+
+def _body(prompt='Erstelle Lernkarten zu Kapitel 1.', temperature=0, max_tokens=100):
+    return {'model': 'gpt-4o-mini', 'temperature': temperature, 'max_tokens': max_tokens,
+            'messages': [{'role': 'user', 'content': prompt}]}
+
+
+def _post(url, body, cache=False, caller='worker'):
+    headers = {'X-Gateway-Caller': caller}
+    if cache:
+        headers['X-Gateway-Cache'] = 'use'
+    return httpx.post(f"{url}/v1/chat/completions", json=body, headers=headers, timeout=30)
+
+
+def test_cache_miss_then_hit(start_gateway, upstream_state):
+    url, _ = start_gateway()
+
+    first = _post(url, _body(), cache=True)
+    second = _post(url, _body(), cache=True)
+
+    assert first.status_code == second.status_code == 200
+    assert first.headers['X-Gateway-Cache'] == 'miss'
+    assert second.headers['X-Gateway-Cache'] == 'hit'
+    assert second.json() == first.json()
+    assert upstream_state.stats()['requests'] == 1
+
+
+def test_without_cache_header_every_request_reaches_upstream(start_gateway, upstream_state):
+    url, _ = start_gateway()
+
+    statuses = [_post(url, _body(temperature=0.7)).headers['X-Gateway-Cache'] for _ in range(2)]
+
+    assert statuses == ['bypass', 'bypass']
+    assert upstream_state.stats()['requests'] == 2
+
+
+def test_concurrent_identical_requests_are_coalesced(start_gateway, upstream_state):
+    upstream_state.latency_ms = 500
+    url, _ = start_gateway()
+
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        responses = list(pool.map(lambda _: _post(url, _body()), range(8)))
+
+    assert all(response.status_code == 200 for response in responses)
+    statuses = sorted(response.headers['X-Gateway-Cache'] for response in responses)
+    assert statuses == ['bypass'] + ['coalesced'] * 7
+    assert len({response.json()['id'] for response in responses}) == 1
+    assert upstream_state.stats()['requests'] == 1
+
+
+def test_token_limit_returns_429_with_retry_after(start_gateway, upstream_state):
+    # 120 Tokens pro Minute: nach der ersten Anfrage fehlen dem Bucket die tatsächlich verbrauchten
+    # Tokens, die zweite (geschätzt über der Kapazität, wartet auf einen vollen Bucket) wird abgelehnt
+    limiter = RateLimiter(requests_per_minute=0, tokens_per_minute=120, max_concurrency=4, wait_seconds=0.2)
+    url, gateway = start_gateway(limiter=limiter)
+
+    first = _post(url, _body('Anfrage eins', max_tokens=100))
+    second = _post(url, _body('Anfrage zwei', max_tokens=200))
+
+    assert first.status_code == 200
+    assert second.status_code == 429
+    assert second.json()['error']['code'] == 'rate_limit_exceeded'
+    assert int(second.headers['Retry-After']) >= 1
+    assert upstream_state.stats()['requests'] == 1
+    assert gateway.usage.snapshot()['totals']['rate_limited'] == 1
+
+
+def test_upstream_5xx_is_retried(start_gateway, upstream_state, monkeypatch):
+    # Mit seed=1 scheitert der erste Aufruf (500), der zweite gelingt
+    upstream_state.rate_500 = 0.5
+    monkeypatch.setattr(gateway_module, 'RETRY_BASE_DELAY', 0.05)
+    url, gateway = start_gateway(max_retries=2)
+
+    response = _post(url, _body())
+
+    assert response.status_code == 200
+    stats = upstream_state.stats()
+    assert (stats['requests'], stats['errors_500']) == (2, 1)
+    assert gateway.usage.snapshot()['totals']['retries'] == 1
+
+
+def test_upstream_5xx_is_returned_after_last_retry(start_gateway, upstream_state):
+    upstream_state.rate_500 = 1.0
+    url, gateway = start_gateway(max_retries=0)
+
+    response = _post(url, _body())
+
+    assert response.status_code == 500
+    assert upstream_state.stats()['requests'] == 1
+    assert gateway.usage.snapshot()['totals']['errors'] == 1
+
+
+def test_usage_is_recorded_per_model_and_caller(start_gateway, upstream_state):
+    url, _ = start_gateway()
+
+    _post(url, _body(), cache=True, caller='api')
+    _post(url, _body(), cache=True, caller='worker')
+    usage = httpx.get(f"{url}/v1/usage", timeout=10).json()
+
+    stats = upstream_state.stats()
+    totals = usage['totals']
+    assert totals['requests'] == 2
+    assert totals['upstream_calls'] == 1
+    assert totals['cache_hits'] == 1
+    assert totals['prompt_tokens'] == stats['prompt_tokens']
+    assert totals['completion_tokens'] == stats['completion_tokens']
+    assert totals['saved_tokens'] == stats['prompt_tokens'] + stats['completion_tokens']
+    assert usage['by_model']['gpt-4o-mini']['requests'] == 2
+    assert usage['by_caller']['api']['upstream_calls'] == 1
+    assert usage['by_caller']['worker']['cache_hits'] == 1
@@ -0,0 +1,125 @@
+"""
+Verbindung zum Upstream (OpenAI oder ein anderer OpenAI-kompatibler Endpunkt).
+
+Ein einziger httpx-Client pro Gateway-Prozess hält die Verbindungen offen
+(Keep-Alive, HTTP-Pool), statt dass jeder API- und Worker-Prozess eigene
+Clients und TLS-Verbindungen aufbaut. Fehler tragen HTTP-Status, Fehlercode und
+Antwort, sodass utils/openai_errors.py sie wie Fehler der OpenAI-Bibliothek
+einstuft.
+"""
+import json
+import logging
+import os
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, Optional
+
+import httpx
+
+logger = logging.getLogger(__name__)
+
+# Basis-URL des Upstreams (ohne /chat/completions)
+UPSTREAM_BASE_URL = os.environ.get('GATEWAY_UPSTREAM_URL', 'https://api.openai.com/v1').rstrip('/')
+# Schlüssel für den Upstream; liegt nur noch im Gateway
+UPSTREAM_API_KEY = os.environ.get('OPENAI_API_KEY', '')
+# Zeitlimit einer Upstream-Anfrage (Sekunden)
+UPSTREAM_TIMEOUT = float(os.environ.get('GATEWAY_UPSTREAM_TIMEOUT', 120))
+# Größe des Verbindungs-Pools (gleichzeitige bzw. offen gehaltene Verbindungen)
+UPSTREAM_MAX_CONNECTIONS = int(os.environ.get('GATEWAY_UPSTREAM_MAX_CONNECTIONS', 64))
+UPSTREAM_MAX_KEEPALIVE = int(os.environ.get('GATEWAY_UPSTREAM_MAX_KEEPALIVE', 32))
+
+
+class UpstreamError(Exception):
+    """Fehler des Upstreams mit HTTP-Status, Fehlercode und Fehlerobjekt (wie APIStatusError der openai-Bibliothek)."""
+
+    def __init__(self, message: str, status_code: Optional[int] = None, code: Optional[str] = None,
+                 body: Optional[Dict[str, Any]] = None, response: Any = None):
+        super().__init__(message)
+        self.status_code = status_code
+        self.code = code
+        self.body = body
+        self.response = response
+
+
+def _error_from_response(response: httpx.Response) -> UpstreamError:
+    """Baut einen UpstreamError aus einer Fehlerantwort (Format der OpenAI-API)."""
+    try:
+        body = response.json()
+    except ValueError:
+        body = {}
+    error = body.get('error') if isinstance(body, dict) else None
+    if not isinstance(error, dict):
+        error = {'message': str(error or response.text[:500])}
+    code = error.get('code') or error.get('type')
+    return UpstreamError(f"Upstream {response.status_code}: {error.get('message')}",
+                         status_code=response.status_code, code=code if isinstance(code, str) else None,
+                         body=error, response=response)
+
+
+class UpstreamClient:
+    """Gepoolter HTTP-Client für /chat/completions des Upstreams."""
+
+    def __init__(self, base_url: str = UPSTREAM_BASE_URL, api_key: str = UPSTREAM_API_KEY,
+                 timeout: float = UPSTREAM_TIMEOUT, max_connections: int = UPSTREAM_MAX_CONNECTIONS,
+                 max_keepalive: int = UPSTREAM_MAX_KEEPALIVE):
+        self.base_url = base_url.rstrip('/')
+        headers = {"Content-Type": "application/json"}
+        if api_key:
+            headers["Authorization"] = f"Bearer {api_key}"
+        self._client = httpx.Client(
+            base_url=self.base_url,
+            headers=headers,
+            timeout=timeout,
+            limits=httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_keepalive),
+        )
+
+    def chat(self, body: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Führt eine Chat-Completion aus.
+
+        Raises:
+            UpstreamError: Bei Fehlerantwort (mit Status) bzw. Verbindungsfehler (ohne Status)
+        """
+        try:
+            response = self._client.post('/chat/completions', json=body)
+        except httpx.HTTPError as e:
+            raise UpstreamError(f"Upstream nicht erreichbar: {e}") from e
+        if response.status_code >= 400:
+            raise _error_from_response(response)
+        try:
+            return response.json()
+        except ValueError as e:
+            raise UpstreamError(f"Ungültige Upstream-Antwort: {e}", status_code=502) from e
+
+    @contextmanager
+    def stream(self, body: Dict[str, Any]) -> Iterator[Iterator[str]]:
+        """
+        Öffnet eine Streaming-Completion und liefert ihre Zeilen (Server-Sent Events).
+
+        Fehler vor dem ersten Byte werden als UpstreamError geworfen, damit sie
+        wie bei chat() wiederholt werden können.
+        """
+        try:
+            with self._client.stream('POST', '/chat/completions', json=body) as response:
+                if response.status_code >= 400:
+                    response.read()
+                    raise _error_from_response(response)
+                yield response.iter_lines()
+        except httpx.HTTPError as e:
+            raise UpstreamError(f"Upstream-Stream abgebrochen: {e}") from e
+
+    def close(self):
+        self._client.close()
+
+
+def usage_from_stream_line(line: str) -> Optional[Dict[str, Any]]:
+    """Token-Nutzung aus einer SSE-Zeile ("data: {...}"), falls der Chunk sie enthält."""
+    if not line.startswith('data:'):
+        return None
+    data = line[len('data:'):].strip()
+    if not data or data == '[DONE]':
+        return None
+    try:
+        chunk = json.loads(data)
+    except ValueError:
+        return None
+    return chunk.get('usage') if isinstance(chunk, dict) else None
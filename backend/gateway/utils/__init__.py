@@ -0,0 +1,3 @@
+"""
+Hilfsmodule des LLM-Gateways.
+"""
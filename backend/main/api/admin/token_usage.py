@@ -7,6 +7,7 @@ import logging
 from datetime import datetime, timedelta
 
 from core.models import TokenUsage, User, db
+from core.openai_integration import MODEL_PRICING
 from flask import jsonify, request
 from openaicache.token_tracker import TokenTracker
 from sqlalchemy import Float, cast, desc, func
@@ -14,6 +15,55 @@ from sqlalchemy import Float, cast, desc, func
 # Logger konfigurieren
 logger = logging.getLogger(__name__)
 
+# Rabatt des Providers auf Input-Tokens, die aus dem Prompt-Cache bedient werden
+PROMPT_CACHE_DISCOUNT = 0.5
+
+
+def _get_prompt_cache_stats(user_id=None, start_date=None, total_input_tokens=0):
+    """
+    Berechnet die Ersparnis durch Provider-Prompt-Caching (gecachte Input-Tokens).
+
+    Args:
+        user_id: Optional, nur Einträge dieses Benutzers
+        start_date: Optional, nur Einträge ab diesem Zeitpunkt
+        total_input_tokens: Summe aller Input-Tokens im selben Zeitraum
+
+    Returns:
+        dict: Gecachte Tokens, Anteil an den Input-Tokens und geschätzte Ersparnis in Credits
+    """
+    query = db.session.query(
+        TokenUsage.model,
+        func.sum(TokenUsage.cached_tokens).label('cached_tokens')
+    )
+    if user_id:
+        query = query.filter(TokenUsage.user_id == user_id)
+    if start_date:
+        query = query.filter(TokenUsage.timestamp >= start_date)
+
+    cached_tokens = 0
+    estimated_savings = 0.0
+    by_model = {}
+    for row in query.group_by(TokenUsage.model).all():
+        model_cached = int(row.cached_tokens or 0)
+        if not model_cached:
+            continue
+        pricing = MODEL_PRICING.get(row.model) or MODEL_PRICING.get(
+            'gpt-4' if row.model and 'gpt-4' in row.model else 'gpt-3.5-turbo')
+        model_savings = model_cached / 1000 * pricing['input'] * PROMPT_CACHE_DISCOUNT
+        cached_tokens += model_cached
+        estimated_savings += model_savings
+        by_model[row.model] = {
+            "cached_tokens": model_cached,
+            "estimated_savings": round(model_savings, 2)
+        }
+
+    return {
+        "cached_input_tokens": cached_tokens,
+        "cached_input_ratio": (cached_tokens / total_input_tokens * 100) if total_input_tokens else 0,
+        "estimated_savings": round(estimated_savings, 2),
+        "by_model": by_model
+    }
+
 
 def get_token_stats():
     """
@@ -79,13 +129,18 @@ def get_token_stats():
         else:
             db_stats["requests"]["cache_hit_rate"] = 0
 
+        # Ersparnis durch Provider-Prompt-Caching
+        db_stats["prompt_cache"] = _get_prompt_cache_stats(
+            user_id, start_date, db_stats["total_tokens"]["input"])
+
     except Exception as e:
         logger.error("Fehler beim Abrufen der Datenbankstatistiken: %s", str(e))
         db_stats = {
             "error": str(e),
             "total_tokens": {"input": 0, "output": 0, "total": 0},
             "costs": {"total_cost": 0},
-            "requests": {"total_requests": 0, "cached_requests": 0, "api_requests": 0, "cache_hit_rate": 0}
+            "requests": {"total_requests": 0, "cached_requests": 0, "api_requests": 0, "cache_hit_rate": 0},
+            "prompt_cache": {"cached_input_tokens": 0, "cached_input_ratio": 0, "estimated_savings": 0, "by_model": {}}
         }
 
     return jsonify({
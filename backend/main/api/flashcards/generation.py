@@ -10,9 +10,9 @@ import json
 import logging
 import re
 
-import tiktoken
-from core.openai_integration import track_token_usage
+from core.openai_integration import get_chat_backend, track_token_usage
 from openai import OpenAI
+from utils.token_counter import count_tokens, truncate_to_tokens
 
 from .utils import categorize_content
 
@@ -25,7 +25,7 @@ def generate_flashcards(content, client, analysis, count=10, language='de', sess
 
     Args:
         content: Der Inhalt, aus dem Flashcards generiert werden sollen
-        client: Der OpenAI-Client
+        client: Der OpenAI-Client (ungenutzt, die Anfrage läuft über get_chat_backend)
         analysis: Die Analyse des Inhalts (Themen, Unterthemen)
         count: Die Anzahl der zu generierenden Flashcards
         language: Die Sprache der Flashcards ('de' oder 'en')
@@ -41,15 +41,12 @@ def generate_flashcards(content, client, analysis, count=10, language='de', sess
 
     # Kürze den Inhalt, falls er zu lang ist
     max_token_length = 4000
-    encoding = tiktoken.encoding_for_model("gpt-3.5-turbo")
-    content_tokens = encoding.encode(content)
+    truncated_content = truncate_to_tokens(content, max_token_length, model="gpt-3.5-turbo")
 
-    if len(content_tokens) > max_token_length:
-        # Kürze den Inhalt auf die max_token_length
-        truncated_content = encoding.decode(content_tokens[:max_token_length])
+    if len(truncated_content) < len(content):
         logger.warning(
             "Inhalt zu lang (%s Tokens). Gekürzt auf %s Tokens.", 
-            len(content_tokens), max_token_length
+            count_tokens(content, model="gpt-3.5-turbo"), max_token_length
         )
         content = truncated_content
 
@@ -139,8 +136,8 @@ Return the answer in the following JSON format:
 The 'category' should be one of the subtopics or another suitable topic if no matching subtopic exists."""
 
     try:
-        # OpenAI-Anfrage
-        response = client.chat.completions.create(
+        # Anfrage über das LLM-Backend des Modells
+        response = get_chat_backend("gpt-3.5-turbo-1106").chat(
             model="gpt-3.5-turbo-1106",
             response_format={"type": "json_object"},
             messages=[
@@ -158,8 +155,8 @@ The 'category' should be one of the subtopics or another suitable topic if no ma
                     None,  # Kein user_id benötigt
                     session_id,
                     "gpt-3.5-turbo-1106",
-                    response.usage.prompt_tokens,
-                    response.usage.completion_tokens,
+                    response['usage']['prompt_tokens'],
+                    response['usage']['completion_tokens'],
                     function_name,
                     None  # kein endpoint benötigt
                 )
@@ -167,7 +164,7 @@ The 'category' should be one of the subtopics or another suitable topic if no ma
                 logger.warning("Token-Tracking fehlgeschlagen: %s", str(track_err))
 
         # Extrahiere JSON aus der Antwort
-        result_text = response.choices[0].message.content
+        result_text = response['choices'][0]['message']['content']
 
         # Suche nach JSON-Strukturen
         json_match = re.search(r'(\[[\s\S]*\])', result_text)
@@ -211,7 +208,7 @@ def generate_additional_flashcards(content, client, analysis, existing_flashcard
 
     Args:
         content: Der Inhalt, aus dem Flashcards generiert werden sollen
-        client: Der OpenAI-Client
+        client: Der OpenAI-Client (ungenutzt, die Anfrage läuft über get_chat_backend)
         analysis: Die Analyse des Inhalts (Themen, Unterthemen)
         existing_flashcards: Eine Liste der bereits vorhandenen Flashcards
         count: Die Anzahl der zu generierenden Flashcards
@@ -228,15 +225,12 @@ def generate_additional_flashcards(content, client, analysis, existing_flashcard
 
     # Kürze den Inhalt, falls er zu lang ist
     max_token_length = 3500
-    encoding = tiktoken.encoding_for_model("gpt-3.5-turbo")
-    content_tokens = encoding.encode(content)
+    truncated_content = truncate_to_tokens(content, max_token_length, model="gpt-3.5-turbo")
 
-    if len(content_tokens) > max_token_length:
-        # Kürze den Inhalt auf die max_token_length
-        truncated_content = encoding.decode(content_tokens[:max_token_length])
+    if len(truncated_content) < len(content):
         logger.warning(
             "Inhalt zu lang (%s Tokens). Gekürzt auf %s Tokens.", 
-            len(content_tokens), max_token_length
+            count_tokens(content, model="gpt-3.5-turbo"), max_token_length
         )
         content = truncated_content
 
@@ -341,8 +335,8 @@ Return the answer in the following JSON format:
 The 'category' should be one of the subtopics or another suitable topic if no matching subtopic exists."""
 
     try:
-        # OpenAI-Anfrage
-        response = client.chat.completions.create(
+        # Anfrage über das LLM-Backend des Modells
+        response = get_chat_backend("gpt-3.5-turbo-1106").chat(
             model="gpt-3.5-turbo-1106",
             response_format={"type": "json_object"},
             messages=[
@@ -360,8 +354,8 @@ The 'category' should be one of the subtopics or another suitable topic if no ma
                     None,  # Kein user_id benötigt
                     session_id,
                     "gpt-3.5-turbo-1106",
-                    response.usage.prompt_tokens,
-                    response.usage.completion_tokens,
+                    response['usage']['prompt_tokens'],
+                    response['usage']['completion_tokens'],
                     function_name,
                     None  # kein endpoint benötigt
                 )
@@ -369,7 +363,7 @@ The 'category' should be one of the subtopics or another suitable topic if no ma
                 logger.warning("Token-Tracking fehlgeschlagen: %s", str(track_err))
 
         # Extrahiere JSON aus der Antwort
-        result_text = response.choices[0].message.content
+        result_text = response['choices'][0]['message']['content']
 
         # Suche nach JSON-Strukturen
         json_match = re.search(r'(\[[\s\S]*\])', result_text)
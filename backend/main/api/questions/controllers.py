@@ -11,12 +11,12 @@ Dieses Modul enthält die Geschäftslogik für die Fragenverwaltung:
 import logging
 from datetime import datetime
 
-import tiktoken
 from api.token_tracking import (calculate_token_cost, check_credits_available,
                                 deduct_credits)
 from core.models import Question, Topic, Upload, User, UserActivity, db
 from flask import current_app, g, jsonify
 from openai import OpenAI
+from utils.token_counter import count_tokens
 
 from .generation import generate_additional_questions, generate_questions
 from .models import get_questions, save_question
@@ -262,8 +262,7 @@ def process_generate_questions(session_id, count=5, topic_filter=None):
     try:
         # Berechne geschätzte Kosten für diesen Aufruf
         # Wir schätzen Tokens basierend auf der Textlänge und dem gewünschten Count
-        content_length = len(upload.content)
-        estimated_input_tokens = min(content_length // 4, 2000) + 500  # Grobe Schätzung basierend auf Textlänge
+        estimated_input_tokens = min(count_tokens(upload.content or ''), 2000) + 500
         estimated_output_tokens = count * 200  # Grobe Schätzung
 
         # Berechne die Kosten
@@ -8,8 +8,8 @@ und die Unterstützung der Fragengenerierung.
 
 import logging
 
-import tiktoken
 from flask import g
+from utils.token_counter import count_tokens as _count_tokens
 
 from ..utils import detect_language
 
@@ -61,13 +61,7 @@ def count_tokens(text):
     Returns:
         int: Die Anzahl der Tokens
     """
-    try:
-        encoding = tiktoken.encoding_for_model("gpt-4")
-        return len(encoding.encode(text))
-    except Exception as e:
-        # Fallback bei Fehlern mit der Tokenizer-Bibliothek
-        logger.warning("Error counting tokens with tiktoken: %s. Using fallback method.", str(e))
-        return len(text) // 4  # Grobe Schätzung: 1 Token = 4 Zeichen
+    return _count_tokens(text, model="gpt-4")
 
 
 def calculate_generation_cost(content_length, count=10):
@@ -16,7 +16,6 @@ import traceback
 import uuid
 from datetime import datetime
 
-import tiktoken
 from core.models import TokenUsage, User, db
 from core.openai_integration import (calculate_token_cost,
                                      check_credits_available, count_tokens,
@@ -12,12 +12,13 @@ import logging
 from api.token_tracking import (calculate_token_cost, check_credits_available,
                                 deduct_credits)
 from core.models import Topic, Upload, User, db
+from core.openai_integration import get_chat_backend
 from flask import current_app
 from openai import OpenAI
 
 from ..utils import (detect_language, query_chatgpt)
 from .models import create_connection_via_parent, find_topic_by_name
-from .utils import get_openai_client, process_topic_response
+from .utils import process_topic_response
 
 logger = logging.getLogger(__name__)
 
@@ -53,11 +54,8 @@ def generate_concept_map_suggestions(upload_id, main_topic, max_suggestions=5, l
         # Erstelle den Prompt
         prompt = _build_concept_map_prompt(main_topic.name, topic_names_str, language)
         
-        # Erstelle OpenAI-Client
-        client = get_openai_client()
-        
-        # Sende Anfrage an OpenAI
-        response = client.chat.completions.create(
+        # Sende Anfrage an das LLM-Backend des Modells (OpenAI oder lokaler Server)
+        response = get_chat_backend("gpt-3.5-turbo").chat(
             model="gpt-3.5-turbo",
             messages=[
                 {"role": "system", "content": "You are an assistant that helps create concept maps."},
@@ -68,7 +66,7 @@ def generate_concept_map_suggestions(upload_id, main_topic, max_suggestions=5, l
         )
         
         # Extrahiere die Antwort
-        answer = response.choices[0].message.content.strip()
+        answer = response['choices'][0]['message']['content'].strip()
         
         # Parse die Antwort und extrahiere die Vorschläge
         suggestions = _parse_suggestion_response(answer)
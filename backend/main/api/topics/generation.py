@@ -12,7 +12,6 @@ import time
 import uuid
 from datetime import datetime
 
-import tiktoken
 import openai
 from flask import current_app, g
 from openai import OpenAI
@@ -22,6 +21,7 @@ from api.error_handler import (InsufficientCreditsError, InvalidInputError,
 from api.token_tracking import (calculate_token_cost, check_credits_available,
                                 deduct_credits)
 from core.models import Topic, Upload, User, db
+from utils.token_counter import count_tokens
 
 from ..utils import detect_language, query_chatgpt
 from .models import (create_connection_via_parent, create_connections_from_list,
@@ -387,7 +387,7 @@ def _calculate_generation_cost(content):
 
     # Zusätzliche Kosten basierend auf Tokenzahl
     try:
-        tokens = len(tiktoken.encoding_for_model("gpt-4").encode(content[:10000]))
+        tokens = count_tokens(content[:10000], model="gpt-4")
         token_cost = tokens // 1000  # 1 Credit pro 1000 Tokens
     except BaseException:
         # Fallback, wenn Tokenizer nicht verfügbar ist
@@ -10,6 +10,8 @@ aufgeteilt in verschiedene spezialisierte Komponenten:
 - session_management: Verwaltung von Upload-Sessions
 - processing: Verarbeitung hochgeladener Dateien und Worker-Delegation
 - diagnostics: Diagnose- und Debug-Funktionen
+- more_materials: "Mehr generieren" aus vorab generierten Einträgen
+- generation_state: Generierungsstand pro Typ und Neugenerierung fehlgeschlagener Typen
 """
 
 # Erstelle einen eigenen Blueprint, der später in der app.py registriert wird
@@ -65,6 +67,8 @@ from .session_management import session_mgmt_get_session_info
 from .upload_chunked import get_upload_progress, upload_chunk, complete_chunked_upload
 from .upload_core import get_results, upload_file, upload_redirect
 from .debug import get_upload_debug_info
+from .more_materials import generate_more
+from .generation_state import get_generation_state, regenerate_failed
 
 # Setze die __all__ Variable, um sicherzustellen, dass nur die gewünschten Elemente exportiert werden
 __all__ = [
@@ -90,7 +94,14 @@ __all__ = [
     'get_session_info',
     
     # debug exports
-    'get_upload_debug_info'
+    'get_upload_debug_info',
+
+    # more_materials exports
+    'generate_more',
+
+    # generation_state exports
+    'get_generation_state',
+    'regenerate_failed'
 ]
 
 # Funktion zum Registrieren der Routen an einem Blueprint
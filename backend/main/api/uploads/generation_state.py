@@ -0,0 +1,117 @@
+"""
+Generierungsstand pro Ausgabetyp und gezielte Neugenerierung.
+
+Der Worker hält pro Quelle und Typ (Lernkarten, Fragen, Themen) fest, ob die
+Generierung abgeschlossen oder fehlgeschlagen ist (`generation_state`, siehe
+worker/tasks/generation_state.py). Schlägt nur ein Typ fehl, startet
+/regenerate/<session_id> genau diese Typen neu, ohne erneute Extraktion und
+ohne die erfolgreichen Typen noch einmal zu bezahlen. Beide Routen stehen nur
+dem Besitzer des Uploads offen.
+"""
+import logging
+import os
+
+from flask import jsonify, make_response, request
+from flask_jwt_extended import jwt_required
+
+from core.models import GenerationState, UploadedFile
+from . import uploads_bp
+from .upload_core import celery_sender, get_owned_upload
+
+logger = logging.getLogger(__name__)
+
+# Neugenerierung läuft in der Queue der Stufe "more" (worker/config/queues.py)
+REGENERATE_QUEUE = os.environ.get('CELERY_QUEUE_MORE', 'more')
+REGENERATE_PRIORITY = 3
+
+GENERATION_TYPES = ('flashcards', 'questions', 'topics')
+
+
+def _serialize(state):
+    return {
+        'uploaded_file_id': state.uploaded_file_id,
+        'type': state.task_type,
+        'status': state.status,
+        'attempts': state.attempts,
+        'error': state.error_message,
+        'input_tokens': state.input_tokens,
+        'output_tokens': state.output_tokens,
+        'prompt_hash': state.last_prompt_hash,
+        'updated_at': state.updated_at.isoformat() if state.updated_at else None,
+    }
+
+
+def _belongs_to_upload(upload_id, uploaded_file_id):
+    """Datei des Uploads oder eine Quelle mit Generierungsstand (auch 'merged:'/'section:'-Quellen)."""
+    if UploadedFile.query.filter_by(id=uploaded_file_id, upload_id=upload_id).first():
+        return True
+    return GenerationState.query.filter_by(upload_id=upload_id, uploaded_file_id=uploaded_file_id).first() is not None
+
+
+@uploads_bp.route('/generation-state/<session_id>', methods=['GET', 'OPTIONS'])
+@jwt_required()
+def get_generation_state(session_id):
+    """
+    Gibt den Generierungsstand aller Quellen und Typen einer Session zurück.
+
+    Returns:
+        200 mit {'states': [...], 'failed': [Typen mit Fehler]}; 403 für fremde Sessions
+    """
+    if request.method == 'OPTIONS':
+        return make_response()
+
+    upload, error = get_owned_upload(session_id)
+    if error:
+        return error
+
+    states = (GenerationState.query
+              .filter_by(upload_id=upload.id)
+              .order_by(GenerationState.uploaded_file_id, GenerationState.task_type)
+              .all())
+    failed = sorted({state.task_type for state in states if state.status == 'failed'})
+    return jsonify({
+        "success": True,
+        "session_id": session_id,
+        "states": [_serialize(state) for state in states],
+        "failed": failed,
+    }), 200
+
+
+@uploads_bp.route('/regenerate/<session_id>', methods=['POST', 'OPTIONS'])
+@jwt_required()
+def regenerate_failed(session_id):
+    """
+    Generiert nur die fehlgeschlagenen bzw. fehlenden Typen einer Session neu.
+
+    Body (optional): {"types": ["flashcards", "questions", "topics"], "uploaded_file_id": str}
+
+    Returns:
+        202, sobald der Worker-Task eingeplant ist; 403 für fremde Sessions
+    """
+    if request.method == 'OPTIONS':
+        return make_response()
+
+    data = request.get_json(silent=True) or {}
+    task_types = data.get('types')
+    if task_types is not None:
+        if not isinstance(task_types, list) or not task_types or any(t not in GENERATION_TYPES for t in task_types):
+            return jsonify({"success": False, "error": {
+                "code": "INVALID_TYPE",
+                "message": f"types muss eine Liste aus {', '.join(GENERATION_TYPES)} sein"}}), 400
+
+    upload, error = get_owned_upload(session_id)
+    if error:
+        return error
+
+    uploaded_file_id = data.get('uploaded_file_id')
+    if uploaded_file_id is not None and (not isinstance(uploaded_file_id, str)
+                                         or not _belongs_to_upload(upload.id, uploaded_file_id)):
+        return jsonify({"success": False, "error": {
+            "code": "INVALID_FILE",
+            "message": "uploaded_file_id gehört nicht zu dieser Sitzung"}}), 400
+
+    celery_sender.send_task('ai.regenerate_failed', args=[upload.id],
+                            kwargs={'task_types': task_types, 'uploaded_file_id': uploaded_file_id},
+                            queue=REGENERATE_QUEUE, priority=REGENERATE_PRIORITY)
+    logger.info(f"Neugenerierung fehlgeschlagener Typen für Session {session_id} angestoßen (Typen: {task_types or 'alle'}).")
+    return jsonify({"success": True, "status": "queued", "session_id": session_id}), 202
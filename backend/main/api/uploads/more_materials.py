@@ -0,0 +1,159 @@
+"""
+"Mehr generieren" für Lernkarten und Fragen.
+
+Liefert zuerst die vom Worker vorab generierten, verborgenen Einträge
+(`pending_material`, siehe worker/tasks/speculative_tasks.py) aus und rechnet
+sie erst jetzt ab. Danach wird der Vorrat im Hintergrund nachgefüllt. Ist kein
+Vorrat vorhanden, generiert der Worker in der "more"-Queue und die Einträge
+erscheinen wie gewohnt über /results/<session_id>.
+
+Nur der Besitzer des Uploads darf nachgenerieren, und in beiden Fällen wird
+vorher geprüft, ob seine Credits reichen.
+"""
+import json
+import logging
+import os
+from datetime import datetime
+
+from flask import jsonify, make_response, request
+from flask_jwt_extended import get_jwt_identity, jwt_required
+
+from api.token_tracking import update_token_usage
+from core.models import Flashcard, PendingMaterial, Question, User, db
+from core.openai_integration import calculate_token_cost
+from . import uploads_bp
+from .upload_core import celery_sender, get_owned_upload
+
+logger = logging.getLogger(__name__)
+
+# Nachgenerierung läuft in der eigenen Queue der Stufe "more", das Nachfüllen in "bulk" (worker/config/queues.py)
+MORE_QUEUE = os.environ.get('CELERY_QUEUE_MORE', 'more')
+MORE_PRIORITY = 3
+REFILL_QUEUE = os.environ.get('CELERY_QUEUE_BULK', 'bulk')
+REFILL_PRIORITY = 6
+MAX_MORE_COUNT = 20
+# Modell der Nachgenerierung: erstes Modell der Worker-Route (worker/config/model_routing.py, gleiche Variablen)
+OPENAI_CHEAP_MODEL = os.environ.get('OPENAI_CHEAP_MODEL', 'gpt-4o-mini')
+MODEL_ROUTE_VARIABLES = {'flashcard': 'MODEL_ROUTE_FLASHCARDS', 'question': 'MODEL_ROUTE_QUESTIONS'}
+# Geschätzte Tokens einer Nachgenerierung ohne Vorrat (für die Credit-Prüfung vor dem Einplanen)
+DELIVER_INPUT_TOKENS = 1500
+DELIVER_OUTPUT_TOKENS_PER_ITEM = 150
+
+# Typ in der Anfrage -> Materialtyp in pending_material
+MATERIAL_TYPES = {'flashcards': 'flashcard', 'questions': 'question'}
+
+
+def _to_visible_row(pending):
+    """Wandelt einen vorab generierten Eintrag in eine sichtbare Lernkarte bzw. Frage um."""
+    content = pending.content or {}
+    if pending.material_type == 'flashcard':
+        return Flashcard(upload_id=pending.upload_id, question=content['question'], answer=content['answer'],
+                         tags=json.dumps([f"upload:{pending.upload_id}"]))
+    return Question(
+        upload_id=pending.upload_id,
+        text=content['question'],
+        options=json.dumps(content.get('options') or []),
+        correct_answer=int(content.get('correct_answer', 0) or 0),
+        explanation=content.get('explanation', ''),
+    )
+
+
+def _routed_model(material_type):
+    """Modell, mit dem der Worker diesen Materialtyp generiert und abrechnet."""
+    route = os.environ.get(MODEL_ROUTE_VARIABLES[material_type], '')
+    models = [model.strip() for model in route.split(',') if model.strip()]
+    return models[0] if models else OPENAI_CHEAP_MODEL
+
+
+def _serialize(row):
+    if isinstance(row, Flashcard):
+        return {'id': row.id, 'question': row.question, 'answer': row.answer}
+    return {'id': row.id, 'text': row.text, 'options': row.options,
+            'correct': row.correct_answer, 'explanation': row.explanation}
+
+
+@uploads_bp.route('/more/<session_id>', methods=['POST', 'OPTIONS'])
+@jwt_required()
+def generate_more(session_id):
+    """
+    Gibt weitere Lernkarten oder Fragen einer Session zurück.
+
+    Body: {"type": "flashcards" | "questions", "count": int}
+
+    Returns:
+        200 mit den neuen Einträgen (aus dem Vorrat) oder 202, wenn der Worker generiert;
+        402 ohne ausreichende Credits, 403 für fremde Sessions
+    """
+    if request.method == 'OPTIONS':
+        return make_response()
+
+    data = request.get_json(silent=True) or {}
+    material_type = MATERIAL_TYPES.get(data.get('type', 'flashcards'))
+    if not material_type:
+        return jsonify({"success": False, "error": {"code": "INVALID_TYPE", "message": "type muss 'flashcards' oder 'questions' sein"}}), 400
+    try:
+        count = max(1, min(int(data.get('count', 5)), MAX_MORE_COUNT))
+    except (TypeError, ValueError):
+        return jsonify({"success": False, "error": {"code": "INVALID_COUNT", "message": "count muss eine Zahl sein"}}), 400
+
+    upload, error = get_owned_upload(session_id)
+    if error:
+        return error
+    user = User.query.get(get_jwt_identity())
+
+    pending = (PendingMaterial.query
+               .filter_by(upload_id=upload.id, material_type=material_type)
+               .order_by(PendingMaterial.created_at)
+               .limit(count)
+               .with_for_update(skip_locked=True)
+               .all())
+
+    if not pending:
+        db.session.rollback()
+        # Kein Vorrat: der Worker generiert und speichert direkt (regulär abgerechnet)
+        estimated_cost = calculate_token_cost(_routed_model(material_type), DELIVER_INPUT_TOKENS,
+                                              DELIVER_OUTPUT_TOKENS_PER_ITEM * count)
+        if user and user.credits is not None and user.credits < estimated_cost:
+            return jsonify({"success": False, "error_type": "insufficient_credits",
+                            "error": {"message": "Nicht genügend Credits", "credits_required": estimated_cost,
+                                      "credits_available": user.credits}}), 402
+        celery_sender.send_task('speculative.pregenerate', args=[upload.id, material_type],
+                                kwargs={'deliver': True, 'count': count, 'session_id': session_id},
+                                queue=MORE_QUEUE, priority=MORE_PRIORITY)
+        return jsonify({"success": True, "status": "queued", "session_id": session_id}), 202
+
+    input_tokens = sum(p.input_tokens or 0 for p in pending)
+    output_tokens = sum(p.output_tokens or 0 for p in pending)
+    model = pending[0].model or _routed_model(material_type)
+    if user and user.credits is not None and user.credits < calculate_token_cost(model, input_tokens, output_tokens):
+        db.session.rollback()
+        return jsonify({"success": False, "error_type": "insufficient_credits",
+                        "error": {"message": "Nicht genügend Credits", "credits_available": user.credits}}), 402
+
+    rows = [_to_visible_row(p) for p in pending]
+    db.session.add_all(rows)
+    for p in pending:
+        db.session.delete(p)
+    upload.last_used_at = datetime.utcnow()
+    db.session.commit()
+    logger.info(f"{len(rows)} vorab generierte {material_type}(s) für Session {session_id} ausgeliefert.")
+
+    if user and input_tokens:
+        update_token_usage(user.id, session_id, input_tokens, output_tokens, model=model,
+                           endpoint='uploads/more', function_name=f"generate_more_{material_type}s",
+                           metadata={'mode': 'speculative', 'items': len(rows)})
+
+    # Vorrat im Hintergrund nachfüllen
+    try:
+        celery_sender.send_task('speculative.pregenerate', args=[upload.id, material_type],
+                                queue=REFILL_QUEUE, priority=REFILL_PRIORITY)
+    except Exception as e:
+        logger.warning(f"Nachfüllen des Vorrats für Upload {upload.id} konnte nicht gestartet werden: {e}")
+
+    return jsonify({
+        "success": True,
+        "status": "completed",
+        "session_id": session_id,
+        "source": "pregenerated",
+        data.get('type', 'flashcards'): [_serialize(row) for row in rows],
+    }), 200
@@ -67,6 +67,15 @@ except ImportError:
 
 # Stelle lokale Celery Sender Instanz wieder her
 celery_sender = Celery('main_chunked_sender', broker=config.redis_url)
+# Interaktive Erstverarbeitung läuft in der eigenen Queue mit höchster Priorität (siehe worker/config/queues.py)
+PROCESSING_QUEUE = os.environ.get('CELERY_QUEUE_INTERACTIVE', 'interactive')
+PROCESSING_PRIORITY = 0
+# Muss zu den Broker-Optionen des Workers passen, sonst landen Prioritäten in der falschen Redis-Liste
+celery_sender.conf.broker_transport_options = {
+    'priority_steps': list(range(10)),
+    'sep': ':',
+    'queue_order_strategy': 'priority',
+}
 logger.info(f"Celery Sender (lokal in upload_chunked) konfiguriert mit Broker: {config.redis_url.replace(config.redis_password, '****') if config.redis_password else config.redis_url}")
 
 @uploads_bp.route('/upload/chunk', methods=['POST', 'OPTIONS'])
@@ -517,7 +526,8 @@ def complete_chunked_upload(session_id):
                 'uploaded_file_id': uploaded_file_id,
                 'file_name': filename,
                 'user_id': upload.user_id,
-                'language': upload.upload_metadata.get('language', 'de') if isinstance(upload.upload_metadata, dict) else 'de'
+                'language': upload.upload_metadata.get('language', 'de') if isinstance(upload.upload_metadata, dict) else 'de',
+                'num_files': 1
             }
         )
         db.session.add(proc_task)
@@ -527,7 +537,8 @@ def complete_chunked_upload(session_id):
         celery_sender.send_task(
             'document.process_document',
             args=[task_id],
-            queue='celery'
+            queue=PROCESSING_QUEUE,
+            priority=PROCESSING_PRIORITY
         )
         logger.info(f"✅ Task '{task_id}' für UploadedFile {uploaded_file_id} (Chunked) gesendet.")
 
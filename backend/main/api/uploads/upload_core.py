@@ -31,6 +31,15 @@ MAX_UPLOAD_SIZE_MB = int(os.environ.get('MAX_UPLOAD_SIZE_MB', 100))
 
 # Stelle lokale Celery Sender Instanz wieder her
 celery_sender = Celery('main_upload_core_sender', broker=config.redis_url)
+# Interaktive Erstverarbeitung läuft in der eigenen Queue mit höchster Priorität (siehe worker/config/queues.py)
+PROCESSING_QUEUE = os.environ.get('CELERY_QUEUE_INTERACTIVE', 'interactive')
+PROCESSING_PRIORITY = 0
+# Muss zu den Broker-Optionen des Workers passen, sonst landen Prioritäten in der falschen Redis-Liste
+celery_sender.conf.broker_transport_options = {
+    'priority_steps': list(range(10)),
+    'sep': ':',
+    'queue_order_strategy': 'priority',
+}
 logger.info(f"Celery Sender (lokal in upload_core) konfiguriert mit Broker: {config.redis_url.replace(config.redis_password, '****') if config.redis_password else config.redis_url}")
 
 
@@ -219,7 +228,10 @@ def upload_file():
                         'file_name': saved_file.file_name,
                         'file_index': saved_file.file_index,
                         'user_id': user_id,
-                        'language': upload_language
+                        'language': upload_language,
+                        'num_files': len(files_to_save),
+                        # Optional: 'merged' für einen gemeinsamen Satz Materialien über alle Dateien
+                        'execution_mode': request.form.get('generation_mode')
                     }
                 )
                 db.session.add(proc_task)
@@ -229,7 +241,8 @@ def upload_file():
                 celery_sender.send_task(
                     'document.process_document',
                     args=[file_task_id],
-                    queue='celery'
+                    queue=PROCESSING_QUEUE,
+                    priority=PROCESSING_PRIORITY
                 )
                 task_ids.append(file_task_id)
                 logger.info(f"✅ Task 'document.process_document' für Datei {saved_file.id} gesendet (Task ID: {file_task_id})")
@@ -519,3 +532,25 @@ def _allowed_file(filename):
     """
     allowed_extensions = {'.pdf', '.docx', '.doc', '.txt', '.rtf', '.odt'}
     return os.path.splitext(filename.lower())[1] in allowed_extensions
+
+
+def get_owned_upload(session_id):
+    """
+    Lädt den Upload einer Session für den angemeldeten Benutzer.
+
+    Für Routen, die kostenpflichtige Generierung anstoßen oder Nutzungsdaten
+    zurückgeben; setzt ein gültiges JWT voraus (@jwt_required()).
+
+    Args:
+        session_id: Die Session-ID des Uploads
+
+    Returns:
+        (Upload, None) oder (None, (Response, Statuscode)) bei fehlender Sitzung bzw. fremdem Upload
+    """
+    upload = Upload.query.filter_by(session_id=session_id).first()
+    if not upload:
+        return None, (jsonify({"success": False, "error": {"code": "NOT_FOUND", "message": "Sitzung nicht gefunden"}}), 404)
+    if str(upload.user_id) != str(get_jwt_identity()):
+        logger.warning(f"Zugriff auf Session {session_id} durch fremden Benutzer {get_jwt_identity()} verweigert.")
+        return None, (jsonify({"success": False, "error": {"code": "FORBIDDEN", "message": "Kein Zugriff auf diese Sitzung"}}), 403)
+    return upload, None
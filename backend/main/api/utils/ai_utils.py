@@ -97,7 +97,7 @@ def _query_chatgpt_legacy(prompt, client, system_content=None, temperature=0.7,
 
     Args:
         prompt: Der Prompt-Text für die Anfrage
-        client: Der OpenAI-Client
+        client: Der OpenAI-Client (ungenutzt, die Anfrage läuft über get_chat_backend)
         system_content: Optionaler System-Prompt
         temperature: Temperatur für die Antwortgenerierung (0.0-1.0)
         max_retries: Maximale Anzahl von Wiederholungsversuchen bei Fehlern
@@ -153,6 +153,12 @@ def _query_chatgpt_legacy(prompt, client, system_content=None, temperature=0.7,
             logger.warning("Nicht genügend Kredite für Benutzer %s in %s", user_id, function_name)
             return "INSUFFICIENT_CREDITS: Nicht genügend Kredite für diese Operation."
 
+        # Anfragen laufen über das LLM-Backend des Modells (OpenAI oder lokaler Server)
+        try:
+            from core.openai_integration import get_chat_backend
+        except ImportError:
+            from backend.main.core.openai_integration import get_chat_backend
+
         # Versuche die Anfrage mit Wiederholungen bei Fehlern
         retries = 0
         backoff_time = 1  # Initiale Wartezeit für Exponential Backoff
@@ -160,7 +166,7 @@ def _query_chatgpt_legacy(prompt, client, system_content=None, temperature=0.7,
         while retries <= max_retries:
             try:
                 # API-Anfrage senden
-                response = client.chat.completions.create(
+                response = get_chat_backend("gpt-3.5-turbo").chat(
                     model="gpt-3.5-turbo",
                     messages=messages,
                     temperature=temperature,
@@ -168,7 +174,7 @@ def _query_chatgpt_legacy(prompt, client, system_content=None, temperature=0.7,
                 )
 
                 # Extrahiere die Antwort
-                answer = response.choices[0].message.content.strip()
+                answer = response['choices'][0]['message']['content'].strip()
 
                 # Speichere im Cache, falls aktiviert
                 if use_cache:
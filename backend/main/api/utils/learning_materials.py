@@ -5,13 +5,28 @@ Funktionen zur Generierung von Lernmaterialien wie Flashcards und Fragen.
 
 import json
 import logging
+import os
 import re
 
+from utils.prompt_budget import fit_document
+
 from .ai_utils import query_chatgpt
 from .text_processing import detect_language
 
 logger = logging.getLogger(__name__)
 
+# Modell und Antwortlänge von query_chatgpt (siehe ai_utils._query_chatgpt_legacy)
+PROMPT_MODEL = 'gpt-3.5-turbo'
+PROMPT_MAX_OUTPUT_TOKENS = 1024
+# Obergrenze für den Quelltext im Prompt (Tokens); darunter bestimmt das Kontextfenster
+DOCUMENT_MAX_TOKENS = int(os.environ.get('LEARNING_MATERIALS_DOCUMENT_TOKENS', 4000))
+
+
+def _with_document(system_content, user_prompt, text):
+    """Hängt den Quelltext im Token-Budget neben System- und Nutzer-Prompt an."""
+    return user_prompt + fit_document(text or '', [system_content, user_prompt], PROMPT_MODEL,
+                                      PROMPT_MAX_OUTPUT_TOKENS, max_document_tokens=DOCUMENT_MAX_TOKENS)
+
 
 def generate_additional_flashcards(text, client, analysis, existing_flashcards=None, num_to_generate=5,
                                    language='en', session_id=None, function_name="generate_additional_flashcards"):
@@ -70,7 +85,7 @@ def generate_additional_flashcards(text, client, analysis, existing_flashcards=N
             - topic: Das zugehörige Thema
 
             Hier ist der Text:
-            {text[:5000]}"""
+            """
         else:
             system_content = """You are an AI assistant helping with creating flashcards.
             Your task is to create effective question-answer pairs that cover important concepts,
@@ -98,7 +113,9 @@ def generate_additional_flashcards(text, client, analysis, existing_flashcards=N
             - topic: The related topic
 
             Here's the text:
-            {text[:5000]}"""
+            """
+
+        user_prompt = _with_document(system_content, user_prompt, text)
 
         # Sende die Anfrage an die KI
         response = query_chatgpt(
@@ -241,7 +258,7 @@ def generate_additional_questions(text, client, analysis, existing_questions=Non
             - topic: Das zugehörige Thema
 
             Hier ist der Text:
-            {text[:5000]}"""
+            """
         else:
             system_content = """You are an AI assistant helping with creating study questions.
             Your task is to create challenging and educational questions that promote understanding
@@ -269,7 +286,9 @@ def generate_additional_questions(text, client, analysis, existing_questions=Non
             - topic: The related topic
 
             Here's the text:
-            {text[:5000]}"""
+            """
+
+        user_prompt = _with_document(system_content, user_prompt, text)
 
         # Sende die Anfrage an die KI
         response = query_chatgpt(
@@ -406,7 +425,7 @@ def generate_quiz(text, client, topics=None, num_questions=5, language='en', ses
             - explanation: Die Erklärung für die korrekte Antwort
 
             Hier ist der Text:
-            {text[:5000]}"""
+            """
         else:
             system_content = """You are an AI assistant helping with creating multiple-choice quiz questions.
             Your task is to create educational and clearly formulated questions with plausible answer options."""
@@ -428,7 +447,9 @@ def generate_quiz(text, client, topics=None, num_questions=5, language='en', ses
             - explanation: The explanation for the correct answer
 
             Here's the text:
-            {text[:5000]}"""
+            """
+
+        user_prompt = _with_document(system_content, user_prompt, text)
 
         # Sende die Anfrage an die KI
         response = query_chatgpt(
@@ -182,6 +182,8 @@ class TokenUsage(db.Model):
     model = db.Column(db.String(50), nullable=False)
     input_tokens = db.Column(db.Integer, nullable=False)
     output_tokens = db.Column(db.Integer, nullable=False)
+    # Anteil der input_tokens, der vom Prompt-Cache des Providers bedient wurde
+    cached_tokens = db.Column(db.Integer, nullable=True, default=0)
     cost = db.Column(db.Float, nullable=False)
     endpoint = db.Column(db.String(100), nullable=True)
     function_name = db.Column(db.String(100), nullable=True)
@@ -189,6 +191,54 @@ class TokenUsage(db.Model):
     request_metadata = db.Column(db.JSON, nullable=True)
 
 
+class GenerationLedger(db.Model):
+    """Ergebnis-Ledger der Generierungs-Tasks im Worker (Idempotenz bei Neuzustellung)."""
+    __tablename__ = 'generation_ledger'
+    idempotency_key = db.Column(db.String(64), primary_key=True)
+    task_type = db.Column(db.String(50), nullable=False, index=True)
+    upload_id = db.Column(db.String(36), db.ForeignKey('upload.id', ondelete='CASCADE'), nullable=True, index=True)
+    uploaded_file_id = db.Column(db.String(64), nullable=True, index=True)
+    status = db.Column(db.String(20), nullable=False, default='running', index=True)
+    attempts = db.Column(db.Integer, nullable=False, default=1)
+    celery_task_id = db.Column(db.String(36), nullable=True)
+    result = db.Column(db.JSON, nullable=True)
+    error_message = db.Column(db.Text, nullable=True)
+    lease_expires_at = db.Column(db.DateTime, nullable=True)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+
+class GenerationState(db.Model):
+    """Stand der Generierung pro Ausgabetyp und Quelle (wird vom Worker gepflegt)."""
+    __tablename__ = 'generation_state'
+    uploaded_file_id = db.Column(db.String(64), primary_key=True)
+    task_type = db.Column(db.String(50), primary_key=True)
+    upload_id = db.Column(db.String(36), db.ForeignKey('upload.id', ondelete='CASCADE'), nullable=False, index=True)
+    status = db.Column(db.String(20), nullable=False, default='running', index=True)
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    error_message = db.Column(db.Text, nullable=True)
+    input_tokens = db.Column(db.Integer, nullable=False, default=0)
+    output_tokens = db.Column(db.Integer, nullable=False, default=0)
+    last_prompt_hash = db.Column(db.String(64), nullable=True)
+    options = db.Column(db.JSON, nullable=True)
+    celery_task_id = db.Column(db.String(36), nullable=True)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+
+class PendingMaterial(db.Model):
+    """Vorab generierte, noch verborgene Lernkarte/Frage für "mehr generieren" (wird vom Worker befüllt)."""
+    __tablename__ = 'pending_material'
+    id = db.Column(db.String(36), primary_key=True, default=lambda: str(uuid.uuid4()))
+    upload_id = db.Column(db.String(36), db.ForeignKey('upload.id', ondelete='CASCADE'), nullable=False, index=True)
+    material_type = db.Column(db.String(20), nullable=False, index=True)
+    content = db.Column(db.JSON, nullable=False)
+    model = db.Column(db.String(50), nullable=True)
+    input_tokens = db.Column(db.Integer, nullable=False, default=0)
+    output_tokens = db.Column(db.Integer, nullable=False, default=0)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow, index=True)
+
+
 # --- DB Initialisierung und Helper (gehören eher in app_factory oder __init__) ---
 
 def init_db(app):
@@ -22,10 +22,12 @@ from datetime import datetime
 from typing import Any, Callable, Dict, List, Optional, Union
 
 import backoff
-import tiktoken
 from core.models import TokenUsage, User, db
 from core.redis_client import RedisClient, redis_client
 from openai import APIError, APITimeoutError, OpenAI, RateLimitError
+from utils.llm_backend import LLMBackend, LLMBackendError, get_llm_backend
+from utils.openai_errors import is_retryable_error
+from utils.token_counter import count_tokens as _count_tokens
 
 # Logger konfigurieren
 logger = logging.getLogger('core.openai_integration')
@@ -39,6 +41,8 @@ CACHE_TTL = int(os.environ.get('OPENAI_CACHE_TTL', 86400))  # 24 Stunden Standar
 CACHE_ENABLED = os.environ.get('OPENAI_CACHE_ENABLED', 'true').lower() == 'true'
 MAX_RETRIES = int(os.environ.get('OPENAI_MAX_RETRIES', 3))
 MAX_TIMEOUT = int(os.environ.get('OPENAI_TIMEOUT', 120))  # Timeout in Sekunden
+# Obergrenze der gesamten Wartezeit aller Wiederholungen (Sekunden); hält Request-Threads nicht beliebig lange fest
+BACKOFF_MAX_TIME = int(os.environ.get('OPENAI_BACKOFF_MAX_TIME', 30))
 
 # Modell-Preiskonfiguration pro 1000 Tokens (in Credits)
 MODEL_PRICING = {
@@ -276,38 +280,8 @@ def count_tokens(text_or_messages, model: str = DEFAULT_MODEL) -> int:
     Returns:
         Anzahl der Tokens
     """
-    if not text_or_messages:
-        return 0
-
-    try:
-        # Konvertiere Text oder Nachrichten in einen String für die Zählung
-        if isinstance(text_or_messages, list):
-            if all(isinstance(item, dict) and "content" in item for item in text_or_messages):
-                # Format: [{"role": "user", "content": "..."}, ...]
-                text = " ".join([msg.get("content", "") for msg in text_or_messages])
-            else:
-                # Anderes Listenformat
-                text = str(text_or_messages)
-        else:
-            # Einfacher String
-            text = str(text_or_messages)
-
-        # Verwende tiktoken für genaue Zählung
-        encoder = tiktoken.encoding_for_model(model)
-        token_count = len(encoder.encode(text))
-        logger.debug("Tiktoken-Zählung: %s Tokens für %s Zeichen", token_count, len(text))
-        return token_count
-    except Exception as e:
-        logger.warning("Fehler beim Zählen der Tokens mit tiktoken: %s", str(e))
-        # Fallback: Ungefähre Schätzung (1 Token ≈ 4 Zeichen)
-        if isinstance(text_or_messages, str):
-            fallback_count = len(text_or_messages) // 4
-        elif isinstance(text_or_messages, list):
-            fallback_count = len(str(text_or_messages)) // 4
-        else:
-            fallback_count = 0
-        logger.warning("Fallback-Zählung verwendet: %s Tokens (ca.)", fallback_count)
-        return fallback_count
+    # Gecachter Encoder pro Modell, identisch zur Zählung im Worker (utils/token_counter.py)
+    return _count_tokens(text_or_messages, model)
 
 
 def calculate_token_cost(model: str, input_tokens: int, output_tokens: int) -> int:
@@ -359,7 +333,8 @@ def track_token_usage(user_id: Optional[str] = None,
                       output_tokens: int = 0,
                       function_name: Optional[str] = None,
                       cached: bool = False,
-                      metadata: Optional[Dict] = None) -> bool:
+                      metadata: Optional[Dict] = None,
+                      cached_tokens: int = 0) -> bool:
     """
     Verfolgt die Token-Nutzung für eine API-Anfrage und speichert sie in der Datenbank.
 
@@ -372,6 +347,7 @@ def track_token_usage(user_id: Optional[str] = None,
         function_name: Name der aufrufenden Funktion (optional)
         cached: Ob die Antwort aus dem Cache kam
         metadata: Zusätzliche Metadaten zur Anfrage
+        cached_tokens: Anteil der Input-Tokens aus dem Prompt-Cache des Providers
 
     Returns:
         True bei Erfolg, False bei Fehler
@@ -402,6 +378,7 @@ def track_token_usage(user_id: Optional[str] = None,
             model=model or DEFAULT_MODEL,
             input_tokens=input_tokens,
             output_tokens=output_tokens,
+            cached_tokens=cached_tokens or 0,
             cost=cost,
             endpoint=function_name,
             function_name=function_name,
@@ -539,6 +516,20 @@ def get_openai_client() -> OpenAI:
 
     return _thread_local.client
 
+def get_chat_backend(model: Optional[str] = None) -> LLMBackend:
+    """
+    Gibt das LLM-Backend für ein Modell zurück (siehe utils/llm_backend.py).
+
+    Modelle mit dem Präfix 'local:' (bzw. alle bei LLM_BACKEND=local) laufen auf
+    dem lokalen Server, alle anderen über OpenAI mit denselben Timeout- und
+    Wiederholungseinstellungen wie get_openai_client() bzw. über das
+    LLM-Gateway, wenn LLM_GATEWAY_URL gesetzt ist.
+
+    Returns:
+        LLMBackend: Backend mit chat() und chat_stream()
+    """
+    return get_llm_backend(model, timeout=MAX_TIMEOUT, max_retries=MAX_RETRIES)
+
 # Backoff-Decorator für API-Aufrufe
 
 
@@ -546,6 +537,11 @@ def with_backoff(max_tries: int = MAX_RETRIES + 1):
     """
     Decorator für API-Aufrufe mit exponentiellen Backoff.
 
+    Die Wartezeiten sind zufällig gestreut (voller Jitter) und insgesamt auf
+    BACKOFF_MAX_TIME begrenzt. Fatale Fehler (ungültige Anfrage,
+    Kontextüberlauf, erschöpftes Kontingent) werden nicht wiederholt, siehe
+    utils/openai_errors.py.
+
     Args:
         max_tries: Maximale Anzahl von Versuchen
 
@@ -555,9 +551,11 @@ def with_backoff(max_tries: int = MAX_RETRIES + 1):
     def decorator(func):
         @backoff.on_exception(
             backoff.expo,
-            (APIError, APITimeoutError, RateLimitError),
+            (APIError, APITimeoutError, RateLimitError, LLMBackendError),
             max_tries=max_tries,
-            giveup=lambda e: isinstance(e, RateLimitError) and "exceeded your quota" in str(e),
+            max_time=BACKOFF_MAX_TIME,
+            jitter=backoff.full_jitter,
+            giveup=lambda e: not is_retryable_error(e),
             on_backoff=lambda details: logger.warning(
                 f"Wiederhole OpenAI-Anfrage nach {details['wait']:.1f}s "
                 f"(Versuch {details['tries']}/{max_tries})"
@@ -575,7 +573,11 @@ def chat_completion(model: str, messages: List[Dict], user_id: Optional[str] = N
                     session_id: Optional[str] = None, function_name: Optional[str] = None,
                     use_cache: bool = True, **kwargs) -> Dict[str, Any]:
     """
-    Führt eine OpenAI-Chat-Completion durch mit Caching, Fehlerbehandlung und Token-Tracking.
+    Führt eine Chat-Completion durch mit Caching, Fehlerbehandlung und Token-Tracking.
+
+    Die Anfrage läuft über das LLM-Backend des Modells (OpenAI, lokaler
+    Server oder LLM-Gateway, siehe get_chat_backend). Über das Gateway
+    übernimmt dessen gemeinsamer Antwort-Cache die Rolle von OpenAICache.
 
     Args:
         model: Modellname
@@ -589,6 +591,11 @@ def chat_completion(model: str, messages: List[Dict], user_id: Optional[str] = N
     Returns:
         Die OpenAI-Antwort als Dictionary
     """
+    # Backend des Modells (OpenAI, lokaler Server oder Gateway)
+    backend = get_chat_backend(model)
+    # Das Gateway cacht selbst (prozessübergreifend, mit Single-Flight)
+    local_cache = use_cache and backend.name != 'gateway'
+
     # Cache initialisieren
     cache = OpenAICache()
 
@@ -596,7 +603,7 @@ def chat_completion(model: str, messages: List[Dict], user_id: Optional[str] = N
     cache_key = cache.generate_key(model, messages, **kwargs)
 
     # Prüfe, ob der Cache aktiviert ist und ob die Antwort im Cache ist
-    if use_cache:
+    if local_cache:
         cached_response = cache.get(cache_key)
         if cached_response:
             # Token-Nutzung für gecachte Antwort tracken
@@ -629,9 +636,6 @@ def chat_completion(model: str, messages: List[Dict], user_id: Optional[str] = N
             # Gibt die gecachte Antwort zurück
             return cached_response
 
-    # Client abrufen
-    client = get_openai_client()
-
     # Metadata für Anfrage speichern
     metadata = {
         "model": model,
@@ -642,32 +646,31 @@ def chat_completion(model: str, messages: List[Dict], user_id: Optional[str] = N
 
     start_time = time.time()
     try:
-        # Anfrage an OpenAI senden
-        response = client.chat.completions.create(
-            model=model,
-            messages=messages,
-            **kwargs
-        )
+        # Anfrage an das Backend senden
+        response_dict = backend.chat(model, messages, cache=use_cache, **kwargs)
 
         # Zeitmessung für Anfrage
         request_time = time.time() - start_time
 
-        # Response in Dict umwandeln
-        response_dict = response.model_dump()
-
         # Im Cache speichern, wenn aktiviert
-        if use_cache:
+        if local_cache:
             cache.set(cache_key, response_dict)
 
+        # Vom Gateway aus dem Cache bzw. aus einer gleichzeitigen Anfrage beantwortet
+        from_gateway_cache = (response_dict.get('gateway') or {}).get('cache') in ('hit', 'coalesced')
+
         # Token-Nutzung tracken
-        input_tokens = response.usage.prompt_tokens
-        output_tokens = response.usage.completion_tokens
+        usage = response_dict.get('usage') or {}
+        input_tokens = usage.get('prompt_tokens', 0)
+        output_tokens = usage.get('completion_tokens', 0)
+        cached_tokens = usage.get('cached_tokens', 0)
 
         # Füge zeitbezogene Metadaten hinzu
         metadata.update({
             "request_duration_ms": int(request_time * 1000),
             "input_tokens": input_tokens,
-            "output_tokens": output_tokens
+            "output_tokens": output_tokens,
+            "cached_tokens": cached_tokens
         })
 
         track_token_usage(
@@ -677,13 +680,14 @@ def chat_completion(model: str, messages: List[Dict], user_id: Optional[str] = N
             input_tokens=input_tokens,
             output_tokens=output_tokens,
             function_name=function_name,
-            cached=False,
-            metadata=metadata
+            cached=from_gateway_cache,
+            metadata=metadata,
+            cached_tokens=cached_tokens
         )
 
         # Erfolgreiche Anfrage protokollieren
         logger.info(
-            f"OpenAI-Anfrage erfolgreich: Modell={model}, "
+            f"LLM-Anfrage erfolgreich ({backend.name}): Modell={model}, "
             f"Tokens={input_tokens}+{output_tokens}, "
             f"Zeit={int(request_time * 1000)}ms"
         )
@@ -846,6 +850,7 @@ def get_usage_stats(user_id: Optional[str] = None,
 __all__ = [
     'OpenAICache',
     'get_openai_client',
+    'get_chat_backend',
     'chat_completion',
     'extract_content_from_response',
     'clear_cache',
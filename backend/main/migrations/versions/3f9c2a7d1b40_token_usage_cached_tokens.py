@@ -0,0 +1,26 @@
+"""Gecachte Prompt-Tokens in token_usage speichern
+
+Revision ID: 3f9c2a7d1b40
+Revises: e12be8eba6ad
+Create Date: 2026-10-18 10:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3f9c2a7d1b40'
+down_revision = 'e12be8eba6ad'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('token_usage', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('cached_tokens', sa.Integer(), nullable=True, server_default='0'))
+
+
+def downgrade():
+    with op.batch_alter_table('token_usage', schema=None) as batch_op:
+        batch_op.drop_column('cached_tokens')
@@ -0,0 +1,50 @@
+"""Ergebnis-Ledger für idempotente Generierungs-Tasks
+
+Revision ID: 7b1e4c9a2d55
+Revises: 3f9c2a7d1b40
+Create Date: 2026-10-18 12:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '7b1e4c9a2d55'
+down_revision = '3f9c2a7d1b40'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('generation_ledger',
+    sa.Column('idempotency_key', sa.String(length=64), nullable=False),
+    sa.Column('task_type', sa.String(length=50), nullable=False),
+    sa.Column('upload_id', sa.String(length=36), nullable=True),
+    sa.Column('uploaded_file_id', sa.String(length=64), nullable=True),
+    sa.Column('status', sa.String(length=20), nullable=False),
+    sa.Column('attempts', sa.Integer(), nullable=False),
+    sa.Column('celery_task_id', sa.String(length=36), nullable=True),
+    sa.Column('result', sa.JSON(), nullable=True),
+    sa.Column('error_message', sa.Text(), nullable=True),
+    sa.Column('lease_expires_at', sa.DateTime(), nullable=True),
+    sa.Column('created_at', sa.DateTime(), nullable=False),
+    sa.Column('updated_at', sa.DateTime(), nullable=False),
+    sa.ForeignKeyConstraint(['upload_id'], ['upload.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('idempotency_key')
+    )
+    with op.batch_alter_table('generation_ledger', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_generation_ledger_task_type'), ['task_type'], unique=False)
+        batch_op.create_index(batch_op.f('ix_generation_ledger_upload_id'), ['upload_id'], unique=False)
+        batch_op.create_index(batch_op.f('ix_generation_ledger_uploaded_file_id'), ['uploaded_file_id'], unique=False)
+        batch_op.create_index(batch_op.f('ix_generation_ledger_status'), ['status'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('generation_ledger', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_generation_ledger_status'))
+        batch_op.drop_index(batch_op.f('ix_generation_ledger_uploaded_file_id'))
+        batch_op.drop_index(batch_op.f('ix_generation_ledger_upload_id'))
+        batch_op.drop_index(batch_op.f('ix_generation_ledger_task_type'))
+
+    op.drop_table('generation_ledger')
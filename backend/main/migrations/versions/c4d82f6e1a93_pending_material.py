@@ -0,0 +1,44 @@
+"""Vorab generierte Materialien für "mehr generieren"
+
+Revision ID: c4d82f6e1a93
+Revises: 7b1e4c9a2d55
+Create Date: 2026-10-18 13:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c4d82f6e1a93'
+down_revision = '7b1e4c9a2d55'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('pending_material',
+    sa.Column('id', sa.String(length=36), nullable=False),
+    sa.Column('upload_id', sa.String(length=36), nullable=False),
+    sa.Column('material_type', sa.String(length=20), nullable=False),
+    sa.Column('content', sa.JSON(), nullable=False),
+    sa.Column('model', sa.String(length=50), nullable=True),
+    sa.Column('input_tokens', sa.Integer(), nullable=False),
+    sa.Column('output_tokens', sa.Integer(), nullable=False),
+    sa.Column('created_at', sa.DateTime(), nullable=False),
+    sa.ForeignKeyConstraint(['upload_id'], ['upload.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('id')
+    )
+    with op.batch_alter_table('pending_material', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_pending_material_upload_id'), ['upload_id'], unique=False)
+        batch_op.create_index(batch_op.f('ix_pending_material_material_type'), ['material_type'], unique=False)
+        batch_op.create_index(batch_op.f('ix_pending_material_created_at'), ['created_at'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('pending_material', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_pending_material_created_at'))
+        batch_op.drop_index(batch_op.f('ix_pending_material_material_type'))
+        batch_op.drop_index(batch_op.f('ix_pending_material_upload_id'))
+
+    op.drop_table('pending_material')
@@ -0,0 +1,47 @@
+"""Generierungsstand pro Ausgabetyp und Quelle
+
+Revision ID: d5e1f0a7b3c2
+Revises: c4d82f6e1a93
+Create Date: 2026-10-18 15:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd5e1f0a7b3c2'
+down_revision = 'c4d82f6e1a93'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('generation_state',
+    sa.Column('uploaded_file_id', sa.String(length=64), nullable=False),
+    sa.Column('task_type', sa.String(length=50), nullable=False),
+    sa.Column('upload_id', sa.String(length=36), nullable=False),
+    sa.Column('status', sa.String(length=20), nullable=False),
+    sa.Column('attempts', sa.Integer(), nullable=False),
+    sa.Column('error_message', sa.Text(), nullable=True),
+    sa.Column('input_tokens', sa.Integer(), nullable=False),
+    sa.Column('output_tokens', sa.Integer(), nullable=False),
+    sa.Column('last_prompt_hash', sa.String(length=64), nullable=True),
+    sa.Column('options', sa.JSON(), nullable=True),
+    sa.Column('celery_task_id', sa.String(length=36), nullable=True),
+    sa.Column('created_at', sa.DateTime(), nullable=False),
+    sa.Column('updated_at', sa.DateTime(), nullable=False),
+    sa.ForeignKeyConstraint(['upload_id'], ['upload.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('uploaded_file_id', 'task_type')
+    )
+    with op.batch_alter_table('generation_state', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_generation_state_upload_id'), ['upload_id'], unique=False)
+        batch_op.create_index(batch_op.f('ix_generation_state_status'), ['status'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('generation_state', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_generation_state_status'))
+        batch_op.drop_index(batch_op.f('ix_generation_state_upload_id'))
+
+    op.drop_table('generation_state')
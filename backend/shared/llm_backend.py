@@ -0,0 +1,452 @@
+"""
+Austauschbares LLM-Backend.
+
+Quelle ist backend/shared/llm_backend.py; die Kopien in API (main/utils) und
+Worker (worker/utils) erzeugt `python sync_shared.py`. Alle Chat-Completions
+laufen über ein Backend mit derselben Schnittstelle:
+
+- chat(): Antwort als Dictionary im Format der Chat-Completions-API
+  ({'model', 'choices': [{'message', 'finish_reason'}], 'usage'})
+- chat_stream(): wie chat(), jeder Textabschnitt geht zusätzlich an on_delta
+- strukturierte Ausgabe über response_format ({"type": "json_object"} bzw. "json_schema")
+- usage mit prompt_tokens, completion_tokens, total_tokens und cached_tokens
+
+Implementierungen:
+
+- OpenAIBackend: OpenAI-SDK
+- LocalHTTPBackend: OpenAI-kompatibler Endpunkt eines lokalen Modellservers
+  (llama.cpp `llama-server`, Ollama unter /v1) über HTTP, ohne API-Schlüssel.
+  Liefert der Server keine Token-Nutzung, wird sie mit utils/token_counter.py geschätzt.
+- GatewayBackend: LLM-Gateway (backend/gateway), das Verbindungs-Pool,
+  Antwort-Cache, Single-Flight, globale Limits, Wiederholungen und
+  Nutzungszähler für alle Dienste bündelt. Aktiv, sobald LLM_GATEWAY_URL
+  gesetzt ist; der OpenAI-Schlüssel liegt dann nur im Gateway.
+
+Welches Backend eine Anfrage bedient, entscheidet das Modell: Modelle mit dem
+Präfix 'local:' (z.B. MODEL_ROUTE_TOPICS="local:qwen2.5:7b-instruct,gpt-4o-mini")
+laufen lokal, alle anderen über LLM_BACKEND ('openai' oder 'local'; 'local'
+leitet alle Anfragen auf den lokalen Server um, z.B. offline in der Entwicklung).
+Fehler aller Backends tragen HTTP-Status und Fehlercode, sodass
+utils/openai_errors.py sie gleich einstuft.
+"""
+import json
+import logging
+import os
+import threading
+from typing import Any, Callable, Dict, List, Optional
+
+from utils.token_counter import count_tokens, count_tokens_batch
+
+logger = logging.getLogger(__name__)
+
+# Standard-Backend für Modelle ohne Präfix ('openai' oder 'local')
+LLM_BACKEND = os.environ.get('LLM_BACKEND', 'openai').lower()
+# Modell-Präfix für Anfragen an den lokalen Server
+LOCAL_MODEL_PREFIX = 'local:'
+# OpenAI-kompatibler Endpunkt des lokalen Servers (Ollama: :11434/v1, llama.cpp: :8080/v1)
+LOCAL_LLM_BASE_URL = os.environ.get('LOCAL_LLM_BASE_URL', 'http://localhost:11434/v1').rstrip('/')
+# Modell, das bei LLM_BACKEND=local statt eines OpenAI-Modellnamens angefragt wird (leer = Name unverändert)
+LOCAL_LLM_MODEL = os.environ.get('LOCAL_LLM_MODEL', '')
+# Zeitlimit einer lokalen Anfrage (Sekunden); CPU-Inferenz ist deutlich langsamer als die API
+LOCAL_LLM_TIMEOUT = float(os.environ.get('LOCAL_LLM_TIMEOUT', 300))
+# Optionaler Schlüssel, falls der lokale Server hinter einem Proxy mit Authentifizierung läuft
+LOCAL_LLM_API_KEY = os.environ.get('LOCAL_LLM_API_KEY', '')
+# OpenAI-kompatibler Endpunkt des LLM-Gateways, z.B. http://llm-gateway:8090/v1 (leer = OpenAI direkt)
+LLM_GATEWAY_URL = os.environ.get('LLM_GATEWAY_URL', '').rstrip('/')
+# Gemeinsames Geheimnis mit dem Gateway (GATEWAY_TOKEN dort)
+LLM_GATEWAY_TOKEN = os.environ.get('LLM_GATEWAY_TOKEN', '')
+# Zeitlimit einer Gateway-Anfrage (Sekunden); enthält Wartezeit auf Limits und Wiederholungen im Gateway
+LLM_GATEWAY_TIMEOUT = float(os.environ.get('LLM_GATEWAY_TIMEOUT', 300))
+# Aufrufer für die Nutzungszähler des Gateways (Standard: Containertyp, z.B. 'api' bzw. 'worker')
+LLM_GATEWAY_CALLER = os.environ.get('LLM_GATEWAY_CALLER') or os.environ.get('CONTAINER_TYPE', 'unknown')
+
+# Backends sind zustandslos bis auf ihre Clients und werden pro Prozess wiederverwendet
+_backends: Dict[str, 'LLMBackend'] = {}
+_backends_lock = threading.Lock()
+
+
+class LLMBackendError(Exception):
+    """Fehler eines Backends mit HTTP-Status und Fehlercode (für utils/openai_errors.py)."""
+
+    def __init__(self, message: str, status_code: Optional[int] = None, code: Optional[str] = None,
+                 response: Any = None):
+        super().__init__(message)
+        self.status_code = status_code
+        self.code = code
+        self.response = response
+
+
+def is_local_model(model: Optional[str]) -> bool:
+    """Prüft, ob ein Modell auf dem lokalen Server läuft."""
+    return bool(model) and (model.startswith(LOCAL_MODEL_PREFIX) or LLM_BACKEND == 'local')
+
+
+def needs_openai_key(model: Optional[str]) -> bool:
+    """Prüft, ob eine Anfrage einen OpenAI-Schlüssel in diesem Dienst braucht (nicht lokal, ohne Gateway)."""
+    return not is_local_model(model) and not LLM_GATEWAY_URL
+
+
+def _completion_result(model: str, content: str, finish_reason: Optional[str],
+                       usage: Optional[Dict[str, int]]) -> Dict[str, Any]:
+    """Antwort im Format der Chat-Completions-API."""
+    return {
+        "model": model,
+        "choices": [
+            {
+                "message": {"role": "assistant", "content": content},
+                "index": 0,
+                "finish_reason": finish_reason
+            }
+        ],
+        "usage": usage
+    }
+
+
+def normalize_usage(usage: Any) -> Optional[Dict[str, int]]:
+    """
+    Vereinheitlicht die Token-Nutzung (Objekt der OpenAI-Bibliothek oder Dictionary).
+
+    Returns:
+        dict: prompt_tokens, completion_tokens, total_tokens und cached_tokens (None ohne Nutzung)
+    """
+    if not usage:
+        return None
+
+    def field(source, name):
+        value = source.get(name) if isinstance(source, dict) else getattr(source, name, None)
+        return value or 0
+
+    details = usage.get('prompt_tokens_details') if isinstance(usage, dict) else getattr(usage, 'prompt_tokens_details', None)
+    prompt_tokens = int(field(usage, 'prompt_tokens'))
+    completion_tokens = int(field(usage, 'completion_tokens'))
+    return {
+        "prompt_tokens": prompt_tokens,
+        "completion_tokens": completion_tokens,
+        "total_tokens": int(field(usage, 'total_tokens')) or prompt_tokens + completion_tokens,
+        "cached_tokens": int(field(details, 'cached_tokens')) if details else 0
+    }
+
+
+def estimate_usage(messages: List[Dict[str, Any]], content: str, model: str) -> Dict[str, int]:
+    """Schätzt die Token-Nutzung, wenn der Server keine meldet."""
+    prompt_tokens = sum(count_tokens_batch([str(message.get('content') or '') for message in messages], model))
+    completion_tokens = count_tokens(content or '', model)
+    return {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens,
+            "total_tokens": prompt_tokens + completion_tokens, "cached_tokens": 0}
+
+
+class LLMBackend:
+    """Schnittstelle eines LLM-Backends."""
+
+    name = 'base'
+
+    def chat(self, model: str, messages: List[Dict[str, Any]], temperature: Optional[float] = None,
+             max_tokens: Optional[int] = None, response_format: Optional[Dict[str, Any]] = None,
+             cache: bool = False, **kwargs) -> Dict[str, Any]:
+        """
+        Führt eine Chat-Completion aus.
+
+        Args:
+            model: Modellname
+            messages: Nachrichten mit 'role' und 'content'
+            temperature: Temperatur (None = Standard des Modells)
+            max_tokens: Maximale Ausgabe-Tokens
+            response_format: Strukturierte Ausgabe, z.B. {"type": "json_object"}
+            cache: Antwort darf aus dem Cache des Gateways kommen (andere Backends ignorieren das)
+            **kwargs: Weitere Parameter der Chat-Completions-API
+
+        Returns:
+            dict: Antwort im Format der Chat-Completions-API; über das Gateway
+                zusätzlich 'gateway': {'cache': 'hit' | 'miss' | 'coalesced' | 'bypass'}
+
+        Raises:
+            Exception: Fehler des Providers (von utils/openai_errors.py einstufbar)
+        """
+        raise NotImplementedError
+
+    def chat_stream(self, model: str, messages: List[Dict[str, Any]], temperature: Optional[float] = None,
+                    max_tokens: Optional[int] = None, response_format: Optional[Dict[str, Any]] = None,
+                    on_delta: Optional[Callable[[str], None]] = None, **kwargs) -> Dict[str, Any]:
+        """
+        Wie chat(), die Antwort wird aber gestreamt.
+
+        Jeder Textabschnitt geht sofort an on_delta. Bricht der Stream ab,
+        nachdem Abschnitte ausgeliefert wurden, enthält die Ausnahme den
+        bisherigen Text (partial_content) und die Nutzung (partial_usage).
+        """
+        raise NotImplementedError
+
+    @staticmethod
+    def _params(model, messages, temperature, max_tokens, response_format, kwargs) -> Dict[str, Any]:
+        params = {"model": model, "messages": messages}
+        if temperature is not None:
+            params["temperature"] = temperature
+        if max_tokens:
+            params["max_tokens"] = max_tokens
+        if response_format:
+            params["response_format"] = response_format
+        params.update(kwargs)
+        return params
+
+
+def _stream_aborted(error: Exception, parts: List[str], usage: Optional[Dict[str, int]]) -> Exception:
+    """Hängt den bereits gestreamten Text an eine Ausnahme an."""
+    error.partial_content = "".join(parts)
+    error.partial_usage = usage
+    return error
+
+
+class OpenAIBackend(LLMBackend):
+    """Chat-Completions über das OpenAI-SDK."""
+
+    name = 'openai'
+
+    def __init__(self, api_key: Optional[str] = None, max_retries: int = 0, timeout: Optional[float] = None,
+                 default_headers: Optional[Dict[str, str]] = None):
+        self.api_key = api_key if api_key is not None else os.environ.get('OPENAI_API_KEY', '')
+        self.max_retries = max_retries
+        self.timeout = timeout
+        self.default_headers = {"OpenAI-Beta": "assistants=v2", **(default_headers or {})}
+        self._local = threading.local()
+
+    def client(self):
+        """OpenAI-Client des aktuellen Threads."""
+        client = getattr(self._local, 'client', None)
+        if client is None:
+            from openai import OpenAI
+            if not self.api_key:
+                raise LLMBackendError("Kein OpenAI API-Schlüssel konfiguriert", status_code=401, code='invalid_api_key')
+            options = {'api_key': self.api_key, 'default_headers': self.default_headers, 'max_retries': self.max_retries}
+            if self.timeout:
+                options['timeout'] = self.timeout
+            client = self._local.client = OpenAI(**options)
+        return client
+
+    def chat(self, model, messages, temperature=None, max_tokens=None, response_format=None, cache=False,
+             **kwargs):
+        completion = self.client().chat.completions.create(
+            **self._params(model, messages, temperature, max_tokens, response_format, kwargs))
+        choice = completion.choices[0]
+        result = _completion_result(completion.model, choice.message.content, choice.finish_reason,
+                                    normalize_usage(completion.usage))
+        result["id"] = getattr(completion, 'id', None)
+        return result
+
+    def chat_stream(self, model, messages, temperature=None, max_tokens=None, response_format=None,
+                    on_delta=None, **kwargs):
+        params = self._params(model, messages, temperature, max_tokens, response_format, kwargs)
+        # Liefert die Token-Nutzung als letzten Chunk mit
+        params.update(stream=True, stream_options={"include_usage": True})
+        parts: List[str] = []
+        finish_reason = None
+        usage = None
+        model_name = model
+        try:
+            for chunk in self.client().chat.completions.create(**params):
+                model_name = getattr(chunk, 'model', None) or model_name
+                if getattr(chunk, 'usage', None):
+                    usage = normalize_usage(chunk.usage)
+                if not chunk.choices:
+                    continue
+                choice = chunk.choices[0]
+                if choice.finish_reason:
+                    finish_reason = choice.finish_reason
+                delta = choice.delta.content if choice.delta else None
+                if delta:
+                    parts.append(delta)
+                    if on_delta:
+                        on_delta(delta)
+        except Exception as e:
+            raise _stream_aborted(e, parts, usage)
+        return _completion_result(model_name, "".join(parts), finish_reason, usage)
+
+
+class LocalHTTPBackend(LLMBackend):
+    """
+    Chat-Completions über einen lokalen, OpenAI-kompatiblen HTTP-Endpunkt.
+
+    Getestet wird gegen die /v1/chat/completions-Schnittstelle von llama.cpp
+    (`llama-server`) und Ollama; strukturierte Ausgabe wird als response_format
+    durchgereicht, beide Server erzwingen damit gültiges JSON.
+    """
+
+    name = 'local'
+    label = 'Lokaler LLM-Server'
+
+    def __init__(self, base_url: str = LOCAL_LLM_BASE_URL, default_model: str = LOCAL_LLM_MODEL,
+                 timeout: float = LOCAL_LLM_TIMEOUT, api_key: str = LOCAL_LLM_API_KEY):
+        self.base_url = base_url.rstrip('/')
+        self.default_model = default_model
+        self.timeout = timeout
+        self.api_key = api_key
+        self._http = None
+        self._http_lock = threading.Lock()
+
+    def client(self):
+        """Gemeinsamer httpx-Client (threadsicher, hält Verbindungen offen)."""
+        if self._http is None:
+            import httpx
+            with self._http_lock:
+                if self._http is None:
+                    self._http = httpx.Client(timeout=self.timeout)
+        return self._http
+
+    def model_name(self, model: Optional[str]) -> str:
+        """Modellname auf dem lokalen Server ('local:'-Präfix entfernt, sonst LOCAL_LLM_MODEL)."""
+        if model and model.startswith(LOCAL_MODEL_PREFIX):
+            return model[len(LOCAL_MODEL_PREFIX):]
+        return self.default_model or model or ''
+
+    def _headers(self, cache: bool = False) -> Dict[str, str]:
+        headers = {"Content-Type": "application/json"}
+        if self.api_key:
+            headers["Authorization"] = f"Bearer {self.api_key}"
+        return headers
+
+    @classmethod
+    def _raise_for_status(cls, response) -> None:
+        if response.status_code < 400:
+            return
+        try:
+            body = response.json()
+        except ValueError:
+            body = {}
+        error = body.get('error') if isinstance(body, dict) else None
+        message = (error.get('message') if isinstance(error, dict) else error) or response.text[:500]
+        code = error.get('code') or error.get('type') if isinstance(error, dict) else None
+        raise LLMBackendError(f"{cls.label}: {response.status_code} {message}",
+                              status_code=response.status_code, code=code if isinstance(code, str) else None,
+                              response=response)
+
+    def chat(self, model, messages, temperature=None, max_tokens=None, response_format=None, cache=False,
+             **kwargs):
+        import httpx
+        local_model = self.model_name(model)
+        params = self._params(local_model, messages, temperature, max_tokens, response_format, kwargs)
+        try:
+            response = self.client().post(f"{self.base_url}/chat/completions", json=params,
+                                          headers=self._headers(cache))
+        except httpx.HTTPError as e:
+            # Timeout bzw. Server nicht erreichbar: ohne Status, gilt als vorübergehend
+            raise LLMBackendError(f"{self.label} nicht erreichbar: {e}") from e
+        self._raise_for_status(response)
+        body = response.json()
+        choice = (body.get('choices') or [{}])[0]
+        content = (choice.get('message') or {}).get('content') or ''
+        usage = normalize_usage(body.get('usage')) or estimate_usage(messages, content, local_model)
+        result = _completion_result(body.get('model') or model, content, choice.get('finish_reason'), usage)
+        if body.get('id'):
+            result["id"] = body['id']
+        return self._with_response_info(result, response)
+
+    def _with_response_info(self, result: Dict[str, Any], response) -> Dict[str, Any]:
+        """Ergänzt das Ergebnis um Angaben aus der HTTP-Antwort (für Unterklassen)."""
+        return result
+
+    def chat_stream(self, model, messages, temperature=None, max_tokens=None, response_format=None,
+                    on_delta=None, **kwargs):
+        import httpx
+        local_model = self.model_name(model)
+        params = self._params(local_model, messages, temperature, max_tokens, response_format, kwargs)
+        params.update(stream=True, stream_options={"include_usage": True})
+        parts: List[str] = []
+        finish_reason = None
+        usage = None
+        model_name = model
+        try:
+            with self.client().stream("POST", f"{self.base_url}/chat/completions", json=params,
+                                      headers=self._headers()) as response:
+                if response.status_code >= 400:
+                    response.read()
+                    self._raise_for_status(response)
+                # Server-Sent Events: "data: {...}" je Chunk, Ende mit "data: [DONE]"
+                for line in response.iter_lines():
+                    if not line.startswith('data:'):
+                        continue
+                    data = line[len('data:'):].strip()
+                    if data == '[DONE]':
+                        break
+                    chunk = json.loads(data)
+                    model_name = chunk.get('model') or model_name
+                    if chunk.get('usage'):
+                        usage = normalize_usage(chunk['usage'])
+                    for choice in chunk.get('choices') or []:
+                        finish_reason = choice.get('finish_reason') or finish_reason
+                        delta = (choice.get('delta') or {}).get('content')
+                        if delta:
+                            parts.append(delta)
+                            if on_delta:
+                                on_delta(delta)
+        except LLMBackendError as e:
+            raise _stream_aborted(e, parts, usage)
+        except (httpx.HTTPError, ValueError) as e:
+            raise _stream_aborted(LLMBackendError(f"{self.label}: Stream abgebrochen: {e}"), parts, usage) from e
+        content = "".join(parts)
+        return _completion_result(model_name, content, finish_reason,
+                                  usage or estimate_usage(messages, content, local_model))
+
+
+class GatewayBackend(LocalHTTPBackend):
+    """
+    Chat-Completions über das LLM-Gateway (backend/gateway).
+
+    Das Gateway spricht dieselbe OpenAI-kompatible Schnittstelle wie ein
+    lokaler Server; Modellnamen bleiben unverändert. Zusätzlich meldet jede
+    Anfrage ihren Aufrufer (X-Gateway-Caller) und fordert mit cache=True den
+    Antwort-Cache des Gateways an (X-Gateway-Cache: use). Der Cache-Status der
+    Antwort steht in result['gateway']['cache'].
+    """
+
+    name = 'gateway'
+    label = 'LLM-Gateway'
+
+    def __init__(self, base_url: str = LLM_GATEWAY_URL, timeout: float = LLM_GATEWAY_TIMEOUT,
+                 api_key: str = LLM_GATEWAY_TOKEN, caller: str = LLM_GATEWAY_CALLER):
+        super().__init__(base_url=base_url, default_model='', timeout=timeout, api_key=api_key)
+        self.caller = caller
+
+    def model_name(self, model: Optional[str]) -> str:
+        return model or ''
+
+    def _headers(self, cache: bool = False) -> Dict[str, str]:
+        headers = super()._headers(cache)
+        headers["X-Gateway-Caller"] = self.caller
+        if cache:
+            headers["X-Gateway-Cache"] = "use"
+        return headers
+
+    def _with_response_info(self, result, response):
+        result["gateway"] = {"cache": response.headers.get('X-Gateway-Cache')}
+        return result
+
+
+def get_llm_backend(model: Optional[str] = None, **openai_options) -> LLMBackend:
+    """
+    Gibt das Backend für ein Modell zurück.
+
+    Args:
+        model: Modellname ('local:<name>' läuft immer lokal)
+        **openai_options: Optionen für OpenAIBackend (api_key, max_retries, timeout,
+            default_headers); Backends mit gleichen Optionen werden wiederverwendet.
+            Über das Gateway entfallen sie, Schlüssel und Wiederholungen liegen dort.
+
+    Returns:
+        LLMBackend: LocalHTTPBackend, GatewayBackend oder OpenAIBackend
+    """
+    if is_local_model(model):
+        key = 'local'
+        factory = LocalHTTPBackend
+    elif LLM_GATEWAY_URL:
+        key = 'gateway'
+        factory = GatewayBackend
+    else:
+        key = 'openai:' + json.dumps(openai_options, sort_keys=True, default=str)
+        factory = lambda: OpenAIBackend(**openai_options)  # noqa: E731
+    backend = _backends.get(key)
+    if backend is None:
+        with _backends_lock:
+            backend = _backends.get(key)
+            if backend is None:
+                backend = _backends[key] = factory()
+                logger.info(f"[LLM BACKEND] {backend.name} initialisiert")
+    return backend
@@ -0,0 +1,146 @@
+"""
+Token-Zählung mit gecachten Encodern.
+
+Quelle ist backend/shared/token_counter.py; die Kopien in API (main/utils) und
+Worker (worker/utils) erzeugt `python sync_shared.py`, damit Abrechnung,
+Budgets und Kürzungen in beiden Diensten dieselben Zahlen liefern. Encoder
+werden einmal pro Modell geladen; ohne tiktoken (oder wenn die BPE-Datei nicht
+geladen werden kann) wird einheitlich mit 4 Zeichen pro Token geschätzt.
+"""
+import logging
+import os
+from functools import lru_cache
+from typing import Any, Iterable, List
+
+try:
+    import tiktoken
+    TIKTOKEN_AVAILABLE = True
+except ImportError:
+    tiktoken = None
+    TIKTOKEN_AVAILABLE = False
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MODEL = os.environ.get('OPENAI_DEFAULT_MODEL', 'gpt-4o')
+# Encoding für Modelle, die tiktoken (noch) nicht kennt
+FALLBACK_ENCODING = 'cl100k_base'
+# Schätzung ohne Encoder
+CHARS_PER_TOKEN = 4
+# Ein Token umfasst höchstens so viele Zeichen (für das Kürzen per Präfix)
+MAX_CHARS_PER_TOKEN = 8
+# Ab dieser Anzahl Texte zählt count_tokens_batch parallel (tiktoken gibt den GIL frei)
+BATCH_THREADS = int(os.environ.get('TOKEN_COUNT_THREADS', 4))
+
+
+@lru_cache(maxsize=32)
+def get_encoding(model: str = DEFAULT_MODEL):
+    """
+    Encoder eines Modells (einmal pro Prozess und Modell geladen).
+
+    Returns:
+        tiktoken.Encoding oder None, wenn kein Encoder verfügbar ist
+    """
+    if not TIKTOKEN_AVAILABLE:
+        return None
+    try:
+        return tiktoken.encoding_for_model(model)
+    except KeyError:
+        pass
+    except Exception as e:
+        logger.warning("Encoder für %s nicht verfügbar, verwende Schätzung: %s", model, e)
+        return None
+    try:
+        return tiktoken.get_encoding(FALLBACK_ENCODING)
+    except Exception as e:
+        logger.warning("Encoder %s nicht verfügbar, verwende Schätzung: %s", FALLBACK_ENCODING, e)
+        return None
+
+
+def as_text(text_or_messages: Any) -> str:
+    """Text einer Anfrage: Strings unverändert, Nachrichtenlisten als verbundene Inhalte."""
+    if not text_or_messages:
+        return ''
+    if isinstance(text_or_messages, list):
+        if all(isinstance(item, dict) and 'content' in item for item in text_or_messages):
+            return ' '.join(str(message.get('content') or '') for message in text_or_messages)
+        return str(text_or_messages)
+    return str(text_or_messages)
+
+
+def estimate_tokens(text: str) -> int:
+    """Schätzung ohne Encoder (4 Zeichen pro Token)."""
+    return len(text) // CHARS_PER_TOKEN
+
+
+def count_tokens(text_or_messages: Any, model: str = DEFAULT_MODEL) -> int:
+    """
+    Zählt die Tokens eines Textes oder einer Nachrichtenliste.
+
+    Args:
+        text_or_messages: Text oder [{"role": ..., "content": ...}, ...]
+        model: Modell, dessen Encoder verwendet wird
+
+    Returns:
+        int: Anzahl der Tokens
+    """
+    text = as_text(text_or_messages)
+    if not text:
+        return 0
+    encoding = get_encoding(model)
+    if encoding is None:
+        return estimate_tokens(text)
+    # encode_ordinary: Spezial-Tokens im Nutzertext ("<|endoftext|>") werden als normaler Text gezählt
+    return len(encoding.encode_ordinary(text))
+
+
+def count_tokens_batch(texts: Iterable[Any], model: str = DEFAULT_MODEL) -> List[int]:
+    """
+    Zählt die Tokens mehrerer Texte in einem Aufruf.
+
+    Args:
+        texts: Texte oder Nachrichtenlisten
+        model: Modell, dessen Encoder verwendet wird
+
+    Returns:
+        list: Anzahl der Tokens je Text (gleiche Reihenfolge)
+    """
+    texts = [as_text(text) for text in texts]
+    encoding = get_encoding(model)
+    if encoding is None:
+        return [estimate_tokens(text) for text in texts]
+    return [len(tokens) for tokens in encoding.encode_ordinary_batch(texts, num_threads=BATCH_THREADS)]
+
+
+def truncate_to_tokens(text: str, max_tokens: int, model: str = DEFAULT_MODEL) -> str:
+    """
+    Kürzt einen Text auf höchstens max_tokens Tokens.
+
+    Kodiert wird nur ein Präfix, das sicher mehr als max_tokens Tokens enthält,
+    nicht der gesamte Text.
+
+    Args:
+        text: Der Text
+        max_tokens: Maximale Anzahl Tokens
+        model: Modell, dessen Encoder verwendet wird
+
+    Returns:
+        str: Der (ggf. gekürzte) Text
+    """
+    if not text or max_tokens <= 0:
+        return ''
+    encoding = get_encoding(model)
+    if encoding is None:
+        return text[:max_tokens * CHARS_PER_TOKEN]
+    # Jedes Token umfasst mindestens ein Byte
+    if len(text.encode('utf-8')) <= max_tokens:
+        return text
+    prefix = text[:max_tokens * MAX_CHARS_PER_TOKEN]
+    tokens = encoding.encode_ordinary(prefix)
+    if len(tokens) <= max_tokens:
+        if len(prefix) == len(text):
+            return text
+        # Sehr lange Tokens (z.B. Leerraum): gesamten Text kodieren
+        tokens = encoding.encode_ordinary(text)
+        if len(tokens) <= max_tokens:
+            return text
+    return encoding.decode(tokens[:max_tokens])
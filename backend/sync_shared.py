@@ -0,0 +1,69 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Verteilt die gemeinsamen Module aus backend/shared an die Dienste.
+
+API, Worker und Gateway werden jeweils aus ihrem eigenen Verzeichnis gebaut
+(COPY utils/ im Dockerfile) und brauchen die Module daher als Datei in ihrem
+utils/-Verzeichnis. Bearbeitet wird nur die Quelle in backend/shared; dieses
+Skript schreibt die Kopien. Mit --check werden nur Abweichungen gemeldet
+(Rückgabewert 1), z.B. vor einem Commit oder im Test.
+
+Aufruf:
+    python sync_shared.py           # Kopien aktualisieren
+    python sync_shared.py --check   # nur prüfen
+"""
+
+import argparse
+import sys
+from pathlib import Path
+
+BACKEND_DIR = Path(__file__).resolve().parent
+SHARED_DIR = BACKEND_DIR / 'shared'
+
+# Modul -> Dienste, in deren utils/ es liegt
+SHARED_MODULES = {
+    'llm_backend.py': ('main', 'worker'),
+    'token_counter.py': ('main', 'worker'),
+    'prompt_budget.py': ('main', 'worker'),
+    'openai_errors.py': ('main', 'worker', 'gateway'),
+}
+
+
+def outdated_copies():
+    """Liste von (Quelle, Kopie) aller Kopien, die fehlen oder von der Quelle abweichen."""
+    outdated = []
+    for module, services in SHARED_MODULES.items():
+        source = SHARED_DIR / module
+        content = source.read_bytes()
+        for service in services:
+            copy = BACKEND_DIR / service / 'utils' / module
+            if not copy.exists() or copy.read_bytes() != content:
+                outdated.append((source, copy))
+    return outdated
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Verteilt die Module aus backend/shared an die Dienste.')
+    parser.add_argument('--check', action='store_true', help='Nur prüfen, nichts schreiben')
+    args = parser.parse_args()
+
+    outdated = outdated_copies()
+    if args.check:
+        for source, copy in outdated:
+            print(f"Abweichend von {source.relative_to(BACKEND_DIR)}: {copy.relative_to(BACKEND_DIR)}")
+        if outdated:
+            print("Bitte 'python sync_shared.py' ausführen (Änderungen nur in backend/shared vornehmen).")
+            return 1
+        print("Alle Kopien der gemeinsamen Module sind aktuell.")
+        return 0
+
+    for source, copy in outdated:
+        copy.write_bytes(source.read_bytes())
+        print(f"Aktualisiert: {copy.relative_to(BACKEND_DIR)}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
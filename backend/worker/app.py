@@ -136,6 +136,12 @@ celery_app.conf.update({
 })
 logger.info(f"Celery-Konfiguration aktualisiert: {celery_app.conf.humanize()}")
 
+# Eine DB-Engine pro Worker-Kindprozess: nach dem Fork erstellen, beim Beenden schließen
+from celery.signals import worker_process_init, worker_process_shutdown
+from tasks.models import init_db_engine, dispose_db_engine
+worker_process_init.connect(init_db_engine, weak=False)
+worker_process_shutdown.connect(dispose_db_engine, weak=False)
+
 # === NEU: Explizite Task-Entdeckung ===
 # Sage Celery, wo es nach Task-Modulen suchen soll (im Paket 'tasks')
 # Das stellt sicher, dass Tasks, die mit @celery_app.task dekoriert sind, gefunden werden.
@@ -186,6 +192,32 @@ def start_heartbeat():
     heartbeat_thread.start()
     return heartbeat_thread
 
+def start_speculative_scheduler():
+    """
+    Startet einen Thread, der regelmäßig die Vorab-Generierung einplant (tasks/speculative_tasks.py).
+
+    Ein Redis-Lock pro Intervall sorgt dafür, dass bei mehreren Worker-Containern
+    nur einer den Task `speculative.schedule` sendet.
+    """
+    from tasks.speculative_tasks import SPECULATIVE_ENABLED, SPECULATIVE_INTERVAL
+    from config.queues import TIER_BULK, tier_options
+    if not SPECULATIVE_ENABLED:
+        return None
+
+    def scheduler():
+        while not stop_event.wait(SPECULATIVE_INTERVAL):
+            try:
+                import redis
+                redis_client = redis.from_url(config.redis_url)
+                if redis_client.set('speculative_scheduler_lock', '1', nx=True, ex=max(SPECULATIVE_INTERVAL - 1, 1)):
+                    celery_app.send_task('speculative.schedule', **tier_options(TIER_BULK))
+            except Exception as e:
+                logger.error(f"Fehler im Scheduler der Vorab-Generierung: {e}")
+
+    scheduler_thread = threading.Thread(target=scheduler, daemon=True)
+    scheduler_thread.start()
+    return scheduler_thread
+
 # Worker-Initialisierung
 def initialize_worker():
     """Initialisiert den Worker mit allen benötigten Komponenten."""
@@ -206,6 +238,10 @@ def initialize_worker():
         # Heartbeat-Thread starten
         heartbeat_thread = start_heartbeat()
         logger.info("Heartbeat-Thread gestartet")
+
+        # Vorab-Generierung für "mehr generieren" (nur mit SPECULATIVE_ENABLED=true)
+        if start_speculative_scheduler():
+            logger.info("Scheduler der Vorab-Generierung gestartet")
         
         # Tasks bei Celery registrieren (DIESER TEIL KÖNNTE JETZT REDUNDANT SEIN, 
         # da autodiscover verwendet wird, aber zur Sicherheit belassen wir ihn vorerst,
@@ -234,27 +270,64 @@ def initialize_worker():
         logger.error(f"Fehler bei der Worker-Initialisierung: {e}")
         return False
 
-def run_celery_worker():
-    """Startet den Celery-Worker für die Verarbeitung von Tasks."""
-    logger.info("========== CELERY-WORKER WIRD GESTARTET ==========")
-    
+def _worker_argv(queues, concurrency, node_name=None):
+    """Baut die Kommandozeilenargumente für einen Celery-Worker."""
     # Lese den gewünschten Pool aus der Konfiguration oder .env
     # Standard ist 'prefork', wenn nicht anders gesetzt
     worker_pool_type = os.environ.get('CELERY_POOL', 'prefork')
-    logger.info(f"Verwende Celery Worker Pool: {worker_pool_type}")
-
-    # Celery worker Kommandozeilenargumente
     argv = [
         'worker',
         '--loglevel=INFO',
-        f'--concurrency={config.worker_concurrency}',
+        f'--concurrency={concurrency}',
         '--without-gossip',
         '--without-mingle',
-        f'--pool={worker_pool_type}'
+        f'--pool={worker_pool_type}',
+        f'--queues={",".join(queues)}'
     ]
-    
-    # Celery worker starten
-    celery_app.worker_main(argv)
+    if node_name:
+        argv.append(f'--hostname={node_name}@%h')
+    return argv
+
+def run_celery_worker():
+    """
+    Startet den Celery-Worker für die Verarbeitung von Tasks.
+
+    Mit WORKER_SPLIT_POOLS=true (Standard) bekommt jede Stufe aus WORKER_TIERS einen
+    eigenen Worker-Prozess mit eigener Pool-Größe (WORKER_CONCURRENCY_<STUFE>), damit
+    Massenarbeit nie die Slots interaktiver Uploads belegt. Sonst arbeitet ein
+    gemeinsamer Pool alle Queues ab.
+    """
+    from config.queues import QUEUE_LEGACY, TIERS, TIER_INTERACTIVE, WORKER_CONCURRENCY_BY_TIER, get_worker_tiers
+    logger.info("========== CELERY-WORKER WIRD GESTARTET ==========")
+
+    tiers = get_worker_tiers()
+    split_pools = os.environ.get('WORKER_SPLIT_POOLS', 'true').lower() == 'true'
+
+    def queues_for(tier_list):
+        queues = [TIERS[tier]['queue'] for tier in tier_list]
+        # Die bisherige Standard-Queue wird vom interaktiven Pool mit abgearbeitet
+        if TIER_INTERACTIVE in tier_list:
+            queues.append(QUEUE_LEGACY)
+        return queues
+
+    if not split_pools or len(tiers) == 1:
+        concurrency = WORKER_CONCURRENCY_BY_TIER[tiers[0]] if len(tiers) == 1 else config.worker_concurrency
+        argv = _worker_argv(queues_for(tiers), concurrency)
+        logger.info(f"Starte einen Worker-Pool: {argv}")
+        celery_app.worker_main(argv)
+        return
+
+    import multiprocessing
+    processes = []
+    for tier in tiers:
+        argv = _worker_argv(queues_for([tier]), WORKER_CONCURRENCY_BY_TIER[tier], node_name=tier)
+        process = multiprocessing.Process(target=celery_app.worker_main, args=(argv,), name=f"celery-{tier}")
+        process.start()
+        processes.append(process)
+        logger.info(f"Worker-Pool '{tier}' gestartet (PID {process.pid}): {argv}")
+
+    for process in processes:
+        process.join()
 
 # Hauptfunktion
 if __name__ == "__main__":
@@ -0,0 +1,64 @@
+#!/usr/bin/env python
+"""
+Benchmark: Aufteilen großer Lernkarten-Anfragen (utils/fanout.py).
+
+Simuliert Completions mit fester Latenz plus Ausgabegeschwindigkeit und hartem
+max_tokens-Limit: Was nicht hineinpasst, fehlt (abgeschnittenes JSON). Verglichen
+werden eine einzelne Completion und die parallelen Teilanfragen für
+verschiedene Kartenzahlen. Zeiten werden mit --time-scale verkürzt.
+
+Aufruf:
+    python benchmarks/fanout.py --counts 5,10,30,60
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from utils.fanout import plan_fanout, run_fanout  # noqa: E402
+
+MAX_TOKENS = 2000
+TOKENS_PER_CARD = 160
+
+
+def simulated_completion(num_cards, time_scale, first_token_seconds, tokens_per_second, fanout_part=None):
+    """Liefert so viele Karten, wie in max_tokens passen, nach der simulierten Latenz."""
+    output_tokens = min(num_cards * TOKENS_PER_CARD + 20, MAX_TOKENS)
+    time.sleep((first_token_seconds + output_tokens / tokens_per_second) * time_scale)
+    delivered = min(num_cards, (MAX_TOKENS - 20) // TOKENS_PER_CARD)
+    prefix = f"{fanout_part[0]}-" if fanout_part else ''
+    cards = [{'question': f"Frage {prefix}{i}", 'answer': 'Antwort'} for i in range(delivered)]
+    return {'flashcards': cards, 'usage': {'completion_tokens': output_tokens}}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--counts', default='5,10,30,60', help='Angeforderte Kartenzahlen')
+    parser.add_argument('--time-scale', type=float, default=0.05, help='Faktor für simulierte Zeiten')
+    parser.add_argument('--first-token', type=float, default=1.5, help='Latenz bis zum ersten Token (s)')
+    parser.add_argument('--tokens-per-second', type=float, default=60.0, help='Ausgabegeschwindigkeit')
+    args = parser.parse_args()
+
+    options = {'time_scale': args.time_scale, 'first_token_seconds': args.first_token,
+               'tokens_per_second': args.tokens_per_second}
+    print(f"{'Karten':>6} | {'einzeln: Karten':>15} {'Zeit':>7} | {'aufgeteilt: Karten':>18} {'Teile':>5} {'Zeit':>7}")
+    for count in (int(value) for value in args.counts.split(',')):
+        start = time.perf_counter()
+        single = simulated_completion(count, **options)
+        single_seconds = (time.perf_counter() - start) / args.time_scale
+
+        sizes = plan_fanout(count, TOKENS_PER_CARD, MAX_TOKENS)
+        start = time.perf_counter()
+        if len(sizes) > 1:
+            split = run_fanout(simulated_completion, 'flashcards', sizes, 'num_cards', **options)
+        else:
+            split = simulated_completion(count, **options)
+        split_seconds = (time.perf_counter() - start) / args.time_scale
+        print(f"{count:>6} | {len(single['flashcards']):>15} {single_seconds:>6.1f}s | "
+              f"{len(split['flashcards']):>18} {len(sizes):>5} {split_seconds:>6.1f}s")
+
+
+if __name__ == '__main__':
+    main()
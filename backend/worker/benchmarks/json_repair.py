@@ -0,0 +1,149 @@
+#!/usr/bin/env python
+"""
+Benchmark: Tolerantes JSON-Parsen (utils/json_repair.py) gegen den bisherigen Pfad.
+
+Verglichen wird, wie viele Lernkarten-Antworten nach dem Parsen und der
+Validierung pro Eintrag zu wenige gültige Karten liefern und damit eine
+erneute, bezahlte Anfrage (Eskalation in der Modell-Kaskade) auslösen.
+
+Ohne --corpus wird ein Korpus aus typischen Formfehlern erzeugt (Code-Block mit
+Begleittext, abschließendes Komma, abgeschnittenes Ende, Text nach dem JSON,
+Zeilenumbruch im String, Python-Literale, doppeltes Komma). Mit --corpus wird
+eine JSONL-Datei aufgezeichneter Antworten verwendet
+({"content": "...", "requested": 10} pro Zeile).
+
+Aufruf:
+    python benchmarks/json_repair.py --responses 500
+    python benchmarks/json_repair.py --corpus aufgezeichnete_antworten.jsonl
+"""
+import argparse
+import json
+import logging
+import os
+import random
+import re
+import sys
+from collections import Counter
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from utils.call_openai import extract_json_from_response  # noqa: E402
+from utils.json_repair import parse_json_response  # noqa: E402
+from utils.validation import validate_generated_flashcards  # noqa: E402
+
+TERMS = ("Photosynthese Zellatmung Mitochondrien Chlorophyll Enzym Substrat Glukose Membran "
+         "Diffusion Osmose Protein Ribosom Translation Transkription").split()
+
+
+def legacy_extract(response_content):
+    """Bisheriger Pfad: direktes Parsen, dann Code-Block, dann äußeres Array."""
+    try:
+        data = json.loads(response_content)
+        if isinstance(data, dict):
+            for key in ["flashcards", "lernkarten", "results"]:
+                if key in data and isinstance(data[key], list):
+                    return {"cards": data[key]}
+        return data
+    except json.JSONDecodeError:
+        json_match = re.search(r'```(?:json)?\s*([\s\S]*?)\s*```', response_content)
+        if json_match:
+            try:
+                return legacy_extract(json_match.group(1))
+            except json.JSONDecodeError:
+                pass
+        json_array_match = re.search(r'\[([\s\S]*)\]', response_content)
+        if json_array_match:
+            try:
+                return json.loads(f"[{json_array_match.group(1)}]")
+            except json.JSONDecodeError:
+                pass
+        return response_content
+
+
+def cards_from(data):
+    """Karten aus dem geparsten Ergebnis wie in generate_flashcards_with_openai."""
+    if isinstance(data, dict):
+        for key in ("flashcards", "cards"):
+            if isinstance(data.get(key), list):
+                return data[key]
+    return data if isinstance(data, list) else []
+
+
+def clean_response(rng, requested):
+    cards = [{'question': f"Was ist {rng.choice(TERMS)} ({i})?",
+              'answer': f"{rng.choice(TERMS)} beschreibt {rng.choice(TERMS)} und {rng.choice(TERMS)}."}
+             for i in range(requested)]
+    return json.dumps({'flashcards': cards}, ensure_ascii=False, indent=rng.choice([None, 2]))
+
+
+def mutate(rng, text):
+    """Typische Formfehler der Modelle."""
+    kind = rng.choice(['fence', 'trailing_comma', 'truncated', 'trailing_text',
+                       'newline_in_string', 'python_literal', 'double_comma', 'clean'])
+    if kind == 'fence':
+        text = f"Hier sind die Lernkarten:\n```json\n{text}\n```\nViel Erfolg beim Lernen!"
+    elif kind == 'trailing_comma':
+        text = re.sub(r'\}(\s*)\]', r'},\1]', text, count=1)
+    elif kind == 'truncated':
+        text = text[:int(len(text) * rng.uniform(0.6, 0.95))]
+    elif kind == 'trailing_text':
+        text = text + "\n\nHinweis: Die Karten decken die wichtigsten Begriffe ab."
+    elif kind == 'newline_in_string':
+        text = text.replace(' beschreibt ', ' beschreibt\n', 1)
+    elif kind == 'python_literal':
+        text = text.replace('}', ', "checked": True}', 1)
+    elif kind == 'double_comma':
+        text = text.replace('}, {', '},, {', 1).replace('},\n', '},,\n', 1)
+    return kind, text
+
+
+def load_corpus(path):
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            if line.strip():
+                entry = json.loads(line)
+                yield entry.get('kind', 'recorded'), entry['content'], int(entry.get('requested', 10))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--responses', type=int, default=500, help='Anzahl erzeugter Antworten')
+    parser.add_argument('--requested', type=int, default=10, help='Angeforderte Karten pro Antwort')
+    parser.add_argument('--corpus', help='JSONL mit aufgezeichneten Antworten')
+    parser.add_argument('--seed', type=int, default=7)
+    args = parser.parse_args()
+    logging.disable(logging.WARNING)
+
+    if args.corpus:
+        corpus = list(load_corpus(args.corpus))
+    else:
+        rng = random.Random(args.seed)
+        corpus = [mutate(rng, clean_response(rng, args.requested)) + (args.requested,)
+                  for _ in range(args.responses)]
+
+    retries = {'bisher': Counter(), 'neu': Counter()}
+    kept = {'bisher': 0, 'neu': 0}
+    repairs = Counter()
+    totals = Counter()
+    for kind, content, requested in corpus:
+        totals[kind] += 1
+        repairs.update(parse_json_response(content)['repairs'])
+        for label, extract in (('bisher', legacy_extract), ('neu', extract_json_from_response)):
+            valid, _ = validate_generated_flashcards(cards_from(extract(content)))
+            kept[label] += len(valid)
+            # Eine zu kurze Liste eskaliert in der Kaskade (erneute Anfrage)
+            if len(valid) < requested:
+                retries[label][kind] += 1
+
+    print(f"{len(corpus)} Antworten\n")
+    print(f"{'Fehlerart':<18} {'Anzahl':>6} {'Retry bisher':>13} {'Retry neu':>10}")
+    for kind in sorted(totals):
+        print(f"{kind:<18} {totals[kind]:>6} {retries['bisher'][kind]:>13} {retries['neu'][kind]:>10}")
+    before, after = sum(retries['bisher'].values()), sum(retries['neu'].values())
+    print(f"\nRetry-Quote: {before / len(corpus):.1%} -> {after / len(corpus):.1%}")
+    print(f"Gültige Karten: {kept['bisher']} -> {kept['neu']}")
+    print(f"Reparaturen: {dict(repairs.most_common())}")
+
+
+if __name__ == '__main__':
+    main()
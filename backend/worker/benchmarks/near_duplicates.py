@@ -0,0 +1,90 @@
+#!/usr/bin/env python
+"""
+Benchmark: Beinahe-Duplikaterkennung für Lernkarten (utils/near_duplicates.py).
+
+Erzeugt einen synthetischen Upload mit N unterschiedlichen Lernkarten und
+umformulierten Varianten eines Teils davon (andere Frageform, Füllwörter,
+Flexion, vertauschte Satzteile). Gemessen werden Aufbau- und Abfragezeit des
+Index sowie Erkennungsrate (Paraphrasen) und Fehlalarme (neue Karten).
+
+Aufruf:
+    python benchmarks/near_duplicates.py --cards 5000 --threshold 0.5
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from utils.near_duplicates import NearDuplicateIndex, flashcard_text  # noqa: E402
+
+QUESTION_FORMS = [
+    "Was ist {term}?",
+    "Was versteht man unter {term}?",
+    "Definiere {term}.",
+    "Erkläre den Begriff {term}.",
+    "Was bezeichnet {term}?",
+]
+FILLERS = ["im Allgemeinen", "kurz gesagt", "vereinfacht", "grundsätzlich", "typischerweise"]
+
+
+def random_word(rng, min_len=5, max_len=11):
+    consonants, vowels = 'bcdfghklmnprstvwz', 'aeiou'
+    length = rng.randint(min_len, max_len)
+    return ''.join(rng.choice(consonants if i % 2 == 0 else vowels) for i in range(length))
+
+
+def make_card(rng):
+    term = f"{random_word(rng)}{rng.choice(['ung', 'ismus', 'ität', 'ose', ''])}"
+    facts = [random_word(rng) for _ in range(rng.randint(6, 10))]
+    answer = f"{term.capitalize()} ist ein {facts[0]} {facts[1]}, das {' '.join(facts[2:])} beschreibt."
+    return {'term': term, 'facts': facts, 'question': rng.choice(QUESTION_FORMS).format(term=term), 'answer': answer}
+
+
+def paraphrase(rng, card):
+    """Umformulierung: andere Frageform, Füllwort, teils gekürzte/umgestellte Antwort."""
+    facts = list(card['facts'])
+    if rng.random() < 0.5:
+        facts.pop(rng.randrange(2, len(facts)))
+    if rng.random() < 0.5:
+        i, j = rng.sample(range(2, len(facts)), 2)
+        facts[i], facts[j] = facts[j], facts[i]
+    term = card['term'] + (rng.choice(['s', 'en']) if rng.random() < 0.3 else '')
+    answer = f"{rng.choice(FILLERS).capitalize()} ist {term} ein {facts[0]} {facts[1]}, das {' '.join(facts[2:])} beschreibt."
+    return {'question': rng.choice(QUESTION_FORMS).format(term=term), 'answer': answer}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--cards', type=int, default=5000, help='Vorhandene Karten im Upload')
+    parser.add_argument('--queries', type=int, default=500, help='Paraphrasen und neue Karten je Messung')
+    parser.add_argument('--threshold', type=float, default=None, help='Ähnlichkeitsschwelle (Standard: NEAR_DUPLICATE_THRESHOLD)')
+    parser.add_argument('--seed', type=int, default=7)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    existing = [make_card(rng) for _ in range(args.cards)]
+    paraphrases = [paraphrase(rng, rng.choice(existing)) for _ in range(args.queries)]
+    fresh = [make_card(rng) for _ in range(args.queries)]
+
+    start = time.perf_counter()
+    index = NearDuplicateIndex.from_texts((flashcard_text(card) for card in existing),
+                                          **({'threshold': args.threshold} if args.threshold is not None else {}))
+    build_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    detected = sum(1 for card in paraphrases if index.find(flashcard_text(card)))
+    false_alarms = sum(1 for card in fresh if index.find(flashcard_text(card)))
+    query_ms = (time.perf_counter() - start) * 1000 / (2 * args.queries)
+
+    print(f"Index: {len(index)} Karten, Schwelle {index.threshold}, Aufbau {build_seconds:.2f}s "
+          f"({build_seconds * 1e6 / max(args.cards, 1):.0f} µs/Karte)")
+    print(f"Abfrage: {query_ms:.2f} ms/Karte")
+    print(f"Erkannte Paraphrasen (Recall): {detected / args.queries:.1%}")
+    print(f"Fehlalarme bei neuen Karten:   {false_alarms / args.queries:.1%}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,461 @@
+#!/usr/bin/env python
+"""
+Offline-Evaluation von Prompt-Varianten (config/prompts.py): Kosten gegen Qualität.
+
+Jede Variante überschreibt einzelne Prompts; alle Varianten laufen über
+denselben festen Korpus gegen ein aufgezeichnetes oder ein Fake-Modell.
+Gemessen werden pro Variante und Aufgabe:
+
+- Input- und Output-Tokens (gleiche Zählung und gleiches Token-Budget wie im Worker)
+- Parse-Quote (utils/json_repair.py, wie extract_json_from_response)
+- Schema-Gültigkeit der Einträge (utils/validation.py)
+- Duplikatquote innerhalb einer Antwort (utils/near_duplicates.py)
+- Erfüllung der angeforderten Menge
+- Ref-F1: Wortüberlappung (Inhaltswörter) jeder Referenz mit dem besten generierten Eintrag
+
+Das Fake-Modell befolgt nur, was der Prompt ausdrücklich verlangt: die Anzahl,
+die genannten Felder und JSON-Schlüssel, eine Zeichengrenze für Antworten,
+"verschiedene Aspekte" und "nur JSON". Es misst also, ob eine gekürzte
+Variante noch alle nötigen Anweisungen enthält, nicht die Sprachqualität.
+Dafür werden echte Antworten einmal aufgezeichnet (--record, benötigt
+OPENAI_API_KEY) und danach beliebig oft offline ausgewertet (--replay).
+
+Varianten (--variants) sind eine JSON-Datei {"name": {"pfad": "Prompt", ...}}.
+Pfade: "flashcards.de", "questions.multiple_choice.de", "topics.en" (SYSTEM_PROMPTS),
+"shared.de" (SHARED_SYSTEM_PROMPTS), "task_prompt" und "document_prompt".
+Ohne --variants wird der aktuelle Stand mit einer Variante ohne JSON-Beispiele
+verglichen. Der Korpus (--corpus) ist eine JSONL-Datei mit
+{"id", "language", "document", "references": {"flashcards": [...], "questions": [...],
+"topics": {"main_topic": "...", "subtopics": [...]}}} pro Zeile; ohne --corpus
+wird ein synthetischer Korpus mit Referenzen erzeugt.
+
+Aufruf:
+    python benchmarks/prompt_eval.py
+    python benchmarks/prompt_eval.py --variants varianten.json --tasks flashcards,questions
+    python benchmarks/prompt_eval.py --corpus korpus.jsonl --record aufnahmen.jsonl
+    python benchmarks/prompt_eval.py --corpus korpus.jsonl --replay aufnahmen.jsonl --json ergebnis.json
+"""
+import argparse
+import copy
+import hashlib
+import json
+import logging
+import os
+import random
+import re
+import sys
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from config import prompts  # noqa: E402
+from utils.json_repair import parse_json_response  # noqa: E402
+from utils.minhash import content_words  # noqa: E402
+from utils.near_duplicates import NearDuplicateIndex, filter_near_duplicates, flashcard_text, question_text  # noqa: E402
+from utils.prompt_budget import prompt_tokens  # noqa: E402
+from utils.token_counter import count_tokens  # noqa: E402
+from utils.validation import (validate_generated_flashcards, validate_generated_questions,  # noqa: E402
+                              validate_generated_topics)
+
+TASKS = ('flashcards', 'questions', 'topics')
+# Completion-Parameter wie in tasks/*/generation.py (dort mit Redis-Importen)
+MAX_TOKENS = {'flashcards': 2000, 'questions': 2000, 'topics': 1500}
+TEMPERATURE = {'flashcards': 0.7, 'questions': 0.7, 'topics': 0.5}
+# Felder und Ergebnisschlüssel, die das Fake-Modell nur verwendet, wenn der Prompt sie nennt
+FIELDS = {
+    'flashcards': ('question', 'answer'),
+    'questions': ('question', 'options', 'correct_answer', 'explanation'),
+    'topics': ('main_topic', 'subtopics', 'title', 'description'),
+}
+RESULT_KEYS = {'flashcards': ('flashcards', 'cards'), 'questions': ('questions',), 'topics': ()}
+VARIETY_HINTS = ('verschiedene aspekte', 'different aspects', 'verschiedener aspekte', 'wichtige konzepte',
+                 'important concepts')
+
+_SENTENCE = re.compile(r'(?<=[.!?])\s+')
+_DEFINITION = re.compile(r'^(.{3,60}?) (ist|sind|bezeichnet|beschreibt|is|are|describes) (.+)$')
+_CHAR_LIMIT = re.compile(r'(\d+)\s*(?:zeichen|characters)')
+_ONLY_JSON = re.compile(r'\b(?:nur|only)\b[^.\n]*json|json[^.\n]*\b(?:nur|only)\b')
+_CODE_EXAMPLE = re.compile(r'\n*[^\n]*beispiel[^\n]*:?\s*```json.*?```|\n*[^\n]*example[^\n]*:?\s*```json.*?```',
+                           re.IGNORECASE | re.DOTALL)
+
+
+# --- Korpus -----------------------------------------------------------------
+
+SUBJECTS = {
+    'Zellbiologie': ['Mitochondrium', 'Ribosom', 'Zellkern', 'Lysosom', 'Zellmembran', 'Chloroplast',
+                     'Golgi-Apparat', 'Zytoskelett', 'Vakuole', 'Endoplasmatisches Retikulum'],
+    'Makroökonomie': ['Inflation', 'Bruttoinlandsprodukt', 'Leitzins', 'Arbeitslosenquote', 'Geldmenge',
+                      'Handelsbilanz', 'Staatsverschuldung', 'Konjunkturzyklus', 'Deflation', 'Wechselkurs'],
+    'Thermodynamik': ['Entropie', 'Enthalpie', 'Wärmekapazität', 'Carnot-Prozess', 'Innere Energie',
+                      'Adiabate', 'Isotherme', 'Wirkungsgrad', 'Wärmeleitung', 'Phasenübergang'],
+}
+VERBS = ['steuert', 'speichert', 'beeinflusst', 'begrenzt', 'beschreibt', 'verstärkt', 'reguliert', 'misst']
+OBJECTS = ['den Energiehaushalt', 'die Stabilität des Systems', 'den Austausch mit der Umgebung',
+           'die langfristige Entwicklung', 'die Verteilung von Ressourcen', 'das Gleichgewicht',
+           'die Geschwindigkeit von Prozessen', 'die Reaktion auf äußere Einflüsse']
+FILLER = ['In der Vorlesung wurde dieser Zusammenhang an mehreren Beispielen gezeigt.',
+          'Die Übungsaufgaben greifen diesen Punkt erneut auf.',
+          'Für die Prüfung ist vor allem das Verständnis der Zusammenhänge wichtig.']
+
+
+def synthetic_corpus(documents, seed):
+    """Dokumente aus Definitionssätzen mit Abschnitten, Füllsätzen und Referenzen."""
+    rng = random.Random(seed)
+    corpus = []
+    for number in range(documents):
+        subject = list(SUBJECTS)[number % len(SUBJECTS)]
+        terms = rng.sample(SUBJECTS[subject], 6)
+        sections, facts = [], []
+        for section, chunk in enumerate((terms[:3], terms[3:]), start=1):
+            title = f"{section}. {chunk[0]} und verwandte Begriffe"
+            lines = []
+            for term in chunk:
+                definition = f"ein Begriff der {subject}, der {rng.choice(VERBS)} {rng.choice(OBJECTS)}"
+                facts.append((term, definition))
+                lines.append(f"{term} ist {definition}.")
+                lines.append(rng.choice(FILLER))
+            sections.append((title, ' '.join(lines)))
+        document = '\n\n'.join(f"# {title}\n\n{body}" for title, body in sections)
+        corpus.append({
+            'id': f"synthetisch-{number + 1}",
+            'language': 'de',
+            'document': document,
+            'references': {
+                'flashcards': [{'question': f"Was ist {term}?", 'answer': f"{term} ist {definition}."}
+                               for term, definition in facts],
+                'questions': [{'question': f"Was ist {term}?", 'options': [definition], 'correct_answer': 0}
+                              for term, definition in facts],
+                'topics': {'main_topic': subject, 'subtopics': [title for title, _ in sections]},
+            },
+        })
+    return corpus
+
+
+def load_corpus(path):
+    with open(path, 'r', encoding='utf-8') as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+# --- Varianten --------------------------------------------------------------
+
+def without_examples():
+    """Variante ohne JSON-Codebeispiele in den Aufgaben-Prompts."""
+    overrides = {}
+    for task, by_language in prompts.SYSTEM_PROMPTS.items():
+        for language, text in by_language.items():
+            stripped = _CODE_EXAMPLE.sub('', text) if isinstance(text, str) else text
+            if stripped != text:
+                overrides[f"{task}.{language}"] = stripped
+    return overrides
+
+
+@contextmanager
+def apply_variant(overrides):
+    """Setzt die Prompts einer Variante für die Dauer des Blocks."""
+    saved = (prompts.SYSTEM_PROMPTS, prompts.SHARED_SYSTEM_PROMPTS, prompts.TASK_PROMPT, prompts.DOCUMENT_PROMPT)
+    system_prompts = copy.deepcopy(prompts.SYSTEM_PROMPTS)
+    shared = dict(prompts.SHARED_SYSTEM_PROMPTS)
+    try:
+        for path, text in (overrides or {}).items():
+            if path == 'task_prompt':
+                prompts.TASK_PROMPT = text
+            elif path == 'document_prompt':
+                prompts.DOCUMENT_PROMPT = text
+            elif path.startswith('shared.'):
+                shared[path.split('.', 1)[1]] = text
+            else:
+                *parents, leaf = path.split('.')
+                node = system_prompts
+                for name in parents:
+                    node = node[name]
+                node[leaf] = text
+        prompts.SYSTEM_PROMPTS, prompts.SHARED_SYSTEM_PROMPTS = system_prompts, shared
+        yield
+    finally:
+        prompts.SYSTEM_PROMPTS, prompts.SHARED_SYSTEM_PROMPTS, prompts.TASK_PROMPT, prompts.DOCUMENT_PROMPT = saved
+
+
+def task_params(task, count):
+    if task == 'flashcards':
+        return {'num_cards': count}
+    if task == 'questions':
+        return {'num_questions': count, 'question_type': 'multiple_choice'}
+    return {'max_topics': count}
+
+
+def request_key(model, messages):
+    canonical = json.dumps([model, messages], sort_keys=True, ensure_ascii=False, separators=(',', ':'))
+    return hashlib.sha256(canonical.encode('utf-8')).hexdigest()
+
+
+# --- Modelle ----------------------------------------------------------------
+
+def _mentions(text, word):
+    return re.search(rf"(?<![a-z_]){re.escape(word)}(?![a-z_])", text) is not None
+
+
+def fake_model(task, messages, params, seed):
+    """Regelbasiertes Modell, das nur ausdrücklich verlangte Anweisungen befolgt."""
+    instructions = messages[-1]['content']
+    lower = instructions.lower()
+    document = messages[1]['content']
+    rng = random.Random(seed)
+    sentences = [s.strip() for s in _SENTENCE.split(document.replace('\n', ' ')) if len(content_words(s)) >= 3]
+    if not sentences:
+        return ''
+    requested = next(iter(params.values()))
+    count = requested if _mentions(instructions, str(requested)) else 5
+    if any(hint in lower for hint in VARIETY_HINTS):
+        picks = rng.sample(sentences, min(count, len(sentences)))
+    else:
+        picks = [rng.choice(sentences) for _ in range(count)]
+    fields = [field for field in FIELDS[task] if _mentions(instructions, field)]
+    limit = _CHAR_LIMIT.search(lower)
+    english = messages[0]['content'].startswith('You')
+
+    def answer_for(sentence):
+        if limit:
+            return sentence[:int(limit.group(1))]
+        # Ohne Grenze antwortet das Modell ausführlich (mehr Output-Tokens)
+        start = sentences.index(sentence)
+        return ' '.join(sentences[start:start + 4])
+
+    def term_of(sentence):
+        match = _DEFINITION.match(sentence)
+        return match.group(1) if match else ' '.join(content_words(sentence)[:2]).title()
+
+    def definition_of(sentence):
+        match = _DEFINITION.match(sentence)
+        return (match.group(3) if match else sentence).rstrip('.')[:200]
+
+    if task == 'topics':
+        headings = [line.lstrip('# ').strip() for line in document.splitlines() if line.startswith('#')]
+        terms = Counter(word for s in sentences for word in content_words(s))
+        subtopics = (headings or [word.title() for word, _ in terms.most_common(count + 1)[1:]])[:count]
+        main_title = terms.most_common(1)[0][0].title()
+        topic = lambda title: {name: value for name, value in (('title', title), ('description', title))
+                               if name in fields}
+        payload = {name: value for name, value in (('main_topic', topic(main_title)),
+                                                   ('subtopics', [topic(title) for title in subtopics]))
+                   if name in fields}
+    else:
+        items = []
+        for sentence in picks:
+            question = f"What is {term_of(sentence)}?" if english else f"Was ist {term_of(sentence)}?"
+            if task == 'flashcards':
+                values = {'question': question, 'answer': answer_for(sentence)}
+            else:
+                correct = definition_of(sentence)
+                others = [definition_of(s) for s in rng.sample(sentences, len(sentences))
+                          if definition_of(s) != correct]
+                options = list(dict.fromkeys(others))[:3] + [correct]
+                rng.shuffle(options)
+                values = {'question': question, 'options': options,
+                          'correct_answer': options.index(correct), 'explanation': answer_for(sentence)}
+            items.append({name: value for name, value in values.items() if name in fields})
+        key = next((name for name in RESULT_KEYS[task] if _mentions(lower, name)), None)
+        if key:
+            payload = {key: items}
+        elif 'json' in lower:
+            payload = items
+        else:
+            return '\n'.join(' | '.join(str(value) for value in item.values()) for item in items)
+
+    text = json.dumps(payload, ensure_ascii=False)
+    if not _ONLY_JSON.search(lower):
+        text = f"Hier ist das Ergebnis:\n```json\n{text}\n```"
+    return text
+
+
+def record_model(model, task, messages):
+    """Live-Aufruf für --record (benötigt OPENAI_API_KEY)."""
+    from utils.call_openai import call_openai_api
+    response = call_openai_api(model=model, messages=messages, temperature=TEMPERATURE[task],
+                               max_tokens=MAX_TOKENS[task], response_format={"type": "json_object"})
+    content = (response.get('choices') or [{}])[0].get('message', {}).get('content', '')
+    return content, response.get('usage')
+
+
+# --- Metriken ---------------------------------------------------------------
+
+def items_from(task, data):
+    """Einträge wie in den Generierungsfunktionen aus dem geparsten JSON holen."""
+    if task == 'topics':
+        return data if isinstance(data, dict) else None
+    if isinstance(data, list):
+        return data
+    if isinstance(data, dict):
+        for key in ('flashcards', 'cards', 'lernkarten', 'questions', 'results', 'items', 'data'):
+            if isinstance(data.get(key), list):
+                return data[key]
+    return None
+
+
+def f1(reference, candidate):
+    """Token-F1 über Inhaltswörter."""
+    ref, cand = Counter(content_words(reference)), Counter(content_words(candidate))
+    overlap = sum((ref & cand).values())
+    if not overlap:
+        return 0.0
+    precision, recall = overlap / sum(cand.values()), overlap / sum(ref.values())
+    return 2 * precision * recall / (precision + recall)
+
+
+def reference_score(task, references, result):
+    """Mittlere beste Übereinstimmung je Referenz (None ohne Referenzen)."""
+    if not references:
+        return None
+    if task == 'topics':
+        titles = []
+        if isinstance(result, dict):
+            main = result.get('main_topic')
+            titles = [(main or {}).get('title', '') if isinstance(main, dict) else str(main or '')]
+            titles += [(topic or {}).get('title', '') if isinstance(topic, dict) else str(topic)
+                       for topic in result.get('subtopics') or []]
+        wanted = [references.get('main_topic', '')] + list(references.get('subtopics') or [])
+        return sum(max((f1(ref, title) for title in titles), default=0.0) for ref in wanted) / len(wanted)
+    text_of = flashcard_text if task == 'flashcards' else question_text
+    candidates = [text_of(item) for item in result or []]
+    return sum(max((f1(text_of(ref), cand) for cand in candidates), default=0.0)
+               for ref in references) / len(references)
+
+
+def evaluate(task, content, requested, references):
+    """Kennzahlen einer einzelnen Antwort."""
+    parsed = parse_json_response(content)
+    items = items_from(task, parsed['data']) if not parsed['error'] else None
+    metrics = {'parsed': items is not None, 'repaired': bool(parsed['repairs']), 'items': 0, 'valid': 0,
+               'duplicates': 0, 'requested': requested, 'ref_f1': None}
+    if items is None:
+        metrics['ref_f1'] = reference_score(task, references, None)
+        return metrics
+    if task == 'topics':
+        valid, _ = validate_generated_topics(items)
+        metrics.update(items=1, valid=1 if valid else 0, requested=1, ref_f1=reference_score(task, references, valid))
+        return metrics
+    validate = validate_generated_flashcards if task == 'flashcards' else validate_generated_questions
+    valid, _ = validate(items)
+    text_of = flashcard_text if task == 'flashcards' else question_text
+    unique, duplicates = filter_near_duplicates(valid, NearDuplicateIndex(), text_of)
+    metrics.update(items=len(items), valid=len(valid), duplicates=len(duplicates),
+                   ref_f1=reference_score(task, references, unique))
+    return metrics
+
+
+def summarize(rows):
+    """Aggregiert die Kennzahlen einer Variante und Aufgabe."""
+    calls = len(rows)
+    items = sum(row['items'] for row in rows)
+    valid = sum(row['valid'] for row in rows)
+    scores = [row['ref_f1'] for row in rows if row['ref_f1'] is not None]
+    return {
+        'calls': calls,
+        'input_tokens': sum(row['input_tokens'] for row in rows) / calls,
+        'output_tokens': sum(row['output_tokens'] for row in rows) / calls,
+        'parse_rate': sum(row['parsed'] for row in rows) / calls,
+        'repair_rate': sum(row['repaired'] for row in rows) / calls,
+        'schema_valid': valid / items if items else 0.0,
+        'duplicate_rate': sum(row['duplicates'] for row in rows) / valid if valid else 0.0,
+        'fulfilment': min(1.0, (valid - sum(row['duplicates'] for row in rows)) / max(1, sum(row['requested'] for row in rows))),
+        'ref_f1': sum(scores) / len(scores) if scores else None,
+    }
+
+
+# --- Ablauf -----------------------------------------------------------------
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--variants', help='JSON-Datei mit Prompt-Varianten')
+    parser.add_argument('--corpus', help='JSONL-Korpus mit Dokumenten und Referenzen')
+    parser.add_argument('--documents', type=int, default=12, help='Dokumente im synthetischen Korpus')
+    parser.add_argument('--tasks', default=','.join(TASKS), help='Kommagetrennte Aufgaben')
+    parser.add_argument('--count', type=int, default=6, help='Angeforderte Einträge (bzw. max. Themen)')
+    parser.add_argument('--model', default=os.environ.get('OPENAI_CHEAP_MODEL', 'gpt-4o-mini'))
+    parser.add_argument('--replay', help='JSONL mit aufgezeichneten Antworten')
+    parser.add_argument('--record', help='Antworten live abrufen und in diese JSONL-Datei schreiben')
+    parser.add_argument('--json', help='Ergebnisse zusätzlich als JSON speichern')
+    parser.add_argument('--seed', type=int, default=7)
+    args = parser.parse_args()
+    logging.disable(logging.WARNING)
+
+    corpus = load_corpus(args.corpus) if args.corpus else synthetic_corpus(args.documents, args.seed)
+    tasks = [task for task in args.tasks.split(',') if task in TASKS]
+    if args.variants:
+        with open(args.variants, 'r', encoding='utf-8') as f:
+            variants = {'baseline': {}, **json.load(f)}
+    else:
+        variants = {'baseline': {}, 'ohne_beispiele': without_examples()}
+
+    recorded = {}
+    if args.replay:
+        for entry in load_corpus(args.replay):
+            recorded[entry['key']] = entry
+    record_file = open(args.record, 'a', encoding='utf-8') if args.record else None
+
+    results = defaultdict(list)
+    missing = Counter()
+    try:
+        for name, overrides in variants.items():
+            with apply_variant(overrides):
+                for task in tasks:
+                    params = task_params(task, args.count)
+                    for document in corpus:
+                        messages = prompts.build_budgeted_messages(task, document['document'], args.model,
+                                                                   MAX_TOKENS[task], language=document.get('language', 'de'),
+                                                                   **params)
+                        key = request_key(args.model, messages)
+                        usage = None
+                        if record_file:
+                            content, usage = record_model(args.model, task, messages)
+                            record_file.write(json.dumps({'key': key, 'variant': name, 'task': task, 'id': document.get('id'),
+                                                          'content': content, 'usage': usage}, ensure_ascii=False) + '\n')
+                        elif args.replay:
+                            if key not in recorded:
+                                missing[name] += 1
+                                continue
+                            content, usage = recorded[key]['content'], recorded[key].get('usage')
+                        else:
+                            content = fake_model(task, messages, params, int(key[:8], 16) ^ args.seed)
+                        row = evaluate(task, content, args.count, (document.get('references') or {}).get(task))
+                        row['input_tokens'] = (usage or {}).get('prompt_tokens') or prompt_tokens(messages, args.model)
+                        row['output_tokens'] = (usage or {}).get('completion_tokens') or count_tokens(content, args.model)
+                        results[(name, task)].append(row)
+    finally:
+        if record_file:
+            record_file.close()
+
+    summary = {key: summarize(rows) for key, rows in results.items() if rows}
+    mode = 'Aufzeichnung' if args.record else 'Wiedergabe' if args.replay else 'Fake-Modell'
+    print(f"{len(corpus)} Dokumente, Modell {args.model}, {mode}\n")
+    header = (f"{'Variante':<16} {'Aufgabe':<11} {'Input':>7} {'Output':>7} {'Parse':>6} {'Repar.':>6} "
+              f"{'Schema':>7} {'Dupl.':>6} {'Menge':>6} {'Ref-F1':>7}")
+    print(header)
+    for (name, task), stats in summary.items():
+        ref = f"{stats['ref_f1']:.3f}" if stats['ref_f1'] is not None else '-'
+        print(f"{name:<16} {task:<11} {stats['input_tokens']:>7.0f} {stats['output_tokens']:>7.0f} "
+              f"{stats['parse_rate']:>6.0%} {stats['repair_rate']:>6.0%} {stats['schema_valid']:>7.0%} "
+              f"{stats['duplicate_rate']:>6.1%} {stats['fulfilment']:>6.0%} {ref:>7}")
+
+    print("\nGegenüber baseline:")
+    for (name, task), stats in summary.items():
+        base = summary.get(('baseline', task))
+        if name == 'baseline' or not base:
+            continue
+        tokens = (stats['input_tokens'] - base['input_tokens']) / base['input_tokens'] if base['input_tokens'] else 0.0
+        quality = ''
+        if stats['ref_f1'] is not None and base['ref_f1'] is not None:
+            quality = f", Ref-F1 {stats['ref_f1'] - base['ref_f1']:+.3f}"
+        print(f"  {name} / {task}: Input-Tokens {tokens:+.1%}, Schema {stats['schema_valid'] - base['schema_valid']:+.0%}"
+              f", Parse {stats['parse_rate'] - base['parse_rate']:+.0%}{quality}")
+    for name, count in missing.items():
+        print(f"  {name}: {count} Anfragen ohne Aufzeichnung übersprungen")
+
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump([{'variant': name, 'task': task, **stats} for (name, task), stats in summary.items()],
+                      f, ensure_ascii=False, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,164 @@
+#!/usr/bin/env python
+"""
+Benchmark: p95 Time-to-First-Results interaktiver Uploads unter Massenlast.
+
+Simuliert (ereignisdiskret, deterministisch per Seed) einen Worker unter
+sättigender Bulk-Last und vergleicht drei Aufstellungen:
+
+- shared:   ein Pool, eine FIFO-Queue (bisheriges Verhalten)
+- priority: ein Pool, Redis-Prioritäten (interaktive Tasks zuerst, ohne Verdrängung)
+- tiered:   eigene Pools pro Stufe (config/queues.py, WORKER_CONCURRENCY_<STUFE>)
+
+Ein interaktiver Upload besteht aus der Extraktion und danach drei
+Generierungs-Tasks; "erste Ergebnisse" liegen vor, sobald die erste
+Generierung ihre erste Karte liefert.
+
+Aufruf:
+    python benchmarks/queue_latency.py --uploads 30 --bulk-jobs 400
+"""
+import argparse
+import heapq
+import os
+import random
+import sys
+from collections import deque
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from config.queues import TIERS, TIER_BULK, TIER_INTERACTIVE, TIER_MORE, WORKER_CONCURRENCY_BY_TIER  # noqa: E402
+
+
+class Job:
+    """Ein Task in der Simulation."""
+
+    def __init__(self, tier, duration, upload=None, kind='generate', first_result=None):
+        self.tier = tier
+        self.duration = duration
+        self.upload = upload
+        self.kind = kind
+        self.first_result = first_result
+
+
+class Pool:
+    """Worker-Pool mit fester Anzahl Slots und einer (ggf. priorisierten) Warteschlange."""
+
+    def __init__(self, slots, use_priority):
+        self.slots = slots
+        self.busy = 0
+        self.use_priority = use_priority
+        self.fifo = deque()
+        self.heap = []
+        self.sequence = 0
+
+    def push(self, job):
+        if self.use_priority:
+            heapq.heappush(self.heap, (TIERS[job.tier]['priority'], self.sequence, job))
+            self.sequence += 1
+        else:
+            self.fifo.append(job)
+
+    def pop(self):
+        if self.use_priority:
+            return heapq.heappop(self.heap)[2] if self.heap else None
+        return self.fifo.popleft() if self.fifo else None
+
+
+def simulate(layout, args, seed):
+    """Führt eine Simulation aus und gibt die Time-to-First-Results aller Uploads zurück."""
+    rng = random.Random(seed)
+    total_slots = sum(WORKER_CONCURRENCY_BY_TIER.values())
+    if layout == 'tiered':
+        pools = {tier: Pool(WORKER_CONCURRENCY_BY_TIER[tier], use_priority=True) for tier in TIERS}
+    else:
+        shared = Pool(total_slots, use_priority=(layout == 'priority'))
+        pools = {tier: shared for tier in TIERS}
+
+    events = []
+    counter = [0]
+
+    def schedule(time, kind, payload):
+        heapq.heappush(events, (time, counter[0], kind, payload))
+        counter[0] += 1
+
+    # Sättigende Bulk-Last: alle Bulk-Jobs liegen zu Beginn in der Queue, dazu "mehr"-Anfragen
+    for _ in range(args.bulk_jobs):
+        schedule(0.0, 'arrive', Job(TIER_BULK, rng.uniform(*args.bulk_duration)))
+    for _ in range(args.more_jobs):
+        schedule(rng.uniform(0, args.horizon), 'arrive', Job(TIER_MORE, rng.uniform(*args.generate_duration)))
+
+    uploads = {}
+    arrival = 0.0
+    for upload_id in range(args.uploads):
+        arrival += rng.expovariate(args.uploads / args.horizon)
+        uploads[upload_id] = {'arrival': arrival, 'first_result': None}
+        schedule(arrival, 'arrive', Job(TIER_INTERACTIVE, rng.uniform(*args.extract_duration), upload=upload_id, kind='extract'))
+
+    def dispatch(pool, now):
+        while pool.busy < pool.slots:
+            job = pool.pop()
+            if job is None:
+                return
+            pool.busy += 1
+            if job.kind == 'generate' and job.upload is not None:
+                record = uploads[job.upload]
+                result_at = now + job.first_result
+                if record['first_result'] is None or result_at < record['first_result']:
+                    record['first_result'] = result_at
+            schedule(now + job.duration, 'finish', (pool, job))
+
+    while events:
+        now, _, kind, payload = heapq.heappop(events)
+        if kind == 'arrive':
+            pool = pools[payload.tier]
+            pool.push(payload)
+            dispatch(pool, now)
+        else:
+            pool, job = payload
+            pool.busy -= 1
+            if job.kind == 'extract':
+                # Nach der Extraktion: drei Generierungs-Tasks (Lernkarten, Fragen, Themen)
+                for _ in range(3):
+                    duration = rng.uniform(*args.generate_duration)
+                    schedule(now, 'arrive', Job(TIER_INTERACTIVE, duration, upload=job.upload,
+                                                first_result=min(args.first_result, duration)))
+            dispatch(pool, now)
+
+    return [record['first_result'] - record['arrival'] for record in uploads.values() if record['first_result']]
+
+
+def percentile(values, pct):
+    """Perzentil (nächster Rang) einer Liste."""
+    if not values:
+        return float('nan')
+    ordered = sorted(values)
+    index = max(0, min(len(ordered) - 1, int(round(pct / 100.0 * len(ordered) + 0.5)) - 1))
+    return ordered[index]
+
+
+def parse_range(value):
+    low, high = (float(part) for part in value.split(','))
+    return low, high
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--uploads', type=int, default=30, help='Anzahl interaktiver Uploads')
+    parser.add_argument('--bulk-jobs', type=int, default=400, help='Bulk-Jobs, die zu Beginn in der Queue liegen')
+    parser.add_argument('--more-jobs', type=int, default=100, help='"Mehr generieren"-Anfragen im Zeitraum')
+    parser.add_argument('--horizon', type=float, default=600.0, help='Zeitraum der Ankünfte (Sekunden)')
+    parser.add_argument('--extract-duration', type=parse_range, default=(1.0, 4.0), help='Extraktion min,max (s)')
+    parser.add_argument('--generate-duration', type=parse_range, default=(8.0, 25.0), help='Generierung min,max (s)')
+    parser.add_argument('--bulk-duration', type=parse_range, default=(20.0, 60.0), help='Bulk-Job min,max (s)')
+    parser.add_argument('--first-result', type=float, default=3.0, help='Zeit bis zur ersten gestreamten Karte (s)')
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    print(f"Pools: {WORKER_CONCURRENCY_BY_TIER} (shared/priority: {sum(WORKER_CONCURRENCY_BY_TIER.values())} Slots)")
+    print(f"{'Aufstellung':<10} {'p50 (s)':>10} {'p95 (s)':>10} {'max (s)':>10}")
+    for layout in ('shared', 'priority', 'tiered'):
+        latencies = simulate(layout, args, args.seed)
+        print(f"{layout:<10} {percentile(latencies, 50):>10.1f} {percentile(latencies, 95):>10.1f} {max(latencies):>10.1f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,186 @@
+#!/usr/bin/env python
+"""
+Benchmark: semantischer Antwort-Cache (redis_utils/semantic_cache.py).
+
+Erzeugt einen synthetischen Korpus von Dokumenten und fragt den Cache mit
+einer gemischten Last ab:
+
+    exact      byteidentischer erneuter Upload (Treffer bereits im regulären Cache)
+    cover      anderes Deckblatt (Titel, Datum, Name)
+    extraction abweichende Extraktion (Silbentrennung, Kopfzeilen, Seitenzahlen)
+    edit       wenige geänderte Wörter
+    related    anderes Dokument derselben Vorlesung (teilt ~35 % der Absätze)
+    fresh      neues Dokument
+
+cover, extraction und edit sollen treffen, related und fresh nicht. Der Index
+bildet das Redis-Layout (ein Set je LSH-Band) im Speicher nach und nutzt
+dieselben Signaturen wie der Worker.
+
+Aufruf:
+    python benchmarks/semantic_cache.py --documents 300 --queries 600
+"""
+import argparse
+import os
+import random
+import sys
+import time
+from collections import Counter, defaultdict
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from utils.document_signature import band_hashes, document_signature  # noqa: E402
+from utils.minhash import estimated_similarity  # noqa: E402
+
+POSITIVE = ('cover', 'extraction', 'edit')
+NEGATIVE = ('related', 'fresh')
+MAX_CANDIDATES = 20
+
+
+def random_word(rng, min_len=3, max_len=11):
+    consonants, vowels = 'bcdfghklmnprstvwz', 'aeiou'
+    length = rng.randint(min_len, max_len)
+    return ''.join(rng.choice(consonants if i % 2 == 0 else vowels) for i in range(length))
+
+
+class Corpus:
+    """Dokumente aus einem gemeinsamen, schief verteilten Vokabular."""
+
+    def __init__(self, rng, vocabulary=4000):
+        self.rng = rng
+        self.words = [random_word(rng) for _ in range(vocabulary)]
+        self.weights = [1 / (rank + 1) for rank in range(vocabulary)]
+
+    def paragraph(self):
+        return self.rng.choices(self.words, weights=self.weights, k=self.rng.randint(60, 120))
+
+    def cover(self):
+        return ['Vorlesung', random_word(self.rng).capitalize(), 'Prof', random_word(self.rng).capitalize(),
+                f"{self.rng.randint(1, 28)}.{self.rng.randint(1, 12)}.{self.rng.randint(2019, 2026)}"]
+
+    def document(self, paragraphs=None):
+        return {'cover': self.cover(), 'paragraphs': paragraphs or [self.paragraph() for _ in range(self.rng.randint(15, 30))]}
+
+
+def render(document, page_every=0):
+    """Dokument als extrahierter Text; optional mit Kopfzeile und Seitenzahl alle page_every Absätze."""
+    parts = [' '.join(document['cover'])]
+    for i, paragraph in enumerate(document['paragraphs']):
+        if page_every and i % page_every == 0:
+            parts.append(f"Seite {i // page_every + 1} {document['cover'][1]}")
+        parts.append(' '.join(paragraph))
+    return '\n\n'.join(parts)
+
+
+def variant(rng, corpus, document, kind):
+    """Erzeugt eine Abfrage der gegebenen Art zu einem indizierten Dokument."""
+    if kind == 'exact':
+        return render(document)
+    if kind == 'cover':
+        return render({'cover': corpus.cover(), 'paragraphs': document['paragraphs']})
+    if kind == 'extraction':
+        paragraphs = []
+        for paragraph in document['paragraphs']:
+            words = list(paragraph)
+            for i, word in enumerate(words):
+                if len(word) > 7 and rng.random() < 0.03:
+                    words[i] = f"{word[:4]}- {word[4:]}"
+            paragraphs.append(words)
+        return render({'cover': document['cover'], 'paragraphs': paragraphs}, page_every=3)
+    if kind == 'edit':
+        paragraphs = [[corpus.rng.choice(corpus.words) if rng.random() < 0.01 else word for word in paragraph]
+                      for paragraph in document['paragraphs']]
+        return render({'cover': document['cover'], 'paragraphs': paragraphs})
+    if kind == 'related':
+        shared = rng.sample(document['paragraphs'], max(1, int(len(document['paragraphs']) * 0.35)))
+        own = [corpus.paragraph() for _ in range(len(document['paragraphs']) - len(shared))]
+        paragraphs = shared + own
+        rng.shuffle(paragraphs)
+        return render(corpus.document(paragraphs))
+    return render(corpus.document())
+
+
+class InMemoryIndex:
+    """Nachbildung des Redis-Layouts: ein Set von Eintrags-IDs je (Band, Band-Hash)."""
+
+    def __init__(self):
+        self.buckets = defaultdict(set)
+        self.signatures = {}
+
+    def add(self, entry_id, text):
+        signature = document_signature(text)
+        self.signatures[entry_id] = signature
+        for band, band_hash in enumerate(band_hashes(signature)):
+            self.buckets[(band, band_hash)].add(entry_id)
+
+    def lookup(self, text, threshold):
+        signature = document_signature(text)
+        band_matches = Counter()
+        for band, band_hash in enumerate(band_hashes(signature)):
+            band_matches.update(self.buckets.get((band, band_hash), ()))
+        best_id, best_similarity = None, 0.0
+        for entry_id, _ in band_matches.most_common(MAX_CANDIDATES):
+            similarity = estimated_similarity(signature, self.signatures[entry_id])
+            if similarity >= threshold and (best_id is None or similarity > best_similarity):
+                best_id, best_similarity = entry_id, similarity
+        return (best_id, best_similarity) if best_id is not None else None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--documents', type=int, default=300, help='Dokumente im Cache')
+    parser.add_argument('--queries', type=int, default=600, help='Abfragen (gleichmäßig über alle Arten)')
+    parser.add_argument('--thresholds', default='0.7,0.8,0.85,0.9', help='Kommagetrennte Schwellen')
+    parser.add_argument('--seed', type=int, default=11)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    corpus = Corpus(rng)
+    documents = [corpus.document() for _ in range(args.documents)]
+    kinds = ('exact',) + POSITIVE + NEGATIVE
+    queries = []
+    for i in range(args.queries):
+        source = rng.randrange(len(documents))
+        kind = kinds[i % len(kinds)]
+        queries.append((kind, source, variant(rng, corpus, documents[source], kind)))
+
+    index = InMemoryIndex()
+    exact_texts = {}
+    start = time.perf_counter()
+    for entry_id, document in enumerate(documents):
+        text = render(document)
+        exact_texts[text] = entry_id
+        index.add(entry_id, text)
+    build_ms = (time.perf_counter() - start) * 1000 / len(documents)
+    print(f"Index: {len(documents)} Dokumente, {build_ms:.1f} ms pro Dokument "
+          f"(~{sum(len(render(d)) for d in documents) // len(documents)} Zeichen)")
+
+    exact_hits = sum(1 for _, _, text in queries if text in exact_texts)
+    for threshold in (float(value) for value in args.thresholds.split(',')):
+        hits, true_hits, false_hits, positives_found = Counter(), 0, 0, 0
+        start = time.perf_counter()
+        for kind, source, text in queries:
+            if text in exact_texts:
+                continue
+            match = index.lookup(text, threshold)
+            if match is None:
+                continue
+            hits[kind] += 1
+            if kind in POSITIVE and match[0] == source:
+                true_hits += 1
+                positives_found += 1
+            else:
+                false_hits += 1
+        lookup_ms = (time.perf_counter() - start) * 1000 / max(len(queries) - exact_hits, 1)
+        positives = sum(1 for kind, _, _ in queries if kind in POSITIVE)
+        precision = true_hits / max(true_hits + false_hits, 1)
+        recall = positives_found / max(positives, 1)
+        hit_rate = (exact_hits + true_hits + false_hits) / len(queries)
+        print(f"\nSchwelle {threshold:.2f}: Precision {precision:.1%}, Recall {recall:.1%}, "
+              f"Abfrage {lookup_ms:.1f} ms")
+        print(f"  Trefferquote: nur exakter Cache {exact_hits / len(queries):.1%}, mit semantischem Cache {hit_rate:.1%}")
+        print('  Treffer je Art: ' + ', '.join(
+            f"{kind} {hits[kind]}/{sum(1 for k, _, _ in queries if k == kind)}" for kind in POSITIVE + NEGATIVE))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,85 @@
+#!/usr/bin/env python
+"""
+Benchmark: Token-Zählung (utils/token_counter.py) gegen den bisherigen Pfad.
+
+Bisher: tiktoken.encoding_for_model(model) und encode() bei jedem Aufruf,
+Kürzen durch Kodieren des gesamten Textes. Neu: gecachter Encoder,
+encode_ordinary, Batch-Zählung und Kürzen über ein Präfix.
+
+Benötigt tiktoken samt BPE-Datei (Download oder TIKTOKEN_CACHE_DIR).
+
+Aufruf:
+    python benchmarks/token_counter.py --texts 2000 --truncate 4000
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from utils.token_counter import (count_tokens, count_tokens_batch, get_encoding,  # noqa: E402
+                                 truncate_to_tokens)
+
+WORDS = ("Photosynthese Zellatmung Mitochondrien Chlorophyll Enzym Substrat Gleichgewicht Energie "
+         "Glukose Membran Transport Diffusion Osmose Protein Ribosom Translation Transkription DNA "
+         "the of and to in is that for on with as be by this are").split()
+
+
+def legacy_count(text, model):
+    import tiktoken
+    return len(tiktoken.encoding_for_model(model).encode(text))
+
+
+def legacy_truncate(text, max_tokens, model):
+    import tiktoken
+    encoding = tiktoken.encoding_for_model(model)
+    tokens = encoding.encode(text)
+    return encoding.decode(tokens[:max_tokens]) if len(tokens) > max_tokens else text
+
+
+def timed(label, func, repeat, baseline=None):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        result = func()
+    seconds = time.perf_counter() - start
+    speedup = f" ({baseline / seconds:.1f}x)" if baseline else ''
+    print(f"{label:<44} {seconds * 1000:9.1f} ms{speedup}")
+    return seconds, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--texts', type=int, default=2000, help='Anzahl kurzer Texte (Karten, Nachrichten)')
+    parser.add_argument('--truncate', type=int, default=4000, help='Token-Grenze beim Kürzen')
+    parser.add_argument('--document-words', type=int, default=60000, help='Wörter im langen Dokument')
+    parser.add_argument('--model', default='gpt-3.5-turbo')
+    parser.add_argument('--seed', type=int, default=3)
+    args = parser.parse_args()
+
+    if get_encoding(args.model) is None:
+        print("tiktoken bzw. BPE-Datei nicht verfügbar, Benchmark nicht möglich.")
+        return 1
+
+    rng = random.Random(args.seed)
+    texts = [' '.join(rng.choices(WORDS, k=rng.randint(10, 80))) for _ in range(args.texts)]
+    document = ' '.join(rng.choices(WORDS, k=args.document_words))
+
+    print(f"{args.texts} kurze Texte, Dokument mit {len(document)} Zeichen, Modell {args.model}\n")
+    baseline, expected = timed("Zählen: encoding_for_model pro Aufruf", lambda: [legacy_count(t, args.model) for t in texts], 1)
+    _, counted = timed("Zählen: gecachter Encoder", lambda: [count_tokens(t, args.model) for t in texts], 1, baseline)
+    _, batched = timed("Zählen: count_tokens_batch", lambda: count_tokens_batch(texts, args.model), 1, baseline)
+    assert counted == batched == expected, "Abweichende Token-Zahlen"
+
+    repeat = 20
+    baseline, expected = timed(f"Kürzen auf {args.truncate}: ganzes Dokument kodieren",
+                               lambda: legacy_truncate(document, args.truncate, args.model), repeat)
+    _, truncated = timed(f"Kürzen auf {args.truncate}: truncate_to_tokens",
+                         lambda: truncate_to_tokens(document, args.truncate, args.model), repeat, baseline)
+    assert truncated == expected, "Abweichendes Kürzungsergebnis"
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
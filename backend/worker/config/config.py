@@ -222,6 +222,7 @@ class WorkerConfig:
         """
         Gibt die Celery-Konfiguration zurück.
         """
+        from .queues import PRIORITY_SEP, PRIORITY_STEPS, QUEUE_INTERACTIVE, get_task_queues, get_task_routes
         return {
             "broker_url": self.redis_url,
             "result_backend": self.redis_url,
@@ -237,7 +238,17 @@ class WorkerConfig:
             "task_acks_late": True,
             "task_reject_on_worker_lost": True, # Wichtig bei task_acks_late
             "worker_concurrency": self.worker_concurrency,
-            "worker_pool": self.celery_pool # Pool dynamisch setzen
+            "worker_pool": self.celery_pool, # Pool dynamisch setzen
+            # Queues pro Stufe (interactive/more/bulk) mit Redis-Prioritäten, siehe config/queues.py
+            "task_queues": get_task_queues(),
+            "task_routes": get_task_routes(),
+            "task_default_queue": QUEUE_INTERACTIVE,
+            "task_default_priority": 0,
+            "broker_transport_options": {
+                "priority_steps": PRIORITY_STEPS,
+                "sep": PRIORITY_SEP,
+                "queue_order_strategy": "priority",
+            },
             # Weitere Celery-Optionen nach Bedarf...
         }
 
@@ -0,0 +1,48 @@
+"""
+Modell-Routing für die KI-Tasks.
+
+Jeder Task-Typ hat eine Kaskade von Modellen: zuerst das günstige Modell,
+nur ungültige bzw. fehlende Ergebnisse werden an das nächststärkere Modell
+eskaliert. Die Reihenfolge kann pro Task-Typ über Umgebungsvariablen
+überschrieben werden (kommagetrennt, z.B. MODEL_ROUTE_FLASHCARDS="gpt-4o-mini,gpt-4o").
+"""
+import os
+from typing import Dict, List, Optional
+
+OPENAI_CHEAP_MODEL = os.environ.get('OPENAI_CHEAP_MODEL', 'gpt-4o-mini')
+OPENAI_STRONG_MODEL = os.environ.get('OPENAI_STRONG_MODEL', 'gpt-4o')
+
+
+def _route_from_env(env_var: str, default: List[str]) -> List[str]:
+    """Liest eine Modell-Kaskade aus einer Umgebungsvariable."""
+    value = os.environ.get(env_var)
+    if not value:
+        return default
+    models = [model.strip() for model in value.split(',') if model.strip()]
+    return models or default
+
+
+# Task-Typ -> Modelle in Eskalationsreihenfolge
+MODEL_ROUTES: Dict[str, List[str]] = {
+    'topics': _route_from_env('MODEL_ROUTE_TOPICS', [OPENAI_CHEAP_MODEL, OPENAI_STRONG_MODEL]),
+    'flashcards': _route_from_env('MODEL_ROUTE_FLASHCARDS', [OPENAI_CHEAP_MODEL, OPENAI_STRONG_MODEL]),
+    'questions': _route_from_env('MODEL_ROUTE_QUESTIONS', [OPENAI_CHEAP_MODEL, OPENAI_STRONG_MODEL]),
+}
+
+
+def get_model_route(task_type: str, options: Optional[dict] = None) -> List[str]:
+    """
+    Gibt die Modell-Kaskade für einen Task-Typ zurück.
+
+    Ist in den Optionen explizit ein Modell gesetzt, wird nur dieses verwendet.
+
+    Args:
+        task_type: 'topics', 'flashcards' oder 'questions'
+        options: Task-Optionen (optional mit 'model')
+
+    Returns:
+        list: Modellnamen in Eskalationsreihenfolge
+    """
+    if options and options.get('model'):
+        return [options['model']]
+    return list(MODEL_ROUTES.get(task_type) or [OPENAI_STRONG_MODEL])
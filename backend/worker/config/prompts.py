@@ -4,6 +4,7 @@ Prompts für OpenAI-Aufrufe
 
 Diese Datei enthält die Prompts für verschiedene KI-Aufgaben in verschiedenen Sprachen.
 """
+from utils.prompt_budget import fit_document
 
 # System-Prompts für verschiedene Aufgabentypen
 SYSTEM_PROMPTS = {
@@ -260,6 +261,55 @@ Format the response as a continuous text without bullet points."""
     }
 }
 
+# Aufgabenunabhängiger System-Prompt. Zusammen mit dem Dokument-Block bildet er
+# einen stabilen Präfix, der für alle Aufgaben auf demselben Dokument identisch
+# ist, sodass der Provider ihn zwischen den Aufrufen cachen kann.
+SHARED_SYSTEM_PROMPTS = {
+    "de": """Du bist ein hilfreicher Lernassistent für Studierende.
+Du erhältst zuerst ein Dokument und anschließend eine konkrete Aufgabe dazu.
+Beziehe dich ausschließlich auf den Inhalt des Dokuments und halte dich exakt an das in der Aufgabe verlangte Ausgabeformat.""",
+
+    "en": """You are a helpful study assistant for students.
+You will first receive a document and then a specific task about it.
+Rely exclusively on the content of the document and follow the output format requested in the task exactly."""
+}
+
+# Dokument-Block (sprach- und aufgabenunabhängig, damit der Präfix stabil bleibt)
+DOCUMENT_PROMPT = "Dokument:\n\n{content}"
+
+# Aufgaben-Block, der nach dem Dokument folgt
+TASK_PROMPT = "Aufgabe zum obigen Dokument:\n\n{instructions}"
+
+# Fokus einer Teilanfrage, wenn eine große Anfrage aufgeteilt wird (utils/fanout.py)
+FOCUS_HINTS = {
+    "de": "Teilauftrag {part} von {parts}: Teile das Dokument gedanklich in {parts} etwa gleich große, "
+          "aufeinanderfolgende Abschnitte und verwende ausschließlich Inhalte aus Abschnitt {part}. "
+          "Die übrigen Abschnitte werden separat bearbeitet.",
+    "en": "Part {part} of {parts}: mentally split the document into {parts} consecutive sections of roughly "
+          "equal length and use content from section {part} only. The other sections are handled separately.",
+}
+
+# Folgeanfrage nach abgeschnittener Antwort (utils/continuation.py): bereits erstellte Einträge
+EXCLUDE_HINTS = {
+    "de": "Folgende Einträge wurden bereits erstellt. Wiederhole sie nicht, sondern decke andere Inhalte ab:\n{items}",
+    "en": "The following items have already been created. Do not repeat them; cover other content instead:\n{items}",
+}
+
+# Mehrere kleine Dokumente in einer Anfrage (tasks/micro_batch.py): Trenner und Antwortformat
+PACKED_DOCUMENT_PROMPT = "=== Dokument {id} ===\n{content}"
+PACKED_HINTS = {
+    "de": "Das obige Material besteht aus {count} voneinander unabhängigen Dokumenten (IDs: {ids}). "
+          "Bearbeite die Aufgabe für JEDES Dokument getrennt und verwende dabei ausschließlich dessen Inhalt. "
+          "Das oben verlangte Ausgabeformat gilt für das Ergebnis eines einzelnen Dokuments. Antworte mit genau einem "
+          "JSON-Objekt der Form {{\"documents\": [{{\"id\": \"<ID>\", \"result\": <Ergebnis im oben verlangten Format>}}]}} "
+          "mit genau einem Eintrag pro Dokument.",
+    "en": "The material above consists of {count} independent documents (IDs: {ids}). "
+          "Perform the task for EACH document separately, using only that document's content. "
+          "The output format requested above applies to the result of a single document. Respond with exactly one "
+          "JSON object of the form {{\"documents\": [{{\"id\": \"<ID>\", \"result\": <result in the format requested above>}}]}} "
+          "with exactly one entry per document.",
+}
+
 # Nutzer-Prompts
 USER_PROMPTS = {
     "flashcards": "Hier ist der Text, für den du Lernkarten erstellen sollst:\n\n{content}",
@@ -315,4 +365,93 @@ def get_user_prompt(task_type, content):
         str: Formatierter Nutzer-Prompt
     """
     prompt_template = USER_PROMPTS.get(task_type, "Hier ist der Text:\n\n{content}")
-    return prompt_template.format(content=content) 
\ No newline at end of file
+    return prompt_template.format(content=content) 
+
+def build_messages(task_type, content, language='de', **options):
+    """
+    Baut das Nachrichtenarray mit stabilem Dokument-Präfix.
+
+    Die Reihenfolge ist: gemeinsamer System-Prompt, Dokument, aufgabenspezifische
+    Anweisungen. Die ersten beiden Nachrichten sind für alle Aufgaben auf demselben
+    Dokument identisch, damit Provider-Prompt-Caching greift.
+
+    Args:
+        task_type: Art der Aufgabe (flashcards, questions, topics, summary)
+        content: Der Inhalt, der verarbeitet werden soll
+        language: Sprache (de, en, fr, es)
+        **options: Weitere Parameter für die Formatierung des Aufgaben-Prompts;
+            focus=(i, N) beschränkt eine Teilanfrage auf Abschnitt i von N,
+            exclude=[...] nennt bereits erstellte Einträge (Folgeanfragen)
+
+    Returns:
+        list: Nachrichten für die Chat-Completion-API
+    """
+    focus = options.pop('focus', None)
+    exclude = options.pop('exclude', None)
+    shared_system_prompt = SHARED_SYSTEM_PROMPTS.get(language, SHARED_SYSTEM_PROMPTS['en'])
+    instructions = get_system_prompt(task_type, language=language, **options)
+    if focus:
+        part, parts = focus
+        hint = FOCUS_HINTS.get(language, FOCUS_HINTS['en'])
+        instructions = f"{instructions}\n\n{hint.format(part=part, parts=parts)}"
+    if exclude:
+        hint = EXCLUDE_HINTS.get(language, EXCLUDE_HINTS['en'])
+        instructions = f"{instructions}\n\n{hint.format(items=chr(10).join(f'- {item}' for item in exclude))}"
+    return [
+        {"role": "system", "content": shared_system_prompt},
+        {"role": "user", "content": DOCUMENT_PROMPT.format(content=content)},
+        {"role": "user", "content": TASK_PROMPT.format(instructions=instructions)}
+    ]
+
+
+def build_budgeted_messages(task_type, content, model, max_output_tokens, language='de', **options):
+    """
+    Wie build_messages, das Dokument erhält aber genau das freie Token-Budget des Modells.
+
+    System-Prompt, Anweisungen samt Beispielen und Hinweisen sowie die reservierte
+    Antwort (max_output_tokens) werden vom Kontextfenster abgezogen; ein längeres
+    Dokument wird an einer Abschnitts- bzw. Satzgrenze gekürzt (utils/prompt_budget.py).
+
+    Args:
+        task_type: Art der Aufgabe (flashcards, questions, topics, summary)
+        content: Der Inhalt, der verarbeitet werden soll
+        model: Modell der Anfrage
+        max_output_tokens: max_tokens der Anfrage
+        language: Sprache (de, en, fr, es)
+        **options: Wie bei build_messages
+
+    Returns:
+        list: Nachrichten für die Chat-Completion-API
+    """
+    fixed_messages = build_messages(task_type, '', language=language, **options)
+    content = fit_document(content, fixed_messages, model, max_output_tokens)
+    return build_messages(task_type, content, language=language, **options)
+
+
+def build_packed_messages(task_type, documents, language='de', **options):
+    """
+    Baut eine Anfrage für mehrere kleine Dokumente mit Dokument-IDs im Antwortformat.
+
+    Die Anweisungen sind dieselben wie bei build_messages; ein Zusatz verlangt
+    das Ergebnis pro Dokument unter {"documents": [{"id", "result"}]}.
+
+    Args:
+        task_type: Art der Aufgabe (flashcards, questions, topics)
+        documents: Liste von (ID, Inhalt)
+        language: Sprache (de, en, fr, es)
+        **options: Weitere Parameter für die Formatierung des Aufgaben-Prompts
+
+    Returns:
+        list: Nachrichten für die Chat-Completion-API
+    """
+    shared_system_prompt = SHARED_SYSTEM_PROMPTS.get(language, SHARED_SYSTEM_PROMPTS['en'])
+    instructions = get_system_prompt(task_type, language=language, **options)
+    ids = [document_id for document_id, _ in documents]
+    hint = PACKED_HINTS.get(language, PACKED_HINTS['en'])
+    instructions = f"{instructions}\n\n{hint.format(count=len(ids), ids=', '.join(ids))}"
+    content = "\n\n".join(PACKED_DOCUMENT_PROMPT.format(id=document_id, content=text) for document_id, text in documents)
+    return [
+        {"role": "system", "content": shared_system_prompt},
+        {"role": "user", "content": DOCUMENT_PROMPT.format(content=content)},
+        {"role": "user", "content": TASK_PROMPT.format(instructions=instructions)}
+    ]
@@ -0,0 +1,135 @@
+"""
+Celery-Queues und Prioritäten pro Stufe.
+
+Drei Stufen trennen die Arbeit, damit ein großer Massenauftrag keine frischen
+Uploads blockiert:
+
+- interactive: Erstgenerierung eines Uploads, dem der Nutzer gerade zusieht
+- more: vom Nutzer angestoßene Nachgenerierung ("mehr Lernkarten")
+- bulk: Hintergrund- und Wartungsarbeit (Batch-API, Aufräumen, Neugenerierung)
+
+Jede Stufe hat eine eigene Queue (eigener Worker-Pool, siehe app.py) und eine
+Redis-Priorität (0 = höchste). Die Priorität sortiert zusätzlich innerhalb
+einer Queue, falls ein Pool mehrere Queues abarbeitet.
+"""
+import os
+from typing import Dict, List, Optional
+
+QUEUE_INTERACTIVE = os.environ.get('CELERY_QUEUE_INTERACTIVE', 'interactive')
+QUEUE_MORE = os.environ.get('CELERY_QUEUE_MORE', 'more')
+QUEUE_BULK = os.environ.get('CELERY_QUEUE_BULK', 'bulk')
+# Bisherige Standard-Queue: wird weiter abgearbeitet, damit alte Nachrichten nicht liegen bleiben
+QUEUE_LEGACY = 'celery'
+
+TIER_INTERACTIVE = 'interactive'
+TIER_MORE = 'more'
+TIER_BULK = 'bulk'
+
+# Stufe -> (Queue, Priorität); Redis: 0 = höchste Priorität
+TIERS: Dict[str, Dict[str, object]] = {
+    TIER_INTERACTIVE: {'queue': QUEUE_INTERACTIVE, 'priority': 0},
+    TIER_MORE: {'queue': QUEUE_MORE, 'priority': 3},
+    TIER_BULK: {'queue': QUEUE_BULK, 'priority': 6},
+}
+
+# Anzahl der Prioritätsstufen im Redis-Broker
+PRIORITY_STEPS = list(range(10))
+# Trenner zwischen Queue-Name und Priorität in den Redis-Listen (broker_transport_options['sep'])
+PRIORITY_SEP = ':'
+
+# Standard-Stufe pro Task; Generierungs-Tasks können pro Aufruf überschrieben werden (options['tier'])
+TASK_TIERS: Dict[str, str] = {
+    'document.process_document': TIER_INTERACTIVE,
+    'document.finalize_file': TIER_INTERACTIVE,
+    'document.finalize_file_error': TIER_INTERACTIVE,
+    'document.finalize_pipeline_part': TIER_INTERACTIVE,
+    'document.finalize_pipeline_part_error': TIER_INTERACTIVE,
+    'ai.trigger_analysis_tasks': TIER_INTERACTIVE,
+    'ai.flush_micro_batch': TIER_INTERACTIVE,
+    'ai.generate_document_section': TIER_INTERACTIVE,
+    'ai.generate_upload_materials': TIER_INTERACTIVE,
+    'ai.generate_flashcards': TIER_INTERACTIVE,
+    'ai.generate_questions': TIER_INTERACTIVE,
+    'ai.extract_topics': TIER_INTERACTIVE,
+    'ai.assistant_analysis': TIER_INTERACTIVE,
+    'ai.regenerate_failed': TIER_MORE,
+    'ai.process_upload': TIER_BULK,
+    'document.process_upload': TIER_BULK,
+    'batch.submit_generation': TIER_BULK,
+    'batch.poll_generation': TIER_BULK,
+    'maintenance.clean_temp_files': TIER_BULK,
+    'maintenance.clean_cache': TIER_BULK,
+    'maintenance.health_check': TIER_BULK,
+    'speculative.schedule': TIER_BULK,
+    'speculative.pregenerate': TIER_BULK,
+}
+
+# Größe des Worker-Pools pro Stufe (Prozesse)
+WORKER_CONCURRENCY_BY_TIER: Dict[str, int] = {
+    TIER_INTERACTIVE: int(os.environ.get('WORKER_CONCURRENCY_INTERACTIVE', 4)),
+    TIER_MORE: int(os.environ.get('WORKER_CONCURRENCY_MORE', 2)),
+    TIER_BULK: int(os.environ.get('WORKER_CONCURRENCY_BULK', 1)),
+}
+
+
+def tier_options(tier: Optional[str]) -> Dict[str, object]:
+    """
+    Gibt Queue und Priorität einer Stufe zurück (für apply_async bzw. signature.set).
+
+    Args:
+        tier: 'interactive', 'more' oder 'bulk' (unbekannt/None: interactive)
+
+    Returns:
+        dict: {'queue': ..., 'priority': ...}
+    """
+    return dict(TIERS.get(tier or TIER_INTERACTIVE, TIERS[TIER_INTERACTIVE]))
+
+
+def with_tier(signature, tier: Optional[str]):
+    """Setzt Queue und Priorität einer Stufe auf einer Celery-Signatur."""
+    if not tier:
+        return signature
+    return signature.set(**tier_options(tier))
+
+
+def get_task_routes() -> Dict[str, Dict[str, object]]:
+    """Celery-Routing: Task-Name -> Queue und Standard-Priorität."""
+    return {task_name: tier_options(tier) for task_name, tier in TASK_TIERS.items()}
+
+
+def get_task_queues() -> List:
+    """Alle Queues, die der Worker kennen muss (inkl. der bisherigen Standard-Queue)."""
+    from kombu import Queue
+    names = [QUEUE_INTERACTIVE, QUEUE_MORE, QUEUE_BULK, QUEUE_LEGACY]
+    return [Queue(name, routing_key=name) for name in names]
+
+
+def get_worker_tiers() -> List[str]:
+    """
+    Stufen, die dieser Worker-Container abarbeitet (WORKER_TIERS, kommagetrennt).
+
+    Returns:
+        list: z.B. ['interactive', 'more', 'bulk']
+    """
+    value = os.environ.get('WORKER_TIERS', ','.join(TIERS))
+    tiers = [tier.strip() for tier in value.split(',') if tier.strip() in TIERS]
+    return tiers or list(TIERS)
+
+
+def queue_depth(redis_client, queues: Optional[List[str]] = None) -> int:
+    """
+    Anzahl wartender Nachrichten in den Broker-Listen der Queues (alle Prioritäten).
+
+    Args:
+        redis_client: Redis-Client des Brokers
+        queues: Queue-Namen (Standard: alle Stufen)
+
+    Returns:
+        int: Summe der Listenlängen
+    """
+    names = queues or [tier['queue'] for tier in TIERS.values()]
+    keys = [name if not step else f"{name}{PRIORITY_SEP}{step}" for name in names for step in PRIORITY_STEPS]
+    pipeline = redis_client.pipeline()
+    for key in keys:
+        pipeline.llen(key)
+    return sum(int(length or 0) for length in pipeline.execute())
@@ -59,6 +59,41 @@ class HealthCheckHandler(BaseHTTPRequestHandler):
             except ImportError:
                 pass
 
+            # Zähler für zusammengelegte (Single-Flight) LLM-Anfragen
+            try:
+                from redis_utils.single_flight import get_single_flight_stats
+                HEALTH_STATUS['single_flight'] = get_single_flight_stats()
+            except Exception:
+                pass
+
+            # Treffer des semantischen Antwort-Caches
+            try:
+                from redis_utils.semantic_cache import get_semantic_cache_stats
+                HEALTH_STATUS['semantic_cache'] = get_semantic_cache_stats()
+            except Exception:
+                pass
+
+            # Abgeschnittene Completions: gerettete und verlorene Tokens
+            try:
+                from utils.continuation import get_truncation_stats
+                HEALTH_STATUS['truncation'] = get_truncation_stats()
+            except Exception:
+                pass
+
+            # Neu eingeplante Tasks nach vorübergehenden OpenAI-Fehlern
+            try:
+                from utils.retry_policy import get_retry_stats
+                HEALTH_STATUS['retries'] = get_retry_stats()
+            except Exception:
+                pass
+
+            # Reparierte bzw. nicht lesbare JSON-Antworten
+            try:
+                from utils.json_repair import get_json_repair_stats
+                HEALTH_STATUS['json_repair'] = get_json_repair_stats()
+            except Exception:
+                pass
+
             self.wfile.write(json.dumps(HEALTH_STATUS).encode('utf-8'))
 
         else:
@@ -3,9 +3,21 @@ Redis-Utilities für den Worker.
 """
 
 from .client import clear_keys, get_redis_client, initialize_redis_connection
+from .semantic_cache import get_semantic_cache_stats, lookup_semantic_cache, store_semantic_cache
+from .session_events import publish_session_event
+from .single_flight import (acquire_single_flight, get_single_flight_stats,
+                            release_single_flight, wait_for_single_flight)
 
 __all__ = [
     'initialize_redis_connection',
     'get_redis_client',
-    'clear_keys'
+    'clear_keys',
+    'publish_session_event',
+    'acquire_single_flight',
+    'release_single_flight',
+    'wait_for_single_flight',
+    'get_single_flight_stats',
+    'lookup_semantic_cache',
+    'store_semantic_cache',
+    'get_semantic_cache_stats'
 ]
@@ -0,0 +1,173 @@
+"""
+Semantischer Antwort-Cache für dokumentbasierte LLM-Anfragen.
+
+Der reguläre Cache (openai_cache:*) trifft nur bei byteidentischem Text. Wird
+dasselbe Skript mit geändertem Deckblatt oder leicht abweichender Extraktion
+erneut hochgeladen, verfehlt er vollständig. Dieser Cache der zweiten Stufe
+indiziert den normalisierten Dokumenttext per MinHash-LSH (utils/document_signature.py)
+in Redis und verweist auf den vorhandenen Eintrag des regulären Caches:
+
+    semantic_cache:<art>:<parameter>:band:<n>:<hash>  Set mit Eintrags-IDs je LSH-Band
+    semantic_cache:<art>:<parameter>:entry:<id>       Hash mit Signatur und Cache-Schlüssel
+
+Kandidaten kommen nur aus demselben Parameter-Namensraum (Modell, Sprache,
+Anzahl, ...). Ein Treffer zählt erst, wenn die geschätzte Jaccard-Ähnlichkeit
+der Signaturen SEMANTIC_CACHE_THRESHOLD erreicht.
+"""
+import hashlib
+import json
+import logging
+import os
+from collections import Counter
+from typing import Any, Dict, Optional
+
+from utils.document_signature import band_hashes, document_signature
+from utils.minhash import estimated_similarity
+
+from .client import get_redis_client
+
+logger = logging.getLogger(__name__)
+
+SEMANTIC_CACHE_ENABLED = os.environ.get('SEMANTIC_CACHE_ENABLED', 'true').lower() == 'true'
+# Ab dieser geschätzten Jaccard-Ähnlichkeit der Wort-Shingles wird eine Antwort wiederverwendet
+SEMANTIC_CACHE_THRESHOLD = float(os.environ.get('SEMANTIC_CACHE_THRESHOLD', 0.8))
+SEMANTIC_CACHE_TTL = int(os.environ.get('SEMANTIC_CACHE_TTL', 86400 * 7))
+# Obergrenze geprüfter Kandidaten pro Abfrage
+SEMANTIC_CACHE_MAX_CANDIDATES = 20
+# Redis-Hash mit Zählern (hits, misses, stored)
+SEMANTIC_CACHE_STATS_KEY = 'stats:semantic_cache'
+
+
+def _namespace(kind: str, params: Dict[str, Any]) -> str:
+    digest = hashlib.sha256(json.dumps(params, sort_keys=True, default=str).encode('utf-8')).hexdigest()[:16]
+    return f"semantic_cache:{kind}:{digest}"
+
+
+def _incr_stat(client, field):
+    try:
+        client.hincrby(SEMANTIC_CACHE_STATS_KEY, field, 1)
+    except Exception as e:
+        logger.debug("Semantic-Cache-Zähler %s konnte nicht erhöht werden: %s", field, e)
+
+
+def lookup_semantic_cache(kind: str, content: str, params: Dict[str, Any],
+                          threshold: Optional[float] = None) -> Optional[str]:
+    """
+    Sucht eine gecachte Antwort für einen ähnlichen Text mit denselben Parametern.
+
+    Args:
+        kind: Art der Anfrage ('flashcards', 'questions', 'topics')
+        content: Dokumenttext der Anfrage
+        params: Parameter, die übereinstimmen müssen (Modell, Sprache, Anzahl, ...)
+        threshold: Mindestähnlichkeit (Standard: SEMANTIC_CACHE_THRESHOLD)
+
+    Returns:
+        str: Die gecachte Antwort oder None
+    """
+    if not SEMANTIC_CACHE_ENABLED:
+        return None
+    client = get_redis_client()
+    if not client:
+        return None
+    threshold = SEMANTIC_CACHE_THRESHOLD if threshold is None else threshold
+    try:
+        signature = document_signature(content)
+        if signature is None:
+            return None
+        namespace = _namespace(kind, params)
+        pipe = client.pipeline(transaction=False)
+        for band, band_hash in enumerate(band_hashes(signature)):
+            pipe.smembers(f"{namespace}:band:{band}:{band_hash}")
+        band_matches = Counter()
+        for members in pipe.execute():
+            band_matches.update(members or ())
+        if not band_matches:
+            _incr_stat(client, 'misses')
+            return None
+
+        # Kandidaten mit den meisten gemeinsamen Bändern zuerst
+        candidates = [entry_id for entry_id, _ in band_matches.most_common(SEMANTIC_CACHE_MAX_CANDIDATES)]
+        pipe = client.pipeline(transaction=False)
+        for entry_id in candidates:
+            pipe.hgetall(f"{namespace}:entry:{entry_id}")
+        matches = []
+        for entry in pipe.execute():
+            if not entry or 'signature' not in entry:
+                continue
+            stored = tuple(int(value) for value in entry['signature'].split(','))
+            similarity = estimated_similarity(signature, stored)
+            if similarity >= threshold:
+                matches.append((similarity, entry['cache_key']))
+
+        for similarity, cache_key in sorted(matches, reverse=True):
+            cached = client.get(cache_key)
+            if cached is None:
+                # Regulärer Eintrag bereits abgelaufen
+                continue
+            _incr_stat(client, 'hits')
+            logger.info(f"[SEMANTIC-CACHE] Treffer für {kind} (Ähnlichkeit {similarity:.2f}, Key: {cache_key})")
+            return cached.decode('utf-8') if isinstance(cached, bytes) else cached
+        _incr_stat(client, 'misses')
+        return None
+    except Exception as e:
+        logger.warning(f"[SEMANTIC-CACHE] Fehler bei der Abfrage ({kind}): {e}")
+        return None
+
+
+def store_semantic_cache(kind: str, content: str, params: Dict[str, Any], cache_key: str,
+                         ttl: int = SEMANTIC_CACHE_TTL):
+    """
+    Indiziert einen Text, dessen Antwort unter cache_key im regulären Cache liegt.
+
+    Args:
+        kind: Art der Anfrage
+        content: Dokumenttext der Anfrage
+        params: Parameter der Anfrage (wie bei lookup_semantic_cache)
+        cache_key: Schlüssel der Antwort im regulären Cache
+        ttl: Lebensdauer der Index-Einträge in Sekunden
+    """
+    if not SEMANTIC_CACHE_ENABLED:
+        return
+    client = get_redis_client()
+    if not client:
+        return
+    try:
+        signature = document_signature(content)
+        if signature is None:
+            return
+        namespace = _namespace(kind, params)
+        entry_id = cache_key.rsplit(':', 1)[-1]
+        pipe = client.pipeline(transaction=False)
+        pipe.hset(f"{namespace}:entry:{entry_id}",
+                  mapping={'signature': ','.join(map(str, signature)), 'cache_key': cache_key})
+        pipe.expire(f"{namespace}:entry:{entry_id}", ttl)
+        for band, band_hash in enumerate(band_hashes(signature)):
+            band_key = f"{namespace}:band:{band}:{band_hash}"
+            pipe.sadd(band_key, entry_id)
+            pipe.expire(band_key, ttl)
+        pipe.hincrby(SEMANTIC_CACHE_STATS_KEY, 'stored', 1)
+        pipe.execute()
+    except Exception as e:
+        logger.warning(f"[SEMANTIC-CACHE] Eintrag konnte nicht gespeichert werden ({kind}): {e}")
+
+
+def get_semantic_cache_stats() -> Dict[str, int]:
+    """
+    Gibt die Zähler des semantischen Caches zurück.
+
+    Returns:
+        dict: {'hits': ..., 'misses': ..., 'stored': ...}
+    """
+    stats = {'hits': 0, 'misses': 0, 'stored': 0}
+    client = get_redis_client()
+    if not client:
+        return stats
+    try:
+        raw = client.hgetall(SEMANTIC_CACHE_STATS_KEY) or {}
+    except Exception as e:
+        logger.debug("Semantic-Cache-Zähler konnten nicht gelesen werden: %s", e)
+        return stats
+    for field, value in raw.items():
+        field = field.decode('utf-8') if isinstance(field, bytes) else field
+        stats[field] = int(value)
+    return stats
@@ -0,0 +1,67 @@
+"""
+Session-Events für Teilergebnisse.
+Veröffentlicht Zwischenergebnisse (z.B. einzelne Lernkarten) an eine Session,
+damit das Frontend sie anzeigen kann, bevor der Task abgeschlossen ist.
+"""
+import json
+import logging
+import time
+
+from .client import get_redis_client
+
+logger = logging.getLogger(__name__)
+
+# Lebensdauer der gepufferten Teilergebnisse (Sekunden)
+SESSION_EVENTS_TTL = 3600
+
+
+def session_events_channel(session_id):
+    """Pub/Sub-Kanal für Live-Events einer Session."""
+    return f"session_events:{session_id}"
+
+
+def partial_results_key(session_id):
+    """Redis-Liste mit allen bisher veröffentlichten Teilergebnissen einer Session."""
+    return f"partial_results:{session_id}"
+
+
+def publish_session_event(session_id, event_type, payload):
+    """
+    Veröffentlicht ein Event an eine Session.
+
+    Das Event wird per Pub/Sub an aktive Zuhörer gesendet und zusätzlich in einer
+    Liste gepuffert, damit pollende Clients verpasste Events nachladen können.
+
+    Args:
+        session_id: ID der Session
+        event_type: Art des Events (z.B. 'flashcard')
+        payload: JSON-serialisierbare Nutzdaten
+
+    Returns:
+        bool: True, wenn das Event veröffentlicht wurde
+    """
+    if not session_id:
+        return False
+
+    client = get_redis_client()
+    if not client:
+        logger.warning("Redis-Client nicht verfügbar, Session-Event wird verworfen")
+        return False
+
+    message = json.dumps({
+        'type': event_type,
+        'session_id': session_id,
+        'data': payload,
+        'timestamp': time.time()
+    })
+
+    try:
+        pipe = client.pipeline()
+        pipe.rpush(partial_results_key(session_id), message)
+        pipe.expire(partial_results_key(session_id), SESSION_EVENTS_TTL)
+        pipe.publish(session_events_channel(session_id), message)
+        pipe.execute()
+        return True
+    except Exception as e:
+        logger.warning("Fehler beim Veröffentlichen des Session-Events (%s): %s", event_type, e)
+        return False
@@ -0,0 +1,172 @@
+"""
+Single-Flight für identische LLM-Anfragen.
+
+Verpassen mehrere Worker gleichzeitig denselben Cache-Eintrag (z.B. zwei Nutzer
+laden dasselbe PDF hoch), berechnet nur der erste die Antwort. Die anderen warten
+auf eine Pub/Sub-Benachrichtigung (mit kurzem Polling als Absicherung) und lesen
+anschließend die gecachte Antwort. Nach Ablauf des Timeouts rechnen sie selbst.
+"""
+import logging
+import os
+import time
+import uuid
+from typing import Dict, Optional
+
+from .client import get_redis_client
+
+logger = logging.getLogger(__name__)
+
+# Maximale Haltedauer des Locks (Sekunden), falls der berechnende Worker abstürzt
+SINGLE_FLIGHT_LOCK_TTL = int(os.environ.get('SINGLE_FLIGHT_LOCK_TTL', 180))
+# Maximale Wartezeit der übrigen Worker (Sekunden), danach rechnen sie selbst
+SINGLE_FLIGHT_WAIT_TIMEOUT = float(os.environ.get('SINGLE_FLIGHT_WAIT_TIMEOUT', 120))
+# Intervall, in dem wartende Worker zusätzlich Cache und Lock prüfen (Sekunden)
+SINGLE_FLIGHT_POLL_INTERVAL = 0.5
+# Redis-Hash mit Zählern (coalesced, timeouts, leader)
+SINGLE_FLIGHT_STATS_KEY = 'stats:single_flight'
+
+# Löscht den Lock nur, wenn er noch dem eigenen Token gehört
+_RELEASE_SCRIPT = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('del', KEYS[1])
+end
+return 0
+"""
+
+
+def single_flight_lock_key(cache_key):
+    """Redis-Schlüssel des Locks für einen Cache-Schlüssel."""
+    return f"lock:{cache_key}"
+
+
+def single_flight_channel(cache_key):
+    """Pub/Sub-Kanal, auf dem das Ende der Berechnung gemeldet wird."""
+    return f"single_flight:{cache_key}"
+
+
+def _incr_stat(client, field):
+    try:
+        client.hincrby(SINGLE_FLIGHT_STATS_KEY, field, 1)
+    except Exception as e:
+        logger.debug("Single-Flight-Zähler %s konnte nicht erhöht werden: %s", field, e)
+
+
+def acquire_single_flight(cache_key):
+    """
+    Versucht, die Berechnung für einen Cache-Schlüssel zu übernehmen.
+
+    Args:
+        cache_key: Cache-Schlüssel der Anfrage
+
+    Returns:
+        str: Lock-Token, wenn dieser Worker rechnen soll
+        None: Wenn bereits ein anderer Worker rechnet
+        '': Wenn Redis nicht verfügbar ist (ohne Koordination rechnen)
+    """
+    client = get_redis_client()
+    if not client:
+        return ''
+    token = uuid.uuid4().hex
+    try:
+        if client.set(single_flight_lock_key(cache_key), token, nx=True, ex=SINGLE_FLIGHT_LOCK_TTL):
+            _incr_stat(client, 'leader')
+            return token
+        return None
+    except Exception as e:
+        logger.warning("Single-Flight-Lock für %s nicht verfügbar: %s", cache_key, e)
+        return ''
+
+
+def release_single_flight(cache_key, token):
+    """
+    Gibt den Lock frei und benachrichtigt wartende Worker.
+
+    Args:
+        cache_key: Cache-Schlüssel der Anfrage
+        token: Token aus acquire_single_flight
+    """
+    if not token:
+        return
+    client = get_redis_client()
+    if not client:
+        return
+    try:
+        client.eval(_RELEASE_SCRIPT, 1, single_flight_lock_key(cache_key), token)
+        client.publish(single_flight_channel(cache_key), 'done')
+    except Exception as e:
+        logger.warning("Single-Flight-Lock für %s konnte nicht freigegeben werden: %s", cache_key, e)
+
+
+def wait_for_single_flight(cache_key, timeout=None):
+    """
+    Wartet, bis ein anderer Worker die Antwort berechnet hat, und liest sie aus dem Cache.
+
+    Args:
+        cache_key: Cache-Schlüssel der Anfrage
+        timeout: Maximale Wartezeit in Sekunden (Standard: SINGLE_FLIGHT_WAIT_TIMEOUT)
+
+    Returns:
+        str: Die gecachte Antwort
+        None: Bei Timeout oder wenn der andere Worker kein Ergebnis gespeichert hat
+    """
+    client = get_redis_client()
+    if not client:
+        return None
+    timeout = SINGLE_FLIGHT_WAIT_TIMEOUT if timeout is None else timeout
+    deadline = time.monotonic() + timeout
+    pubsub = client.pubsub(ignore_subscribe_messages=True)
+
+    def read_cache():
+        value = client.get(cache_key)
+        if value is not None and isinstance(value, bytes):
+            value = value.decode('utf-8')
+        return value
+
+    try:
+        # Erst abonnieren, dann prüfen: so geht keine Benachrichtigung verloren
+        pubsub.subscribe(single_flight_channel(cache_key))
+        while time.monotonic() < deadline:
+            cached = read_cache()
+            if cached is not None:
+                _incr_stat(client, 'coalesced')
+                logger.info(f"[SINGLE-FLIGHT] Antwort eines anderen Workers übernommen (Key: {cache_key})")
+                return cached
+            if not client.exists(single_flight_lock_key(cache_key)):
+                # Lock frei, aber kein Cache-Eintrag: der andere Worker ist fehlgeschlagen
+                logger.info(f"[SINGLE-FLIGHT] Berechnung des anderen Workers ohne Ergebnis beendet (Key: {cache_key})")
+                return None
+            pubsub.get_message(timeout=SINGLE_FLIGHT_POLL_INTERVAL)
+
+        _incr_stat(client, 'timeouts')
+        logger.warning(f"[SINGLE-FLIGHT] Timeout nach {timeout}s, berechne selbst (Key: {cache_key})")
+        return None
+    except Exception as e:
+        logger.warning("Fehler beim Warten auf Single-Flight-Ergebnis (%s): %s", cache_key, e)
+        return None
+    finally:
+        try:
+            pubsub.close()
+        except Exception:
+            pass
+
+
+def get_single_flight_stats() -> Dict[str, int]:
+    """
+    Gibt die Single-Flight-Zähler zurück.
+
+    Returns:
+        dict: {'leader': ..., 'coalesced': ..., 'timeouts': ...}
+    """
+    stats = {'leader': 0, 'coalesced': 0, 'timeouts': 0}
+    client = get_redis_client()
+    if not client:
+        return stats
+    try:
+        raw = client.hgetall(SINGLE_FLIGHT_STATS_KEY) or {}
+    except Exception as e:
+        logger.debug("Single-Flight-Zähler konnten nicht gelesen werden: %s", e)
+        return stats
+    for field, value in raw.items():
+        field = field.decode('utf-8') if isinstance(field, bytes) else field
+        stats[field] = int(value)
+    return stats
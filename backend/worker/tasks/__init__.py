@@ -50,6 +50,28 @@ def register_tasks(celery_app):
         logger.error(f"Fehler beim Importieren/Registrieren der Maintenance-Tasks: {e}")
     except Exception as e:
         logger.error(f"Unerwarteter Fehler beim Registrieren der Maintenance-Tasks: {e}")
+
+    # Importiere und registriere Batch-Tasks
+    try:
+        from .batch_tasks import register_tasks as register_batch_tasks
+        batch_tasks_dict = register_batch_tasks(celery_app)
+        all_registered_tasks.update(batch_tasks_dict)
+        logger.info(f"Batch-Tasks erfolgreich registriert: {list(batch_tasks_dict.keys())}")
+    except ImportError as e:
+        logger.error(f"Fehler beim Importieren/Registrieren der Batch-Tasks: {e}")
+    except Exception as e:
+        logger.error(f"Unerwarteter Fehler beim Registrieren der Batch-Tasks: {e}")
+
+    # Importiere und registriere Tasks der Vorab-Generierung
+    try:
+        from .speculative_tasks import register_tasks as register_speculative_tasks
+        speculative_tasks_dict = register_speculative_tasks(celery_app)
+        all_registered_tasks.update(speculative_tasks_dict)
+        logger.info(f"Speculative-Tasks erfolgreich registriert: {list(speculative_tasks_dict.keys())}")
+    except ImportError as e:
+        logger.error(f"Fehler beim Importieren/Registrieren der Speculative-Tasks: {e}")
+    except Exception as e:
+        logger.error(f"Unerwarteter Fehler beim Registrieren der Speculative-Tasks: {e}")
             
     # --- Die redundante Definition von document.process_upload wird entfernt --- 
     # @celery_app.task(name='document.process_upload', bind=True, max_retries=3)
@@ -12,29 +12,47 @@ from datetime import datetime
 from typing import Dict, List, Optional, Any
 import re
 
+from sqlalchemy.exc import IntegrityError
+
 # Logger definieren
 logger = logging.getLogger(__name__)
 
 # Import der modularen Funktionen - diese kommen jetzt aus den Modulen
-from .flashcards.generation import generate_flashcards_with_openai
-from .questions.generation import generate_questions_with_openai
-from .topics.generation import extract_topics_with_openai
-from utils.call_openai import call_openai_api
+from .flashcards.generation import build_flashcards_request, generate_flashcards_with_openai
+from .questions.generation import build_questions_request, generate_questions_with_openai
+from .topics.generation import build_topics_request, extract_topics_with_openai
+from utils.call_openai import OpenAIRetryableError, call_openai_api
 
 # Import der Datenbankmodelle
-from .models import Upload, UploadedFile, Flashcard, Question, Topic, get_db_session, User
-
-# Import der Datenbankanbindung
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker
+from .models import Upload, UploadedFile, Flashcard, Question, Topic, get_db_session, session_scope, User
+from .ledger import run_idempotent, ledger_row_id, insert_ignore_existing
+from .generation_state import GENERATION_TYPES, plan_regeneration, prompt_hash, track_generation
+from .pipeline import section_file_id
+from .micro_batch import (MICRO_BATCH_MAX_DOCUMENTS, MICRO_BATCH_WINDOW_SECONDS, enqueue_micro_batch,
+                          is_micro_batch_candidate, micro_batch_group_key, pop_micro_batch, run_micro_batch)
 
 # Importiere die Token-Tracking-Funktion aus dem Worker-Utils
 from utils.token_tracking import update_token_usage
+from utils.model_cascade import run_model_cascade, cascade_usage_metadata
+from utils.validation import (validate_flashcard_data, validate_generated_flashcards,
+                              validate_generated_questions, validate_generated_topics)
+from config.model_routing import get_model_route
+from config.queues import TIER_MORE, with_tier
+from redis_utils.session_events import publish_session_event
+from utils.merged_context import build_merged_context
+from utils.near_duplicates import NearDuplicateIndex, filter_near_duplicates, flashcard_text, question_text
+from utils.retry_policy import retry_generation
+from utils.token_counter import count_tokens
 
 # OpenAI API-Konfiguration
 DEFAULT_MODEL = os.environ.get('OPENAI_DEFAULT_MODEL', 'gpt-3.5-turbo')
+# Lernkarten gestreamt generieren und einzeln speichern/veröffentlichen
+FLASHCARDS_STREAMING = os.environ.get('FLASHCARDS_STREAMING', 'true').lower() == 'true'
 
-from celery import group, current_app as celery_app # Import group
+# Präfix der Pseudo-Datei-ID bei Upload-weiter (zusammengeführter) Generierung
+MERGED_SOURCE_PREFIX = 'merged:'
+
+from celery import chord, group, current_app as celery_app
 
 def register_tasks(celery_app):
     """
@@ -71,16 +89,11 @@ def register_tasks(celery_app):
         # Verbinde die Datenbank, um session_id zu erhalten, falls nicht übergeben
         if not session_id:
             try:
-                engine = create_engine(os.environ.get('SQLALCHEMY_DATABASE_URI'))
-                Session = sessionmaker(bind=engine)
-                db_session = Session()
-                
-                upload = db_session.query(Upload).get(upload_id)
-                if upload and hasattr(upload, 'session_id'):
-                    session_id = upload.session_id
-                    logger.info(f"Session-ID aus Datenbank extrahiert: {session_id}")
-                
-                db_session.close()
+                with session_scope() as db_session:
+                    upload = db_session.query(Upload).get(upload_id)
+                    if upload and hasattr(upload, 'session_id'):
+                        session_id = upload.session_id
+                        logger.info(f"Session-ID aus Datenbank extrahiert: {session_id}")
             except Exception as e:
                 logger.warning(f"Fehler beim Abrufen der session_id aus der Datenbank: {e}")
         
@@ -112,7 +125,7 @@ def register_tasks(celery_app):
             question_type=question_type,
             max_topics=max_topics,
             options=options
-        ))
+        )
     
     tasks['ai.process_upload'] = process_upload
 
@@ -148,8 +161,15 @@ def register_tasks(celery_app):
             # Stelle sicher, dass user_id hier auch drin ist!
             # 'user_id': options.get('user_id') # Wichtig für Token Tracking
         })
-        # Rufe die SYNCHRONE interne Task-Funktion auf (ohne asyncio.run)
-        return _generate_flashcards_task(uploaded_file_id, upload_id, session_id, internal_options)
+        # Rufe die SYNCHRONE interne Task-Funktion auf (ohne asyncio.run); bei Neuzustellung aus dem Ledger
+        try:
+            extracted_text = _load_for_ledger('flashcards', uploaded_file_id, internal_options)
+            return track_generation(self, 'flashcards', uploaded_file_id, upload_id, internal_options, lambda: run_idempotent(
+                self, 'flashcards', uploaded_file_id, upload_id, internal_options,
+                lambda opts: _generate_flashcards_task(uploaded_file_id, upload_id, session_id, opts, extracted_text)))
+        except OpenAIRetryableError as e:
+            # Neu einplanen statt im Worker-Slot zu warten
+            return retry_generation(self, e, 'flashcards', uploaded_file_id, upload_id)
 
     tasks['ai.generate_flashcards'] = generate_flashcards
 
@@ -182,8 +202,15 @@ def register_tasks(celery_app):
             'task_id': self.request.id or str(uuid.uuid4()),
             'timestamp': str(time.time())
         })
-        # SYNCHRONER Aufruf
-        return _generate_questions_task(uploaded_file_id, upload_id, session_id, internal_options)
+        # SYNCHRONER Aufruf; bei Neuzustellung aus dem Ledger
+        try:
+            extracted_text = _load_for_ledger('questions', uploaded_file_id, internal_options)
+            return track_generation(self, 'questions', uploaded_file_id, upload_id, internal_options, lambda: run_idempotent(
+                self, 'questions', uploaded_file_id, upload_id, internal_options,
+                lambda opts: _generate_questions_task(uploaded_file_id, upload_id, session_id, opts, extracted_text)))
+        except OpenAIRetryableError as e:
+            # Neu einplanen statt im Worker-Slot zu warten
+            return retry_generation(self, e, 'questions', uploaded_file_id, upload_id)
 
     tasks['ai.generate_questions'] = generate_questions
 
@@ -214,8 +241,15 @@ def register_tasks(celery_app):
             'task_id': self.request.id or str(uuid.uuid4()),
             'timestamp': str(time.time())
         })
-        # SYNCHRONER Aufruf
-        return _extract_topics_task(uploaded_file_id, upload_id, session_id, internal_options)
+        # SYNCHRONER Aufruf; bei Neuzustellung aus dem Ledger
+        try:
+            extracted_text = _load_for_ledger('topics', uploaded_file_id, internal_options)
+            return track_generation(self, 'topics', uploaded_file_id, upload_id, internal_options, lambda: run_idempotent(
+                self, 'topics', uploaded_file_id, upload_id, internal_options,
+                lambda opts: _extract_topics_task(uploaded_file_id, upload_id, session_id, opts, extracted_text)))
+        except OpenAIRetryableError as e:
+            # Neu einplanen statt im Worker-Slot zu warten
+            return retry_generation(self, e, 'topics', uploaded_file_id, upload_id)
 
     tasks['ai.extract_topics'] = extract_topics
 
@@ -239,27 +273,18 @@ def register_tasks(celery_app):
         
         # Suche nach Upload-ID für die Session-ID
         upload_id = None
-        db_session = None
         
         try:
-            # Datenbankverbindung herstellen
-            engine = create_engine(os.environ.get('SQLALCHEMY_DATABASE_URI'))
-            Session = sessionmaker(bind=engine)
-            db_session = Session()
-            
             # Upload anhand der Session-ID finden
-            upload = db_session.query(Upload).filter_by(session_id=session_id).first()
-            if upload:
-                upload_id = upload.id
-                logger.info(f"Upload-ID aus Datenbank für Session {session_id} gefunden: {upload_id}")
-            else:
-                logger.warning(f"Kein Upload für Session-ID {session_id} gefunden")
-            
-            db_session.close()
+            with session_scope() as db_session:
+                upload = db_session.query(Upload).filter_by(session_id=session_id).first()
+                if upload:
+                    upload_id = upload.id
+                    logger.info(f"Upload-ID aus Datenbank für Session {session_id} gefunden: {upload_id}")
+                else:
+                    logger.warning(f"Kein Upload für Session-ID {session_id} gefunden")
         except Exception as e:
             logger.error(f"Fehler beim Abrufen der Upload-ID: {e}")
-            if db_session:
-                db_session.close()
         
         # Interne Implementation mit dem neuen Format aufrufen
         if upload_id:
@@ -275,28 +300,32 @@ def register_tasks(celery_app):
     
     tasks['ai.assistant_analysis'] = assistant_analysis
     
-    # NEUER TRIGGER TASK
-    @celery_app.task(name='ai.trigger_analysis_tasks', bind=True, max_retries=2)
-    def trigger_analysis_tasks(self, uploaded_file_id: str, upload_id: str, user_id: Optional[str], session_id: str, language: str, task_metadata: Optional[Dict] = None):
-        """
-        Startet die parallelen AI-Analyse-Tasks für eine einzelne Datei.
-        Wird vom document.process_document Task aufgerufen.
-        """
-        logger.info(f"[TRIGGER AI] Starte AI Task Gruppe für UploadedFile: {uploaded_file_id} (Upload: {upload_id})" )
-        task_metadata = task_metadata or {} # Stelle sicher, dass Metadaten existieren
-        options = { # Optionen für die AI-Tasks zusammenstellen
+    def _analysis_options(user_id, session_id, language, task_metadata):
+        """Stellt die Optionen für die AI-Tasks aus den Task-Metadaten zusammen."""
+        return {
             'user_id': user_id,
             'session_id': session_id,
             'language': language,
-            'model': task_metadata.get('model', DEFAULT_MODEL),
+            # Ohne explizites Modell entscheidet das Routing pro Task-Typ (config/model_routing.py)
+            'model': task_metadata.get('model'),
             # Spezifische Optionen für jeden Task-Typ
             'num_cards': task_metadata.get('num_flashcards', 5),
             'num_questions': task_metadata.get('num_questions', 3),
             'question_type': task_metadata.get('question_type', 'multiple_choice'),
-            'max_topics': task_metadata.get('max_topics', 8)
+            'max_topics': task_metadata.get('max_topics', 8),
+            # Stufe für Queue und Priorität ('interactive', 'more', 'bulk'; config/queues.py)
+            'tier': task_metadata.get('tier')
             # Füge hier ggf. weitere Optionen hinzu
         }
-        
+
+    def _analysis_signatures(uploaded_file_id, upload_id, language, options, task_types=GENERATION_TYPES,
+                             precomputed=None):
+        """
+        Baut die Signaturen der AI-Tasks (Lernkarten, Fragen, Themen bzw. task_types) für eine Quelle.
+
+        precomputed: {task_type: {'response_content', 'usage', 'usage_metadata'}} aus einer
+        gepackten Anfrage (tasks/micro_batch.py); der Task verarbeitet dann diese Antwort.
+        """
         # Argumente für alle Tasks
         common_args = {
             'uploaded_file_id': uploaded_file_id,
@@ -304,59 +333,501 @@ def register_tasks(celery_app):
             'language': language,
             'options': options # Übergebe alle Optionen gebündelt
         }
-
-        tasks_to_run_signatures = []
+        signatures = []
 
         # Flashcards Signatur
-        try: # Fange Fehler ab, falls Task nicht registriert ist
-             flashcard_kwargs = common_args.copy()
-             flashcard_kwargs['num_cards'] = options['num_cards']
-             tasks_to_run_signatures.append(celery_app.signature('ai.generate_flashcards', kwargs=flashcard_kwargs))
-             logger.debug("[TRIGGER AI] Signatur für Flashcards hinzugefügt.")
-        except KeyError:
-             logger.warning("Task 'ai.generate_flashcards' nicht gefunden/registriert.")
+        if 'flashcards' in task_types:
+            try: # Fange Fehler ab, falls Task nicht registriert ist
+                 flashcard_kwargs = common_args.copy()
+                 if precomputed and precomputed.get('flashcards'):
+                     flashcard_kwargs['options'] = dict(options, **precomputed['flashcards'])
+                 flashcard_kwargs['num_cards'] = options['num_cards']
+                 signatures.append(with_tier(celery_app.signature('ai.generate_flashcards', kwargs=flashcard_kwargs), options.get('tier')))
+                 logger.debug("[TRIGGER AI] Signatur für Flashcards hinzugefügt.")
+            except KeyError:
+                 logger.warning("Task 'ai.generate_flashcards' nicht gefunden/registriert.")
 
         # Questions Signatur
-        try:
-             question_kwargs = common_args.copy()
-             question_kwargs['num_questions'] = options['num_questions']
-             question_kwargs['question_type'] = options['question_type']
-             tasks_to_run_signatures.append(celery_app.signature('ai.generate_questions', kwargs=question_kwargs))
-             logger.debug("[TRIGGER AI] Signatur für Questions hinzugefügt.")
-        except KeyError:
-             logger.warning("Task 'ai.generate_questions' nicht gefunden/registriert.")
+        if 'questions' in task_types:
+            try:
+                 question_kwargs = common_args.copy()
+                 if precomputed and precomputed.get('questions'):
+                     question_kwargs['options'] = dict(options, **precomputed['questions'])
+                 question_kwargs['num_questions'] = options['num_questions']
+                 question_kwargs['question_type'] = options['question_type']
+                 signatures.append(with_tier(celery_app.signature('ai.generate_questions', kwargs=question_kwargs), options.get('tier')))
+                 logger.debug("[TRIGGER AI] Signatur für Questions hinzugefügt.")
+            except KeyError:
+                 logger.warning("Task 'ai.generate_questions' nicht gefunden/registriert.")
 
         # Topics Signatur
+        if 'topics' in task_types:
+            try:
+                 topic_kwargs = common_args.copy()
+                 if precomputed and precomputed.get('topics'):
+                     topic_kwargs['options'] = dict(options, **precomputed['topics'])
+                 topic_kwargs['max_topics'] = options['max_topics']
+                 signatures.append(with_tier(celery_app.signature('ai.extract_topics', kwargs=topic_kwargs), options.get('tier')))
+                 logger.debug("[TRIGGER AI] Signatur für Topics hinzugefügt.")
+            except KeyError:
+                 logger.warning("Task 'ai.extract_topics' nicht gefunden/registriert.")
+
+        return signatures
+
+    def _start_chord(signatures, finalize_kwargs, tier=None, callback='document.finalize_file'):
+        """
+        Startet die AI-Tasks als Chord; der Callback schließt die Datei(en) genau einmal ab.
+
+        callback: Name des Abschluss-Tasks; bei Fehlern läuft '<callback>_error'.
+        """
+        finalize = with_tier(celery_app.signature(callback, kwargs=finalize_kwargs), tier)
+        finalize.on_error(with_tier(celery_app.signature(f'{callback}_error', kwargs=finalize_kwargs), tier))
+        return chord(signatures)(finalize)
+
+    def _collect_for_micro_batch(uploaded_file_id, upload_id, language, options):
+        """
+        Legt ein kleines Dokument in die Sammelliste seiner Parametergruppe.
+
+        Das erste Dokument einer Gruppe plant ai.flush_micro_batch nach Ablauf des
+        Sammelfensters ein, eine volle Sammlung sofort.
+
+        Returns:
+            bool: True, wenn das Dokument gesammelt wurde (sonst sofort generieren)
+        """
         try:
-             topic_kwargs = common_args.copy()
-             topic_kwargs['max_topics'] = options['max_topics']
-             tasks_to_run_signatures.append(celery_app.signature('ai.extract_topics', kwargs=topic_kwargs))
-             logger.debug("[TRIGGER AI] Signatur für Topics hinzugefügt.")
-        except KeyError:
-             logger.warning("Task 'ai.extract_topics' nicht gefunden/registriert.")
+            text = load_extracted_text(uploaded_file_id, log_prefix='MICRO BATCH')
+        except ValueError:
+            return False
+        if not is_micro_batch_candidate(text, options):
+            return False
+        group_key = micro_batch_group_key(options)
+        queued = enqueue_micro_batch(group_key, {'uploaded_file_id': uploaded_file_id, 'upload_id': upload_id,
+                                                 'language': language, 'options': options})
+        if queued is None:
+            return False
+        size, opened = queued
+        flush = with_tier(celery_app.signature('ai.flush_micro_batch', args=[group_key]), options.get('tier'))
+        if size >= MICRO_BATCH_MAX_DOCUMENTS:
+            flush.apply_async()
+        elif opened:
+            flush.apply_async(countdown=MICRO_BATCH_WINDOW_SECONDS)
+        logger.info(f"[MICRO BATCH] {uploaded_file_id} gesammelt (Gruppe {group_key[:8]}, {size} Dokument(e))")
+        return True
+
+    # NEUER TRIGGER TASK
+    @celery_app.task(name='ai.trigger_analysis_tasks', bind=True, max_retries=2)
+    def trigger_analysis_tasks(self, uploaded_file_id: str, upload_id: str, user_id: Optional[str], session_id: str, language: str, task_metadata: Optional[Dict] = None):
+        """
+        Startet die parallelen AI-Analyse-Tasks für eine einzelne Datei.
+        Wird vom document.process_document Task aufgerufen.
+        """
+        logger.info(f"[TRIGGER AI] Starte AI Task Gruppe für UploadedFile: {uploaded_file_id} (Upload: {upload_id})" )
+        task_metadata = task_metadata or {} # Stelle sicher, dass Metadaten existieren
+        options = _analysis_options(user_id, session_id, language, task_metadata)
+
+        # Nicht-interaktive Massengenerierung (z.B. Neugenerierung eines Kurses) über die Batch-API
+        if task_metadata.get('execution_mode') == 'batch':
+            items = [
+                {'task_type': task_type, 'uploaded_file_id': uploaded_file_id, 'upload_id': upload_id, 'options': options}
+                for task_type in ('flashcards', 'questions', 'topics')
+            ]
+            batch_result = celery_app.signature('batch.submit_generation', kwargs={'items': items}).apply_async()
+            logger.info(f"[TRIGGER AI] Batch-Auftrag für {uploaded_file_id} angestoßen. Task ID: {batch_result.id}")
+            return {'status': 'batch_submitted', 'group_id': None, 'batch_task_id': batch_result.id, 'num_tasks': len(items)}
 
+        # Kleine Dokumente kurz sammeln und gemeinsam in einer Anfrage pro Typ generieren
+        if _collect_for_micro_batch(uploaded_file_id, upload_id, language, options):
+            return {'status': 'micro_batched', 'group_id': None, 'num_tasks': 0}
+
+        tasks_to_run_signatures = _analysis_signatures(uploaded_file_id, upload_id, language, options)
+
+        finalize_kwargs = {'uploaded_file_id': uploaded_file_id, 'upload_id': upload_id}
         if tasks_to_run_signatures:
             try:
-                task_group = group(tasks_to_run_signatures)
-                # Starte die Gruppe asynchron
-                group_result = task_group.apply_async()
-                logger.info(f"[TRIGGER AI] AI Task Gruppe ({len(tasks_to_run_signatures)} Tasks) gestartet für {uploaded_file_id}. Group ID: {group_result.id}")
-                # Optional: group_id im ProcessingTask des document.process_document speichern? Oder separater Tracking-Mechanismus.
-                return {'status': 'success', 'group_id': group_result.id, 'num_tasks': len(tasks_to_run_signatures)}
+                # Chord: Der Callback schließt die Datei genau einmal ab, wenn alle AI-Tasks fertig sind
+                chord_result = _start_chord(tasks_to_run_signatures, finalize_kwargs, options.get('tier'))
+                logger.info(f"[TRIGGER AI] AI Task Chord ({len(tasks_to_run_signatures)} Tasks) gestartet für {uploaded_file_id}. Callback ID: {chord_result.id}")
+                return {'status': 'success', 'group_id': chord_result.id, 'num_tasks': len(tasks_to_run_signatures)}
             except Exception as e:
-                 logger.error(f"[TRIGGER AI] Fehler beim Starten der Gruppe für {uploaded_file_id}: {e}", exc_info=True)
-                 # Optional: Retry?
+                 logger.error(f"[TRIGGER AI] Fehler beim Starten des Chords für {uploaded_file_id}: {e}", exc_info=True)
                  raise self.retry(exc=e)
         else:
             logger.warning(f"[TRIGGER AI] Keine AI-Tasks zum Starten für {uploaded_file_id} gefunden.")
+            celery_app.signature('document.finalize_file', args=[[]], kwargs=finalize_kwargs).apply_async()
             return {'status': 'no_tasks', 'group_id': None, 'num_tasks': 0}
 
     tasks['ai.trigger_analysis_tasks'] = trigger_analysis_tasks
+
+    @celery_app.task(name='ai.flush_micro_batch', bind=True, max_retries=2)
+    def flush_micro_batch(self, group_key: str):
+        """
+        Generiert die gesammelten kleinen Dokumente einer Gruppe gemeinsam.
+
+        Pro Ausgabetyp wird eine gepackte Anfrage gestellt (tasks/micro_batch.py);
+        danach startet für jede Datei der übliche Chord ihrer AI-Tasks, die die
+        anteilige Antwort speichern. Dokumente ohne Ergebnis generieren live.
+
+        Args:
+            group_key: Schlüssel der Parametergruppe (micro_batch_group_key)
+        """
+        entries, remaining = pop_micro_batch(group_key)
+        if remaining:
+            # Mehr als eine volle Sammlung: den Rest sofort im nächsten Flush packen
+            self.apply_async(args=[group_key])
+        if not entries:
+            return {'status': 'empty', 'num_documents': 0}
+
+        documents = []
+        for index, entry in enumerate(entries):
+            entry['document_id'] = f"d{index + 1}"
+            try:
+                documents.append((entry['document_id'], load_extracted_text(entry['uploaded_file_id'], log_prefix='MICRO BATCH')))
+            except ValueError as e:
+                logger.warning(f"[MICRO BATCH] Kein Text für {entry['uploaded_file_id']}, generiere einzeln: {e}")
+
+        precomputed = {}
+        if len(documents) > 1:
+            precomputed = run_micro_batch(documents, entries[0]['options'])
+
+        started = 0
+        for entry in entries:
+            options = entry['options']
+            signatures = _analysis_signatures(entry['uploaded_file_id'], entry['upload_id'], entry['language'], options,
+                                              precomputed=precomputed.get(entry['document_id']))
+            finalize_kwargs = {'uploaded_file_id': entry['uploaded_file_id'], 'upload_id': entry['upload_id']}
+            try:
+                _start_chord(signatures, finalize_kwargs, options.get('tier'))
+                started += 1
+            except Exception as e:
+                logger.error(f"[MICRO BATCH] Chord für {entry['uploaded_file_id']} konnte nicht gestartet werden: {e}", exc_info=True)
+                celery_app.signature('document.finalize_file', args=[[{'status': 'error', 'error': str(e)}]],
+                                     kwargs=finalize_kwargs).apply_async()
+
+        packed = sum(len(types) for types in precomputed.values())
+        logger.info(f"[MICRO BATCH] Gruppe {group_key[:8]}: {len(entries)} Dokumente, {packed} Ergebnisse aus "
+                    f"gepackten Anfragen, {started} Chord(s) gestartet")
+        return {'status': 'success', 'num_documents': len(entries), 'packed_results': packed, 'started': started}
+
+    tasks['ai.flush_micro_batch'] = flush_micro_batch
+
+    @celery_app.task(name='ai.generate_document_section', bind=True, max_retries=2)
+    def generate_document_section(self, uploaded_file_id: str, source_id: str, upload_id: str, user_id: Optional[str],
+                                  session_id: str, language: str, task_metadata: Optional[Dict] = None,
+                                  task_types: Optional[List[str]] = None, counts: Optional[Dict] = None):
+        """
+        Startet die AI-Tasks für einen Teil eines gepipelinten PDFs (tasks/pipeline.py).
+
+        Wird von document.process_document aufgerufen, sobald die Seiten eines
+        Abschnitts extrahiert sind (Lernkarten und Fragen) bzw. nach der
+        Extraktion für den Gesamttext (Themen). Der Chord-Callback
+        document.finalize_pipeline_part schließt die Datei mit dem letzten Teil ab.
+
+        Args:
+            uploaded_file_id: ID der Datei
+            source_id: Quelle des Teils (Abschnitts-ID bzw. Datei-ID für den Gesamttext)
+            upload_id: ID des Uploads
+            user_id: ID des Nutzers (für Token-Tracking)
+            session_id: ID der Session
+            language: Sprache der Materialien
+            task_metadata: Metadaten des ProcessingTask
+            task_types: Ausgabetypen dieses Teils
+            counts: Mengen des Abschnitts ({'num_cards', 'num_questions'})
+        """
+        options = dict(_analysis_options(user_id, session_id, language, task_metadata or {}), **(counts or {}))
+        # Typen ohne Anteil an der Menge (z.B. 0 Fragen für einen kurzen Abschnitt) entfallen
+        count_options = {'flashcards': 'num_cards', 'questions': 'num_questions'}
+        task_types = [task_type for task_type in (task_types or GENERATION_TYPES)
+                      if options.get(count_options.get(task_type), 1) > 0]
+        signatures = _analysis_signatures(source_id, upload_id, language, options, task_types=task_types)
+
+        finalize_kwargs = {'uploaded_file_id': uploaded_file_id, 'upload_id': upload_id, 'part_id': source_id}
+        if not signatures:
+            celery_app.signature('document.finalize_pipeline_part', args=[[]], kwargs=finalize_kwargs).apply_async()
+            return {'status': 'no_tasks', 'source_id': source_id, 'num_tasks': 0}
+        try:
+            chord_result = _start_chord(signatures, finalize_kwargs, options.get('tier'),
+                                        callback='document.finalize_pipeline_part')
+        except Exception as e:
+            logger.error(f"[PIPELINE] Fehler beim Starten des Chords für {source_id}: {e}", exc_info=True)
+            raise self.retry(exc=e)
+        logger.info(f"[PIPELINE] AI-Tasks für {source_id} gestartet ({', '.join(task_types)}). Callback ID: {chord_result.id}")
+        return {'status': 'success', 'source_id': source_id, 'group_id': chord_result.id, 'num_tasks': len(signatures)}
+
+    tasks['ai.generate_document_section'] = generate_document_section
+
+    @celery_app.task(name='ai.generate_upload_materials', bind=True, max_retries=2)
+    def generate_upload_materials(self, upload_id: str, uploaded_file_ids: List[str], user_id: Optional[str], session_id: str, language: str, task_metadata: Optional[Dict] = None):
+        """
+        Upload-weite Generierung: ein gemeinsamer Satz Lernmaterialien für alle Dateien.
+
+        Wird von der letzten extrahierten Datei eines Uploads gestartet. Die Texte
+        werden zu einem Kontext mit Token-Budget zusammengeführt; die gewünschten
+        Mengen (pro Datei wie im Einzelmodus) werden nach Textanteil verteilt.
+
+        Args:
+            upload_id: ID des Uploads
+            uploaded_file_ids: Dateien mit erfolgreich extrahiertem Text
+            user_id: ID des Nutzers (für Token-Tracking)
+            session_id: ID der Session
+            language: Sprache der Materialien
+            task_metadata: Metadaten des ProcessingTask (wie bei ai.trigger_analysis_tasks)
+        """
+        task_metadata = task_metadata or {}
+        finalize_kwargs = {'uploaded_file_id': None, 'upload_id': upload_id, 'uploaded_file_ids': uploaded_file_ids}
+        if not uploaded_file_ids:
+            logger.warning(f"[MERGED] Keine Dateien mit Text für Upload {upload_id}.")
+            return {'status': 'no_tasks', 'upload_id': upload_id, 'num_tasks': 0}
+
+        # Dateinamen in Upload-Reihenfolge laden (eine Abfrage)
+        with session_scope() as db_session:
+            rows = (db_session.query(UploadedFile.id, UploadedFile.file_name)
+                    .filter(UploadedFile.id.in_(uploaded_file_ids))
+                    .order_by(UploadedFile.file_index, UploadedFile.created_at).all())
+
+        files = []
+        for file_id, file_name in rows:
+            try:
+                files.append({'id': file_id, 'name': file_name, 'text': load_extracted_text(file_id, log_prefix='MERGED')})
+            except ValueError as e:
+                logger.error(f"[MERGED] Überspringe Datei {file_id}: {e}")
+
+        options = _analysis_options(user_id, session_id, language, task_metadata)
+        # Gleiche Abdeckung wie im Einzelmodus: Mengen pro Datei × Anzahl der Dateien
+        options['num_cards'] = options['num_cards'] * len(files)
+        options['num_questions'] = options['num_questions'] * len(files)
+        merged_text, distribution = build_merged_context(
+            files, {'Lernkarten': options['num_cards'], 'Fragen': options['num_questions']}
+        )
+        if not merged_text:
+            celery_app.signature('document.finalize_file', args=[[{'status': 'error', 'error': 'no_extracted_text'}]],
+                                 kwargs=finalize_kwargs).apply_async()
+            return {'status': 'no_tasks', 'upload_id': upload_id, 'num_tasks': 0}
+
+        source_id = merged_source_id(upload_id)
+        from redis_utils.client import get_redis_client
+        get_redis_client().set(f"extracted_text:{source_id}", merged_text, ex=86400) # 24h TTL wie beim Einzeltext
+
+        signatures = _analysis_signatures(source_id, upload_id, language, options)
+        try:
+            chord_result = _start_chord(signatures, finalize_kwargs, options.get('tier'))
+        except Exception as e:
+            logger.error(f"[MERGED] Fehler beim Starten des Chords für Upload {upload_id}: {e}", exc_info=True)
+            raise self.retry(exc=e)
+        logger.info(f"[MERGED] Upload-weite Generierung für {upload_id} gestartet ({len(files)} Dateien, "
+                    f"{options['num_cards']} Lernkarten, {options['num_questions']} Fragen). Callback ID: {chord_result.id}")
+        return {'status': 'success', 'upload_id': upload_id, 'group_id': chord_result.id,
+                'num_tasks': len(signatures), 'distribution': distribution}
+
+    tasks['ai.generate_upload_materials'] = generate_upload_materials
+
+    @celery_app.task(name='ai.regenerate_failed', bind=True, max_retries=2)
+    def regenerate_failed(self, upload_id: str, task_types: Optional[List[str]] = None, uploaded_file_id: Optional[str] = None):
+        """
+        Generiert nur die fehlgeschlagenen bzw. fehlenden Ausgabetypen eines Uploads neu.
+
+        Grundlage ist der Stand in `generation_state` (tasks/generation_state.py).
+        Die Tasks laufen mit den gespeicherten Optionen des letzten Laufs; der
+        Text wird aus Redis bzw. der Datenbank geladen, nicht neu extrahiert.
+        Abgeschlossene und laufende Typen werden nicht gestartet.
+
+        Args:
+            upload_id: ID des Uploads
+            task_types: Einschränkung auf bestimmte Typen (Standard: alle)
+            uploaded_file_id: Einschränkung auf eine Quelle (optional)
+        """
+        plan = plan_regeneration(upload_id, task_types, uploaded_file_id)
+        if not plan:
+            logger.info(f"[REGENERATE] Upload {upload_id}: nichts neu zu generieren.")
+            return {'status': 'nothing_to_do', 'upload_id': upload_id, 'num_tasks': 0, 'sources': {}}
+
+        signatures = []
+        for source_id, entry in plan.items():
+            options = dict(entry['options'], tier=TIER_MORE)
+            signatures.extend(_analysis_signatures(source_id, upload_id, options.get('language', 'de'), options,
+                                                   task_types=entry['task_types']))
+        try:
+            group_result = group(signatures).apply_async()
+        except Exception as e:
+            logger.error(f"[REGENERATE] Fehler beim Starten der Neugenerierung für Upload {upload_id}: {e}", exc_info=True)
+            raise self.retry(exc=e)
+        sources = {source_id: entry['task_types'] for source_id, entry in plan.items()}
+        logger.info(f"[REGENERATE] Upload {upload_id}: {len(signatures)} Task(s) neu gestartet: {sources}")
+        return {'status': 'success', 'upload_id': upload_id, 'group_id': group_result.id,
+                'num_tasks': len(signatures), 'sources': sources}
+
+    tasks['ai.regenerate_failed'] = regenerate_failed
     
     return tasks
 
 # Interne Implementierungsfunktionen für die asynchrone Ausführung
 
+def load_extracted_text(uploaded_file_id, log_prefix='AI'):
+    """
+    Lädt den extrahierten Text einer Datei aus Redis, mit Fallback auf die Datenbank.
+
+    Args:
+        uploaded_file_id: ID der hochgeladenen Datei
+        log_prefix: Präfix für Log-Ausgaben (z.B. 'FLASHCARDS')
+
+    Returns:
+        str: Der extrahierte Text
+
+    Raises:
+        ValueError: Wenn weder in Redis noch in der Datenbank Text vorhanden ist
+    """
+    from redis_utils.client import get_redis_client
+    redis_key = f"extracted_text:{uploaded_file_id}"
+    cached_text = get_redis_client().get(redis_key)
+    if cached_text:
+        extracted_text = cached_text.decode('utf-8') if isinstance(cached_text, bytes) else cached_text
+        logger.info(f"[{log_prefix}] Text erfolgreich aus Redis geladen ({len(extracted_text)} Zeichen)")
+        return extracted_text
+
+    error_msg = f"Kein extrahierter Text in Redis gefunden für Key: {redis_key}"
+    logger.warning(f"[{log_prefix}] {error_msg}, versuche Fallback aus DB")
+    try:
+        with session_scope() as db_session:
+            uploaded_file = db_session.query(UploadedFile).get(uploaded_file_id)
+            if uploaded_file and uploaded_file.extracted_text:
+                logger.info(f"[{log_prefix}] Fallback: Text aus DB geladen.")
+                return uploaded_file.extracted_text
+    except Exception as db_err:
+        logger.error(f"[{log_prefix}] Fallback aus DB fehlgeschlagen: {db_err}")
+    raise ValueError(error_msg)
+
+def _generation_request(task_type, extracted_text, options, model):
+    """Chat-Anfrage eines Generierungs-Tasks (Grundlage von prompt_hash)."""
+    language = options.get('language', 'de')
+    if task_type == 'flashcards':
+        return build_flashcards_request(extracted_text, options.get('num_cards', 5), language, model)
+    if task_type == 'questions':
+        return build_questions_request(extracted_text, options.get('num_questions', 3),
+                                       options.get('question_type', 'multiple_choice'), language, model)
+    return build_topics_request(extracted_text, options.get('max_topics', 8), language, model)
+
+def _load_for_ledger(task_type, uploaded_file_id, options):
+    """
+    Lädt den Text eines Generierungs-Tasks und setzt options['prompt_hash'].
+
+    Der Hash geht in den Idempotenzschlüssel ein (tasks/ledger.py): nach einer
+    Änderung von Prompt oder Dokument wird neu generiert statt wiederholt.
+
+    Returns:
+        str|None: Der extrahierte Text; None, wenn er nicht geladen werden konnte
+            (der Task versucht es dann selbst und meldet den Fehler)
+    """
+    try:
+        extracted_text = load_extracted_text(uploaded_file_id, log_prefix=task_type.upper())
+    except Exception as e:
+        logger.warning(f"[LEDGER] Text für {task_type} ({uploaded_file_id}) nicht verfügbar, Schlüssel ohne Prompt-Hash: {e}")
+        return None
+    model = get_model_route(task_type, options)[0]
+    options['prompt_hash'] = prompt_hash(_generation_request(task_type, extracted_text, options, model)['messages'])
+    return extracted_text
+
+def existing_material(db_session, upload_id, task_type):
+    """
+    Bereits gespeicherte Lernkarten bzw. Fragen eines Uploads im Format der Generierung.
+
+    Args:
+        db_session: Offene Datenbank-Session
+        upload_id: ID des Uploads
+        task_type: 'flashcards' oder 'questions'
+
+    Returns:
+        list: [{'question', 'answer'}] bzw. [{'question', 'options', 'correct_answer'}]
+    """
+    if task_type == 'flashcards':
+        rows = db_session.query(Flashcard.question, Flashcard.answer).filter_by(upload_id=upload_id)
+        return [{'question': question, 'answer': answer} for question, answer in rows]
+    rows = db_session.query(Question.text, Question.options, Question.correct_answer).filter_by(upload_id=upload_id)
+    items = []
+    for text, options, correct_answer in rows:
+        if isinstance(options, str):
+            try:
+                options = json.loads(options)
+            except ValueError:
+                options = []
+        items.append({'question': text, 'options': options or [], 'correct_answer': correct_answer})
+    return items
+
+def merged_source_id(upload_id):
+    """Pseudo-Datei-ID des zusammengeführten Kontexts eines Uploads (Text unter extracted_text:{ID})."""
+    return f"{MERGED_SOURCE_PREFIX}{upload_id}"
+
+def _source_tags(uploaded_file_id, upload_id):
+    """Tags der generierten Materialien: Quelldatei (auch für Abschnitte) bzw. der gesamte Upload bei zusammengeführter Generierung."""
+    if str(uploaded_file_id).startswith(MERGED_SOURCE_PREFIX):
+        return json.dumps([f"upload:{upload_id}"])
+    return json.dumps([f"file:{section_file_id(uploaded_file_id)}"])
+
+def _generated_row_id(idempotency_key, *parts):
+    """Zeilen-ID eines generierten Objekts: deterministisch mit Idempotenzschlüssel, sonst zufällig."""
+    if idempotency_key:
+        return ledger_row_id(idempotency_key, *parts)
+    return str(uuid.uuid4())
+
+def _add_generated_rows(db_session, objects, idempotency_key):
+    """Fügt generierte Objekte hinzu; mit Idempotenzschlüssel werden bereits gespeicherte IDs übersprungen."""
+    if idempotency_key:
+        inserted = insert_ignore_existing(db_session, objects)
+        if inserted < len(objects):
+            logger.info(f"[LEDGER] {len(objects) - inserted} von {len(objects)} Objekten bereits gespeichert, übersprungen.")
+    else:
+        db_session.add_all(objects)
+
+def _track_cascade_usage(cascade, user_id, session_id, function_name, options, log_prefix):
+    """
+    Speichert die Token-Nutzung jedes Versuchs einer Modell-Kaskade.
+
+    Jeder Versuch wird mit seinem eigenen Modell abgerechnet; Route, Latenz,
+    Kosten und Eskalation landen in den TokenUsage-Metadaten.
+
+    Returns:
+        dict: Summierte input_tokens, output_tokens und cached_tokens
+    """
+    totals = {'input_tokens': 0, 'output_tokens': 0, 'cached_tokens': 0}
+    for attempt in cascade['attempts']:
+        usage = attempt['usage'] or {}
+        input_tokens = usage.get('prompt_tokens', 0)
+        output_tokens = usage.get('completion_tokens', 0)
+        cached_tokens = usage.get('cached_tokens', 0)
+        totals['input_tokens'] += input_tokens
+        totals['output_tokens'] += output_tokens
+        totals['cached_tokens'] += cached_tokens
+        if not user_id or input_tokens <= 0:
+            continue
+        # Batch-Metadaten gelten nur für die vorberechnete Antwort des ersten Versuchs
+        base_metadata = options.get('usage_metadata') if attempt['attempt'] == 0 else None
+        tracking_result = update_token_usage(
+            user_id=user_id,
+            session_id=session_id,
+            input_tokens=input_tokens,
+            output_tokens=output_tokens,
+            model=attempt['model'],
+            function_name=function_name,
+            metadata=cascade_usage_metadata(cascade, attempt, base_metadata),
+            cached_tokens=cached_tokens
+        )
+        logger.info(f"[{log_prefix}] Token Tracking Ergebnis ({attempt['model']}): {tracking_result}")
+
+    if not user_id:
+        logger.warning(f"[{log_prefix}] Keine User ID, Token-Nutzung kann nicht gespeichert/abgezogen werden.")
+    elif totals['input_tokens'] <= 0:
+        logger.info(f"[{log_prefix}] Keine Tokens verbraucht, überspringe Tracking.")
+    return totals
+
+def _precomputed_response_options(options):
+    """
+    Gibt die Generierungsoptionen für eine bereits vorliegende Modellantwort zurück.
+
+    Batch-Aufträge liefern die Antwort später nach; sie wird dann über
+    'response_content'/'usage' an die Generierungsfunktionen durchgereicht.
+    """
+    if options.get('response_content') is None:
+        return {}
+    return {'response_content': options['response_content'], 'usage': options.get('usage')}
+
 async def _extract_file_content(upload_id):
     """Extrahiert den Dateiinhalt aus dem Upload und speichert ihn temporär.
     
@@ -369,9 +840,7 @@ async def _extract_file_content(upload_id):
     logger.info("="*50)
     logger.info(f"DATEIEXTRAKTION GESTARTET FÜR UPLOAD: {upload_id}")
     
-    engine = create_engine(os.environ.get('SQLALCHEMY_DATABASE_URI'))
-    Session = sessionmaker(bind=engine)
-    db_session = Session()
+    db_session = get_db_session()
     
     temp_file_path = None
     
@@ -412,8 +881,7 @@ async def _extract_file_content(upload_id):
                 logger.warning(f"Extrahierter Text ist sehr kurz ({len(text_content)} Zeichen), möglicherweise PDF mit Bildern oder Scans")
                 
             # Tokenisierung und Kürzung für OpenAI
-            token_schätzung = len(text_content) // 4  # Grobe Schätzung: ~4 Zeichen/Token
-            logger.info(f"Geschätzte Token-Anzahl: ~{token_schätzung}")
+            logger.info(f"Token-Anzahl: {count_tokens(text_content)}")
             
             # Begrenze Textlänge auf 15.000 Zeichen für OpenAI
             if len(text_content) > 15000:
@@ -455,7 +923,7 @@ async def _extract_file_content(upload_id):
     finally:
         db_session.close()
 
-def _generate_flashcards_task(uploaded_file_id, upload_id, session_id, options):
+def _generate_flashcards_task(uploaded_file_id, upload_id, session_id, options, extracted_text=None):
     """Interne SYNCHRONE Funktion zur Lernkartengenerierung."""
     logger.info("=========================================================")
     logger.info(f"[FLASHCARDS SYNC TASK START] ID: {options.get('task_id')}")
@@ -469,95 +937,84 @@ def _generate_flashcards_task(uploaded_file_id, upload_id, session_id, options):
     saved_count = 0
     cards = []
     input_tokens = 0
+    prompt_digest = None
     output_tokens = 0
-    model_used = options.get('model', DEFAULT_MODEL)
+    models = get_model_route('flashcards', options)
     user_id = options.get('user_id')
+    num_cards = options.get('num_cards', 5)
+    streamed_keys = set()
     
     try:
         # 1. Hole extrahierten Text aus Redis
         logger.info(f"[FLASHCARDS] Schritt 1: Hole Text aus Redis (Key: extracted_text:{uploaded_file_id})")
-        from redis_utils.client import get_redis_client
-        redis_client = get_redis_client()
-        redis_key = f"extracted_text:{uploaded_file_id}"
-        extracted_text_bytes = redis_client.get(redis_key)
-        if not extracted_text_bytes:
-             error_msg = f"Kein extrahierter Text in Redis gefunden für Key: {redis_key}"
-             logger.error(f"[FLASHCARDS] {error_msg}")
-             # Optional: Versuche Fallback aus DB (benötigt user_id)
-             if user_id:
-                 try:
-                     logger.info(f"[FLASHCARDS] Versuche Fallback: Lade Text aus DB für UploadedFile {uploaded_file_id}")
-                     db_session = get_db_session()
-                     uploaded_file = db_session.query(UploadedFile).get(uploaded_file_id)
-                     if uploaded_file and uploaded_file.extracted_text:
-                          extracted_text = uploaded_file.extracted_text
-                          logger.info("[FLASHCARDS] Fallback: Text aus DB geladen.")
-                     else:
-                          raise ValueError(error_msg)
-                 except Exception as db_err:
-                      logger.error(f"[FLASHCARDS] Fallback aus DB fehlgeschlagen: {db_err}")
-                      raise ValueError(error_msg)
-                 finally:
-                      if db_session: db_session.close(); db_session=None
-             else:
-                 raise ValueError(error_msg)
-        else:
-             extracted_text = extracted_text_bytes.decode('utf-8')
-             logger.info(f"[FLASHCARDS] Text erfolgreich aus Redis geladen ({len(extracted_text)} Zeichen)")
+        if extracted_text is None:
+            extracted_text = load_extracted_text(uploaded_file_id, log_prefix='FLASHCARDS')
+        prompt_digest = options.get('prompt_hash') or prompt_hash(
+            _generation_request('flashcards', extracted_text, options, models[0])['messages'])
 
         # 2. Stelle Datenbankverbindung her (jetzt benötigt für save und user check)
         logger.info(f"[FLASHCARDS] Schritt 2: Stelle DB-Verbindung her (für Speichern/User)")
         db_session = get_db_session()
+        # Beinahe-Duplikate vorhandener Karten des Uploads werden beim Speichern verworfen
+        duplicate_index = NearDuplicateIndex.from_texts(
+            flashcard_text(item) for item in existing_material(db_session, upload_id, 'flashcards')
+        )
 
         # 3. Starte OpenAI-Anfrage
         logger.info(f"[FLASHCARDS] Schritt 3: Starte SYNC OpenAI-Anfrage...")
-        # Annahme: Funktion gibt Dict mit 'flashcards' und 'usage' zurück
-        result_data = generate_flashcards_with_openai(
+        generation_options = {}
+        if options.get('stream', FLASHCARDS_STREAMING):
+            # Fertige (gültige) Karten werden schon während des Streams gespeichert und veröffentlicht
+            generation_options['on_card'] = lambda card: _persist_streamed_flashcard(
+                db_session, card, uploaded_file_id, upload_id, session_id, streamed_keys,
+                idempotency_key=options.get('idempotency_key'), duplicate_index=duplicate_index,
+                max_cards=num_cards
+            )
+        # Günstiges Modell zuerst, nur ungültige/fehlende Karten werden eskaliert
+        cascade = run_model_cascade(
+            'flashcards',
+            generate_flashcards_with_openai,
+            models,
+            validate_generated_flashcards,
+            result_key='flashcards',
+            count=num_cards,
+            count_kwarg='num_cards',
+            first_attempt_options=_precomputed_response_options(options),
             extracted_text=extracted_text,
-            num_cards=options.get('num_cards', 5),
             language=options.get('language', 'de'),
-            model=model_used
+            **generation_options
         )
-        cards = result_data.get('flashcards', [])
-        usage = result_data.get('usage')
-        if usage:
-            input_tokens = usage.get('prompt_tokens', 0)
-            output_tokens = usage.get('completion_tokens', 0)
-        logger.info(f"[FLASHCARDS] OpenAI-Antwort erhalten: {len(cards)} Karten. Usage: In={input_tokens}, Out={output_tokens}")
+        cards = cascade['result']
+        logger.info(f"[FLASHCARDS] OpenAI-Antwort erhalten: {len(cards)} Karten nach {len(cascade['attempts'])} Versuch(en)")
 
         # 4. Token-Nutzung tracken (NACH erfolgreichem API-Call)
         logger.info(f"[FLASHCARDS] Schritt 4: Tracke Token-Nutzung (User: {user_id})")
-        if user_id and input_tokens > 0:
-            tracking_result = update_token_usage(
-                user_id=user_id,
-                session_id=session_id,
-                input_tokens=input_tokens,
-                output_tokens=output_tokens,
-                model=model_used,
-                function_name='ai.generate_flashcards'
-            )
-            logger.info(f"[FLASHCARDS] Token Tracking Ergebnis: {tracking_result}")
-        elif not user_id:
-             logger.warning("[FLASHCARDS] Keine User ID, Token-Nutzung kann nicht gespeichert/abgezogen werden.")
-        else: # input_tokens <= 0
-             logger.info("[FLASHCARDS] Keine Tokens verbraucht, überspringe Tracking.")
+        totals = _track_cascade_usage(cascade, user_id, session_id, 'ai.generate_flashcards', options, 'FLASHCARDS')
+        input_tokens, output_tokens = totals['input_tokens'], totals['output_tokens']
 
         # 5. Speichere Flashcards in der Datenbank
         logger.info(f"[FLASHCARDS] Schritt 5: Speichere {len(cards)} Karten in DB (Upload: {upload_id})")
+        idempotency_key = options.get('idempotency_key')
         flashcards_to_add = []
-        saved_count = 0
-        for i, card in enumerate(cards):
+        saved_count = len(streamed_keys)
+        if saved_count:
+            logger.info(f"[FLASHCARDS] {saved_count} Karten bereits während des Streams gespeichert.")
+        unstreamed = [card for card in cards if _flashcard_key(card) not in streamed_keys]
+        unique_cards, duplicates = filter_near_duplicates(unstreamed, duplicate_index, flashcard_text)
+        # Gestreamte Karten zählen mit: insgesamt höchstens num_cards speichern
+        unique_cards = unique_cards[:max(num_cards - len(streamed_keys), 0)]
+        for i, card in enumerate(unique_cards):
             question = card.get('question', '').strip()
             answer = card.get('answer', '').strip()
-                         
+
             if question and answer:
                 try:
                     flashcard_obj = Flashcard(
-                        id=str(uuid.uuid4()),
+                        id=_generated_row_id(idempotency_key, 'flashcard', question),
                         upload_id=upload_id, # Verknüpfung mit dem Haupt-Upload!
                         question=question,
                         answer=answer,
-                        tags=json.dumps([f"file:{uploaded_file_id}"]) # Tag hinzufügen
+                        tags=_source_tags(uploaded_file_id, upload_id) # Tag hinzufügen
                     )
                     flashcards_to_add.append(flashcard_obj)
                     saved_count += 1 
@@ -572,16 +1029,16 @@ def _generate_flashcards_task(uploaded_file_id, upload_id, session_id, options):
         if flashcards_to_add:
             try:
                 logger.info(f"[FLASHCARDS] Füge {len(flashcards_to_add)} Karten zur DB-Session hinzu...")
-                db_session.add_all(flashcards_to_add)
+                _add_generated_rows(db_session, flashcards_to_add, idempotency_key)
                 logger.info("[FLASHCARDS] Committing zur Datenbank...")
                 db_session.commit()
                 logger.info(f"[FLASHCARDS] {len(flashcards_to_add)} Karten erfolgreich gespeichert.")
             except Exception as commit_err:
                  logger.error(f"[FLASHCARDS] DB Commit Fehler: {commit_err}", exc_info=True)
                  db_session.rollback()
-                 saved_count = 0
+                 saved_count = len(streamed_keys)
                  raise # Fehler weitergeben, damit Task fehlschlägt
-        else:
+        elif not streamed_keys:
             logger.warning("[FLASHCARDS] Keine gültigen Karten zum Speichern.")
             saved_count = 0
 
@@ -597,9 +1054,19 @@ def _generate_flashcards_task(uploaded_file_id, upload_id, session_id, options):
             'upload_id': upload_id,
             'session_id': session_id,
             'flashcards_generated': len(cards),
-            'flashcards_saved': saved_count
+            'flashcards_saved': saved_count,
+            'near_duplicates_rejected': len(duplicates),
+            'input_tokens': input_tokens,
+            'output_tokens': output_tokens,
+            'prompt_hash': prompt_digest
         }
         
+    except OpenAIRetryableError:
+        # Vorübergehender API-Fehler: der Celery-Task plant sich neu ein
+        if db_session:
+             try: db_session.rollback()
+             except: pass
+        raise
     except Exception as e:
         logger.error(f"[FLASHCARDS SYNC TASK ENDE - FEHLER] ID: {options.get('task_id')}: {e}", exc_info=True)
         if db_session:
@@ -610,14 +1077,85 @@ def _generate_flashcards_task(uploaded_file_id, upload_id, session_id, options):
             'uploaded_file_id': uploaded_file_id,
             'upload_id': upload_id,
             'session_id': session_id,
-            'error': str(e)
+            'error': str(e),
+            'input_tokens': input_tokens,
+            'output_tokens': output_tokens,
+            'prompt_hash': prompt_digest
         }
     finally:
         if db_session:
             db_session.close()
             logger.debug("[FLASHCARDS] DB Session geschlossen.")
 
-def _generate_questions_task(uploaded_file_id, upload_id, session_id, options):
+def _flashcard_key(card):
+    """(Frage, Antwort) ohne umgebende Leerzeichen; gleicher Schlüssel für Stream und Abschluss."""
+    return (card.get('question', '').strip(), card.get('answer', '').strip())
+
+def _persist_streamed_flashcard(db_session, card, uploaded_file_id, upload_id, session_id, streamed_keys,
+                                idempotency_key=None, duplicate_index=None, max_cards=None):
+    """
+    Speichert eine gestreamte Lernkarte sofort und veröffentlicht sie an die Session.
+
+    Args:
+        db_session: Offene Datenbank-Session
+        card: Dict mit 'question' und 'answer'
+        uploaded_file_id: ID der verarbeiteten Datei
+        upload_id: ID des übergeordneten Uploads
+        session_id: ID der Session, an die veröffentlicht wird
+        streamed_keys: Set der bereits gespeicherten (question, answer)-Paare
+        idempotency_key: Schlüssel des Tasks (deterministische Karten-ID, siehe tasks/ledger.py)
+        duplicate_index: NearDuplicateIndex des Uploads (Beinahe-Duplikate werden nicht gespeichert)
+        max_cards: Angeforderte Anzahl; weitere Karten (z.B. aus einer Eskalation) werden nicht gespeichert
+    """
+    key = _flashcard_key(card)
+    if key in streamed_keys:
+        return
+    if max_cards is not None and len(streamed_keys) >= max_cards:
+        logger.info(f"[FLASHCARDS] {max_cards} Karten gestreamt, weitere Karte verworfen: '{key[0][:80]}'")
+        return
+    is_valid, error = validate_flashcard_data(card)
+    if not is_valid:
+        # Ungültige Karten werden nicht veröffentlicht, sondern von der Kaskade eskaliert
+        logger.warning(f"[FLASHCARDS] Gestreamte Karte verworfen: {error}")
+        return
+    if duplicate_index is not None and duplicate_index.find(flashcard_text(card)):
+        logger.info(f"[FLASHCARDS] Gestreamte Karte ist Beinahe-Duplikat, verworfen: '{card['question'][:80]}'")
+        return
+
+    flashcard_obj = Flashcard(
+        id=_generated_row_id(idempotency_key, 'flashcard', key[0]),
+        upload_id=upload_id,
+        question=key[0],
+        answer=key[1],
+        tags=_source_tags(uploaded_file_id, upload_id)
+    )
+    try:
+        db_session.add(flashcard_obj)
+        db_session.commit()
+    except IntegrityError:
+        # Karte wurde bereits von einer früheren Zustellung desselben Tasks gespeichert
+        db_session.rollback()
+        streamed_keys.add(key)
+        logger.info(f"[FLASHCARDS] Gestreamte Karte bereits gespeichert (ID: {flashcard_obj.id})")
+        return
+    except Exception as e:
+        logger.error(f"[FLASHCARDS] Fehler beim Speichern der gestreamten Karte: {e}")
+        db_session.rollback()
+        return
+
+    streamed_keys.add(key)
+    if duplicate_index is not None:
+        duplicate_index.add(flashcard_text(card))
+    logger.info(f"[FLASHCARDS] Karte {len(streamed_keys)} gestreamt und gespeichert (ID: {flashcard_obj.id})")
+    publish_session_event(session_id, 'flashcard', {
+        'id': flashcard_obj.id,
+        'upload_id': upload_id,
+        'uploaded_file_id': uploaded_file_id,
+        'question': flashcard_obj.question,
+        'answer': flashcard_obj.answer
+    })
+
+def _generate_questions_task(uploaded_file_id, upload_id, session_id, options, extracted_text=None):
     """Interne SYNCHRONE Funktion zur Fragengenerierung."""
     logger.info("=========================================================")
     logger.info(f"[QUESTIONS SYNC TASK START] ID: {options.get('task_id')}")
@@ -632,65 +1170,56 @@ def _generate_questions_task(uploaded_file_id, upload_id, session_id, options):
     questions = []
 
     input_tokens = 0
+    prompt_digest = None
     output_tokens = 0
-    model_used = options.get('model', DEFAULT_MODEL)
+    models = get_model_route('questions', options)
     user_id = options.get('user_id')
 
     try:
         # 1. Hole extrahierten Text aus Redis
         logger.info(f"[QUESTIONS] Schritt 1: Hole Text aus Redis für uploaded_file_id: {uploaded_file_id}")
-        from redis_utils.client import get_redis_client
-        redis_client = get_redis_client()
-        redis_key = f"extracted_text:{uploaded_file_id}"
-        extracted_text_bytes = redis_client.get(redis_key)
-        if not extracted_text_bytes:
-             raise ValueError(f"Kein extrahierter Text in Redis gefunden für Key: {redis_key}")
-        extracted_text = extracted_text_bytes.decode('utf-8')
-        logger.info(f"[QUESTIONS] Text erfolgreich aus Redis geladen ({len(extracted_text)} Zeichen)")
+        if extracted_text is None:
+            extracted_text = load_extracted_text(uploaded_file_id, log_prefix='QUESTIONS')
+        prompt_digest = options.get('prompt_hash') or prompt_hash(
+            _generation_request('questions', extracted_text, options, models[0])['messages'])
 
         # 2. Stelle Datenbankverbindung her
         logger.info(f"[QUESTIONS] Schritt 2: Stelle Datenbankverbindung her (für Speichern)")
-        engine = create_engine(os.environ.get('SQLALCHEMY_DATABASE_URI'))
-        Session = sessionmaker(bind=engine)
-        db_session = Session()
+        db_session = get_db_session()
+        duplicate_index = NearDuplicateIndex.from_texts(
+            question_text(item) for item in existing_material(db_session, upload_id, 'questions')
+        )
 
         # 3. Starte OpenAI-Anfrage
         logger.info(f"[QUESTIONS] Schritt 3: Starte SYNC OpenAI-Anfrage...")
-        # Annahme: Funktion gibt Dict mit 'questions' und 'usage' zurück
-        result_data = generate_questions_with_openai(
+        # Günstiges Modell zuerst, nur ungültige/fehlende Fragen werden eskaliert
+        cascade = run_model_cascade(
+            'questions',
+            generate_questions_with_openai,
+            models,
+            validate_generated_questions,
+            result_key='questions',
+            count=options.get('num_questions', 5),
+            count_kwarg='num_questions',
+            first_attempt_options=_precomputed_response_options(options),
             extracted_text=extracted_text,
-            num_questions=options.get('num_questions', 5),
             question_type=options.get('question_type', 'multiple_choice'),
-            language=options.get('language', 'de'),
-            model=model_used
+            language=options.get('language', 'de')
         )
-        questions = result_data.get('questions', [])
-        usage = result_data.get('usage')
-        if usage:
-            input_tokens = usage.get('prompt_tokens', 0)
-            output_tokens = usage.get('completion_tokens', 0)
+        questions = cascade['result']
+        totals = _track_cascade_usage(cascade, user_id, session_id, 'ai.generate_questions', options, 'QUESTIONS')
+        input_tokens, output_tokens = totals['input_tokens'], totals['output_tokens']
         logger.info(f"[QUESTIONS] OpenAI-Antwort erhalten: {len(questions)} Fragen. Usage: In={input_tokens}, Out={output_tokens}")
 
-        # Token-Nutzung tracken
-        if user_id and input_tokens > 0:
-            update_token_usage(
-                user_id=user_id,
-                session_id=session_id,
-                input_tokens=input_tokens,
-                output_tokens=output_tokens,
-                model=model_used,
-                function_name='ai.generate_questions'
-            )
-        elif not user_id:
-            logger.warning("[QUESTIONS] Keine User ID vorhanden, Token-Nutzung kann nicht gespeichert werden.")
-
         # 4. Speichere Fragen in Datenbank (verknüpft mit upload_id)
         logger.info(f"[QUESTIONS] Schritt 4: Speichere {len(questions)} Fragen in Datenbank (verknüpft mit Upload {upload_id})")
+        idempotency_key = options.get('idempotency_key')
         questions_to_add = []
         saved_count = 0
-        
-        for q in questions:
-            question_text = q.get('question', '').strip()
+        unique_questions, duplicates = filter_near_duplicates(questions, duplicate_index, question_text)
+
+        for q in unique_questions:
+            text = q.get('question', '').strip()
             options_list = q.get('options', [])
             correct_answer = q.get('correct_answer', 0) # Typ korrigieren?
             explanation = q.get('explanation', '').strip()
@@ -699,27 +1228,26 @@ def _generate_questions_task(uploaded_file_id, upload_id, session_id, options):
             try:
                 correct_answer_int = int(correct_answer)
             except (ValueError, TypeError):
-                logger.warning(f"[QUESTIONS] Ungültiger correct_answer Wert '{correct_answer}' für Frage '{question_text[:50]}...'. Setze auf 0.")
+                logger.warning(f"[QUESTIONS] Ungültiger correct_answer Wert '{correct_answer}' für Frage '{text[:50]}...'. Setze auf 0.")
                 correct_answer_int = 0
 
-            if question_text:
+            if text:
                 try:
                     if not isinstance(options_list, list):
-                        logger.warning(f"[QUESTIONS] 'options' ist keine Liste für Frage '{question_text[:50]}...'.")
+                        logger.warning(f"[QUESTIONS] 'options' ist keine Liste für Frage '{text[:50]}...'.")
                         options_list = []
                         
                     question_obj = Question(
-                        id=str(uuid.uuid4()),
+                        id=_generated_row_id(idempotency_key, 'question', text),
                         upload_id=upload_id, # Verknüpfung mit dem Haupt-Upload!
-                        text=question_text,
+                        text=text,
                         options=json.dumps(options_list), # JSON speichern
                         correct_answer=correct_answer_int, # Korrigierten Integer verwenden
-                        explanation=explanation,
-                        tags=json.dumps([f"file:{uploaded_file_id}"]) # Tag hinzufügen
+                        explanation=explanation
                     )
                     questions_to_add.append(question_obj)
                     saved_count += 1
-                    logger.debug(f"[QUESTIONS] Frage vorbereitet: {question_text[:50]}...")
+                    logger.debug(f"[QUESTIONS] Frage vorbereitet: {text[:50]}...")
                 except Exception as e:
                     logger.error(f"[QUESTIONS] Fehler beim Erstellen des Question-Objekts: {e} für Frage: {q}")
             else:
@@ -728,7 +1256,7 @@ def _generate_questions_task(uploaded_file_id, upload_id, session_id, options):
         if questions_to_add:
             try:
                 logger.info(f"[QUESTIONS] Füge {len(questions_to_add)} Fragen zur Session hinzu und committe...")
-                db_session.add_all(questions_to_add)
+                _add_generated_rows(db_session, questions_to_add, idempotency_key)
                 db_session.commit()
                 logger.info(f"[QUESTIONS] {len(questions_to_add)} Fragen erfolgreich in Datenbank gespeichert")
             except Exception as commit_err:
@@ -752,9 +1280,16 @@ def _generate_questions_task(uploaded_file_id, upload_id, session_id, options):
             'upload_id': upload_id,
             'session_id': session_id,
             'questions_generated': len(questions),
-            'questions_saved': saved_count
+            'questions_saved': saved_count,
+            'near_duplicates_rejected': len(duplicates),
+            'input_tokens': input_tokens,
+            'output_tokens': output_tokens,
+            'prompt_hash': prompt_digest
         }
         
+    except OpenAIRetryableError:
+        # Vorübergehender API-Fehler: der Celery-Task plant sich neu ein
+        raise
     except Exception as e:
         logger.error(f"[QUESTIONS] Fehler bei der Fragengenerierung für File {uploaded_file_id}: {e}", exc_info=True)
         return {
@@ -762,14 +1297,17 @@ def _generate_questions_task(uploaded_file_id, upload_id, session_id, options):
             'uploaded_file_id': uploaded_file_id,
             'upload_id': upload_id,
             'session_id': session_id,
-            'error': str(e)
+            'error': str(e),
+            'input_tokens': input_tokens,
+            'output_tokens': output_tokens,
+            'prompt_hash': prompt_digest
         }
         
     finally:
         if db_session:
             db_session.close()
             
-def _extract_topics_task(uploaded_file_id, upload_id, session_id, options):
+def _extract_topics_task(uploaded_file_id, upload_id, session_id, options, extracted_text=None):
     """Interne SYNCHRONE Funktion zur Themenextraktion."""
     logger.info("=========================================================")
     logger.info(f"[TOPICS SYNC TASK START] ID: {options.get('task_id')}")
@@ -784,59 +1322,45 @@ def _extract_topics_task(uploaded_file_id, upload_id, session_id, options):
     topics_data = {}
 
     input_tokens = 0
+    prompt_digest = None
     output_tokens = 0
-    model_used = options.get('model', DEFAULT_MODEL)
+    models = get_model_route('topics', options)
     user_id = options.get('user_id')
     
     try:
         # 1. Hole extrahierten Text aus Redis
         logger.info(f"[TOPICS] Schritt 1: Hole Text aus Redis für uploaded_file_id: {uploaded_file_id}")
-        from redis_utils.client import get_redis_client
-        redis_client = get_redis_client()
-        redis_key = f"extracted_text:{uploaded_file_id}"
-        extracted_text_bytes = redis_client.get(redis_key)
-        if not extracted_text_bytes:
-             raise ValueError(f"Kein extrahierter Text in Redis gefunden für Key: {redis_key}")
-        extracted_text = extracted_text_bytes.decode('utf-8')
-        logger.info(f"[TOPICS] Text erfolgreich aus Redis geladen ({len(extracted_text)} Zeichen)")
+        if extracted_text is None:
+            extracted_text = load_extracted_text(uploaded_file_id, log_prefix='TOPICS')
+        prompt_digest = options.get('prompt_hash') or prompt_hash(
+            _generation_request('topics', extracted_text, options, models[0])['messages'])
 
         # 2. Stelle Datenbankverbindung her
         logger.info(f"[TOPICS] Schritt 2: Stelle Datenbankverbindung her (für Speichern)")
-        engine = create_engine(os.environ.get('SQLALCHEMY_DATABASE_URI'))
-        Session = sessionmaker(bind=engine)
-        db_session = Session()
+        db_session = get_db_session()
 
         # 3. Starte OpenAI-Anfrage
         logger.info(f"[TOPICS] Schritt 3: Starte SYNC OpenAI-Anfrage...")
-        # Annahme: Funktion gibt Dict mit 'topics_data' und 'usage' zurück
-        result_data = extract_topics_with_openai(
+        # Günstiges Modell zuerst, bei ungültigem Ergebnis an das stärkere Modell eskalieren
+        cascade = run_model_cascade(
+            'topics',
+            extract_topics_with_openai,
+            models,
+            validate_generated_topics,
+            result_key='topics_data',
+            first_attempt_options=_precomputed_response_options(options),
             extracted_text=extracted_text,
             max_topics=options.get('max_topics', 8),
-            language=options.get('language', 'de'),
-            model=model_used
+            language=options.get('language', 'de')
         )
-        topics_data = result_data.get('topics_data', {})
-        usage = result_data.get('usage')
-        if usage:
-            input_tokens = usage.get('prompt_tokens', 0)
-            output_tokens = usage.get('completion_tokens', 0)
+        topics_data = cascade['result'] or {}
+        totals = _track_cascade_usage(cascade, user_id, session_id, 'ai.extract_topics', options, 'TOPICS')
+        input_tokens, output_tokens = totals['input_tokens'], totals['output_tokens']
         logger.info(f"[TOPICS] OpenAI-Antwort erhalten. Usage: In={input_tokens}, Out={output_tokens}")
 
-        # Token-Nutzung tracken
-        if user_id and input_tokens > 0:
-            update_token_usage(
-                user_id=user_id,
-                session_id=session_id,
-                input_tokens=input_tokens,
-                output_tokens=output_tokens,
-                model=model_used,
-                function_name='ai.extract_topics'
-            )
-        elif not user_id:
-            logger.warning("[TOPICS] Keine User ID vorhanden, Token-Nutzung kann nicht gespeichert werden.")
-
         # 4. Speichere Themen in Datenbank (verknüpft mit upload_id)
         logger.info(f"[TOPICS] Schritt 4: Speichere Themen in Datenbank (verknüpft mit Upload {upload_id})")
+        idempotency_key = options.get('idempotency_key')
         topics_to_add = []
         saved_count = 0
         main_topic_id = None
@@ -847,7 +1371,7 @@ def _extract_topics_task(uploaded_file_id, upload_id, session_id, options):
             description = topics_data['main_topic'].get('description', '').strip()
             if title:
                 try:
-                    main_topic_id = str(uuid.uuid4())
+                    main_topic_id = _generated_row_id(idempotency_key, 'topic', 'main', title)
                     topic_obj = Topic(
                         id=main_topic_id,
                         upload_id=upload_id, # Verknüpfung mit Haupt-Upload
@@ -855,7 +1379,7 @@ def _extract_topics_task(uploaded_file_id, upload_id, session_id, options):
                         description=description,
                         is_main_topic=True,
                         parent_id=None,
-                        tags=json.dumps([f"file:{uploaded_file_id}"])
+                        tags=_source_tags(uploaded_file_id, upload_id)
                     )
                     topics_to_add.append(topic_obj)
                 except Exception as e:
@@ -870,13 +1394,13 @@ def _extract_topics_task(uploaded_file_id, upload_id, session_id, options):
                 if title:
                     try:
                         topic_obj = Topic(
-                            id=str(uuid.uuid4()),
+                            id=_generated_row_id(idempotency_key, 'topic', 'sub', title),
                             upload_id=upload_id, # Verknüpfung mit Haupt-Upload
                             name=title,
                             description=description,
                             is_main_topic=False,
                             parent_id=main_topic_id, # Verknüpfung mit Hauptthema
-                            tags=json.dumps([f"file:{uploaded_file_id}"])
+                            tags=_source_tags(uploaded_file_id, upload_id)
                         )
                         topics_to_add.append(topic_obj)
                     except Exception as e:
@@ -885,7 +1409,7 @@ def _extract_topics_task(uploaded_file_id, upload_id, session_id, options):
         if topics_to_add:
             try:
                 logger.info(f"[TOPICS] Füge {len(topics_to_add)} Themen zur Session hinzu und committe...")
-                db_session.add_all(topics_to_add)
+                _add_generated_rows(db_session, topics_to_add, idempotency_key)
                 db_session.commit()
                 saved_count = len(topics_to_add)
                 logger.info(f"[TOPICS] {saved_count} Themen erfolgreich in Datenbank gespeichert")
@@ -910,9 +1434,15 @@ def _extract_topics_task(uploaded_file_id, upload_id, session_id, options):
             'upload_id': upload_id,
             'session_id': session_id,
             'topics_extracted': 1 + len(topics_data.get('subtopics', [])) if topics_data.get('main_topic', {}).get('title') else len(topics_data.get('subtopics', [])),
-            'topics_saved': saved_count
+            'topics_saved': saved_count,
+            'input_tokens': input_tokens,
+            'output_tokens': output_tokens,
+            'prompt_hash': prompt_digest
         }
         
+    except OpenAIRetryableError:
+        # Vorübergehender API-Fehler: der Celery-Task plant sich neu ein
+        raise
     except Exception as e:
         logger.error(f"[TOPICS] Fehler bei der Themenextraktion für File {uploaded_file_id}: {e}", exc_info=True)
         return {
@@ -920,7 +1450,10 @@ def _extract_topics_task(uploaded_file_id, upload_id, session_id, options):
             'uploaded_file_id': uploaded_file_id,
             'upload_id': upload_id,
             'session_id': session_id,
-            'error': str(e)
+            'error': str(e),
+            'input_tokens': input_tokens,
+            'output_tokens': output_tokens,
+            'prompt_hash': prompt_digest
         }
         
     finally:
@@ -962,19 +1495,13 @@ async def _process_upload_combined(upload_id, session_id, language, model, num_c
 
 async def _get_session_id_from_upload(upload_id):
     """Hilfsfunktion zum Abrufen der Session-ID aus der DB."""
-    db_session = None
     try:
-        engine = create_engine(os.environ.get('SQLALCHEMY_DATABASE_URI'))
-        Session = sessionmaker(bind=engine)
-        db_session = Session()
-        upload = db_session.query(Upload).get(upload_id)
-        return upload.session_id if upload else None
+        with session_scope() as db_session:
+            upload = db_session.query(Upload).get(upload_id)
+            return upload.session_id if upload else None
     except Exception as e:
         logger.warning(f"Fehler beim Abrufen der Session-ID für Upload {upload_id}: {e}")
         return None
-    finally:
-        if db_session:
-            db_session.close()
 
 def _get_session_id_from_upload_sync(upload_id):
      logger.warning("_get_session_id_from_upload_sync ist nur ein Platzhalter!")
@@ -0,0 +1,293 @@
+"""
+Batch-Tasks für nicht-interaktive Massengenerierung.
+
+Sammelt Generierungsanfragen (Lernkarten, Fragen, Themen) mehrerer Dateien in
+einer JSONL-Datei, reicht sie über die Batch-API ein und führt die Ergebnisse
+nach Abschluss in die normale Speicherlogik der AI-Tasks zurück.
+"""
+import json
+import logging
+import os
+import time
+from typing import Any, Dict, List, Optional
+
+from celery import chord
+
+from .ai_tasks import (
+    load_extracted_text,
+    _generate_flashcards_task,
+    _generate_questions_task,
+    _extract_topics_task,
+)
+from .flashcards.generation import build_flashcards_request
+from .questions.generation import build_questions_request
+from .topics.generation import build_topics_request
+from config.model_routing import get_model_route
+from config.queues import TIER_BULK, with_tier
+from redis_utils.client import get_redis_client
+from utils.batch_api import (
+    BATCH_TERMINAL_STATES,
+    get_batch_provider,
+    parse_batch_result_line,
+    write_batch_file,
+)
+
+logger = logging.getLogger(__name__)
+
+# Abfrageintervall für den Batch-Status (Sekunden)
+BATCH_POLL_INTERVAL = int(os.environ.get('BATCH_POLL_INTERVAL', 300))
+# Maximale Wartezeit, danach werden offene Einträge live generiert (Sekunden)
+BATCH_MAX_WAIT = int(os.environ.get('BATCH_MAX_WAIT', 26 * 3600))
+# Lebensdauer des Batch-Manifests in Redis (Sekunden)
+BATCH_MANIFEST_TTL = 3 * 86400
+
+# Unterstützte Task-Typen und der zugehörige Live-Task für den Fallback
+BATCH_TASK_TYPES = {
+    'flashcards': 'ai.generate_flashcards',
+    'questions': 'ai.generate_questions',
+    'topics': 'ai.extract_topics',
+}
+
+
+def batch_manifest_key(batch_id):
+    """Redis-Schlüssel des Manifests eines Batch-Auftrags."""
+    return f"batch_job:{batch_id}"
+
+
+def _build_request(task_type: str, text: str, options: Dict[str, Any]) -> Dict[str, Any]:
+    """Baut die Completion-Parameter für einen Batch-Eintrag."""
+    language = options.get('language', 'de')
+    # Der Batch läuft mit dem ersten Modell der Route; Eskalationen erfolgen live
+    model = get_model_route(task_type, options)[0]
+    if task_type == 'flashcards':
+        return build_flashcards_request(text, num_cards=options.get('num_cards', 5), language=language, model=model)
+    if task_type == 'questions':
+        return build_questions_request(
+            text,
+            num_questions=options.get('num_questions', 3),
+            question_type=options.get('question_type', 'multiple_choice'),
+            language=language,
+            model=model
+        )
+    if task_type == 'topics':
+        return build_topics_request(text, max_topics=options.get('max_topics', 8), language=language, model=model)
+    raise ValueError(f"Unbekannter Batch-Task-Typ: {task_type}")
+
+
+def _persist_result(item: Dict[str, Any], batch_id: str, content: str, usage: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+    """Führt eine Batch-Antwort in die normale Speicherlogik zurück."""
+    options = dict(item.get('options') or {})
+    options.update({
+        'task_id': f"{batch_id}:{item['custom_id']}",
+        'response_content': content,
+        'usage': usage,
+        'stream': False,
+        'usage_metadata': {'mode': 'batch', 'batch_id': batch_id},
+    })
+    persist = {
+        'flashcards': _generate_flashcards_task,
+        'questions': _generate_questions_task,
+        'topics': _extract_topics_task,
+    }[item['task_type']]
+    return persist(item['uploaded_file_id'], item['upload_id'], options.get('session_id'), options)
+
+
+def register_tasks(celery_app):
+    """
+    Registriert die Batch-Tasks mit der Celery-App.
+
+    Args:
+        celery_app: Die Celery-App-Instanz.
+
+    Returns:
+        dict: Dictionary mit den registrierten Tasks.
+    """
+    tasks = {}
+
+    def _live_signature(item: Dict[str, Any]):
+        """Baut die Signatur, mit der ein Eintrag als normaler (Live-)AI-Task läuft."""
+        options = item.get('options') or {}
+        kwargs = {
+            'uploaded_file_id': item['uploaded_file_id'],
+            'upload_id': item['upload_id'],
+            'language': options.get('language', 'de'),
+            'options': options,
+        }
+        if item['task_type'] == 'flashcards':
+            kwargs['num_cards'] = options.get('num_cards', 5)
+        elif item['task_type'] == 'questions':
+            kwargs['num_questions'] = options.get('num_questions', 3)
+            kwargs['question_type'] = options.get('question_type', 'multiple_choice')
+        elif item['task_type'] == 'topics':
+            kwargs['max_topics'] = options.get('max_topics', 8)
+        # Nachgeholte Einträge bleiben Hintergrundarbeit und verdrängen keine interaktiven Uploads
+        return with_tier(celery_app.signature(BATCH_TASK_TYPES[item['task_type']], kwargs=kwargs), TIER_BULK)
+
+    def _finalize_file(uploaded_file_id: str, upload_id: str, persisted: List[Dict[str, Any]], live_signatures: list):
+        """
+        Schließt eine Datei des Batches ab.
+
+        Ohne Live-Nachholungen direkt über den Restzähler, sonst als Chord-Callback
+        der nachgeholten Tasks (wie bei ai.trigger_analysis_tasks).
+        """
+        finalize_kwargs = {'uploaded_file_id': uploaded_file_id, 'upload_id': upload_id}
+        if not live_signatures:
+            celery_app.signature('document.finalize_file', args=[persisted], kwargs=finalize_kwargs).apply_async()
+            return
+        finalize = with_tier(celery_app.signature('document.finalize_file', kwargs=finalize_kwargs), TIER_BULK)
+        finalize.on_error(with_tier(celery_app.signature('document.finalize_file_error', kwargs=finalize_kwargs), TIER_BULK))
+        chord(live_signatures)(finalize)
+
+    @celery_app.task(name='batch.submit_generation', bind=True, max_retries=3)
+    def submit_generation(self, items: List[Dict[str, Any]], provider: Optional[str] = None):
+        """
+        Reicht Generierungsanfragen als Batch-Auftrag ein.
+
+        Args:
+            items: Liste von {'task_type', 'uploaded_file_id', 'upload_id', 'options'}
+                   (options wie bei ai.trigger_analysis_tasks)
+            provider: Optionaler Provider-Name ('openai', 'local'), sonst BATCH_PROVIDER
+
+        Returns:
+            dict: Status, Batch-ID und Anzahl der eingereichten Anfragen
+        """
+        logger.info(f"[BATCH] Stelle Batch-Auftrag mit {len(items)} Einträgen zusammen")
+        requests = []
+        manifest_items = {}
+        skipped_files = {}
+
+        for index, item in enumerate(items):
+            task_type = item.get('task_type')
+            if task_type not in BATCH_TASK_TYPES:
+                logger.warning(f"[BATCH] Überspringe Eintrag mit unbekanntem Task-Typ: {task_type}")
+                continue
+            try:
+                text = load_extracted_text(item['uploaded_file_id'], log_prefix='BATCH')
+            except ValueError as e:
+                logger.error(f"[BATCH] Überspringe {task_type} für {item['uploaded_file_id']}: {e}")
+                skipped_files[item['uploaded_file_id']] = item.get('upload_id')
+                continue
+
+            custom_id = f"{task_type}:{item['uploaded_file_id']}:{index}"
+            requests.append({'custom_id': custom_id, 'body': _build_request(task_type, text, item.get('options') or {})})
+            manifest_items[custom_id] = dict(item, custom_id=custom_id)
+
+        # Dateien ohne Text erscheinen nicht im Manifest und werden hier als fehlgeschlagen abgeschlossen
+        batched_files = {item['uploaded_file_id'] for item in manifest_items.values()}
+        for uploaded_file_id, upload_id in skipped_files.items():
+            if uploaded_file_id not in batched_files:
+                _finalize_file(uploaded_file_id, upload_id, [{'status': 'error', 'error': 'no_extracted_text'}], [])
+
+        if not requests:
+            logger.warning("[BATCH] Keine gültigen Einträge, kein Batch-Auftrag eingereicht")
+            return {'status': 'no_tasks', 'batch_id': None, 'num_requests': 0}
+
+        input_path = write_batch_file(requests)
+        batch_provider = get_batch_provider(provider)
+        try:
+            batch_id = batch_provider.submit(input_path, metadata={'source': 'hackthestudy'})
+        except Exception as e:
+            logger.error(f"[BATCH] Fehler beim Einreichen des Batch-Auftrags: {e}", exc_info=True)
+            raise self.retry(exc=e, countdown=60)
+        finally:
+            if os.path.exists(input_path):
+                os.remove(input_path)
+
+        manifest = {
+            'provider': batch_provider.name,
+            'submitted_at': time.time(),
+            'items': manifest_items,
+        }
+        get_redis_client().set(batch_manifest_key(batch_id), json.dumps(manifest), ex=BATCH_MANIFEST_TTL)
+        logger.info(f"[BATCH] Batch-Auftrag {batch_id} mit {len(requests)} Anfragen eingereicht ({batch_provider.name})")
+
+        # Lokale Batches sind sofort fertig, echte Batches erst nach dem Abfrageintervall prüfen
+        countdown = 0 if batch_provider.name == 'local' else BATCH_POLL_INTERVAL
+        poll_generation.apply_async(args=[batch_id], countdown=countdown)
+        return {'status': 'submitted', 'batch_id': batch_id, 'num_requests': len(requests)}
+
+    tasks['batch.submit_generation'] = submit_generation
+
+    @celery_app.task(name='batch.poll_generation', bind=True, max_retries=3)
+    def poll_generation(self, batch_id: str):
+        """
+        Prüft den Status eines Batch-Auftrags und speichert die Ergebnisse.
+
+        Plant sich selbst neu ein, solange der Auftrag läuft. Einträge ohne
+        Ergebnis (Fehler, Ablauf, Abbruch) werden als Live-Tasks nachgeholt.
+
+        Args:
+            batch_id: ID des Batch-Auftrags
+
+        Returns:
+            dict: Status und Anzahl gespeicherter bzw. nachgeholter Einträge
+        """
+        redis_client = get_redis_client()
+        raw_manifest = redis_client.get(batch_manifest_key(batch_id))
+        if not raw_manifest:
+            logger.error(f"[BATCH] Kein Manifest für Batch {batch_id} gefunden")
+            return {'status': 'error', 'batch_id': batch_id, 'error': 'manifest_missing'}
+        manifest = json.loads(raw_manifest)
+        items = manifest['items']
+        batch_provider = get_batch_provider(manifest.get('provider'))
+
+        try:
+            status = batch_provider.get_status(batch_id)
+        except Exception as e:
+            logger.warning(f"[BATCH] Statusabfrage für {batch_id} fehlgeschlagen: {e}")
+            raise self.retry(exc=e, countdown=BATCH_POLL_INTERVAL)
+
+        state = status.get('status')
+        waited = time.time() - manifest.get('submitted_at', time.time())
+        if state not in BATCH_TERMINAL_STATES and waited < BATCH_MAX_WAIT:
+            logger.info(f"[BATCH] Batch {batch_id} noch nicht abgeschlossen (Status: {state}), nächste Prüfung in {BATCH_POLL_INTERVAL}s")
+            poll_generation.apply_async(args=[batch_id], countdown=BATCH_POLL_INTERVAL)
+            return {'status': 'pending', 'batch_id': batch_id, 'batch_status': state}
+
+        results = []
+        if state == 'completed' or status.get('output_file_id'):
+            try:
+                results = [parse_batch_result_line(line) for line in batch_provider.get_results(batch_id)]
+            except Exception as e:
+                logger.warning(f"[BATCH] Ergebnisse für {batch_id} konnten nicht geladen werden: {e}")
+                raise self.retry(exc=e, countdown=BATCH_POLL_INTERVAL)
+
+        saved = 0
+        persisted = {}
+        for result in results:
+            item = items.get(result['custom_id'])
+            if not item or result['error'] or result['content'] is None:
+                if item:
+                    logger.warning(f"[BATCH] Eintrag {result['custom_id']} fehlgeschlagen: {result['error']}")
+                continue
+            try:
+                persisted[result['custom_id']] = _persist_result(item, batch_id, result['content'], result['usage'])
+                saved += 1
+            except Exception as e:
+                logger.error(f"[BATCH] Fehler beim Speichern von {result['custom_id']}: {e}", exc_info=True)
+
+        # Fehlende Einträge live nachholen, damit kein Upload ohne Ergebnis bleibt;
+        # jede Datei wird danach genau einmal abgeschlossen
+        files = {}
+        for custom_id, item in items.items():
+            entry = files.setdefault(item['uploaded_file_id'], {'upload_id': item['upload_id'], 'persisted': [], 'live': []})
+            if custom_id in persisted:
+                entry['persisted'].append(persisted[custom_id])
+            else:
+                entry['live'].append(_live_signature(item))
+
+        fallback = 0
+        for uploaded_file_id, entry in files.items():
+            try:
+                _finalize_file(uploaded_file_id, entry['upload_id'], entry['persisted'], entry['live'])
+                fallback += len(entry['live'])
+            except Exception as e:
+                logger.error(f"[BATCH] Abschluss bzw. Live-Fallback für Datei {uploaded_file_id} fehlgeschlagen: {e}")
+
+        redis_client.delete(batch_manifest_key(batch_id))
+        logger.info(f"[BATCH] Batch {batch_id} abgeschlossen (Status: {state}): {saved} gespeichert, {fallback} live nachgeholt")
+        return {'status': 'completed', 'batch_id': batch_id, 'batch_status': state, 'saved': saved, 'fallback': fallback}
+
+    tasks['batch.poll_generation'] = poll_generation
+
+    return tasks
@@ -17,8 +17,11 @@ if base_dir not in sys.path:
     
 # Import aus dem lokalen models-Modul
 import tasks.models as models
-from tasks.models import ProcessingTask, Upload, UploadedFile, Flashcard, Topic, Question, get_db_session, db
-from .ai_tasks import DEFAULT_MODEL
+from tasks.models import ProcessingTask, Upload, UploadedFile, Flashcard, Topic, Question, get_db_session, session_scope
+from .upload_status import (finalize_uploaded_file, init_upload_counter, register_extracted_file,
+                            summarize_generation_results)
+from .pipeline import (SECTION_TASK_TYPES, WHOLE_DOCUMENT_TASK_TYPES, complete_pipeline_part, extract_pages,
+                       init_pipeline, plan_sections, store_section_text)
 
 # Logger konfigurieren
 logger = logging.getLogger(__name__)
@@ -69,8 +72,12 @@ else:
             'exists': os.path.exists(file_path)
         }
 
-from celery import current_app as celery_app, group
+from celery import current_app as celery_app
 from redis_utils.client import get_redis_client
+from config.queues import with_tier
+
+# 'per_file' (AI-Tasks pro Datei) oder 'merged' (ein gemeinsamer Satz Materialien pro Upload)
+UPLOAD_GENERATION_MODE = os.environ.get('UPLOAD_GENERATION_MODE', 'per_file')
 
 # --- Fallback-Funktionen definieren ---
 def _save_file_for_processing_fallback(file_content, file_name=None):
@@ -129,6 +136,92 @@ else:
     cleanup_temp_file = _cleanup_temp_file_fallback
     logger.warning("Echte 'cleanup_temp_file' Funktion nicht gefunden oder nicht aufrufbar, verwende Fallback.")
 
+def _get_num_files(db_session, task_metadata, upload_id):
+    """Anzahl der Dateien des Uploads (für den Restzähler), ohne die Dateien zu laden."""
+    if task_metadata.get('num_files'):
+        return int(task_metadata['num_files'])
+    upload = db_session.query(Upload).get(upload_id)
+    upload_metadata = upload.upload_metadata if upload else None
+    if isinstance(upload_metadata, str):
+        try:
+            upload_metadata = json.loads(upload_metadata)
+        except json.JSONDecodeError:
+            upload_metadata = None
+    if isinstance(upload_metadata, dict) and upload_metadata.get('num_files'):
+        return int(upload_metadata['num_files'])
+    return 1
+
+def _merged_generation_context(task_metadata, upload_id, num_files, user_id, session_id, language):
+    """Kontext der Upload-weiten Generierung oder None, wenn die Dateien einzeln verarbeitet werden."""
+    mode = task_metadata.get('execution_mode') or UPLOAD_GENERATION_MODE
+    if mode != 'merged' or not upload_id or num_files < 2:
+        return None
+    return {'num_files': num_files, 'user_id': user_id, 'session_id': session_id,
+            'language': language, 'task_metadata': task_metadata}
+
+def _register_merged_file(db_session, upload_id, uploaded_file_id, merged, ok):
+    """
+    Meldet eine extrahierte Datei; die letzte Datei startet die Upload-weite Generierung.
+
+    Fehler (Redis nicht erreichbar) werden weitergegeben, damit der Aufrufer die
+    Datei als fehlgeschlagen abschließt. Scheitert der Start der Generierung,
+    werden die bereits extrahierten Dateien abgeschlossen, weil sonst niemand
+    mehr auf sie wartet.
+    """
+    extracted_ids = register_extracted_file(upload_id, uploaded_file_id, merged['num_files'], ok=ok)
+    if not extracted_ids:
+        return None
+    logger.info(f"Alle Dateien von Upload {upload_id} extrahiert, starte Upload-weite Generierung für {len(extracted_ids)} Datei(en).")
+    try:
+        return with_tier(celery_app.signature('ai.generate_upload_materials', kwargs={
+            'upload_id': upload_id,
+            'uploaded_file_ids': extracted_ids,
+            'user_id': merged['user_id'],
+            'session_id': merged['session_id'],
+            'language': merged['language'],
+            'task_metadata': merged['task_metadata']
+        }), merged['task_metadata'].get('tier')).apply_async()
+    except Exception as e:
+        logger.error(f"❌ Upload-weite Generierung für Upload {upload_id} nicht gestartet: {e}", exc_info=True)
+        for file_id in extracted_ids:
+            if str(file_id) != str(uploaded_file_id):
+                finalize_uploaded_file(db_session, upload_id, file_id, failed=True,
+                                       error_message=f"Merged generation start failed: {e}")
+        raise
+
+def _fail_file(db_session, upload_id, uploaded_file_id, merged=None, error_message=None):
+    """Schließt eine Datei als fehlgeschlagen ab (und meldet sie bei Upload-weiter Generierung als ohne Text)."""
+    finalize_uploaded_file(db_session, upload_id, uploaded_file_id, failed=True, error_message=error_message)
+    if merged:
+        try:
+            _register_merged_file(db_session, upload_id, uploaded_file_id, merged, ok=False)
+        except Exception as e:
+            # Die Datei selbst ist abgeschlossen; ohne Redis kann die Upload-weite Generierung nicht starten
+            logger.error(f"❌ Fehlgeschlagene Datei {uploaded_file_id} nicht für Upload {upload_id} gemeldet: {e}")
+
+def _start_pipeline_part(context, source_id, task_types, counts=None):
+    """Startet die AI-Tasks eines Teils (Abschnitt bzw. Gesamttext) eines gepipelinten PDFs."""
+    return with_tier(celery_app.signature('ai.generate_document_section', kwargs=dict(
+        context, source_id=source_id, task_types=list(task_types), counts=counts
+    )), context['task_metadata'].get('tier')).apply_async()
+
+def _start_section(context, section, text):
+    """Legt den Text eines fertig extrahierten Abschnitts ab und startet seine Generierung sofort."""
+    try:
+        store_section_text(section['source_id'], text)
+        _start_pipeline_part(context, section['source_id'], SECTION_TASK_TYPES, section['counts'])
+        section['started'] = True
+        logger.info(f"[PIPELINE] Abschnitt {section['source_id']} (Seiten {section['start'] + 1}-{section['end']}) "
+                    f"extrahiert, Generierung gestartet: {section['counts']}")
+    except Exception as e:
+        logger.error(f"[PIPELINE] Abschnitt {section['source_id']} konnte nicht gestartet werden: {e}", exc_info=True)
+
+def _abandon_pipeline_parts(db_session, context, part_ids, error_message):
+    """Meldet nicht gestartete Teile als fehlgeschlagen, damit der letzte laufende Teil die Datei abschließt."""
+    for part_id in part_ids:
+        complete_pipeline_part(db_session, context['upload_id'], context['uploaded_file_id'], part_id,
+                               [{'status': 'error', 'error': error_message}])
+
 def process_document(task_id):
     """
     Verarbeitet ein Dokument basierend auf einem ProcessingTask.
@@ -150,22 +243,26 @@ def process_document(task_id):
     uploaded_file = None # Initialisieren
     task = None # Initialisieren
     db_session = None # Initialisieren
+    upload_id = None # Initialisieren
+    uploaded_file_id = None # Initialisieren
+    merged = None # Kontext der Upload-weiten Generierung (falls aktiv)
+    sections = [] # Abschnitte eines gepipelinten PDFs (tasks/pipeline.py)
     
     try:
         db_session = get_db_session()
         
         # 1. ProcessingTask laden
-            task = db_session.query(ProcessingTask).get(task_id)
+        task = db_session.query(ProcessingTask).get(task_id)
         if not task:
             error_msg = f"ProcessingTask mit ID {task_id} nicht gefunden."
             logger.error(error_msg)
             # Kann hier nicht viel mehr tun, da kein Task-Kontext
             return {'task_id': task_id, 'status': 'error', 'error': 'TASK_NOT_FOUND', 'message': error_msg}
 
-                # Task-Status aktualisieren
-                task.status = "processing"
-                task.started_at = datetime.now()
-                db_session.commit()
+        # Task-Status aktualisieren
+        task.status = "processing"
+        task.started_at = datetime.now()
+        db_session.commit()
         
         # 2. Notwendige Metadaten aus dem Task extrahieren
         task_metadata = task.task_metadata or {}
@@ -180,12 +277,18 @@ def process_document(task_id):
         if not uploaded_file_id:
             error_msg = f"Keine uploaded_file_id in den Metadaten von Task {task_id} gefunden."
             logger.error(error_msg)
-                task.status = "error"
-                task.error_message = error_msg
-                task.completed_at = datetime.now()
-                db_session.commit()
+            task.status = "error"
+            task.error_message = error_msg
+            task.completed_at = datetime.now()
+            db_session.commit()
             return {'task_id': task_id, 'status': 'error', 'error': 'MISSING_METADATA', 'message': error_msg, 'session_id': session_id}
 
+        # Restzähler des Uploads anlegen (nur der erste Task eines Uploads setzt ihn)
+        if upload_id:
+            num_files = _get_num_files(db_session, task_metadata, upload_id)
+            init_upload_counter(upload_id, num_files)
+            merged = _merged_generation_context(task_metadata, upload_id, num_files, user_id, session_id, language)
+
         # 3. Zugehöriges UploadedFile laden
         uploaded_file = db_session.query(UploadedFile).get(uploaded_file_id)
         if not uploaded_file:
@@ -195,6 +298,7 @@ def process_document(task_id):
             task.error_message = error_msg
             task.completed_at = datetime.now()
             db_session.commit()
+            _fail_file(db_session, upload_id, uploaded_file_id, merged)
             return {'task_id': task_id, 'status': 'error', 'error': 'UPLOADED_FILE_NOT_FOUND', 'message': error_msg, 'session_id': session_id}
 
         # Status des UploadedFile aktualisieren
@@ -216,8 +320,7 @@ def process_document(task_id):
             uploaded_file.extraction_status = "error"
             uploaded_file.extraction_info = {'error': 'NO_FILE_CONTENT'}
             db_session.commit()
-            # Ggf. Gesamt-Upload-Status aktualisieren
-            # check_and_update_overall_upload_status(db_session, upload_id)
+            _fail_file(db_session, upload_id, uploaded_file_id, merged)
             return {'task_id': task_id, 'status': 'error', 'error': 'NO_FILE_CONTENT', 'message': error_msg, 'session_id': session_id}
 
         logger.info(f"Verarbeite UploadedFile: {file_name} (ID: {uploaded_file_id}), Typ: {file_type}, Größe: {len(file_content)} Bytes")
@@ -241,12 +344,29 @@ def process_document(task_id):
 
             # --- Textextraktionslogik --- Start ---
             try:
-            if file_type == 'pdf':
-                try:
-                    import fitz  # PyMuPDF
-                    doc = fitz.open(temp_file_path)
-                    page_count = len(doc)
-                        document_text = "\n".join(page.get_text() for page in doc)
+                if file_type == 'pdf':
+                    try:
+                        import fitz  # PyMuPDF
+                        doc = fitz.open(temp_file_path)
+                        page_count = len(doc)
+                        # Lange PDFs: Generierung der ersten Abschnitte startet schon während der Extraktion
+                        if upload_id and not merged:
+                            sections = plan_sections(uploaded_file_id, page_count, task_metadata)
+                        if sections:
+                            try:
+                                init_pipeline(uploaded_file_id, len(sections) + 1)
+                            except Exception as pipeline_err:
+                                logger.warning(f"[PIPELINE] Zähler nicht verfügbar, extrahiere am Stück: {pipeline_err}")
+                                sections = []
+                        if sections:
+                            pipeline_context = {'uploaded_file_id': uploaded_file_id, 'upload_id': upload_id,
+                                                'user_id': user_id, 'session_id': session_id,
+                                                'language': language, 'task_metadata': task_metadata}
+                            extraction_details['pipeline_sections'] = len(sections)
+                            document_text = extract_pages(
+                                doc, sections, lambda section, text: _start_section(pipeline_context, section, text))
+                        else:
+                            document_text = "\n".join(page.get_text() for page in doc)
                         extraction_details['pages'] = page_count
                         logger.info(f"✅ PDF-Text extrahiert ({page_count} Seiten)")
                         extraction_successful = True
@@ -258,23 +378,23 @@ def process_document(task_id):
                         extraction_details['error'] = f"PDF extraction failed: {str(pdf_err)}"
 
                 elif file_type in ['docx', 'vnd.openxmlformats-officedocument.wordprocessingml.document', 'doc', 'msword']:
-                try:
-                    import docx
-                    doc = docx.Document(temp_file_path)
-                    document_text = "\n".join([para.text for para in doc.paragraphs])
+                    try:
+                        import docx
+                        doc = docx.Document(temp_file_path)
+                        document_text = "\n".join([para.text for para in doc.paragraphs])
                         logger.info(f"✅ Word-Text extrahiert.")
                         extraction_successful = True
-                except ImportError:
+                    except ImportError:
                         logger.error(f"❌ python-docx nicht installiert.")
                         raise RuntimeError("python-docx ist für die Word-Verarbeitung erforderlich.")
                     except Exception as docx_err:
                         logger.error(f"❌ Fehler bei Word-Textextraktion: {str(docx_err)}", exc_info=True)
                         extraction_details['error'] = f"Word extraction failed: {str(docx_err)}"
-            else:
+                else:
                     # Generische Textverarbeitung (versucht als Text zu lesen)
-                try:
-                    with open(temp_file_path, 'r', encoding='utf-8', errors='ignore') as f:
-                        document_text = f.read()
+                    try:
+                        with open(temp_file_path, 'r', encoding='utf-8', errors='ignore') as f:
+                            document_text = f.read()
                         logger.info(f"✅ Generischer Text gelesen (Annahme: Textdatei).")
                         extraction_successful = True # Nehmen wir an, es hat geklappt, wenn keine Exception
                     except Exception as txt_err:
@@ -293,7 +413,7 @@ def process_document(task_id):
 
             # 7. Ergebnisse der Extraktion im UploadedFile speichern
             if document_text is not None:
-                    char_count = len(document_text)
+                char_count = len(document_text)
                 estimated_tokens = char_count // 4 # Grobe Schätzung
                 uploaded_file.extracted_text = document_text
                 uploaded_file.extraction_status = 'completed' if extraction_successful else 'error'
@@ -301,7 +421,7 @@ def process_document(task_id):
                 extraction_details['estimated_tokens'] = estimated_tokens
                 uploaded_file.extraction_info = extraction_details
                 logger.info(f"💾 Extraktion abgeschlossen ({uploaded_file.extraction_status}): {char_count} Zeichen, {estimated_tokens} geschätzte Tokens.")
-                extraction_success = True
+                extraction_success = extraction_successful
             else:
                 uploaded_file.extraction_status = 'error'
                 uploaded_file.extraction_info = extraction_details if extraction_details else {'error': 'No text could be extracted'}
@@ -323,87 +443,57 @@ def process_document(task_id):
             else:
                 logger.warning(f"Überspringe Redis-Speicherung für {uploaded_file_id} da Extraktion fehlgeschlagen.")
 
-            # 9. Starte AI-Tasks als Gruppe (nur bei Erfolg)
-            ai_task_group_id = None
-            if extraction_success:
+            # 9. Starte AI-Tasks (Chord mit Abschluss-Callback, nur bei Erfolg)
+            ai_started = False
+            if extraction_success and merged:
+                # Upload-weite Generierung: die letzte extrahierte Datei startet sie für alle
                 try:
-                    logger.info(f"🔍 Starte AI Task Gruppe für UploadedFile ID {uploaded_file_id} ...")
-
-                    # Importiere Celery App sicher
-                    if not celery_app or not callable(celery_app.signature):
-                         raise RuntimeError("Celery App konnte nicht geladen werden oder hat keine Signatur.")
-
-                    # Stelle sicher, dass AI Tasks registriert sind (nur zur Info, Registrierung erfolgt beim Start)
-                    # ai_tasks_dict = celery_app.tasks # Dictionary der registrierten Tasks
-
-                    # Argumente für alle Tasks
-                common_kwargs = {
+                    _register_merged_file(db_session, upload_id, uploaded_file_id, merged, ok=True)
+                    ai_started = True
+                except Exception as ai_err:
+                    logger.error(f"❌ Fehler beim Melden der Datei für die Upload-weite Generierung: {ai_err}", exc_info=True)
+                    task.error_message = f"Merged generation start failed: {ai_err}"
+            elif extraction_success and sections:
+                # Abschnitte laufen bereits; die Themen brauchen den Gesamttext
+                try:
+                    topics_result = _start_pipeline_part(pipeline_context, uploaded_file_id, WHOLE_DOCUMENT_TASK_TYPES)
+                    ai_started = True
+                    task.result_data = dict(task.result_data or {}, ai_trigger_task_id=topics_result.id)
+                    logger.info(f"--> [PIPELINE] Gesamttext-Tasks gestartet. Task ID: {topics_result.id}")
+                except Exception as ai_err:
+                    logger.error(f"❌ Fehler beim Starten der Gesamttext-Tasks: {ai_err}", exc_info=True)
+                    task.error_message = f"Pipeline whole-document start failed: {ai_err}"
+            elif extraction_success:
+                try:
+                    logger.info(f"🔍 Starte AI-Tasks für UploadedFile ID {uploaded_file_id} ...")
+                    trigger_result = with_tier(celery_app.signature('ai.trigger_analysis_tasks', kwargs={
                         'uploaded_file_id': uploaded_file_id,
-                    'upload_id': upload_id,
+                        'upload_id': upload_id,
+                        'user_id': user_id,
+                        'session_id': session_id,
                         'language': language,
-                        'options': { # Übergebe Optionen als verschachteltes Dict
-                             'user_id': user_id,
-                             'session_id': session_id,
-                             'model': task_metadata.get('model', DEFAULT_MODEL),
-                             'num_cards': task_metadata.get('num_flashcards', 5),
-                             'num_questions': task_metadata.get('num_questions', 3),
-                             'question_type': task_metadata.get('question_type', 'multiple_choice'),
-                             'max_topics': task_metadata.get('max_topics', 8)
-                        }
-                    }
-
-                    tasks_to_run_signatures = []
-
-                    # Flashcards Signatur erstellen
-                    try:
-                    flashcard_kwargs = common_kwargs.copy()
-                        flashcard_kwargs['num_cards'] = common_kwargs['options']['num_cards']
-                        tasks_to_run_signatures.append(celery_app.signature('ai.generate_flashcards', kwargs=flashcard_kwargs))
-                        logger.info("--> Signatur für ai.generate_flashcards erstellt.")
-                    except KeyError as e:
-                        logger.warning(f"Task ai.generate_flashcards nicht gefunden oder Argument {e} fehlt.")
-                        
-                    # Questions Signatur erstellen
-                    try:
-                    question_kwargs = common_kwargs.copy()
-                        question_kwargs['num_questions'] = common_kwargs['options']['num_questions']
-                        question_kwargs['question_type'] = common_kwargs['options']['question_type']
-                        tasks_to_run_signatures.append(celery_app.signature('ai.generate_questions', kwargs=question_kwargs))
-                        logger.info("--> Signatur für ai.generate_questions erstellt.")
-                    except KeyError as e:
-                        logger.warning(f"Task ai.generate_questions nicht gefunden oder Argument {e} fehlt.")
-
-                    # Topics Signatur erstellen
-                    try:
-                    topic_kwargs = common_kwargs.copy()
-                        topic_kwargs['max_topics'] = common_kwargs['options']['max_topics']
-                        tasks_to_run_signatures.append(celery_app.signature('ai.extract_topics', kwargs=topic_kwargs))
-                        logger.info("--> Signatur für ai.extract_topics erstellt.")
-                    except KeyError as e:
-                         logger.warning(f"Task ai.extract_topics nicht gefunden oder Argument {e} fehlt.")
-
-                    # Starte die Gruppe
-                if tasks_to_run_signatures:
-                        logger.info(f"--> Starte Gruppe mit {len(tasks_to_run_signatures)} AI-Tasks...")
-                    task_group = group(tasks_to_run_signatures)
-                    group_result = task_group.apply_async()
-                        ai_task_group_id = group_result.id
-                        logger.info(f"--> AI Task Gruppe gestartet. Group ID: {ai_task_group_id}")
-                        task.result_data = task.result_data or {}
-                        task.result_data['ai_task_group_id'] = ai_task_group_id
-                else:
-                        logger.warning("Keine gültigen AI-Task-Signaturen zum Starten vorhanden.")
-
-            except Exception as ai_err:
-                    logger.error(f"❌ Fehler beim Vorbereiten/Starten der AI Task Gruppe: {ai_err}", exc_info=True)
+                        'task_metadata': task_metadata
+                    }), task_metadata.get('tier')).apply_async()
+                    ai_started = True
+                    task.result_data = dict(task.result_data or {}, ai_trigger_task_id=trigger_result.id)
+                    logger.info(f"--> AI-Trigger gestartet. Task ID: {trigger_result.id}")
+                except Exception as ai_err:
+                    logger.error(f"❌ Fehler beim Starten der AI-Tasks: {ai_err}", exc_info=True)
                     task.error_message = (task.error_message + f" | AI Group Start Failed: {ai_err}") if task.error_message else f"AI Group Start Failed: {ai_err}"
-                    # Setze Task-Status auf Fehler, wenn Gruppe nicht gestartet werden kann?
-                    task.status = "error"
             else:
                  logger.warning(f"Überspringe AI-Tasks für {uploaded_file_id}, da Extraktion fehlgeschlagen.")
 
-            # 10. Task abschließen (Status basiert auf Extraktion UND ob AI gestartet wurde?)
-            # Derzeit basiert er nur auf Extraktion. Das ist OK, da die AI-Tasks asynchron laufen.
+            # Gepipelintes PDF: nicht gestartete Teile als fehlgeschlagen melden, den Abschluss übernimmt der letzte Teil
+            if sections:
+                unstarted = [section['source_id'] for section in sections if not section.get('started')]
+                if any(section.get('started') for section in sections) or ai_started:
+                    if not ai_started:
+                        unstarted.append(uploaded_file_id)
+                    _abandon_pipeline_parts(db_session, pipeline_context, unstarted,
+                                            task.error_message or f"Text extraction failed for {file_name}")
+                    ai_started = True
+
+            # 10. Task abschließen (Status basiert auf der Extraktion; die AI-Tasks laufen asynchron)
             task.status = "completed" if extraction_success else "error"
             if task.status == 'error' and not task.error_message:
                  task.error_message = f"Text extraction failed for {file_name}"
@@ -411,9 +501,9 @@ def process_document(task_id):
             db_session.commit() # Commit für Task-Status
             logger.info(f"✅ Task {task_id} abgeschlossen mit Status: {task.status}")
 
-            # 11. Gesamtstatus des Uploads aktualisieren!
-            check_and_update_overall_upload_status(db_session, upload_id)
-            db_session.commit() # Wichtig: Commit nach Status-Update
+            # 11. Ohne AI-Tasks gibt es keinen Chord-Callback: Datei direkt abschließen
+            if not ai_started:
+                _fail_file(db_session, upload_id, uploaded_file_id, merged, error_message=task.error_message)
 
             return {
                 'task_id': task_id,
@@ -443,10 +533,9 @@ def process_document(task_id):
                            uploaded_file.extraction_info = uploaded_file.extraction_info or {}
                            uploaded_file.extraction_info['error'] = f"Unexpected task error: {str(e)}"
                  db_session.commit()
-                 # Auch hier Gesamtstatus prüfen!
-                 if upload_id: # Nur wenn upload_id bekannt ist
-                      check_and_update_overall_upload_status(db_session, upload_id)
-                      db_session.commit()
+                 # Datei als fehlgeschlagen abschließen, damit der Upload nicht hängen bleibt
+                 if upload_id and uploaded_file_id:
+                      _fail_file(db_session, upload_id, uploaded_file_id, merged)
              except Exception as final_db_err:
                   logger.error(f"Fehler beim Speichern des finalen Fehlerstatus für Task {task_id}: {final_db_err}")
                   if db_session: db_session.rollback()
@@ -478,7 +567,7 @@ def register_tasks(celery_app):
         """
         logger.info(f"Celery Task document.process_document gestartet für Task-ID: {task_id}")
         try:
-        # Rufe die eigentliche Verarbeitungsfunktion auf
+            # Rufe die eigentliche Verarbeitungsfunktion auf
             result = process_document(task_id)
             logger.info(f"Celery Task document.process_document für Task-ID {task_id} Ergebnis: {result.get('status')}")
             return result
@@ -487,77 +576,101 @@ def register_tasks(celery_app):
              # Wiederholung nach Fehler (Celery's default behavior mit max_retries)
              try:
                  # Versuche, den Fehler im DB Task zu speichern
-                 db_session = get_db_session()
-                 task = db_session.query(ProcessingTask).get(task_id)
-                 if task:
-                     task.status = "failed" # Oder behalte 'error'?
-                     task.error_message = f"Celery task failed after retries: {str(exc)}"
-                     task.completed_at = datetime.now()
-                     db_session.commit()
-                     # check_and_update_overall_upload_status(db_session, task.upload_id)
-                 db_session.close()
+                 with session_scope() as db_session:
+                     task = db_session.query(ProcessingTask).get(task_id)
+                     if task:
+                         task.status = "failed" # Oder behalte 'error'?
+                         task.error_message = f"Celery task failed after retries: {str(exc)}"
+                         task.completed_at = datetime.now()
              except Exception as db_log_err:
                  logger.error(f"Konnte finalen Fehlerstatus nicht in DB speichern für Task {task_id}: {db_log_err}")
              # Task erneut auslösen für Wiederholung
              raise self.retry(exc=exc, countdown=60 * self.request.retries)
     
     tasks['document.process_document'] = process_document_task
-    return tasks
 
-# --- Hilfsfunktion zum Aktualisieren des Gesamtstatus --- #
-def check_and_update_overall_upload_status(db_session, upload_id):
-    """
-    Prüft den Status aller UploadedFile-Einträge für einen Upload
-    und aktualisiert den overall_processing_status des Uploads.
-    """
-    if not upload_id:
-        return
+    @celery_app.task(name='document.finalize_file')
+    def finalize_file_task(results, uploaded_file_id, upload_id, uploaded_file_ids=None):
+        """
+        Chord-Callback: Schließt eine Datei ab, sobald alle ihre AI-Tasks fertig sind.
 
-    try:
-        upload = db_session.query(Upload).options(db.joinedload(Upload.files)).get(upload_id)
-        if not upload:
-            logger.warning(f"Upload {upload_id} nicht gefunden für Statusaktualisierung.")
-            return
-
-        all_files = upload.files.all() # Alle zugehörigen Dateien laden
-        if not all_files:
-            # Wenn keine Dateien (mehr) da sind, Status auf 'completed' oder 'error' setzen?
-            if upload.overall_processing_status != 'completed':
-                 logger.info(f"Keine Dateien für Upload {upload_id} gefunden. Setze Status auf 'completed'.")
-                 upload.overall_processing_status = 'completed'
-                 upload.updated_at = datetime.now()
-            return
-
-        num_files = len(all_files)
-        num_completed = sum(1 for f in all_files if f.extraction_status == 'completed')
-        num_failed = sum(1 for f in all_files if f.extraction_status == 'error')
-        num_pending_or_processing = num_files - num_completed - num_failed
-
-        new_status = upload.overall_processing_status
-
-        if num_pending_or_processing > 0:
-            new_status = 'processing'
-        elif num_failed > 0:
-            # Wenn mindestens eine Datei fehlgeschlagen ist, Gesamtstatus auf 'error'
-            new_status = 'error'
-            # Optional: Fehlermeldungen sammeln
-            error_messages = [f.extraction_info.get('error', 'Unknown error') for f in all_files if f.extraction_status == 'error']
-            upload.error_message = " | ".join(error_messages)
-        elif num_completed == num_files:
-            # Alle Dateien erfolgreich verarbeitet
-            new_status = 'completed'
-            upload.error_message = None # Fehler löschen
-
-        if new_status != upload.overall_processing_status:
-            logger.info(f"Aktualisiere Gesamtstatus für Upload {upload_id} von '{upload.overall_processing_status}' zu '{new_status}'.")
-            upload.overall_processing_status = new_status
-            upload.updated_at = datetime.now()
-            # Commit wird außerhalb dieser Funktion erwartet
+        Args:
+            results: Rückgabewerte der AI-Tasks
+            uploaded_file_id: ID der Datei
+            upload_id: ID des Uploads
+            uploaded_file_ids: Alle Dateien der Upload-weiten Generierung (statt uploaded_file_id)
+        """
+        summary, failed = summarize_generation_results(results)
+        with session_scope() as db_session:
+            upload_status = None
+            for file_id in uploaded_file_ids or [uploaded_file_id]:
+                upload_status = finalize_uploaded_file(db_session, upload_id, file_id, failed=failed, summary=summary) or upload_status
+        return {'uploaded_file_id': uploaded_file_id, 'upload_id': upload_id, 'failed': failed, 'upload_status': upload_status}
 
-    except Exception as e:
-        logger.error(f"Fehler beim Aktualisieren des Gesamtstatus für Upload {upload_id}: {e}", exc_info=True)
-        # Hier keinen Rollback machen, da dies in einem größeren Kontext aufgerufen wird
+    tasks['document.finalize_file'] = finalize_file_task
+
+    @celery_app.task(name='document.finalize_file_error')
+    def finalize_file_error_task(request, exc, traceback, uploaded_file_id, upload_id, uploaded_file_ids=None):
+        """
+        Fehler-Callback des Chords: Schließt die Datei als fehlgeschlagen ab.
+
+        Args:
+            request: Request des fehlgeschlagenen Tasks
+            exc: Aufgetretene Exception
+            traceback: Traceback als Text
+            uploaded_file_id: ID der Datei
+            upload_id: ID des Uploads
+            uploaded_file_ids: Alle Dateien der Upload-weiten Generierung (statt uploaded_file_id)
+        """
+        logger.error(f"[UPLOAD STATUS] AI-Chord für Datei(en) {uploaded_file_ids or uploaded_file_id} fehlgeschlagen: {exc}")
+        with session_scope() as db_session:
+            upload_status = None
+            for file_id in uploaded_file_ids or [uploaded_file_id]:
+                upload_status = finalize_uploaded_file(db_session, upload_id, file_id, failed=True,
+                                                       error_message=f"AI tasks failed: {exc}") or upload_status
+        return {'uploaded_file_id': uploaded_file_id, 'upload_id': upload_id, 'failed': True, 'upload_status': upload_status}
+
+    tasks['document.finalize_file_error'] = finalize_file_error_task
+
+    @celery_app.task(name='document.finalize_pipeline_part')
+    def finalize_pipeline_part_task(results, uploaded_file_id, upload_id, part_id):
+        """
+        Chord-Callback eines Teils eines gepipelinten PDFs (tasks/pipeline.py).
+
+        Der letzte fertige Teil schließt die Datei mit den Ergebnissen aller Teile ab.
 
-# WICHTIG: Die Funktion check_and_update_overall_upload_status muss noch
-# an den richtigen Stellen im Code aufgerufen werden, z.B. am Ende von
-# process_document oder in einem separaten Task, der auf das Ende der AI Group wartet.
+        Args:
+            results: Rückgabewerte der AI-Tasks des Teils
+            uploaded_file_id: ID der Datei
+            upload_id: ID des Uploads
+            part_id: Quelle des Teils (Abschnitts-ID bzw. Datei-ID für den Gesamttext)
+        """
+        with session_scope() as db_session:
+            completed = complete_pipeline_part(db_session, upload_id, uploaded_file_id, part_id, results)
+        return {'uploaded_file_id': uploaded_file_id, 'upload_id': upload_id, 'part_id': part_id,
+                'file_completed': completed is not None, **(completed or {})}
+
+    tasks['document.finalize_pipeline_part'] = finalize_pipeline_part_task
+
+    @celery_app.task(name='document.finalize_pipeline_part_error')
+    def finalize_pipeline_part_error_task(request, exc, traceback, uploaded_file_id, upload_id, part_id):
+        """
+        Fehler-Callback des Chords eines Teils: meldet den Teil als fehlgeschlagen.
+
+        Args:
+            request: Request des fehlgeschlagenen Tasks
+            exc: Aufgetretene Exception
+            traceback: Traceback als Text
+            uploaded_file_id: ID der Datei
+            upload_id: ID des Uploads
+            part_id: Quelle des Teils
+        """
+        logger.error(f"[PIPELINE] AI-Chord für Teil {part_id} fehlgeschlagen: {exc}")
+        with session_scope() as db_session:
+            completed = complete_pipeline_part(db_session, upload_id, uploaded_file_id, part_id,
+                                               [{'status': 'error', 'error': f"AI tasks failed: {exc}"}])
+        return {'uploaded_file_id': uploaded_file_id, 'upload_id': upload_id, 'part_id': part_id,
+                'file_completed': completed is not None, **(completed or {})}
+
+    tasks['document.finalize_pipeline_part_error'] = finalize_pipeline_part_error_task
+    return tasks
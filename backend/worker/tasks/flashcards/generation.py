@@ -8,7 +8,7 @@ Dieses Modul enthält Funktionen zur KI-gestützten Generierung von Flashcards.
 import json
 import logging
 import os
-from typing import List, Dict, Any, Optional
+from typing import Any, Callable, Dict, List, Optional
 import datetime
 import hashlib
 
@@ -16,9 +16,88 @@ import hashlib
 logger = logging.getLogger(__name__)
 
 # Absolute Imports verwenden statt relativer Imports
-from utils.call_openai import call_openai_api, extract_json_from_response
-from config.prompts import get_system_prompt, get_user_prompt
+from utils.call_openai import call_openai_api, call_openai_api_stream, extract_json_from_response
+from utils.continuation import complete_truncated, finish_reason
+from utils.fanout import plan_fanout, run_fanout
+from utils.json_stream import IncrementalArrayItemParser
+from utils.near_duplicates import NearDuplicateIndex, filter_near_duplicates, flashcard_text
+from utils.prompt_budget import fit_document
+from utils.token_counter import count_tokens
+from config.prompts import build_budgeted_messages
 from redis_utils.client import get_redis_client
+from redis_utils.single_flight import acquire_single_flight, release_single_flight, wait_for_single_flight
+from redis_utils.semantic_cache import lookup_semantic_cache, store_semantic_cache
+
+# Parameter der Completion für Lernkarten
+FLASHCARDS_TEMPERATURE = 0.7
+FLASHCARDS_MAX_TOKENS = 2000
+# Nachträglich generierte Antworten: Antwortlänge und Kontext (Tokens)
+ANSWER_MAX_TOKENS = 300
+ANSWER_CONTEXT_TOKENS = int(os.environ.get('ANSWER_CONTEXT_TOKENS', 2000))
+# Geschätzte Ausgabe-Tokens pro Karte (Antwort bis 450 Zeichen plus Frage und JSON)
+FLASHCARD_TOKENS_PER_ITEM = int(os.environ.get('FLASHCARD_TOKENS_PER_ITEM', 160))
+
+def build_flashcards_request(content: str, num_cards: int = 10, language: str = 'de', model: str = None,
+                             focus=None, exclude=None) -> Dict[str, Any]:
+    """
+    Baut die Parameter der Chat-Completion für die Lernkarten-Generierung.
+
+    Wird sowohl für direkte API-Aufrufe als auch für Batch-Aufträge verwendet.
+
+    Args:
+        content: Der Text, aus dem Karten generiert werden sollen
+        num_cards: Anzahl der zu generierenden Karten
+        language: Sprachcode
+        model: Zu verwendendes Modell
+        focus: (i, N) für Teilanfrage i von N (siehe utils/fanout.py)
+        exclude: Bereits erstellte Kartenvorderseiten (Folgeanfrage, siehe utils/continuation.py)
+
+    Returns:
+        dict: model, messages, temperature, max_tokens und response_format
+    """
+    model = model or os.environ.get('OPENAI_DEFAULT_MODEL', 'gpt-3.5-turbo')
+    return {
+        "model": model,
+        "messages": build_budgeted_messages("flashcards", content, model, FLASHCARDS_MAX_TOKENS, language=language,
+                                            num_cards=num_cards, focus=focus, exclude=exclude),
+        "temperature": FLASHCARDS_TEMPERATURE,
+        "max_tokens": FLASHCARDS_MAX_TOKENS,
+        "response_format": {"type": "json_object"}
+    }
+
+def flashcards_cache_key(content: str, num_cards: int, language: str, model: str, part=None) -> str:
+    """Gibt den Redis-Cache-Schlüssel für eine Lernkarten-Antwort (bzw. Teilanfrage) zurück."""
+    # Verwende nur die ersten 20k Zeichen des Inhalts für den Hash, um Performance zu schonen
+    combined_key_material = f"{content[:20000]}-num:{num_cards}-lang:{language}-model:{model}"
+    if part:
+        combined_key_material += f"-part:{part[0]}/{part[1]}"
+    return f"openai_cache:flashcards:{hashlib.sha256(combined_key_material.encode('utf-8')).hexdigest()}"
+
+def _make_card_stream_handler(on_card: Callable[[Dict[str, str]], None]) -> Callable[[str], None]:
+    """
+    Erstellt einen Delta-Handler, der vollständige Karten aus dem Stream meldet.
+
+    Args:
+        on_card: Callback, der für jede fertige Karte mit {'question', 'answer'} aufgerufen wird
+
+    Returns:
+        Callable: Handler für call_openai_api_stream(on_delta=...)
+    """
+    parser = IncrementalArrayItemParser()
+
+    def handle_delta(delta: str) -> None:
+        for card in parser.feed(delta):
+            question = str(card.get('question', card.get('front', ''))).strip()
+            answer = str(card.get('answer', card.get('back', ''))).strip()
+            if not (question and answer):
+                # Karten ohne Antwort werden später regulär nachbearbeitet
+                continue
+            try:
+                on_card({'question': question, 'answer': answer})
+            except Exception as e:
+                logger.warning(f"[FLASHCARDS] Fehler im on_card-Callback: {e}")
+
+    return handle_delta
 
 def generate_flashcards_with_openai(
     extracted_text: str,
@@ -34,7 +113,11 @@ def generate_flashcards_with_openai(
         extracted_text (str): Der Text, aus dem Karten generiert werden sollen.
         num_cards (int): Anzahl der zu generierenden Karten.
         language (str): Sprachcode (de, en, fr, es, ...).
-        **options: Weitere Optionen (z.B. 'model').
+        **options: Weitere Optionen (z.B. 'model'). Mit 'on_card' (Callable) wird die
+            Antwort gestreamt und jede fertige Karte sofort an den Callback übergeben.
+            Passen num_cards Karten nicht in eine Completion, wird die Anfrage in parallele
+            Teilanfragen ('fanout_part') aufgeteilt. 'semantic_cache': False überspringt den
+            Ähnlichkeits-Cache (Nachgenerierung, Folgeanfragen).
 
     Returns:
         dict: Enthält {"flashcards": List[Dict], "usage": Dict} oder leeres Dict bei Fehler.
@@ -52,72 +135,100 @@ def generate_flashcards_with_openai(
          logger.error("[FLASHCARDS] Kein Text zur Verarbeitung übergeben.")
          return {"flashcards": [], "usage": None} # Leeres Ergebnis
 
-    response_content = None
+    # Große Anfragen: parallele Teilanfragen mit disjunktem Fokus statt einer abgeschnittenen Antwort
+    fanout_part = options.get('fanout_part')
+    if fanout_part is None and options.get('response_content') is None:
+        sizes = plan_fanout(num_cards, FLASHCARD_TOKENS_PER_ITEM, FLASHCARDS_MAX_TOKENS)
+        if len(sizes) > 1:
+            merged = run_fanout(generate_flashcards_with_openai, 'flashcards', sizes, 'num_cards',
+                                on_item_kwarg='on_card', extracted_text=content, language=language, **options)
+            cards, duplicates = filter_near_duplicates(merged['flashcards'], NearDuplicateIndex(), flashcard_text)
+            logger.info(f"[FLASHCARDS] {len(cards)} Karten aus {merged['fanout']} Teilanfragen "
+                        f"({len(duplicates)} Duplikate entfernt)")
+            return {"flashcards": cards, "usage": merged['usage']}
+    exclude = options.get('exclude')
+    continuation_depth = options.get('continuation_depth', 0)
+
+    # Vorberechnete Antwort (z.B. aus einem Batch-Auftrag) überspringt Cache und API
+    response_content = options.get('response_content')
+    usage = options.get('usage')
     cache_key = None
     CACHE_TTL = 86400 * 7 # 7 Tage
-    try:
-        # Erstelle einen eindeutigen Hash basierend auf Inhalt und Parametern
-        # (Verwende nur die ersten X Zeichen des Inhalts für den Hash, um Performance zu schonen)
-        content_hash_part = content[:20000] # Beispiel: erste 20k Zeichen
-        params_str = f"num:{num_cards}-lang:{language}-model:{model}"
-        combined_key_material = f"{content_hash_part}-{params_str}"
-        cache_key = f"openai_cache:flashcards:{hashlib.sha256(combined_key_material.encode('utf-8')).hexdigest()}"
-        
-        cached_response = get_redis_client().get(cache_key)
-        if cached_response:
-            response_content = cached_response.decode('utf-8')
-            logger.info(f"[CACHE HIT] Antwort aus Redis-Cache geladen für Key: {cache_key}")
-            # Überspringe API-Aufruf, gehe direkt zur JSON-Extraktion
-        else:
-            logger.info(f"[CACHE MISS] Kein Cache-Eintrag gefunden für Key: {cache_key}")
+    # Folgeanfragen (exclude) nicht cachen: der Schlüssel bildet die ausgeschlossenen Karten nicht ab
+    if response_content is None and not exclude:
+        try:
+            cache_key = flashcards_cache_key(content, num_cards, language, model, part=fanout_part)
+            cached_response = get_redis_client().get(cache_key)
+            if cached_response:
+                response_content = cached_response.decode('utf-8') if isinstance(cached_response, bytes) else cached_response
+                logger.info(f"[CACHE HIT] Antwort aus Redis-Cache geladen für Key: {cache_key}")
+                # Überspringe API-Aufruf, gehe direkt zur JSON-Extraktion
+            else:
+                logger.info(f"[CACHE MISS] Kein Cache-Eintrag gefunden für Key: {cache_key}")
 
-    except Exception as cache_err:
-        logger.warning(f"[FLASHCARDS] Fehler bei Cache-Prüfung: {cache_err}")
-        # Fortfahren ohne Cache
+        except Exception as cache_err:
+            logger.warning(f"[FLASHCARDS] Fehler bei Cache-Prüfung: {cache_err}")
+            # Fortfahren ohne Cache
+    elif response_content is not None:
+        logger.info(f"[FLASHCARDS] Verwende vorberechnete Antwort ({len(response_content)} Zeichen)")
 
-    usage = None # Initialisiere usage
+    # Zweite Stufe: Antwort eines sehr ähnlichen Dokuments mit denselben Parametern
+    semantic_params = {'num_cards': num_cards, 'language': language, 'model': model, 'part': fanout_part}
+    if response_content is None and cache_key and options.get('semantic_cache', True):
+        response_content = lookup_semantic_cache('flashcards', content, semantic_params)
 
-    if response_content is None:
-        logger.info(f"[FLASHCARDS] Schritt 1: Analysiere Text ({len(content)} Zeichen)")
-        tokens_estimate = len(content) // 4
-        logger.info(f"[FLASHCARDS] Geschätzte Token-Anzahl: ~{tokens_estimate}")
-        logger.info(f"[FLASHCARDS] Textvorschau: {content[:200]}...")
+    # Single-Flight: Nur ein Worker berechnet dieselbe Anfrage, die übrigen übernehmen das Ergebnis
+    lock_token = None
+    if response_content is None and cache_key:
+        lock_token = acquire_single_flight(cache_key)
+        if lock_token is None:
+            response_content = wait_for_single_flight(cache_key)
+            if response_content is None:
+                lock_token = acquire_single_flight(cache_key)
 
-        logger.info(f"[FLASHCARDS] Schritt 2: Erstelle Prompts für die KI")
-        system_prompt = get_system_prompt("flashcards", language=language, num_cards=num_cards)
-        user_prompt = get_user_prompt("flashcards", content)
-        
-        logger.info(f"[FLASHCARDS] System-Prompt erstellt ({len(system_prompt)} Zeichen)")
-        logger.info(f"[FLASHCARDS] System-Prompt Anfang: {system_prompt[:150]}...")
-        logger.info(f"[FLASHCARDS] User-Prompt erstellt ({len(user_prompt)} Zeichen)")
-        
-        logger.info(f"[FLASHCARDS] Schritt 3: Erstelle Nachrichtenarray für OpenAI")
-        messages = [
-            {"role": "system", "content": system_prompt},
-            {"role": "user", "content": user_prompt}
-        ]
-        logger.info(f"[FLASHCARDS] Nachrichtenarray mit {len(messages)} Nachrichten erstellt")
+    try:
+        if response_content is None:
+            logger.info(f"[FLASHCARDS] Schritt 1: Analysiere Text ({len(content)} Zeichen)")
+            logger.info(f"[FLASHCARDS] Token-Anzahl: {count_tokens(content, model)}")
+            logger.info(f"[FLASHCARDS] Textvorschau: {content[:200]}...")
+
+            logger.info(f"[FLASHCARDS] Schritt 2/3: Erstelle Nachrichtenarray (Dokument-Präfix + Aufgabe)")
+            request = build_flashcards_request(content, num_cards=num_cards, language=language, model=model,
+                                               focus=fanout_part, exclude=exclude)
+            logger.info(f"[FLASHCARDS] Aufgaben-Prompt Anfang: {request['messages'][-1]['content'][:150]}...")
+            logger.info(f"[FLASHCARDS] Nachrichtenarray mit {len(request['messages'])} Nachrichten erstellt")
         
-        logger.info(f"[FLASHCARDS] Schritt 4: Sende SYNC Anfrage an OpenAI API ({model})")
-        response = call_openai_api(
-            model=model,
-            messages=messages,
-            temperature=0.7,
-            max_tokens=2000,
-            response_format={"type": "json_object"}
-        )
-        logger.info(f"[FLASHCARDS] OpenAI-Antwort erhalten.")
+            on_card = options.get('on_card')
+            if callable(on_card):
+                logger.info(f"[FLASHCARDS] Schritt 4: Sende SYNC Streaming-Anfrage an OpenAI API ({model})")
+                response = call_openai_api_stream(**request, on_delta=_make_card_stream_handler(on_card))
+            else:
+                logger.info(f"[FLASHCARDS] Schritt 4: Sende SYNC Anfrage an OpenAI API ({model})")
+                response = call_openai_api(**request)
+            logger.info(f"[FLASHCARDS] OpenAI-Antwort erhalten.")
+
+            response_content = response.get('choices', [{}])[0].get('message', {}).get('content', '{}')
+            usage = response.get('usage') 
+            logger.info(f"[FLASHCARDS] Antworttext extrahiert. Usage: {usage}")
 
-        response_content = response.get('choices', [{}])[0].get('message', {}).get('content', '{}')
-        usage = response.get('usage') 
-        logger.info(f"[FLASHCARDS] Antworttext extrahiert. Usage: {usage}")
+            if finish_reason(response) == 'length':
+                # Abgeschnittenes JSON: vollständige Karten übernehmen, nur den Rest nachfordern
+                response_content, usage = complete_truncated(
+                    response_content, usage, 'flashcards', num_cards, continuation_depth,
+                    lambda remaining, done: generate_flashcards_with_openai(
+                        content, num_cards=remaining, language=language,
+                        **{**options, 'exclude': (exclude or []) + [card.get('question', '') for card in done],
+                           'continuation_depth': continuation_depth + 1, 'semantic_cache': False}))
         
-        if response_content and response_content != '{}' and cache_key:
-            try:
-                get_redis_client().set(cache_key, response_content, ex=CACHE_TTL)
-                logger.info(f"[CACHE SET] Antwort in Redis gespeichert (Key: {cache_key}, TTL: {CACHE_TTL // 86400} Tage)")
-            except Exception as cache_set_err:
-                logger.warning(f"[FLASHCARDS] Fehler beim Speichern der Antwort im Cache: {cache_set_err}")
+            if response_content and response_content != '{}' and cache_key and not response.get('error'):
+                try:
+                    get_redis_client().set(cache_key, response_content, ex=CACHE_TTL)
+                    logger.info(f"[CACHE SET] Antwort in Redis gespeichert (Key: {cache_key}, TTL: {CACHE_TTL // 86400} Tage)")
+                    store_semantic_cache('flashcards', content, semantic_params, cache_key, ttl=CACHE_TTL)
+                except Exception as cache_set_err:
+                    logger.warning(f"[FLASHCARDS] Fehler beim Speichern der Antwort im Cache: {cache_set_err}")
+    finally:
+        release_single_flight(cache_key, lock_token)
 
     logger.info(f"[FLASHCARDS] Schritt 5: Verarbeite OpenAI-Antwort")
     try:
@@ -220,15 +331,18 @@ def generate_flashcards_with_openai(
             if question and not answer:
                 logger.warning(f"[FLASHCARDS] Karte {i+1} hat keine Antwort. Generiere Antwort (SYNC)..." )
                 try:
+                    answer_instructions = "Beantworte die folgende Frage präzise basierend auf dem Kontext, falls möglich. Gib NUR die Antwort zurück.\n\nKontext:\n"
+                    answer_context = fit_document(content, [answer_instructions, question], model,
+                                                  ANSWER_MAX_TOKENS, max_document_tokens=ANSWER_CONTEXT_TOKENS)
                     answer_prompt_messages = [
-                        {"role": "system", "content": f"Beantworte die folgende Frage präzise basierend auf dem Kontext, falls möglich. Gib NUR die Antwort zurück.\n\nKontext:\n{content[:8000]}"},
+                        {"role": "system", "content": answer_instructions + answer_context},
                         {"role": "user", "content": question}
                     ]
                     answer_response = call_openai_api(
                         model=model, 
                         messages=answer_prompt_messages,
                         temperature=0.5,
-                        max_tokens=300
+                        max_tokens=ANSWER_MAX_TOKENS
                     )
                     answer_text = answer_response.get('choices', [{}])[0].get('message', {}).get('content', '').strip()
                     if answer_text:
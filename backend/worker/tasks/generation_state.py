@@ -0,0 +1,176 @@
+"""
+Generierungsstand pro Ausgabetyp und Quelle.
+
+Scheitert bei einem Upload nur ein Ausgabetyp (z.B. die Fragen wegen eines
+Rate-Limits), sollen Lernkarten und Themen nicht erneut bezahlt werden. Die
+Tabelle `generation_state` hält deshalb pro Quelle (Datei bzw.
+'merged:{upload_id}') und Typ Status, Versuche, letzten Fehler, verbrauchte
+Tokens und den Hash des zuletzt gesendeten Prompts.
+
+`ai.regenerate_failed` plant daraus nur die fehlgeschlagenen bzw. fehlenden
+Typen neu ein. Der Text wird wie bei jeder Generierung aus Redis (Fallback
+Datenbank) geladen, also nicht erneut extrahiert; abgeschlossene Typen werden
+nicht gestartet (und würden zusätzlich vom Ledger aus tasks/ledger.py
+wiedergegeben).
+"""
+import hashlib
+import json
+import logging
+from datetime import datetime
+from typing import Any, Callable, Dict, Iterable, List, Optional
+
+from celery.exceptions import Retry
+
+from .models import GenerationState, session_scope
+
+logger = logging.getLogger(__name__)
+
+GENERATION_TYPES = ('flashcards', 'questions', 'topics')
+
+# Optionen, die nur einen einzelnen Lauf betreffen und nicht wiederverwendet werden
+_TRANSIENT_OPTIONS = ('task_id', 'timestamp', 'idempotency_key', 'prompt_hash', 'response_content', 'usage',
+                      'usage_metadata')
+
+
+def prompt_hash(messages: Iterable[Dict[str, Any]]) -> str:
+    """sha256 der Chat-Nachrichten (ändert sich mit Prompt-Version und Dokument)."""
+    canonical = json.dumps(list(messages), sort_keys=True, ensure_ascii=False, separators=(',', ':'))
+    return hashlib.sha256(canonical.encode('utf-8')).hexdigest()
+
+
+def _reusable_options(options: Dict[str, Any]) -> Dict[str, Any]:
+    """Optionen ohne laufbezogene Werte (JSON-serialisierbar)."""
+    reusable = {}
+    for name, value in (options or {}).items():
+        if name in _TRANSIENT_OPTIONS or callable(value):
+            continue
+        reusable[name] = value
+    return reusable
+
+
+def start_generation(task_type, uploaded_file_id, upload_id, options: Dict[str, Any], celery_task_id=None):
+    """Markiert einen Typ als laufend und zählt den Versuch."""
+    with session_scope() as db_session:
+        state = db_session.get(GenerationState, (uploaded_file_id, task_type), with_for_update=True)
+        if state is None:
+            state = GenerationState(uploaded_file_id=uploaded_file_id, task_type=task_type,
+                                    upload_id=upload_id, attempts=0)
+            db_session.add(state)
+        state.status = 'running'
+        state.attempts = (state.attempts or 0) + 1
+        state.error_message = None
+        state.options = _reusable_options(options)
+        state.celery_task_id = celery_task_id
+        state.updated_at = datetime.utcnow()
+
+
+def finish_generation(task_type, uploaded_file_id, result: Optional[Dict[str, Any]] = None, error=None):
+    """
+    Speichert den Ausgang eines Laufs.
+
+    Args:
+        task_type: 'flashcards', 'questions' oder 'topics'
+        uploaded_file_id: ID der Quelle
+        result: Ergebnis des Tasks (status, input_tokens, output_tokens, prompt_hash)
+        error: Ausnahme bzw. Meldung, falls der Lauf abgebrochen ist
+    """
+    result = result if isinstance(result, dict) else {}
+    if error is None and result.get('status') == 'error':
+        error = result.get('error') or 'unbekannter Fehler'
+    with session_scope() as db_session:
+        state = db_session.get(GenerationState, (uploaded_file_id, task_type))
+        if state is None:
+            return
+        state.status = 'failed' if error is not None else 'completed'
+        state.error_message = str(error)[:2000] if error is not None else None
+        # Ein wiedergegebenes Ledger-Ergebnis hat keine neuen Tokens verbraucht
+        if not result.get('idempotent_replay'):
+            state.input_tokens = (state.input_tokens or 0) + int(result.get('input_tokens') or 0)
+            state.output_tokens = (state.output_tokens or 0) + int(result.get('output_tokens') or 0)
+        if result.get('prompt_hash'):
+            state.last_prompt_hash = result['prompt_hash']
+        state.updated_at = datetime.utcnow()
+
+
+def track_generation(task, task_type, uploaded_file_id, upload_id, options: Dict[str, Any],
+                     run: Callable[[], Dict[str, Any]]) -> Dict[str, Any]:
+    """
+    Führt einen Generierungslauf aus und hält den Stand in `generation_state` fest.
+
+    Fehler beim Schreiben des Stands brechen die Generierung nicht ab. Eine
+    Ausnahme des Laufs (z.B. OpenAIRetryableError) wird als 'failed' vermerkt
+    und weitergereicht; die Neueinplanung setzt den Stand wieder auf 'running'.
+
+    Args:
+        task: Gebundener Celery-Task (für die Task-ID)
+        task_type: 'flashcards', 'questions' oder 'topics'
+        uploaded_file_id: ID der Quelle
+        upload_id: ID des Uploads
+        options: Interne Optionen des Tasks (werden für die Neugenerierung gespeichert)
+        run: Funktion ohne Argumente, die generiert und das Ergebnis zurückgibt
+
+    Returns:
+        dict: Ergebnis von run
+    """
+    try:
+        start_generation(task_type, uploaded_file_id, upload_id, options, task.request.id)
+    except Exception as e:
+        logger.warning(f"[GENERATION STATE] Stand für {task_type}/{uploaded_file_id} nicht gespeichert: {e}")
+        return run()
+
+    try:
+        result = run()
+    except Retry:
+        # Ledger-Lease einer anderen Ausführung: der Typ läuft weiter
+        raise
+    except Exception as e:
+        try:
+            finish_generation(task_type, uploaded_file_id, error=e)
+        except Exception as state_err:
+            logger.warning(f"[GENERATION STATE] Fehlerstand für {task_type}/{uploaded_file_id} nicht gespeichert: {state_err}")
+        raise
+
+    try:
+        finish_generation(task_type, uploaded_file_id, result)
+    except Exception as e:
+        logger.warning(f"[GENERATION STATE] Ergebnis für {task_type}/{uploaded_file_id} nicht gespeichert: {e}")
+    return result
+
+
+def plan_regeneration(upload_id, task_types: Optional[Iterable[str]] = None,
+                      uploaded_file_id=None) -> Dict[str, Dict[str, Any]]:
+    """
+    Ermittelt, welche Typen pro Quelle neu generiert werden müssen.
+
+    Neu generiert werden fehlgeschlagene Typen und Typen ohne Stand, sofern
+    die Quelle bereits einen Stand hat. Laufende und abgeschlossene Typen
+    werden übersprungen.
+
+    Args:
+        upload_id: ID des Uploads
+        task_types: Einschränkung auf bestimmte Typen (Standard: alle)
+        uploaded_file_id: Einschränkung auf eine Quelle (optional)
+
+    Returns:
+        dict: {uploaded_file_id: {'task_types': [...], 'options': {...}}}
+    """
+    wanted = [t for t in GENERATION_TYPES if task_types is None or t in task_types]
+    with session_scope() as db_session:
+        query = db_session.query(GenerationState).filter(GenerationState.upload_id == upload_id)
+        if uploaded_file_id:
+            query = query.filter(GenerationState.uploaded_file_id == uploaded_file_id)
+        rows = query.all()
+        sources: Dict[str, Dict[str, Any]] = {}
+        for row in rows:
+            source = sources.setdefault(row.uploaded_file_id, {'states': {}, 'options': {}})
+            source['states'][row.task_type] = row.status
+            # Die Optionen eines Laufs gelten für alle Typen der Quelle (ai._analysis_options)
+            if row.options and not source['options']:
+                source['options'] = dict(row.options)
+
+    plan: Dict[str, Dict[str, Any]] = {}
+    for source_id, source in sources.items():
+        todo: List[str] = [t for t in wanted if source['states'].get(t, 'failed') == 'failed']
+        if todo:
+            plan[source_id] = {'task_types': todo, 'options': source['options']}
+    return plan
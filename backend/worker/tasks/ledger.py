@@ -0,0 +1,252 @@
+"""
+Ergebnis-Ledger für idempotente Generierungs-Tasks.
+
+Mit `task_acks_late` wird ein Task nach einem Worker-Absturz (oder nach Ablauf
+des Visibility-Timeouts) erneut zugestellt. Ohne Schutz würde er OpenAI ein
+zweites Mal aufrufen, Tokens doppelt abrechnen und Karten doppelt speichern.
+
+Jeder Generierungs-Task erhält deshalb einen deterministischen
+Idempotenzschlüssel aus Task-Typ, Datei und Parametern. Die Tabelle
+`generation_ledger` hält pro Schlüssel Status und Ergebnis:
+
+- completed: eine erneute Ausführung gibt das gespeicherte Ergebnis zurück
+- running: eine andere Ausführung läuft noch (Lease), der Task wird verzögert erneut versucht
+- failed bzw. abgelaufene Lease: die Ausführung wird übernommen
+
+Zusätzlich werden die IDs der gespeicherten Zeilen aus dem Schlüssel abgeleitet
+(`ledger_row_id`) und mit ON CONFLICT DO NOTHING eingefügt. Stirbt ein Worker
+nach dem Speichern, aber vor dem Abschluss im Ledger, entstehen bei der
+Wiederholung keine Duplikate, ohne dass vorher abgefragt werden muss.
+"""
+import hashlib
+import json
+import logging
+import os
+import re
+import uuid
+from datetime import datetime, timedelta
+from typing import Any, Callable, Dict, Optional, Tuple
+
+from sqlalchemy import inspect as sa_inspect
+from sqlalchemy.exc import IntegrityError
+
+from utils.retry_policy import record_lease_wait
+from .models import GenerationLedger, session_scope
+
+logger = logging.getLogger(__name__)
+
+# Ledger ein-/ausschalten
+IDEMPOTENT_TASKS = os.environ.get('IDEMPOTENT_TASKS', 'true').lower() == 'true'
+# Lease einer laufenden Ausführung (Sekunden); danach darf eine Neuzustellung übernehmen
+LEDGER_LEASE_SECONDS = int(os.environ.get('LEDGER_LEASE_SECONDS', 300))
+# Wartezeit, bevor ein Task bei laufender Ausführung erneut prüft (Sekunden)
+LEDGER_RETRY_COUNTDOWN = int(os.environ.get('LEDGER_RETRY_COUNTDOWN', 15))
+# Gültigkeit eines abgeschlossenen Ergebnisses (Sekunden); danach generiert eine erneute Verarbeitung neu
+LEDGER_COMPLETED_TTL = int(os.environ.get('LEDGER_COMPLETED_TTL', 86400))
+
+# Parameter, die das Ergebnis bestimmen (Task-ID, Zeitstempel, Nutzer und Stufe gehören nicht dazu)
+LEDGER_KEY_PARAMS: Dict[str, Tuple[str, ...]] = {
+    'flashcards': ('num_cards',),
+    'questions': ('num_questions', 'question_type'),
+    'topics': ('max_topics',),
+}
+# prompt_hash: sha256 von Prompt und Dokument (ai_tasks._load_for_ledger), ändert sich mit der Prompt-Version
+LEDGER_COMMON_PARAMS = ('language', 'model', 'prompt_hash')
+
+# Namensraum für die aus dem Schlüssel abgeleiteten Zeilen-IDs
+_ROW_ID_NAMESPACE = uuid.UUID('5d0b7c0e-8f3a-4f53-9a52-3b8f4f6a9c21')
+_WHITESPACE = re.compile(r'\s+')
+
+
+def generation_idempotency_key(task_type, uploaded_file_id, upload_id, options: Optional[Dict[str, Any]] = None) -> str:
+    """
+    Deterministischer Idempotenzschlüssel eines Generierungs-Tasks.
+
+    Ein explizit übergebener Schlüssel (options['idempotency_key']) hat Vorrang,
+    z.B. für eine bewusste Neugenerierung.
+
+    Args:
+        task_type: 'flashcards', 'questions' oder 'topics'
+        uploaded_file_id: ID der Datei (bzw. 'merged:{upload_id}')
+        upload_id: ID des Uploads
+        options: Optionen des Tasks
+
+    Returns:
+        str: sha256-Hexdigest
+    """
+    options = options or {}
+    if options.get('idempotency_key'):
+        return str(options['idempotency_key'])
+    names = LEDGER_COMMON_PARAMS + LEDGER_KEY_PARAMS.get(task_type, ())
+    payload = {
+        'task_type': task_type,
+        'uploaded_file_id': uploaded_file_id,
+        'upload_id': upload_id,
+        'params': {name: options.get(name) for name in names},
+    }
+    canonical = json.dumps(payload, sort_keys=True, ensure_ascii=False, separators=(',', ':'))
+    return hashlib.sha256(canonical.encode('utf-8')).hexdigest()
+
+
+def ledger_row_id(idempotency_key, *parts) -> str:
+    """
+    Deterministische Zeilen-ID für ein generiertes Objekt.
+
+    Args:
+        idempotency_key: Schlüssel des Tasks
+        *parts: Identität des Objekts innerhalb des Tasks (z.B. 'flashcard', Frage)
+
+    Returns:
+        str: UUID (v5), bei jeder Wiederholung dieselbe
+    """
+    normalized = [_WHITESPACE.sub(' ', str(part)).strip().lower() for part in parts]
+    return str(uuid.uuid5(_ROW_ID_NAMESPACE, '|'.join([idempotency_key] + normalized)))
+
+
+def claim_ledger_entry(idempotency_key, task_type, uploaded_file_id, upload_id, celery_task_id=None):
+    """
+    Reserviert einen Schlüssel für die aktuelle Ausführung.
+
+    Returns:
+        (str, dict|None): ('new', None), ('running', None) oder ('completed', Ergebnis)
+    """
+    now = datetime.utcnow()
+    lease_expires_at = now + timedelta(seconds=LEDGER_LEASE_SECONDS)
+    try:
+        with session_scope() as db_session:
+            entry = db_session.get(GenerationLedger, idempotency_key, with_for_update=True)
+            if entry is None:
+                db_session.add(GenerationLedger(
+                    idempotency_key=idempotency_key,
+                    task_type=task_type,
+                    upload_id=upload_id,
+                    uploaded_file_id=uploaded_file_id,
+                    status='running',
+                    attempts=1,
+                    celery_task_id=celery_task_id,
+                    lease_expires_at=lease_expires_at,
+                ))
+                db_session.flush()
+                return 'new', None
+            # lease_expires_at gilt bei abgeschlossenen Einträgen als Ablauf des Ergebnisses
+            if entry.status == 'completed' and (entry.lease_expires_at is None or entry.lease_expires_at > now):
+                return 'completed', dict(entry.result or {})
+            if entry.status == 'running' and entry.lease_expires_at and entry.lease_expires_at > now:
+                return 'running', None
+            # Fehlgeschlagen, Lease abgelaufen (Worker abgestürzt) oder Ergebnis abgelaufen: Ausführung übernehmen
+            logger.info(f"[LEDGER] Übernehme {task_type}-Ausführung {idempotency_key[:12]} "
+                        f"(Status '{entry.status}', Versuch {entry.attempts + 1})")
+            entry.status = 'running'
+            entry.attempts = (entry.attempts or 0) + 1
+            entry.celery_task_id = celery_task_id
+            entry.error_message = None
+            entry.lease_expires_at = lease_expires_at
+            return 'new', None
+    except IntegrityError:
+        # Gleichzeitige Zustellung hat den Eintrag zuerst angelegt
+        return 'running', None
+
+
+def complete_ledger_entry(idempotency_key, result: Dict[str, Any]):
+    """Speichert das Ergebnis einer erfolgreichen Ausführung."""
+    with session_scope() as db_session:
+        entry = db_session.get(GenerationLedger, idempotency_key)
+        if entry:
+            entry.status = 'completed'
+            entry.result = result
+            entry.lease_expires_at = datetime.utcnow() + timedelta(seconds=LEDGER_COMPLETED_TTL)
+
+
+def fail_ledger_entry(idempotency_key, error_message):
+    """Markiert eine Ausführung als fehlgeschlagen (die nächste Zustellung darf neu rechnen)."""
+    with session_scope() as db_session:
+        entry = db_session.get(GenerationLedger, idempotency_key)
+        if entry:
+            entry.status = 'failed'
+            entry.error_message = str(error_message)[:2000]
+            entry.lease_expires_at = None
+
+
+def run_idempotent(task, task_type, uploaded_file_id, upload_id, options: Dict[str, Any],
+                   run: Callable[[Dict[str, Any]], Dict[str, Any]]) -> Dict[str, Any]:
+    """
+    Führt einen Generierungs-Task höchstens einmal pro Idempotenzschlüssel aus.
+
+    Args:
+        task: Gebundener Celery-Task (für retry und Task-ID)
+        task_type: 'flashcards', 'questions' oder 'topics'
+        uploaded_file_id: ID der Datei
+        upload_id: ID des Uploads
+        options: Interne Optionen des Tasks
+        run: Funktion, die mit den Optionen (inkl. 'idempotency_key') generiert und speichert
+
+    Returns:
+        dict: Ergebnis der Ausführung bzw. das gespeicherte Ergebnis (mit 'idempotent_replay')
+    """
+    if not IDEMPOTENT_TASKS:
+        return run(options)
+
+    key = generation_idempotency_key(task_type, uploaded_file_id, upload_id, options)
+    try:
+        state, stored = claim_ledger_entry(key, task_type, uploaded_file_id, upload_id, task.request.id)
+    except Exception as e:
+        logger.warning(f"[LEDGER] Ledger nicht verfügbar, führe {task_type} ohne Idempotenzschutz aus: {e}")
+        return run(options)
+
+    if state == 'completed':
+        logger.info(f"[LEDGER] {task_type} für {uploaded_file_id} bereits abgeschlossen, gebe gespeichertes Ergebnis zurück.")
+        stored['idempotent_replay'] = True
+        return stored
+    if state == 'running':
+        logger.info(f"[LEDGER] {task_type} für {uploaded_file_id} läuft bereits, prüfe in {LEDGER_RETRY_COUNTDOWN}s erneut.")
+        # Ohne Obergrenze: spätestens nach Ablauf der Lease wird die Ausführung übernommen.
+        # Der Wartezyklus wird gezählt, damit retry_generation ihn nicht als Fehlversuch wertet.
+        record_lease_wait(task.request.id)
+        raise task.retry(countdown=LEDGER_RETRY_COUNTDOWN, max_retries=None)
+
+    try:
+        result = run(dict(options, idempotency_key=key))
+    except Exception as e:
+        fail_ledger_entry(key, e)
+        raise
+
+    try:
+        if isinstance(result, dict) and result.get('status') == 'error':
+            fail_ledger_entry(key, result.get('error'))
+        else:
+            complete_ledger_entry(key, result)
+    except Exception as e:
+        logger.error(f"[LEDGER] Ergebnis für {key[:12]} konnte nicht gespeichert werden: {e}")
+    return result
+
+
+def insert_ignore_existing(db_session, objects) -> int:
+    """
+    Fügt Modellobjekte ein und überspringt IDs, die bereits existieren.
+
+    Auf Postgres/SQLite per INSERT ... ON CONFLICT (id) DO NOTHING, sonst per add_all.
+    Der Commit erfolgt durch den Aufrufer.
+
+    Args:
+        db_session: Offene Datenbank-Session
+        objects: Objekte desselben Modells mit gesetzter ID
+
+    Returns:
+        int: Anzahl neu eingefügter Zeilen
+    """
+    if not objects:
+        return 0
+    model = type(objects[0])
+    dialect = db_session.get_bind().dialect.name
+    if dialect == 'postgresql':
+        from sqlalchemy.dialects.postgresql import insert
+    elif dialect == 'sqlite':
+        from sqlalchemy.dialects.sqlite import insert
+    else:
+        db_session.add_all(objects)
+        return len(objects)
+
+    attributes = [attr.key for attr in sa_inspect(model).column_attrs]
+    rows = [{name: getattr(obj, name) for name in attributes} for obj in objects]
+    statement = insert(model.__table__).values(rows).on_conflict_do_nothing(index_elements=['id'])
+    return db_session.execute(statement).rowcount
@@ -0,0 +1,328 @@
+"""
+Micro-Batching kleiner Dokumente.
+
+Ein einseitiges Handout kostet sonst drei vollständige Anfragen, deren Tokens
+und Latenz fast nur aus System-Prompt und Anweisungen bestehen. Kleine
+Dokumente (höchstens MICRO_BATCH_MAX_DOCUMENT_TOKENS) werden deshalb kurz
+(MICRO_BATCH_WINDOW_SECONDS) in einer Redis-Liste pro kompatibler
+Parametergruppe gesammelt. `ai.flush_micro_batch` packt sie pro Ausgabetyp in
+eine Anfrage mit Dokument-IDs im Antwortformat
+({"documents": [{"id", "result"}]}, config/prompts.build_packed_messages) und
+verteilt die Ergebnisse samt anteiliger Token-Nutzung wieder auf die Dateien.
+
+Jede Datei läuft danach wie gewohnt durch ihre eigenen AI-Tasks (Ledger,
+Generierungsstand, Validierung, Chord mit document.finalize_file); die
+gepackte Antwort wird ihnen als vorberechnete Antwort ('response_content')
+übergeben. Fehlt ein Dokument in der Antwort oder ist sein Ergebnis
+unvollständig, generiert die Modell-Kaskade den Rest live.
+"""
+import hashlib
+import json
+import logging
+import math
+import os
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional, Tuple
+
+from .flashcards.generation import FLASHCARD_TOKENS_PER_ITEM, FLASHCARDS_TEMPERATURE
+from .questions.generation import QUESTION_TOKENS_PER_ITEM, QUESTIONS_TEMPERATURE
+from .topics.generation import TOPICS_TEMPERATURE
+from config.model_routing import get_model_route
+from config.prompts import build_packed_messages
+from redis_utils.client import get_redis_client
+from utils.call_openai import call_openai_api
+from utils.json_repair import parse_json_response
+from utils.prompt_budget import context_window, prompt_tokens
+from utils.token_counter import count_tokens
+
+logger = logging.getLogger(__name__)
+
+MICRO_BATCH_ENABLED = os.environ.get('MICRO_BATCH_ENABLED', 'true').lower() == 'true'
+# Sammelfenster ab dem ersten Dokument einer Gruppe (Sekunden; 0 = aus)
+MICRO_BATCH_WINDOW_SECONDS = float(os.environ.get('MICRO_BATCH_WINDOW_SECONDS', 2))
+# Dokumente bis zu dieser Größe (Tokens) werden gesammelt
+MICRO_BATCH_MAX_DOCUMENT_TOKENS = int(os.environ.get('MICRO_BATCH_MAX_DOCUMENT_TOKENS', 1500))
+# Höchstens so viele Dokumente pro Sammlung; ist sie voll, wird sofort gepackt
+MICRO_BATCH_MAX_DOCUMENTS = int(os.environ.get('MICRO_BATCH_MAX_DOCUMENTS', 8))
+# Ausgabe-Limit einer gepackten Anfrage; bestimmt, wie viele Dokumente eine Anfrage teilen
+MICRO_BATCH_MAX_OUTPUT_TOKENS = int(os.environ.get('MICRO_BATCH_MAX_OUTPUT_TOKENS', 4096))
+# Gleichzeitig laufende gepackte Anfragen eines Flushs
+MICRO_BATCH_MAX_PARALLEL = int(os.environ.get('MICRO_BATCH_MAX_PARALLEL', 6))
+# Anteil des Ausgabe-Limits, der für Ergebnisse eingeplant wird (Rest: JSON-Hülle, Ausreißer)
+MICRO_BATCH_OUTPUT_SHARE = 0.8
+# Geschätzte Ausgabe-Tokens pro Thema (Titel, Beschreibung, JSON)
+TOPIC_TOKENS_PER_ITEM = 60
+# Lebensdauer der Sammelliste, falls ein Flush verloren geht (Sekunden)
+MICRO_BATCH_QUEUE_TTL = 600
+
+# Pro Ausgabetyp: Mengenparameter, geschätzte Tokens pro Eintrag, Temperatur
+PACKED_TASKS: Dict[str, Dict[str, Any]] = {
+    'flashcards': {'count': 'num_cards', 'tokens_per_item': FLASHCARD_TOKENS_PER_ITEM,
+                   'temperature': FLASHCARDS_TEMPERATURE},
+    'questions': {'count': 'num_questions', 'tokens_per_item': QUESTION_TOKENS_PER_ITEM,
+                  'temperature': QUESTIONS_TEMPERATURE},
+    'topics': {'count': 'max_topics', 'tokens_per_item': TOPIC_TOKENS_PER_ITEM,
+               'temperature': TOPICS_TEMPERATURE},
+}
+# Optionen, die für alle Dokumente einer gepackten Anfrage gleich sein müssen
+GROUP_PARAMS = ('language', 'model', 'tier', 'num_cards', 'num_questions', 'question_type', 'max_topics')
+
+
+def micro_batch_queue_key(group_key):
+    """Redis-Liste der gesammelten Dokumente einer Gruppe."""
+    return f"micro_batch:{group_key}"
+
+
+def micro_batch_timer_key(group_key):
+    """Markiert, dass für die Gruppe bereits ein Flush eingeplant ist."""
+    return f"micro_batch:{group_key}:timer"
+
+
+def micro_batch_group_key(options: Dict[str, Any]) -> str:
+    """Gruppenschlüssel aus den Parametern, die eine gepackte Anfrage teilen muss."""
+    canonical = json.dumps({name: options.get(name) for name in GROUP_PARAMS}, sort_keys=True, separators=(',', ':'))
+    return hashlib.sha256(canonical.encode('utf-8')).hexdigest()[:32]
+
+
+def is_micro_batch_candidate(text: str, options: Dict[str, Any]) -> bool:
+    """
+    Prüft, ob ein Dokument gesammelt statt sofort generiert werden soll.
+
+    Args:
+        text: Extrahierter Text der Datei
+        options: Optionen der AI-Tasks (ai._analysis_options)
+
+    Returns:
+        bool: True für kleine Dokumente bei aktivem Micro-Batching
+    """
+    if not MICRO_BATCH_ENABLED or MICRO_BATCH_WINDOW_SECONDS <= 0 or MICRO_BATCH_MAX_DOCUMENTS < 2 or not text:
+        return False
+    return count_tokens(text) <= MICRO_BATCH_MAX_DOCUMENT_TOKENS
+
+
+def enqueue_micro_batch(group_key: str, entry: Dict[str, Any]) -> Optional[Tuple[int, bool]]:
+    """
+    Legt ein Dokument in die Sammelliste seiner Gruppe.
+
+    Args:
+        group_key: Schlüssel aus micro_batch_group_key
+        entry: {'uploaded_file_id', 'upload_id', 'language', 'options'}
+
+    Returns:
+        (int, bool): Länge der Liste und ob dieser Aufruf das Sammelfenster eröffnet hat;
+        None, wenn Redis nicht verfügbar ist (dann sofort generieren)
+    """
+    client = get_redis_client()
+    if not client:
+        return None
+    try:
+        queue_key = micro_batch_queue_key(group_key)
+        pipe = client.pipeline()
+        pipe.rpush(queue_key, json.dumps(entry))
+        pipe.expire(queue_key, MICRO_BATCH_QUEUE_TTL)
+        size = pipe.execute()[0]
+        # Läuft das Fenster ab, ohne dass ein Flush die Liste leert, eröffnet das nächste Dokument ein neues
+        opened = client.set(micro_batch_timer_key(group_key), '1', nx=True,
+                            ex=math.ceil(MICRO_BATCH_WINDOW_SECONDS) + 30)
+        return int(size), bool(opened)
+    except Exception as e:
+        logger.warning(f"[MICRO BATCH] Dokument {entry.get('uploaded_file_id')} konnte nicht gesammelt werden: {e}")
+        return None
+
+
+def pop_micro_batch(group_key: str) -> Tuple[List[Dict[str, Any]], int]:
+    """
+    Entnimmt bis zu MICRO_BATCH_MAX_DOCUMENTS Dokumente einer Gruppe (atomar).
+
+    Returns:
+        (list, int): Entnommene Einträge und Anzahl der verbliebenen
+    """
+    client = get_redis_client()
+    queue_key = micro_batch_queue_key(group_key)
+    pipe = client.pipeline()
+    pipe.lrange(queue_key, 0, MICRO_BATCH_MAX_DOCUMENTS - 1)
+    pipe.ltrim(queue_key, MICRO_BATCH_MAX_DOCUMENTS, -1)
+    pipe.llen(queue_key)
+    pipe.delete(micro_batch_timer_key(group_key))
+    raw_entries, _, remaining, _ = pipe.execute()
+    entries = [json.loads(raw.decode('utf-8') if isinstance(raw, bytes) else raw) for raw in raw_entries]
+    return entries, int(remaining or 0)
+
+
+def _apportion(total: int, weights: List[float]) -> List[int]:
+    """Verteilt eine ganze Zahl nach Gewichten (größter Rest), die Summe bleibt erhalten."""
+    weight_sum = sum(weights)
+    if not total or weight_sum <= 0:
+        return [0] * len(weights)
+    shares = [total * weight / weight_sum for weight in weights]
+    parts = [int(share) for share in shares]
+    for index in sorted(range(len(shares)), key=lambda i: shares[i] - parts[i], reverse=True)[:total - sum(parts)]:
+        parts[index] += 1
+    return parts
+
+
+def split_usage(usage: Optional[Dict[str, Any]], input_weights: List[float],
+                output_weights: List[float]) -> List[Optional[Dict[str, Any]]]:
+    """
+    Teilt die Token-Nutzung einer gepackten Anfrage auf die Dokumente auf.
+
+    Prompt-Tokens (inkl. gecachter) nach Dokumentgröße, Completion-Tokens nach
+    Länge des jeweiligen Ergebnisses.
+    """
+    if not usage:
+        return [None] * len(input_weights)
+    parts: List[Dict[str, Any]] = [{} for _ in input_weights]
+    for key, value in usage.items():
+        if not isinstance(value, int) or isinstance(value, bool) or key == 'total_tokens':
+            continue
+        weights = output_weights if key.startswith('completion') else input_weights
+        for part, share in zip(parts, _apportion(value, weights)):
+            part[key] = share
+    for part in parts:
+        part['total_tokens'] = part.get('prompt_tokens', 0) + part.get('completion_tokens', 0)
+    return parts
+
+
+def split_packed_response(content: str, document_ids: List[str]) -> Dict[str, Any]:
+    """
+    Ordnet die Ergebnisse einer gepackten Antwort den Dokument-IDs zu.
+
+    Akzeptiert {"documents": [{"id", "result"}]} sowie {"<ID>": <Ergebnis>}.
+    Abgeschnittene Antworten werden repariert; vollständige Dokumente bleiben erhalten.
+
+    Returns:
+        dict: {ID: Ergebnis im Format einer Einzelanfrage}
+    """
+    data = parse_json_response(content)['data']
+    results: Dict[str, Any] = {}
+    if not isinstance(data, dict):
+        return results
+    entries = data.get('documents')
+    if isinstance(entries, list):
+        for entry in entries:
+            if isinstance(entry, dict) and str(entry.get('id')) in document_ids and entry.get('result') is not None:
+                results.setdefault(str(entry['id']), entry['result'])
+    else:
+        results = {key: value for key, value in data.items() if key in document_ids and value is not None}
+    return results
+
+
+def plan_packs(task_type: str, document_ids: List[str], options: Dict[str, Any]) -> List[List[str]]:
+    """Teilt die Dokumente so auf, dass die geschätzten Ergebnisse ins Ausgabe-Limit passen."""
+    spec = PACKED_TASKS[task_type]
+    per_document = max(1, int(options.get(spec['count']) or 5)) * spec['tokens_per_item']
+    per_pack = max(1, int(MICRO_BATCH_MAX_OUTPUT_TOKENS * MICRO_BATCH_OUTPUT_SHARE) // per_document)
+    return [document_ids[i:i + per_pack] for i in range(0, len(document_ids), per_pack)]
+
+
+def _prompt_params(task_type: str, options: Dict[str, Any]) -> Dict[str, Any]:
+    """Formatierungsparameter des Aufgaben-Prompts (wie in build_*_request)."""
+    if task_type == 'flashcards':
+        return {'num_cards': options.get('num_cards', 5)}
+    if task_type == 'questions':
+        return {'num_questions': options.get('num_questions', 3),
+                'question_type': options.get('question_type', 'multiple_choice')}
+    return {'max_topics': options.get('max_topics', 8)}
+
+
+def _packed_messages(task_type, documents, options, model):
+    """Nachrichten einer gepackten Anfrage; passt sie nicht ins Kontextfenster, fallen hintere Dokumente heraus."""
+    params = _prompt_params(task_type, options)
+    language = options.get('language', 'de')
+    while documents:
+        messages = build_packed_messages(task_type, documents, language=language, **params)
+        if len(documents) == 1 or \
+                prompt_tokens(messages, model) + MICRO_BATCH_MAX_OUTPUT_TOKENS <= context_window(model):
+            return messages, documents
+        documents = documents[:-1]
+    return None, []
+
+
+def run_packed_request(task_type: str, documents: List[Tuple[str, str]], options: Dict[str, Any],
+                       batch_id: str) -> Dict[str, Dict[str, Any]]:
+    """
+    Führt eine gepackte Anfrage aus und zerlegt die Antwort.
+
+    Args:
+        task_type: 'flashcards', 'questions' oder 'topics'
+        documents: Liste von (ID, Text)
+        options: Gemeinsame Optionen der Gruppe
+        batch_id: ID des Flushs (für die Token-Metadaten)
+
+    Returns:
+        dict: {ID: {'response_content', 'usage', 'usage_metadata'}} für alle Dokumente mit Ergebnis
+    """
+    model = get_model_route(task_type, options)[0]
+    messages, documents = _packed_messages(task_type, documents, options, model)
+    if not documents:
+        return {}
+    document_ids = [document_id for document_id, _ in documents]
+    response = call_openai_api(
+        model=model,
+        messages=messages,
+        temperature=PACKED_TASKS[task_type]['temperature'],
+        max_tokens=MICRO_BATCH_MAX_OUTPUT_TOKENS,
+        response_format={"type": "json_object"}
+    )
+    content = response.get('choices', [{}])[0].get('message', {}).get('content') or ''
+    results = split_packed_response(content, document_ids)
+    if not results:
+        logger.warning(f"[MICRO BATCH] {task_type}: gepackte Antwort ohne verwertbare Ergebnisse "
+                       f"({len(document_ids)} Dokumente), generiere einzeln")
+        return {}
+
+    texts = dict(documents)
+    answered = [document_id for document_id in document_ids if document_id in results]
+    serialized = {document_id: json.dumps(results[document_id], ensure_ascii=False) for document_id in answered}
+    usages = split_usage(response.get('usage'),
+                         [count_tokens(texts[document_id], model) + 1 for document_id in answered],
+                         [len(serialized[document_id]) for document_id in answered])
+    metadata = {'mode': 'micro_batch', 'micro_batch_id': batch_id, 'micro_batch_documents': len(document_ids)}
+    logger.info(f"[MICRO BATCH] {task_type}: {len(answered)}/{len(document_ids)} Dokumente aus einer Anfrage "
+                f"({model}, Usage: {response.get('usage')})")
+    return {document_id: {'response_content': serialized[document_id], 'usage': usage, 'usage_metadata': metadata}
+            for document_id, usage in zip(answered, usages)}
+
+
+def run_micro_batch(documents: List[Tuple[str, str]], options: Dict[str, Any],
+                    task_types=tuple(PACKED_TASKS)) -> Dict[str, Dict[str, Dict[str, Any]]]:
+    """
+    Generiert alle Ausgabetypen für eine Sammlung kleiner Dokumente.
+
+    Gepackte Anfragen laufen parallel. Scheitert eine Anfrage, generieren die
+    betroffenen Dokumente diesen Typ einzeln (ihre Tasks bekommen dann keine
+    vorberechnete Antwort).
+
+    Args:
+        documents: Liste von (ID, Text)
+        options: Gemeinsame Optionen der Gruppe
+        task_types: Zu generierende Ausgabetypen
+
+    Returns:
+        dict: {ID: {task_type: {'response_content', 'usage', 'usage_metadata'}}}
+    """
+    batch_id = uuid.uuid4().hex[:12]
+    texts = dict(documents)
+    jobs = [(task_type, pack) for task_type in task_types
+            for pack in plan_packs(task_type, [document_id for document_id, _ in documents], options)
+            if len(pack) > 1]
+    precomputed: Dict[str, Dict[str, Dict[str, Any]]] = {document_id: {} for document_id, _ in documents}
+    if not jobs:
+        return precomputed
+
+    def run(job):
+        task_type, pack = job
+        try:
+            return task_type, run_packed_request(task_type, [(document_id, texts[document_id]) for document_id in pack],
+                                                 options, batch_id)
+        except Exception as e:
+            logger.warning(f"[MICRO BATCH] Gepackte {task_type}-Anfrage für {len(pack)} Dokumente fehlgeschlagen, "
+                           f"generiere einzeln: {e}")
+            return task_type, {}
+
+    with ThreadPoolExecutor(max_workers=max(1, min(MICRO_BATCH_MAX_PARALLEL, len(jobs)))) as executor:
+        for task_type, results in executor.map(run, jobs):
+            for document_id, result in results.items():
+                precomputed[document_id][task_type] = result
+    return precomputed
@@ -6,8 +6,10 @@ import os
 import logging
 from datetime import datetime
 
+from contextlib import contextmanager
+
 from sqlalchemy import (Column, String, Text, Integer, DateTime, Boolean, 
-                        ForeignKey, BigInteger, JSON, LargeBinary, 
+                        ForeignKey, BigInteger, JSON, LargeBinary, Float,
                         create_engine)
 from sqlalchemy.orm import sessionmaker, relationship, declarative_base
 from config.config import config 
@@ -15,16 +17,90 @@ from config.config import config
 logger = logging.getLogger(__name__)
 Base = declarative_base()
 
-# Datenbankverbindungsfunktion
-def get_db_session():
-    """Erstellt eine neue Datenbankverbindung."""
+# Verbindungspool pro Worker-Prozess: Verbindungen zu Postgres = Prozesse × (DB_POOL_SIZE + DB_MAX_OVERFLOW)
+DB_POOL_SIZE = int(os.environ.get('DB_POOL_SIZE', 2))
+DB_MAX_OVERFLOW = int(os.environ.get('DB_MAX_OVERFLOW', 0))
+DB_POOL_TIMEOUT = int(os.environ.get('DB_POOL_TIMEOUT', 30))
+DB_POOL_RECYCLE = int(os.environ.get('DB_POOL_RECYCLE', 1800))
+
+# Engine und Session-Factory des aktuellen Prozesses (nach dem Fork neu erstellt)
+_engine = None
+_engine_pid = None
+_session_factory = None
+
+
+def get_engine():
+    """
+    Gibt die Engine des aktuellen Prozesses zurück und erstellt sie bei Bedarf.
+
+    Jeder Celery-Kindprozess bekommt genau eine Engine mit eigenem Pool. Eine vor
+    dem Fork geerbte Engine wird verworfen, ohne die Verbindungen des
+    Elternprozesses zu schließen.
+    """
+    global _engine, _engine_pid, _session_factory
+    pid = os.getpid()
+    if _engine is not None and _engine_pid == pid:
+        return _engine
+
     db_url = config.database_url
     if not db_url:
         logger.error("DATABASE_URL nicht in der Konfiguration gefunden!")
         raise ValueError("DATABASE_URL ist nicht konfiguriert.")
-    engine = create_engine(db_url)
-    SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
-    return SessionLocal()
+    if _engine is not None:
+        # Geerbt vom Elternprozess: Pool verwerfen, Verbindungen gehören dem Elternprozess
+        _engine.dispose(close=False)
+    _engine = create_engine(
+        db_url,
+        pool_size=DB_POOL_SIZE,
+        max_overflow=DB_MAX_OVERFLOW,
+        pool_timeout=DB_POOL_TIMEOUT,
+        pool_recycle=DB_POOL_RECYCLE,
+        pool_pre_ping=True,
+    )
+    _engine_pid = pid
+    _session_factory = sessionmaker(autocommit=False, autoflush=False, bind=_engine)
+    logger.info(f"DB-Engine für Prozess {pid} erstellt (Pool: {DB_POOL_SIZE} + {DB_MAX_OVERFLOW} Overflow)")
+    return _engine
+
+
+def init_db_engine(**kwargs):
+    """Erstellt die Engine im frisch geforkten Worker-Prozess (Handler für worker_process_init)."""
+    get_engine()
+
+
+def dispose_db_engine(**kwargs):
+    """Schließt die Verbindungen des Prozesses (Handler für worker_process_shutdown)."""
+    global _engine, _engine_pid, _session_factory
+    if _engine is not None and _engine_pid == os.getpid():
+        _engine.dispose()
+    _engine, _engine_pid, _session_factory = None, None, None
+
+
+# Datenbankverbindungsfunktion
+def get_db_session():
+    """Gibt eine neue Session auf dem Verbindungspool des aktuellen Prozesses zurück."""
+    get_engine()
+    return _session_factory()
+
+
+@contextmanager
+def session_scope():
+    """
+    Session für die Dauer eines Blocks: Commit bei Erfolg, Rollback bei Fehler, immer schließen.
+
+    Beispiel:
+        with session_scope() as db_session:
+            db_session.add(obj)
+    """
+    db_session = get_db_session()
+    try:
+        yield db_session
+        db_session.commit()
+    except Exception:
+        db_session.rollback()
+        raise
+    finally:
+        db_session.close()
 
 # --- Modelldefinitionen --- 
 
@@ -33,6 +109,7 @@ class User(Base):
     __tablename__ = 'user'
     id = Column(String(36), primary_key=True)
     # Minimale Definition für den Worker
+    credits = Column(Integer, nullable=True)
 
 class Upload(Base):
     """Repräsentiert einen gesamten Upload-Vorgang."""
@@ -128,3 +205,71 @@ class UserActivity(Base):
     upload_id = Column(String(36), ForeignKey('upload.id', ondelete='CASCADE'), nullable=True, index=True)
     main_topic = Column(Text, nullable=True) 
     timestamp = Column(DateTime, nullable=False, default=datetime.utcnow, index=True)
+
+class TokenUsage(Base):
+    __tablename__ = 'token_usage'
+    id = Column(String(36), primary_key=True)
+    user_id = Column(String(36), ForeignKey('user.id'), nullable=True)
+    session_id = Column(String(255), nullable=True)
+    timestamp = Column(DateTime, nullable=True)
+    model = Column(String(50), nullable=False)
+    input_tokens = Column(Integer, nullable=False)
+    output_tokens = Column(Integer, nullable=False)
+    # Anteil der input_tokens, der vom Prompt-Cache des Providers bedient wurde
+    cached_tokens = Column(Integer, nullable=True, default=0)
+    cost = Column(Float, nullable=False)
+    endpoint = Column(String(100), nullable=True)
+    function_name = Column(String(100), nullable=True)
+    cached = Column(Boolean, nullable=True)
+    request_metadata = Column(JSON, nullable=True)
+
+class GenerationLedger(Base):
+    """Ergebnis-Ledger der Generierungs-Tasks (Idempotenz bei Neuzustellung, siehe tasks/ledger.py)."""
+    __tablename__ = 'generation_ledger'
+    # sha256 über Task-Typ, Datei und Parameter
+    idempotency_key = Column(String(64), primary_key=True)
+    task_type = Column(String(50), nullable=False, index=True)
+    upload_id = Column(String(36), ForeignKey('upload.id', ondelete='CASCADE'), nullable=True, index=True)
+    # Ohne FK: bei Upload-weiter Generierung steht hier die Pseudo-ID 'merged:{upload_id}'
+    uploaded_file_id = Column(String(64), nullable=True, index=True)
+    status = Column(String(20), nullable=False, default='running', index=True)  # running | completed | failed
+    attempts = Column(Integer, nullable=False, default=1)
+    celery_task_id = Column(String(36), nullable=True)
+    result = Column(JSON, nullable=True)
+    error_message = Column(Text, nullable=True)
+    lease_expires_at = Column(DateTime, nullable=True)
+    created_at = Column(DateTime, nullable=False, default=datetime.utcnow)
+    updated_at = Column(DateTime, nullable=False, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+class GenerationState(Base):
+    """Stand der Generierung pro Ausgabetyp und Quelle (für "nur Fehlgeschlagenes neu generieren", siehe tasks/generation_state.py)."""
+    __tablename__ = 'generation_state'
+    # Datei-ID bzw. Pseudo-ID 'merged:{upload_id}' (ohne FK, wie im Ledger)
+    uploaded_file_id = Column(String(64), primary_key=True)
+    task_type = Column(String(50), primary_key=True)  # flashcards | questions | topics
+    upload_id = Column(String(36), ForeignKey('upload.id', ondelete='CASCADE'), nullable=False, index=True)
+    status = Column(String(20), nullable=False, default='running', index=True)  # running | completed | failed
+    attempts = Column(Integer, nullable=False, default=0)
+    error_message = Column(Text, nullable=True)
+    input_tokens = Column(Integer, nullable=False, default=0)
+    output_tokens = Column(Integer, nullable=False, default=0)
+    # sha256 der zuletzt gesendeten Nachrichten (Prompt-Version + Dokument)
+    last_prompt_hash = Column(String(64), nullable=True)
+    # Optionen des letzten Laufs, damit eine Neugenerierung dieselben Parameter verwendet
+    options = Column(JSON, nullable=True)
+    celery_task_id = Column(String(36), nullable=True)
+    created_at = Column(DateTime, nullable=False, default=datetime.utcnow)
+    updated_at = Column(DateTime, nullable=False, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+class PendingMaterial(Base):
+    """Vorab generierte, noch verborgene Lernkarte/Frage für "mehr generieren" (siehe tasks/speculative_tasks.py)."""
+    __tablename__ = 'pending_material'
+    id = Column(String(36), primary_key=True, default=lambda: str(uuid.uuid4()))
+    upload_id = Column(String(36), ForeignKey('upload.id', ondelete='CASCADE'), nullable=False, index=True)
+    material_type = Column(String(20), nullable=False, index=True)  # flashcard | question
+    content = Column(JSON, nullable=False)
+    model = Column(String(50), nullable=True)
+    # Anteil der Tokens des Aufrufs; abgerechnet wird erst bei der Auslieferung
+    input_tokens = Column(Integer, nullable=False, default=0)
+    output_tokens = Column(Integer, nullable=False, default=0)
+    created_at = Column(DateTime, nullable=False, default=datetime.utcnow, index=True)
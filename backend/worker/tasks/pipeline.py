@@ -0,0 +1,247 @@
+"""
+Pipelining von Extraktion und Generierung langer PDFs.
+
+Ohne Pipelining beginnt die Generierung erst, wenn `document.process_document`
+das gesamte Dokument extrahiert hat; bei 400 Seiten vergehen so zig Sekunden
+bis zur ersten Anfrage. Lange PDFs (ab PIPELINE_MIN_PAGES Seiten) werden
+deshalb in Abschnitte zerlegt: ein kurzer erster Abschnitt
+(PIPELINE_FIRST_SECTION_PAGES), der Rest gleichmäßig auf höchstens
+PIPELINE_MAX_SECTIONS Abschnitte verteilt. Sobald die Seiten eines Abschnitts
+extrahiert sind, liegt sein Text unter `extracted_text:section:{Datei}:{n}` und
+`ai.generate_document_section` startet Lernkarten und Fragen für ihn, während
+die Extraktion weiterläuft. Die Zeit bis zu den ersten Ergebnissen hängt damit
+nicht mehr von der Dokumentlänge ab.
+
+Die gewünschten Mengen werden nach Seitenanteil auf die Abschnitte verteilt
+(der erste erhält mindestens einen Eintrag). Themen brauchen den Überblick
+über das ganze Dokument und laufen nach der Extraktion auf dem Gesamttext.
+
+Jeder Teil (Abschnitt bzw. Themen) meldet sich über den Chord-Callback
+`document.finalize_pipeline_part`. Ein Lua-Skript zählt die offenen Teile
+atomar herunter und sammelt die Ergebnisse; der letzte Teil schließt die Datei
+genau einmal ab (wie document.finalize_file).
+"""
+import json
+import logging
+import os
+from typing import Any, Callable, Dict, List, Optional
+
+from redis_utils.client import get_redis_client
+from .upload_status import finalize_uploaded_file, summarize_generation_results
+
+logger = logging.getLogger(__name__)
+
+PIPELINE_ENABLED = os.environ.get('PIPELINE_ENABLED', 'true').lower() == 'true'
+# Kürzere PDFs werden schnell genug am Stück extrahiert
+PIPELINE_MIN_PAGES = int(os.environ.get('PIPELINE_MIN_PAGES', 40))
+# Seiten des ersten Abschnitts; bestimmt die Zeit bis zu den ersten Ergebnissen
+PIPELINE_FIRST_SECTION_PAGES = int(os.environ.get('PIPELINE_FIRST_SECTION_PAGES', 10))
+# Höchstens so viele Abschnitte pro Dokument (jeder kostet eigene Anfragen)
+PIPELINE_MAX_SECTIONS = int(os.environ.get('PIPELINE_MAX_SECTIONS', 6))
+# Ausgabetypen pro Abschnitt; Themen laufen auf dem Gesamttext
+SECTION_TASK_TYPES = ('flashcards', 'questions')
+WHOLE_DOCUMENT_TASK_TYPES = ('topics',)
+# Mengenparameter je Abschnittstyp: (Option, Schlüssel in den Task-Metadaten, Standard wie in ai_tasks)
+SECTION_COUNTS = {
+    'flashcards': ('num_cards', 'num_flashcards', 5),
+    'questions': ('num_questions', 'num_questions', 3),
+}
+# Präfix der Pseudo-Datei-ID eines Abschnitts (Text unter extracted_text:{ID})
+SECTION_SOURCE_PREFIX = 'section:'
+# Lebensdauer der Zähler und des Abschnittstexts (Sekunden)
+PIPELINE_TTL = 86400
+
+# KEYS: remaining, results, done_parts | ARGV: part_id, results_json, ttl
+# Rückgabe: {remaining} bzw. {0, results} für den letzten Teil; -1 ohne Zähler, -2 wenn der Teil bereits gemeldet wurde
+_COMPLETE_PART_SCRIPT = """
+if redis.call('exists', KEYS[1]) == 0 then
+    return {-1}
+end
+if redis.call('sadd', KEYS[3], ARGV[1]) == 0 then
+    return {-2}
+end
+redis.call('expire', KEYS[3], ARGV[3])
+redis.call('rpush', KEYS[2], ARGV[2])
+redis.call('expire', KEYS[2], ARGV[3])
+local remaining = redis.call('decr', KEYS[1])
+if remaining > 0 then
+    return {remaining}
+end
+local results = redis.call('lrange', KEYS[2], 0, -1)
+redis.call('del', KEYS[1], KEYS[2], KEYS[3])
+return {0, results}
+"""
+
+
+def pipeline_remaining_key(uploaded_file_id):
+    """Anzahl der Teile einer Datei, deren Generierung noch läuft."""
+    return f"pipeline_remaining:{uploaded_file_id}"
+
+
+def pipeline_results_key(uploaded_file_id):
+    """Gesammelte Ergebnisse der abgeschlossenen Teile (JSON pro Teil)."""
+    return f"pipeline_results:{uploaded_file_id}"
+
+
+def pipeline_done_parts_key(uploaded_file_id):
+    """Set der bereits gemeldeten Teile (macht Meldungen idempotent)."""
+    return f"pipeline_done_parts:{uploaded_file_id}"
+
+
+def section_source_id(uploaded_file_id, index):
+    """Pseudo-Datei-ID des index-ten Abschnitts einer Datei."""
+    return f"{SECTION_SOURCE_PREFIX}{uploaded_file_id}:{index}"
+
+
+def section_file_id(source_id):
+    """Datei eines Abschnitts (andere Quellen unverändert)."""
+    source_id = str(source_id)
+    if not source_id.startswith(SECTION_SOURCE_PREFIX):
+        return source_id
+    return source_id[len(SECTION_SOURCE_PREFIX):].rsplit(':', 1)[0]
+
+
+def section_counts(total: int, pages: List[int]) -> List[int]:
+    """
+    Verteilt eine Menge nach Seitenanteil auf die Abschnitte (größter Rest).
+
+    Der erste Abschnitt erhält mindestens einen Eintrag, damit er sofort
+    Ergebnisse liefert; er wird dem Abschnitt mit den meisten Einträgen abgezogen.
+    """
+    page_sum = sum(pages)
+    if total <= 0 or page_sum <= 0:
+        return [0] * len(pages)
+    shares = [total * count / page_sum for count in pages]
+    parts = [int(share) for share in shares]
+    for index in sorted(range(len(shares)), key=lambda i: shares[i] - parts[i], reverse=True)[:total - sum(parts)]:
+        parts[index] += 1
+    if parts and parts[0] == 0:
+        parts[parts.index(max(parts))] -= 1
+        parts[0] = 1
+    return parts
+
+
+def plan_sections(uploaded_file_id, page_count: int, task_metadata: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """
+    Zerlegt ein PDF in Abschnitte mit eigenen Mengen.
+
+    Args:
+        uploaded_file_id: ID der Datei
+        page_count: Seitenzahl des PDFs
+        task_metadata: Metadaten des ProcessingTask (Mengen, Ausführungsmodus)
+
+    Returns:
+        list: [{'source_id', 'start', 'end', 'counts': {'num_cards', 'num_questions'}}];
+            leer, wenn das Dokument am Stück verarbeitet wird
+    """
+    if (not PIPELINE_ENABLED or page_count < max(PIPELINE_MIN_PAGES, 2)
+            or task_metadata.get('execution_mode') == 'batch'):
+        return []
+    first = max(1, min(PIPELINE_FIRST_SECTION_PAGES, page_count - 1))
+    rest = page_count - first
+    num_rest = max(1, min(PIPELINE_MAX_SECTIONS - 1, rest))
+    base, extra = divmod(rest, num_rest)
+    bounds = [(0, first)]
+    for index in range(num_rest):
+        start = bounds[-1][1]
+        bounds.append((start, start + base + (1 if index < extra else 0)))
+
+    pages = [end - start for start, end in bounds]
+    counts_by_option = {}
+    for option, metadata_key, default in SECTION_COUNTS.values():
+        counts_by_option[option] = section_counts(int(task_metadata.get(metadata_key, default)), pages)
+    return [
+        {
+            'source_id': section_source_id(uploaded_file_id, index),
+            'start': start,
+            'end': end,
+            'counts': {option: counts[index] for option, counts in counts_by_option.items()},
+        }
+        for index, (start, end) in enumerate(bounds)
+    ]
+
+
+def extract_pages(doc, sections: List[Dict[str, Any]], on_section: Callable[[Dict[str, Any], str], None]) -> str:
+    """
+    Extrahiert ein PDF Seite für Seite und meldet jeden fertigen Abschnitt sofort.
+
+    Args:
+        doc: Geöffnetes PyMuPDF-Dokument
+        sections: Abschnitte aus plan_sections (aufsteigend, lückenlos)
+        on_section: Wird mit (Abschnitt, Text) aufgerufen, sobald seine Seiten extrahiert sind
+
+    Returns:
+        str: Text des gesamten Dokuments
+    """
+    texts = []
+    pending = list(sections)
+    for page in doc:
+        texts.append(page.get_text())
+        while pending and len(texts) >= pending[0]['end']:
+            section = pending.pop(0)
+            on_section(section, "\n".join(texts[section['start']:section['end']]))
+    return "\n".join(texts)
+
+
+def store_section_text(source_id, text):
+    """Legt den Text eines Abschnitts für die AI-Tasks in Redis ab (wie extracted_text:{Datei})."""
+    get_redis_client().set(f"extracted_text:{source_id}", text, ex=PIPELINE_TTL)
+
+
+def init_pipeline(uploaded_file_id, num_parts):
+    """
+    Legt den Zähler der offenen Teile an (Abschnitte plus Gesamttext).
+
+    Nur der erste Aufruf setzt den Wert, damit ein wiederholter Task keine
+    bereits gemeldeten Teile erneut erwartet.
+    """
+    get_redis_client().set(pipeline_remaining_key(uploaded_file_id), int(num_parts), nx=True, ex=PIPELINE_TTL)
+
+
+def complete_pipeline_part(db_session, upload_id, uploaded_file_id, part_id,
+                           results: Optional[List[Any]]) -> Optional[Dict[str, Any]]:
+    """
+    Meldet einen fertigen Teil; der letzte schließt die Datei ab.
+
+    Args:
+        db_session: Offene Datenbank-Session
+        upload_id: ID des Uploads
+        uploaded_file_id: ID der Datei
+        part_id: Quelle des Teils (Abschnitts-ID bzw. Datei-ID für den Gesamttext)
+        results: Rückgabewerte der AI-Tasks des Teils
+
+    Returns:
+        dict|None: {'failed', 'upload_status'}, wenn dieser Aufruf die Datei abgeschlossen hat
+    """
+    try:
+        response = get_redis_client().eval(
+            _COMPLETE_PART_SCRIPT, 3,
+            pipeline_remaining_key(uploaded_file_id), pipeline_results_key(uploaded_file_id),
+            pipeline_done_parts_key(uploaded_file_id),
+            part_id, json.dumps(results or [], default=str), PIPELINE_TTL
+        )
+    except Exception as e:
+        logger.error(f"[PIPELINE] Zähler für Datei {uploaded_file_id} nicht verfügbar: {e}")
+        response = [-1]
+
+    remaining = int(response[0])
+    if remaining == -2:
+        logger.info(f"[PIPELINE] Teil {part_id} wurde bereits gemeldet.")
+        return None
+    if remaining > 0:
+        logger.info(f"[PIPELINE] Teil {part_id} fertig, {remaining} Teil(e) offen für Datei {uploaded_file_id}.")
+        return None
+
+    if remaining == -1:
+        # Ohne Zähler (abgelaufen bzw. Redis nicht erreichbar) die Datei nicht hängen lassen
+        logger.warning(f"[PIPELINE] Kein Zähler für Datei {uploaded_file_id}, schließe mit Teil {part_id} ab.")
+        all_results = list(results or [])
+    else:
+        all_results = []
+        for raw in response[1]:
+            all_results.extend(json.loads(raw.decode('utf-8') if isinstance(raw, bytes) else raw))
+
+    summary, failed = summarize_generation_results(all_results)
+    upload_status = finalize_uploaded_file(db_session, upload_id, uploaded_file_id, failed=failed, summary=summary)
+    logger.info(f"[PIPELINE] Alle Teile von Datei {uploaded_file_id} fertig ({len(summary)} Task-Ergebnisse).")
+    return {'failed': failed, 'upload_status': upload_status}
@@ -16,8 +16,58 @@ logger = logging.getLogger(__name__)
 
 # Absolute Imports verwenden statt relativer Imports
 from utils.call_openai import call_openai_api, extract_json_from_response
-from config.prompts import get_system_prompt, get_user_prompt
+from utils.fanout import plan_fanout, run_fanout
+from utils.continuation import complete_truncated, finish_reason
+from utils.near_duplicates import NearDuplicateIndex, filter_near_duplicates
+from utils.near_duplicates import question_text as question_compare_text
+from config.prompts import build_budgeted_messages
 from redis_utils.client import get_redis_client
+from redis_utils.single_flight import acquire_single_flight, release_single_flight, wait_for_single_flight
+from redis_utils.semantic_cache import lookup_semantic_cache, store_semantic_cache
+
+# Parameter der Completion für Fragen
+QUESTIONS_TEMPERATURE = 0.7
+QUESTIONS_MAX_TOKENS = 2000
+# Geschätzte Ausgabe-Tokens pro Frage (Fragetext, vier Optionen, Erklärung)
+QUESTION_TOKENS_PER_ITEM = int(os.environ.get('QUESTION_TOKENS_PER_ITEM', 250))
+
+def build_questions_request(content: str, num_questions: int = 5, question_type: str = 'multiple_choice',
+                            language: str = 'de', model: str = None, focus=None, exclude=None) -> Dict[str, Any]:
+    """
+    Baut die Parameter der Chat-Completion für die Fragen-Generierung.
+
+    Wird sowohl für direkte API-Aufrufe als auch für Batch-Aufträge verwendet.
+
+    Args:
+        content: Der Text, aus dem Fragen generiert werden sollen
+        num_questions: Anzahl der Fragen
+        question_type: Fragetyp (multiple_choice, open, true_false)
+        language: Sprachcode
+        model: Zu verwendendes Modell
+        focus: (i, N) für Teilanfrage i von N (siehe utils/fanout.py)
+        exclude: Bereits erstellte Fragen (Folgeanfrage, siehe utils/continuation.py)
+
+    Returns:
+        dict: model, messages, temperature, max_tokens und response_format
+    """
+    model = model or os.environ.get('OPENAI_DEFAULT_MODEL', 'gpt-3.5-turbo')
+    return {
+        "model": model,
+        "messages": build_budgeted_messages("questions", content, model, QUESTIONS_MAX_TOKENS, language=language,
+                                            num_questions=num_questions, question_type=question_type,
+                                            focus=focus, exclude=exclude),
+        "temperature": QUESTIONS_TEMPERATURE,
+        "max_tokens": QUESTIONS_MAX_TOKENS,
+        "response_format": {"type": "json_object"}
+    }
+
+def questions_cache_key(content: str, num_questions: int, question_type: str, language: str, model: str,
+                        part=None) -> str:
+    """Gibt den Redis-Cache-Schlüssel für eine Fragen-Antwort (bzw. Teilanfrage) zurück."""
+    combined_key_material = f"{content[:20000]}-num:{num_questions}-type:{question_type}-lang:{language}-model:{model}"
+    if part:
+        combined_key_material += f"-part:{part[0]}/{part[1]}"
+    return f"openai_cache:questions:{hashlib.sha256(combined_key_material.encode('utf-8')).hexdigest()}"
 
 def generate_questions_with_openai(
     extracted_text: str,
@@ -34,7 +84,9 @@ def generate_questions_with_openai(
         num_questions (int): Anzahl der Fragen.
         question_type (str): Fragetyp (multiple_choice, open, true_false).
         language (str): Sprachcode (de, en, ...).
-        **options: Weitere Optionen (model).
+        **options: Weitere Optionen (model). Passen num_questions Fragen nicht in eine
+            Completion, wird die Anfrage in parallele Teilanfragen ('fanout_part') aufgeteilt.
+            'semantic_cache': False überspringt den Ähnlichkeits-Cache (Nachgenerierung, Folgeanfragen).
     Returns:
         dict: Enthält {"questions": List[Dict], "usage": Dict} oder leeres Dict bei Fehler.
     """
@@ -49,58 +101,86 @@ def generate_questions_with_openai(
         logger.error("[QUESTIONS] Kein Text zur Verarbeitung übergeben.")
         return {"questions": [], "usage": None}
 
-    # Cache-Prüfung (bleibt ähnlich, verwendet `content`)
-    response_content = None
-    usage = None
+    # Große Anfragen: parallele Teilanfragen mit disjunktem Fokus statt einer abgeschnittenen Antwort
+    fanout_part = options.get('fanout_part')
+    if fanout_part is None and options.get('response_content') is None:
+        sizes = plan_fanout(num_questions, QUESTION_TOKENS_PER_ITEM, QUESTIONS_MAX_TOKENS)
+        if len(sizes) > 1:
+            merged = run_fanout(generate_questions_with_openai, 'questions', sizes, 'num_questions',
+                                extracted_text=content, question_type=question_type, language=language, **options)
+            questions, duplicates = filter_near_duplicates(merged['questions'], NearDuplicateIndex(), question_compare_text)
+            logger.info(f"[QUESTIONS] {len(questions)} Fragen aus {merged['fanout']} Teilanfragen "
+                        f"({len(duplicates)} Duplikate entfernt)")
+            return {"questions": questions, "usage": merged['usage']}
+    exclude = options.get('exclude')
+    continuation_depth = options.get('continuation_depth', 0)
+
+    # Vorberechnete Antwort (z.B. aus einem Batch-Auftrag) überspringt Cache und API
+    response_content = options.get('response_content')
+    usage = options.get('usage')
     cache_key = None
     CACHE_TTL = 86400 * 7 # 7 Tage
     redis_client = get_redis_client() # Hole Redis Client hier
-    try:
-        content_hash_part = content[:20000] 
-        params_str = f"num:{num_questions}-type:{question_type}-lang:{language}-model:{model}"
-        combined_key_material = f"{content_hash_part}-{params_str}"
-        # Cache-Key spezifisch für Fragen
-        cache_key = f"openai_cache:questions:{hashlib.sha256(combined_key_material.encode('utf-8')).hexdigest()}"
-        
-        cached_response = redis_client.get(cache_key)
-        if cached_response:
-            response_content = cached_response.decode('utf-8')
-            logger.info(f"[CACHE HIT] Antwort aus Redis-Cache geladen für Key: {cache_key}")
-        else:
-            logger.info(f"[CACHE MISS] Kein Cache-Eintrag gefunden für Key: {cache_key}")
+    # Folgeanfragen (exclude) nicht cachen: der Schlüssel bildet die ausgeschlossenen Einträge nicht ab
+    if response_content is None and not exclude:
+        try:
+            cache_key = questions_cache_key(content, num_questions, question_type, language, model, part=fanout_part)
+            cached_response = redis_client.get(cache_key)
+            if cached_response:
+                response_content = cached_response.decode('utf-8') if isinstance(cached_response, bytes) else cached_response
+                logger.info(f"[CACHE HIT] Antwort aus Redis-Cache geladen für Key: {cache_key}")
+            else:
+                logger.info(f"[CACHE MISS] Kein Cache-Eintrag gefunden für Key: {cache_key}")
 
-    except Exception as cache_err:
-        logger.warning(f"[FRAGEN] Fehler bei Cache-Prüfung: {cache_err}")
+        except Exception as cache_err:
+            logger.warning(f"[FRAGEN] Fehler bei Cache-Prüfung: {cache_err}")
 
-    if response_content is None:
-        # Prompts vorbereiten
-        system_prompt = get_system_prompt("questions", language=language, num_questions=num_questions, question_type=question_type)
-        user_prompt = get_user_prompt("questions", content)
-        messages = [
-            {"role": "system", "content": system_prompt},
-            {"role": "user", "content": user_prompt}
-        ]
+    # Zweite Stufe: Antwort eines sehr ähnlichen Dokuments mit denselben Parametern
+    semantic_params = {'num_questions': num_questions, 'question_type': question_type, 'language': language,
+                       'model': model, 'part': fanout_part}
+    if response_content is None and cache_key and options.get('semantic_cache', True):
+        response_content = lookup_semantic_cache('questions', content, semantic_params)
 
-        # OpenAI-API aufrufen (SYNCHRON)
-        logger.info(f"[QUESTIONS] Schritt 4: Sende SYNC Anfrage an OpenAI API ({model})")
-        response = call_openai_api(
-            model=model,
-            messages=messages,
-            temperature=0.7,
-            max_tokens=2000,
-            response_format={"type": "json_object"}
-        )
-        response_content = response.get('choices', [{}])[0].get('message', {}).get('content', '{}')
-        usage = response.get('usage')
-        logger.info(f"[QUESTIONS] OpenAI-Antwort erhalten. Usage: {usage}")
+    # Single-Flight: Nur ein Worker berechnet dieselbe Anfrage, die übrigen übernehmen das Ergebnis
+    lock_token = None
+    if response_content is None and cache_key:
+        lock_token = acquire_single_flight(cache_key)
+        if lock_token is None:
+            response_content = wait_for_single_flight(cache_key)
+            if response_content is None:
+                lock_token = acquire_single_flight(cache_key)
 
-        # Cache speichern (bleibt gleich)
-        if response_content and response_content != '{}' and cache_key:
-            try:
-                redis_client.set(cache_key, response_content, ex=CACHE_TTL)
-                logger.info(f"[CACHE SET] Antwort in Redis gespeichert (Key: {cache_key}, TTL: {CACHE_TTL // 86400} Tage)")
-            except Exception as cache_set_err:
-                logger.warning(f"[FRAGEN] Fehler beim Speichern der Antwort im Cache: {cache_set_err}")
+    try:
+        if response_content is None:
+            request = build_questions_request(content, num_questions=num_questions, question_type=question_type,
+                                              language=language, model=model, focus=fanout_part, exclude=exclude)
+
+            # OpenAI-API aufrufen (SYNCHRON)
+            logger.info(f"[QUESTIONS] Schritt 4: Sende SYNC Anfrage an OpenAI API ({model})")
+            response = call_openai_api(**request)
+            response_content = response.get('choices', [{}])[0].get('message', {}).get('content', '{}')
+            usage = response.get('usage')
+            logger.info(f"[QUESTIONS] OpenAI-Antwort erhalten. Usage: {usage}")
+
+            if finish_reason(response) == 'length':
+                # Abgeschnittenes JSON: vollständige Fragen übernehmen, nur den Rest nachfordern
+                response_content, usage = complete_truncated(
+                    response_content, usage, 'questions', num_questions, continuation_depth,
+                    lambda remaining, done: generate_questions_with_openai(
+                        content, num_questions=remaining, question_type=question_type, language=language,
+                        **{**options, 'exclude': (exclude or []) + [q.get('question', '') for q in done],
+                           'continuation_depth': continuation_depth + 1, 'semantic_cache': False}))
+
+            # Cache speichern (bleibt gleich)
+            if response_content and response_content != '{}' and cache_key:
+                try:
+                    redis_client.set(cache_key, response_content, ex=CACHE_TTL)
+                    logger.info(f"[CACHE SET] Antwort in Redis gespeichert (Key: {cache_key}, TTL: {CACHE_TTL // 86400} Tage)")
+                    store_semantic_cache('questions', content, semantic_params, cache_key, ttl=CACHE_TTL)
+                except Exception as cache_set_err:
+                    logger.warning(f"[FRAGEN] Fehler beim Speichern der Antwort im Cache: {cache_set_err}")
+    finally:
+        release_single_flight(cache_key, lock_token)
 
     # Antwort parsen & Fragen extrahieren/standardisieren (bleibt gleich)
     standardized_questions = []
@@ -237,19 +317,22 @@ def generate_questions_with_openai(
                     'question': 'Was ist das Hauptthema des Dokuments?',
                     'options': ['Hauptthema A', 'Hauptthema B', 'Hauptthema C', 'Hauptthema D'],
                     'correct_answer': 0,
-                    'explanation': 'Wähle die Option, die am besten das Hauptthema des Dokuments beschreibt.'
+                    'explanation': 'Wähle die Option, die am besten das Hauptthema des Dokuments beschreibt.',
+                    'fallback': True
                 })
             elif question_type == 'open':
                 standardized_questions.append({
                     'question': 'Fasse den Hauptinhalt des Dokuments zusammen.',
                     'answer': 'Der Hauptinhalt muss aus dem Dokument abgeleitet werden.',
-                    'keywords': ['Inhalt', 'Zusammenfassung', 'Hauptthema']
+                    'keywords': ['Inhalt', 'Zusammenfassung', 'Hauptthema'],
+                    'fallback': True
                 })
             elif question_type == 'true_false':
                 standardized_questions.append({
                     'statement': 'Das Dokument enthält wichtige Informationen.',
                     'is_true': True,
-                    'explanation': 'Jedes Dokument enthält in der Regel wichtige Informationen.'
+                    'explanation': 'Jedes Dokument enthält in der Regel wichtige Informationen.',
+                    'fallback': True
                 })
                 
             logger.info(f"[FRAGEN] Fallback-Frage erstellt")
@@ -0,0 +1,337 @@
+"""
+Spekulative Vorab-Generierung für "mehr Lernkarten/Fragen".
+
+Klickt ein Nutzer auf "mehr generieren", soll die Antwort sofort kommen statt
+nach 20–40 s. Solange die Queues fast leer sind, erzeugt der Worker deshalb für
+kürzlich aktive Uploads den nächsten Satz Lernkarten und Fragen im Voraus und
+legt ihn verborgen in `pending_material` ab. Der "mehr"-Endpunkt des Backends
+übernimmt diese Zeilen, rechnet erst dann die Tokens ab und stößt das
+Nachfüllen an.
+
+Ein Token-Budget pro Nutzer und Tag (und insgesamt pro Tag) begrenzt, wie viel
+spekulativ verbraucht werden darf. Vom Nutzer angeforderte Generierung
+(deliver=True) zählt nicht zum Budget, sie wird regulär abgerechnet.
+"""
+import json
+import logging
+import os
+from datetime import datetime, timedelta
+from typing import Any, Dict, List
+
+from sqlalchemy import func
+
+from .ai_tasks import _source_tags, existing_material, merged_source_id
+from .flashcards.generation import FLASHCARDS_MAX_TOKENS, generate_flashcards_with_openai
+from .models import Flashcard, PendingMaterial, Question, Upload, UploadedFile, session_scope
+from .questions.generation import QUESTIONS_MAX_TOKENS, generate_questions_with_openai
+from config.model_routing import get_model_route
+from config.queues import TIER_BULK, queue_depth, tier_options
+from redis_utils.client import get_redis_client
+from utils.merged_context import build_merged_context
+from utils.near_duplicates import (NearDuplicateIndex, covered_concepts_summary, filter_near_duplicates,
+                                   flashcard_text, question_text)
+from utils.token_counter import count_tokens
+from utils.token_tracking import update_token_usage
+from utils.validation import validate_generated_flashcards, validate_generated_questions
+
+logger = logging.getLogger(__name__)
+
+# Vorab-Generierung ein-/ausschalten
+SPECULATIVE_ENABLED = os.environ.get('SPECULATIVE_ENABLED', 'false').lower() == 'true'
+# Intervall des Schedulers (Sekunden)
+SPECULATIVE_INTERVAL = int(os.environ.get('SPECULATIVE_INTERVAL', 60))
+# Nur vorab generieren, wenn höchstens so viele Nachrichten in den Queues warten
+SPECULATIVE_MAX_QUEUE_DEPTH = int(os.environ.get('SPECULATIVE_MAX_QUEUE_DEPTH', 2))
+# Uploads gelten als aktiv, wenn sie in diesem Zeitraum genutzt wurden (Minuten)
+SPECULATIVE_ACTIVE_MINUTES = int(os.environ.get('SPECULATIVE_ACTIVE_MINUTES', 30))
+# Maximale Anzahl Vorab-Generierungen pro Scheduler-Lauf
+SPECULATIVE_MAX_JOBS_PER_RUN = int(os.environ.get('SPECULATIVE_MAX_JOBS_PER_RUN', 4))
+# Tokenbudget pro Nutzer und Tag bzw. insgesamt pro Tag
+SPECULATIVE_USER_DAILY_TOKENS = int(os.environ.get('SPECULATIVE_USER_DAILY_TOKENS', 30000))
+SPECULATIVE_DAILY_TOKENS = int(os.environ.get('SPECULATIVE_DAILY_TOKENS', 1000000))
+
+# Größe eines vorab generierten Satzes pro Materialtyp
+SPECULATIVE_BATCH_SIZE = {
+    'flashcard': int(os.environ.get('SPECULATIVE_BATCH_FLASHCARDS', 10)),
+    'question': int(os.environ.get('SPECULATIVE_BATCH_QUESTIONS', 5)),
+}
+# Sperre gegen parallele Generierung desselben Uploads und Typs (Sekunden)
+SPECULATIVE_LOCK_TTL = 600
+BUDGET_KEY_TTL = 2 * 86400
+
+# KEYS: user_key, global_key | ARGV: tokens, user_cap, global_cap, ttl
+# Rückgabe: 1 wenn reserviert, 0 wenn ein Budget überschritten würde
+_RESERVE_BUDGET_SCRIPT = """
+local tokens = tonumber(ARGV[1])
+if tonumber(redis.call('get', KEYS[1]) or '0') + tokens > tonumber(ARGV[2]) then
+    return 0
+end
+if tonumber(redis.call('get', KEYS[2]) or '0') + tokens > tonumber(ARGV[3]) then
+    return 0
+end
+redis.call('incrby', KEYS[1], tokens)
+redis.call('expire', KEYS[1], ARGV[4])
+redis.call('incrby', KEYS[2], tokens)
+redis.call('expire', KEYS[2], ARGV[4])
+return 1
+"""
+
+
+
+def speculative_budget_keys(user_id, day=None):
+    """Redis-Zähler der spekulativ verbrauchten Tokens (Nutzer, gesamt) für einen Tag."""
+    day = day or datetime.utcnow().strftime('%Y%m%d')
+    return f"speculative_tokens:{user_id}:{day}", f"speculative_tokens:all:{day}"
+
+
+def reserve_speculative_budget(user_id, tokens) -> bool:
+    """
+    Reserviert geschätzte Tokens im Tagesbudget des Nutzers und im Gesamtbudget.
+
+    Returns:
+        bool: True, wenn beide Budgets ausreichen
+    """
+    user_key, global_key = speculative_budget_keys(user_id)
+    try:
+        return bool(int(get_redis_client().eval(
+            _RESERVE_BUDGET_SCRIPT, 2, user_key, global_key,
+            int(tokens), SPECULATIVE_USER_DAILY_TOKENS, SPECULATIVE_DAILY_TOKENS, BUDGET_KEY_TTL
+        )))
+    except Exception as e:
+        logger.warning(f"[SPECULATIVE] Budget nicht verfügbar, keine Vorab-Generierung: {e}")
+        return False
+
+
+def adjust_speculative_budget(user_id, delta):
+    """Korrigiert die Reservierung um die Differenz zwischen tatsächlichem Verbrauch und Schätzung."""
+    if not delta:
+        return
+    client = get_redis_client()
+    try:
+        for key in speculative_budget_keys(user_id):
+            client.incrby(key, int(delta))
+    except Exception as e:
+        logger.debug(f"[SPECULATIVE] Budget konnte nicht korrigiert werden: {e}")
+
+
+def _text_of(material_type):
+    return flashcard_text if material_type == 'flashcard' else question_text
+
+
+def _existing_items(db_session, upload_id, material_type) -> List[Dict[str, Any]]:
+    """Bereits vorhandene (sichtbare und vorab generierte) Lernkarten bzw. Fragen eines Uploads."""
+    visible = existing_material(db_session, upload_id, 'flashcards' if material_type == 'flashcard' else 'questions')
+    pending = [
+        row[0]
+        for row in db_session.query(PendingMaterial.content).filter_by(upload_id=upload_id, material_type=material_type)
+    ]
+    return [item for item in visible + pending if item and item.get('question')]
+
+
+def _build_context(files: List[Dict[str, str]], existing: List[Dict[str, Any]]) -> str:
+    """Text aller Dateien (mit Token-Budget) plus Zusammenfassung der bereits abgedeckten Begriffe."""
+    context, _ = build_merged_context(files, {})
+    covered = covered_concepts_summary(item['question'] for item in existing)
+    if covered:
+        context += f"\n\n### Bereits abgedeckte Begriffe (Anzahl Einträge; nicht wiederholen, neue Aspekte abdecken)\n{covered}"
+    return context
+
+
+def _generate(material_type, context, count, language, model):
+    """Ruft die Generierung auf und gibt (gültige Einträge, usage) zurück."""
+    # Ohne Ähnlichkeits-Cache: eine Antwort zu einem ähnlichen Dokument enthielte bereits vorhandene Einträge
+    if material_type == 'flashcard':
+        result = generate_flashcards_with_openai(context, num_cards=count, language=language, model=model,
+                                                 semantic_cache=False)
+        valid, _ = validate_generated_flashcards(result.get('flashcards'))
+    else:
+        result = generate_questions_with_openai(context, num_questions=count, language=language, model=model,
+                                                semantic_cache=False)
+        valid, _ = validate_generated_questions(result.get('questions'))
+    return valid, result.get('usage') or {}
+
+
+def register_tasks(celery_app):
+    """
+    Registriert die Tasks der Vorab-Generierung mit der Celery-App.
+
+    Args:
+        celery_app: Die Celery-App-Instanz.
+
+    Returns:
+        dict: Dictionary mit den registrierten Tasks.
+    """
+    tasks = {}
+
+    @celery_app.task(name='speculative.schedule')
+    def schedule():
+        """
+        Plant Vorab-Generierungen für kürzlich aktive Uploads, solange die Queues fast leer sind.
+
+        Returns:
+            dict: Status und Anzahl gestarteter Generierungen
+        """
+        if not SPECULATIVE_ENABLED:
+            return {'status': 'disabled'}
+        try:
+            depth = queue_depth(get_redis_client())
+        except Exception as e:
+            logger.warning(f"[SPECULATIVE] Queue-Tiefe nicht verfügbar: {e}")
+            return {'status': 'skipped', 'reason': 'queue_depth_unavailable'}
+        if depth > SPECULATIVE_MAX_QUEUE_DEPTH:
+            logger.info(f"[SPECULATIVE] {depth} Nachrichten in den Queues, keine Vorab-Generierung.")
+            return {'status': 'skipped', 'reason': 'busy', 'queue_depth': depth}
+
+        cutoff = datetime.utcnow() - timedelta(minutes=SPECULATIVE_ACTIVE_MINUTES)
+        with session_scope() as db_session:
+            uploads = (db_session.query(Upload.id, Upload.user_id)
+                       .filter(Upload.user_id.isnot(None),
+                               Upload.overall_processing_status == 'completed',
+                               func.coalesce(Upload.last_used_at, Upload.updated_at) >= cutoff)
+                       .order_by(func.coalesce(Upload.last_used_at, Upload.updated_at).desc())
+                       .limit(SPECULATIVE_MAX_JOBS_PER_RUN)
+                       .all())
+            upload_ids = [upload.id for upload in uploads]
+            pending_counts = {
+                (upload_id, material_type): count
+                for upload_id, material_type, count in (
+                    db_session.query(PendingMaterial.upload_id, PendingMaterial.material_type, func.count(PendingMaterial.id))
+                    .filter(PendingMaterial.upload_id.in_(upload_ids))
+                    .group_by(PendingMaterial.upload_id, PendingMaterial.material_type)
+                    .all()
+                )
+            } if upload_ids else {}
+
+        started = 0
+        for upload in uploads:
+            for material_type, batch_size in SPECULATIVE_BATCH_SIZE.items():
+                if started >= SPECULATIVE_MAX_JOBS_PER_RUN:
+                    break
+                if pending_counts.get((upload.id, material_type), 0) >= batch_size:
+                    continue
+                pregenerate.apply_async(args=[upload.id, material_type], **tier_options(TIER_BULK))
+                started += 1
+
+        logger.info(f"[SPECULATIVE] {started} Vorab-Generierung(en) für {len(uploads)} aktive Upload(s) gestartet.")
+        return {'status': 'success', 'started': started, 'queue_depth': depth}
+
+    tasks['speculative.schedule'] = schedule
+
+    @celery_app.task(name='speculative.pregenerate')
+    def pregenerate(upload_id, material_type, deliver=False, count=None, session_id=None):
+        """
+        Generiert den nächsten Satz Lernkarten oder Fragen eines Uploads.
+
+        Args:
+            upload_id: ID des Uploads
+            material_type: 'flashcard' oder 'question'
+            deliver: True = direkt sichtbar speichern und abrechnen (Nutzeranfrage ohne Vorrat),
+                False = verborgen in pending_material ablegen (Budget-begrenzt)
+            count: Anzahl (Standard: SPECULATIVE_BATCH_SIZE)
+            session_id: Session für die Abrechnung bei deliver=True
+
+        Returns:
+            dict: Status und Anzahl gespeicherter Einträge
+        """
+        if material_type not in SPECULATIVE_BATCH_SIZE:
+            return {'status': 'error', 'error': f"Unbekannter Materialtyp: {material_type}"}
+        count = int(count or SPECULATIVE_BATCH_SIZE[material_type])
+        client = get_redis_client()
+        lock_key = f"speculative_lock:{upload_id}:{material_type}"
+        if not deliver and not client.set(lock_key, '1', nx=True, ex=SPECULATIVE_LOCK_TTL):
+            return {'status': 'skipped', 'reason': 'in_progress'}
+
+        reserved = 0
+        user_id = None
+        try:
+            with session_scope() as db_session:
+                upload = db_session.query(Upload).get(upload_id)
+                if not upload:
+                    return {'status': 'error', 'error': 'upload_not_found'}
+                user_id = upload.user_id
+                session_id = session_id or upload.session_id
+                language = (upload.upload_metadata or {}).get('language', 'de')
+                files = [
+                    {'id': f.id, 'name': f.file_name, 'text': f.extracted_text}
+                    for f in db_session.query(UploadedFile).filter_by(upload_id=upload_id).order_by(UploadedFile.file_index)
+                    if f.extracted_text
+                ]
+                existing = _existing_items(db_session, upload_id, material_type)
+            if not files:
+                return {'status': 'skipped', 'reason': 'no_text'}
+
+            context = _build_context(files, existing)
+            max_output = FLASHCARDS_MAX_TOKENS if material_type == 'flashcard' else QUESTIONS_MAX_TOKENS
+            model = get_model_route('flashcards' if material_type == 'flashcard' else 'questions')[0]
+            if not deliver:
+                estimate = count_tokens(context, model) + max_output
+                if not user_id or not reserve_speculative_budget(user_id, estimate):
+                    logger.info(f"[SPECULATIVE] Tagesbudget für Nutzer {user_id} erschöpft, überspringe Upload {upload_id}.")
+                    return {'status': 'skipped', 'reason': 'budget'}
+                reserved = estimate
+
+            items, usage = _generate(material_type, context, count, language, model)
+            input_tokens = int(usage.get('prompt_tokens', 0) or 0)
+            output_tokens = int(usage.get('completion_tokens', 0) or 0)
+            if reserved:
+                adjust_speculative_budget(user_id, input_tokens + output_tokens - reserved)
+                reserved = 0
+
+            # Nur neue Einträge übernehmen (Beinahe-Duplikate vorhandener Einträge werden verworfen)
+            text_of = _text_of(material_type)
+            index = NearDuplicateIndex.from_texts(text_of(item) for item in existing)
+            fresh, _ = filter_near_duplicates(items, index, text_of)
+
+            with session_scope() as db_session:
+                if deliver:
+                    for item in fresh:
+                        db_session.add(_visible_row(material_type, upload_id, item))
+                else:
+                    share = max(len(fresh), 1)
+                    for item in fresh:
+                        db_session.add(PendingMaterial(
+                            upload_id=upload_id,
+                            material_type=material_type,
+                            content=item,
+                            model=model,
+                            input_tokens=input_tokens // share,
+                            output_tokens=output_tokens // share,
+                        ))
+
+            if deliver and user_id and input_tokens:
+                update_token_usage(user_id=user_id, session_id=session_id, input_tokens=input_tokens,
+                                   output_tokens=output_tokens, model=model,
+                                   function_name=f"generate_more_{material_type}s",
+                                   metadata={'mode': 'more'},
+                                   cached_tokens=int(usage.get('cached_tokens', 0) or 0))
+
+            logger.info(f"[SPECULATIVE] {len(fresh)} {material_type}(s) für Upload {upload_id} "
+                        f"{'gespeichert' if deliver else 'vorab generiert'} ({input_tokens + output_tokens} Tokens).")
+            return {'status': 'completed', 'upload_id': upload_id, 'material_type': material_type,
+                    'saved': len(fresh), 'delivered': bool(deliver)}
+        except Exception as e:
+            logger.error(f"[SPECULATIVE] Fehler bei der Generierung für Upload {upload_id}: {e}", exc_info=True)
+            if reserved:
+                adjust_speculative_budget(user_id, -reserved)
+            return {'status': 'error', 'upload_id': upload_id, 'error': str(e)}
+        finally:
+            if not deliver:
+                client.delete(lock_key)
+
+    tasks['speculative.pregenerate'] = pregenerate
+
+    return tasks
+
+
+def _visible_row(material_type, upload_id, item: Dict[str, Any]):
+    """Erstellt die sichtbare Lernkarte bzw. Frage aus einem generierten Eintrag."""
+    if material_type == 'flashcard':
+        return Flashcard(upload_id=upload_id, question=item['question'], answer=item['answer'],
+                         tags=_source_tags(merged_source_id(upload_id), upload_id))
+    return Question(
+        upload_id=upload_id,
+        text=item['question'],
+        options=json.dumps(item.get('options') or []),
+        correct_answer=int(item.get('correct_answer', 0) or 0),
+        explanation=item.get('explanation', ''),
+    )
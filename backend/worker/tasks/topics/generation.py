@@ -12,8 +12,44 @@ logger = logging.getLogger(__name__)
 
 # Absolute Imports verwenden statt relativer Imports
 from utils.call_openai import call_openai_api, extract_json_from_response
-from config.prompts import get_system_prompt, get_user_prompt
+from config.prompts import build_budgeted_messages
 from redis_utils.client import get_redis_client
+from redis_utils.single_flight import acquire_single_flight, release_single_flight, wait_for_single_flight
+from redis_utils.semantic_cache import lookup_semantic_cache, store_semantic_cache
+
+# Parameter der Completion für Themen (niedrigere Temperatur für konsistentere Ergebnisse)
+TOPICS_TEMPERATURE = 0.5
+TOPICS_MAX_TOKENS = 1500
+
+def build_topics_request(content: str, max_topics: int = 8, language: str = 'de', model: str = None) -> Dict[str, Any]:
+    """
+    Baut die Parameter der Chat-Completion für die Themen-Extraktion.
+
+    Wird sowohl für direkte API-Aufrufe als auch für Batch-Aufträge verwendet.
+
+    Args:
+        content: Der Text, aus dem Themen extrahiert werden sollen
+        max_topics: Maximale Anzahl Themen
+        language: Sprachcode
+        model: Zu verwendendes Modell
+
+    Returns:
+        dict: model, messages, temperature, max_tokens und response_format
+    """
+    model = model or os.environ.get('OPENAI_DEFAULT_MODEL', 'gpt-3.5-turbo')
+    return {
+        "model": model,
+        "messages": build_budgeted_messages("topics", content, model, TOPICS_MAX_TOKENS, language=language,
+                                            max_topics=max_topics),
+        "temperature": TOPICS_TEMPERATURE,
+        "max_tokens": TOPICS_MAX_TOKENS,
+        "response_format": {"type": "json_object"}
+    }
+
+def topics_cache_key(content: str, max_topics: int, language: str, model: str) -> str:
+    """Gibt den Redis-Cache-Schlüssel für eine Themen-Antwort zurück."""
+    combined_key_material = f"{content[:20000]}-max:{max_topics}-lang:{language}-model:{model}"
+    return f"openai_cache:topics:{hashlib.sha256(combined_key_material.encode('utf-8')).hexdigest()}"
 
 def extract_topics_with_openai(
     extracted_text: str,
@@ -43,58 +79,60 @@ def extract_topics_with_openai(
         logger.error("[TOPICS] Kein Text zur Verarbeitung übergeben.")
         return {"topics_data": {'main_topic': {}, 'subtopics': []}, "usage": None}
 
-    # Cache-Prüfung (bleibt ähnlich)
-    response_content = None
-    usage = None
+    # Vorberechnete Antwort (z.B. aus einem Batch-Auftrag) überspringt Cache und API
+    response_content = options.get('response_content')
+    usage = options.get('usage')
     cache_key = None
     CACHE_TTL = 86400 * 7 # 7 Tage
-    try:
-        content_hash_part = content[:20000] 
-        params_str = f"max:{max_topics}-lang:{language}-model:{model}"
-        combined_key_material = f"{content_hash_part}-{params_str}"
-        # Cache-Key spezifisch für Themen
-        cache_key = f"openai_cache:topics:{hashlib.sha256(combined_key_material.encode('utf-8')).hexdigest()}"
-        
-        cached_response = get_redis_client().get(cache_key)
-        if cached_response:
-            response_content = cached_response.decode('utf-8')
-            logger.info(f"[CACHE HIT] Antwort aus Redis-Cache geladen für Key: {cache_key}")
-        else:
-            logger.info(f"[CACHE MISS] Kein Cache-Eintrag gefunden für Key: {cache_key}")
+    if response_content is None:
+        try:
+            cache_key = topics_cache_key(content, max_topics, language, model)
+            cached_response = get_redis_client().get(cache_key)
+            if cached_response:
+                response_content = cached_response.decode('utf-8') if isinstance(cached_response, bytes) else cached_response
+                logger.info(f"[CACHE HIT] Antwort aus Redis-Cache geladen für Key: {cache_key}")
+            else:
+                logger.info(f"[CACHE MISS] Kein Cache-Eintrag gefunden für Key: {cache_key}")
 
-    except Exception as cache_err:
-        logger.warning(f"[THEMEN] Fehler bei Cache-Prüfung: {cache_err}")
+        except Exception as cache_err:
+            logger.warning(f"[THEMEN] Fehler bei Cache-Prüfung: {cache_err}")
+
+    # Zweite Stufe: Antwort eines sehr ähnlichen Dokuments mit denselben Parametern
+    semantic_params = {'max_topics': max_topics, 'language': language, 'model': model}
+    if response_content is None and cache_key:
+        response_content = lookup_semantic_cache('topics', content, semantic_params)
 
     # Nur wenn kein Cache-Hit, die API aufrufen
-    if response_content is None:
-        # Prompts vorbereiten
-        system_prompt = get_system_prompt("topics", language=language, max_topics=max_topics)
-        user_prompt = get_user_prompt("topics", content)
-        messages = [
-            {"role": "system", "content": system_prompt},
-            {"role": "user", "content": user_prompt}
-        ]
+    # Single-Flight: Nur ein Worker berechnet dieselbe Anfrage, die übrigen übernehmen das Ergebnis
+    lock_token = None
+    if response_content is None and cache_key:
+        lock_token = acquire_single_flight(cache_key)
+        if lock_token is None:
+            response_content = wait_for_single_flight(cache_key)
+            if response_content is None:
+                lock_token = acquire_single_flight(cache_key)
+
+    try:
+        if response_content is None:
+            request = build_topics_request(content, max_topics=max_topics, language=language, model=model)
         
-        # OpenAI-API aufrufen (SYNCHRON)
-        logger.info(f"[TOPICS] Schritt 4: Sende SYNC Anfrage an OpenAI API ({model})")
-        response = call_openai_api(
-            model=model,
-            messages=messages,
-            temperature=0.5,  # Niedrigere Temperatur für konsistentere Ergebnisse
-            max_tokens=1500,
-            response_format={"type": "json_object"}
-        )
-        response_content = response.get('choices', [{}])[0].get('message', {}).get('content', '{}')
-        usage = response.get('usage')
-        logger.info(f"[TOPICS] OpenAI-Antwort erhalten. Usage: {usage}")
-
-        # Cache speichern (bleibt gleich)
-        if response_content and response_content != '{}' and cache_key:
-            try:
-                get_redis_client().set(cache_key, response_content, ex=CACHE_TTL)
-                logger.info(f"[CACHE SET] Antwort in Redis gespeichert (Key: {cache_key}, TTL: {CACHE_TTL // 86400} Tage)")
-            except Exception as cache_set_err:
-                logger.warning(f"[THEMEN] Fehler beim Speichern der Antwort im Cache: {cache_set_err}")
+            # OpenAI-API aufrufen (SYNCHRON)
+            logger.info(f"[TOPICS] Schritt 4: Sende SYNC Anfrage an OpenAI API ({model})")
+            response = call_openai_api(**request)
+            response_content = response.get('choices', [{}])[0].get('message', {}).get('content', '{}')
+            usage = response.get('usage')
+            logger.info(f"[TOPICS] OpenAI-Antwort erhalten. Usage: {usage}")
+
+            # Cache speichern (bleibt gleich)
+            if response_content and response_content != '{}' and cache_key:
+                try:
+                    get_redis_client().set(cache_key, response_content, ex=CACHE_TTL)
+                    logger.info(f"[CACHE SET] Antwort in Redis gespeichert (Key: {cache_key}, TTL: {CACHE_TTL // 86400} Tage)")
+                    store_semantic_cache('topics', content, semantic_params, cache_key, ttl=CACHE_TTL)
+                except Exception as cache_set_err:
+                    logger.warning(f"[THEMEN] Fehler beim Speichern der Antwort im Cache: {cache_set_err}")
+    finally:
+        release_single_flight(cache_key, lock_token)
 
     # Antwort parsen & Themen extrahieren/normalisieren (bleibt gleich)
     topics_result = {'main_topic': {}, 'subtopics': []}
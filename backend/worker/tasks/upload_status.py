@@ -0,0 +1,257 @@
+"""
+Abschluss von Uploads über einen atomaren Restzähler.
+
+Jede Datei eines Uploads meldet genau einmal ihren Abschluss (Chord-Callback der
+AI-Tasks oder Fehler bei der Extraktion). Ein Lua-Skript verringert dabei in Redis
+atomar den Restzähler des Uploads; nur der Aufruf, der den Zähler auf 0 bringt,
+schließt den Upload ab. Der Abschluss liest und schreibt nur die Upload-Zeile
+selbst (O(1)), es werden keine Dateien durchsucht.
+
+Fehlt der Zähler (abgelaufen, beim Anlegen nicht erreichbar) oder ist Redis
+nicht erreichbar, wird der Stand aus den Dateien gezählt: jede abgeschlossene
+Datei trägt dafür extraction_info['finished'].
+"""
+import logging
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+from redis_utils.client import get_redis_client
+from .models import Upload, UploadedFile
+
+logger = logging.getLogger(__name__)
+
+# Lebensdauer der Zähler (Sekunden)
+UPLOAD_COUNTER_TTL = 86400
+
+# KEYS: remaining, failed, done_files | ARGV: uploaded_file_id, failed (0/1), ttl
+# Rückgabe: {remaining, failed}; remaining = -1 ohne Zähler, -2 wenn die Datei bereits gemeldet wurde
+_MARK_FILE_DONE_SCRIPT = """
+if redis.call('exists', KEYS[1]) == 0 then
+    return {-1, 0}
+end
+if redis.call('sadd', KEYS[3], ARGV[1]) == 0 then
+    return {-2, 0}
+end
+redis.call('expire', KEYS[3], ARGV[3])
+if ARGV[2] == '1' then
+    redis.call('incr', KEYS[2])
+    redis.call('expire', KEYS[2], ARGV[3])
+end
+local remaining = redis.call('decr', KEYS[1])
+local failed = tonumber(redis.call('get', KEYS[2]) or '0')
+return {remaining, failed}
+"""
+
+# KEYS: arrived, extracted | ARGV: uploaded_file_id, ok (0/1), num_files, ttl
+# Rückgabe: {1, Dateien mit Text} für die letzte Datei (Zähler werden gelöscht), {0} sonst,
+# {-1} wenn die Datei bereits gemeldet wurde
+_MARK_FILE_EXTRACTED_SCRIPT = """
+if redis.call('sadd', KEYS[1], ARGV[1]) == 0 then
+    return {-1}
+end
+redis.call('expire', KEYS[1], ARGV[4])
+if ARGV[2] == '1' then
+    redis.call('sadd', KEYS[2], ARGV[1])
+    redis.call('expire', KEYS[2], ARGV[4])
+end
+if redis.call('scard', KEYS[1]) >= tonumber(ARGV[3]) then
+    local extracted = redis.call('smembers', KEYS[2])
+    redis.call('del', KEYS[1], KEYS[2])
+    return {1, extracted}
+end
+return {0}
+"""
+
+
+def upload_remaining_key(upload_id):
+    """Anzahl der Dateien eines Uploads, die noch nicht abgeschlossen sind."""
+    return f"upload_remaining:{upload_id}"
+
+
+def upload_failed_key(upload_id):
+    """Anzahl der fehlgeschlagenen Dateien eines Uploads."""
+    return f"upload_failed:{upload_id}"
+
+
+def upload_done_files_key(upload_id):
+    """Set der bereits gemeldeten Dateien (macht Meldungen idempotent)."""
+    return f"upload_done_files:{upload_id}"
+
+
+def upload_arrived_files_key(upload_id):
+    """Set der Dateien, deren Extraktion beendet ist (erfolgreich oder nicht)."""
+    return f"upload_arrived_files:{upload_id}"
+
+
+def upload_extracted_files_key(upload_id):
+    """Set der Dateien mit erfolgreich extrahiertem Text."""
+    return f"upload_extracted_files:{upload_id}"
+
+
+def init_upload_counter(upload_id, num_files):
+    """
+    Legt den Restzähler eines Uploads an, falls er noch nicht existiert.
+
+    Jede Datei ruft dies beim Start auf; nur der erste Aufruf setzt den Wert.
+
+    Args:
+        upload_id: ID des Uploads
+        num_files: Anzahl der Dateien des Uploads
+    """
+    try:
+        get_redis_client().set(upload_remaining_key(upload_id), int(num_files), nx=True, ex=UPLOAD_COUNTER_TTL)
+    except Exception as e:
+        logger.error(f"[UPLOAD STATUS] Restzähler für Upload {upload_id} konnte nicht angelegt werden: {e}")
+
+
+def finalize_uploaded_file(db_session, upload_id, uploaded_file_id, failed=False,
+                           summary: Optional[List[Dict[str, Any]]] = None, error_message=None):
+    """
+    Schließt eine Datei ab und – falls sie die letzte war – den gesamten Upload.
+
+    Args:
+        db_session: Offene Datenbank-Session (Commit erfolgt hier)
+        upload_id: ID des Uploads
+        uploaded_file_id: ID der abgeschlossenen Datei
+        failed: True, wenn die Verarbeitung der Datei fehlgeschlagen ist
+        summary: Zusammenfassung der Generierung (landet in extraction_info['generation'])
+        error_message: Fehlermeldung für die Datei bzw. den Upload
+
+    Returns:
+        str|None: Neuer Gesamtstatus des Uploads, wenn dieser Aufruf ihn abgeschlossen hat
+    """
+    uploaded_file = db_session.query(UploadedFile).get(uploaded_file_id)
+    if uploaded_file:
+        info = dict(uploaded_file.extraction_info or {})
+        if summary is not None:
+            info['generation'] = summary
+        if error_message:
+            info.setdefault('error', error_message)
+        # Abschluss in der Datei festhalten (Rückfall ohne Restzähler)
+        info['finished'] = 'failed' if failed else 'completed'
+        uploaded_file.extraction_info = info
+        db_session.commit()
+
+    try:
+        remaining, failed_count = get_redis_client().eval(
+            _MARK_FILE_DONE_SCRIPT, 3,
+            upload_remaining_key(upload_id), upload_failed_key(upload_id), upload_done_files_key(upload_id),
+            uploaded_file_id, '1' if failed else '0', UPLOAD_COUNTER_TTL
+        )
+        remaining, failed_count = int(remaining), int(failed_count)
+    except Exception as e:
+        logger.error(f"[UPLOAD STATUS] Restzähler für Upload {upload_id} nicht verfügbar: {e}")
+        remaining, failed_count = -1, 0
+
+    if remaining == -1:
+        # Ohne Zähler den Upload nicht hängen lassen: Stand aus den Dateien zählen
+        upload = db_session.query(Upload).get(upload_id)
+        if upload and upload.overall_processing_status in ('completed', 'error'):
+            logger.info(f"[UPLOAD STATUS] Kein Restzähler für Upload {upload_id}, Upload bereits abgeschlossen.")
+            return None
+        remaining, failed_count = count_unfinished_files(db_session, upload_id)
+        logger.warning(f"[UPLOAD STATUS] Kein Restzähler für Upload {upload_id}, aus der Datenbank gezählt: "
+                       f"{remaining} offen, {failed_count} fehlgeschlagen.")
+    if remaining == -2:
+        logger.info(f"[UPLOAD STATUS] Datei {uploaded_file_id} wurde bereits abgeschlossen.")
+        return None
+    if remaining > 0:
+        logger.info(f"[UPLOAD STATUS] Datei {uploaded_file_id} abgeschlossen, {remaining} Datei(en) offen für Upload {upload_id}.")
+        return None
+
+    # Letzte Datei: Upload genau einmal abschließen
+    new_status = 'error' if failed_count else 'completed'
+    upload = db_session.query(Upload).get(upload_id)
+    if upload:
+        upload.overall_processing_status = new_status
+        upload.error_message = f"{failed_count} Datei(en) fehlgeschlagen" if failed_count else None
+        upload.updated_at = datetime.now()
+        db_session.commit()
+        logger.info(f"[UPLOAD STATUS] Upload {upload_id} abgeschlossen mit Status '{new_status}'.")
+    else:
+        logger.warning(f"[UPLOAD STATUS] Upload {upload_id} nicht gefunden für Abschluss.")
+
+    try:
+        get_redis_client().delete(upload_remaining_key(upload_id), upload_failed_key(upload_id),
+                                  upload_done_files_key(upload_id))
+    except Exception as e:
+        logger.debug(f"[UPLOAD STATUS] Zähler für Upload {upload_id} konnten nicht gelöscht werden: {e}")
+    return new_status
+
+
+def count_unfinished_files(db_session, upload_id):
+    """
+    Zählt offene und fehlgeschlagene Dateien eines Uploads aus der Datenbank.
+
+    Args:
+        db_session: Offene Datenbank-Session
+        upload_id: ID des Uploads
+
+    Returns:
+        (int, int): Noch nicht abgeschlossene und fehlgeschlagene Dateien
+    """
+    pending = failed = 0
+    rows = (db_session.query(UploadedFile.extraction_status, UploadedFile.extraction_info)
+            .filter(UploadedFile.upload_id == upload_id))
+    for extraction_status, info in rows:
+        finished = (info or {}).get('finished')
+        if finished == 'failed' or (finished is None and extraction_status == 'error'):
+            failed += 1
+        elif finished is None:
+            pending += 1
+    return pending, failed
+
+
+def summarize_generation_results(results):
+    """
+    Fasst die Ergebnisse der AI-Tasks einer Datei zusammen.
+
+    Args:
+        results: Rückgabewerte der AI-Tasks (aus dem Chord)
+
+    Returns:
+        (list, bool): Zusammenfassung pro Task und ob die Generierung insgesamt fehlgeschlagen ist
+    """
+    summary = []
+    for result in results or []:
+        if not isinstance(result, dict):
+            continue
+        # Nur Status, Fehler und Zähler übernehmen (z.B. flashcards_saved, topics_extracted)
+        summary.append({
+            key: value for key, value in result.items()
+            if key in ('status', 'error') or key.endswith(('_generated', '_saved', '_extracted'))
+        })
+    failed = bool(summary) and all(entry.get('status') == 'error' for entry in summary)
+    return summary, failed
+
+
+def register_extracted_file(upload_id, uploaded_file_id, num_files, ok=True) -> Optional[List[str]]:
+    """
+    Meldet das Ende der Extraktion einer Datei (für die Upload-weite Generierung).
+
+    Args:
+        upload_id: ID des Uploads
+        uploaded_file_id: ID der Datei
+        num_files: Anzahl der Dateien des Uploads
+        ok: True, wenn Text extrahiert wurde
+
+    Returns:
+        list|None: IDs aller Dateien mit Text, wenn dies die letzte Datei war, sonst None
+
+    Raises:
+        Exception: Wenn Redis nicht erreichbar ist. Das Skript wirkt atomar, die
+            Meldung kann also wiederholt werden (z.B. als fehlgeschlagene Datei).
+    """
+    try:
+        response = get_redis_client().eval(
+            _MARK_FILE_EXTRACTED_SCRIPT, 2,
+            upload_arrived_files_key(upload_id), upload_extracted_files_key(upload_id),
+            uploaded_file_id, '1' if ok else '0', int(num_files), UPLOAD_COUNTER_TTL
+        )
+    except Exception as e:
+        logger.error(f"[UPLOAD STATUS] Extraktionsstand für Upload {upload_id} nicht verfügbar: {e}")
+        raise
+    if int(response[0]) != 1:
+        return None
+    extracted = response[1] or []
+    return sorted(file_id.decode('utf-8') if isinstance(file_id, bytes) else file_id for file_id in extracted)
@@ -9,6 +9,8 @@ import logging
 import os
 import json
 
+from utils.llm_backend import get_llm_backend, needs_openai_key
+
 logger = logging.getLogger(__name__)
 
 # OpenAI API-Konfiguration
@@ -18,25 +20,21 @@ DEFAULT_MODEL = os.environ.get('OPENAI_DEFAULT_MODEL', 'gpt-3.5-turbo')
 
 def call_openai_api(model, messages, temperature=0.7, max_tokens=None, **kwargs):
     """
-    Ruft die OpenAI-API direkt und synchron auf ohne async/await.
+    Ruft das LLM-Backend des Modells direkt und synchron auf ohne async/await.
 
     Args:
-        model (str): Das zu verwendende OpenAI-Modell.
+        model (str): Das zu verwendende Modell ('local:<name>' für den lokalen Server).
         messages (list): Liste der Nachrichtenelemente.
         temperature (float): Temperatur für die Antwortgenerierung.
         max_tokens (int, optional): Maximale Antwortlänge in Tokens.
         **kwargs: Weitere Parameter für die API.
 
     Returns:
-        dict: OpenAI-API-Antwort.
+        dict: Antwort im Format der OpenAI-API.
     """
     try:
-        # Importiere OpenAI
-        import openai
-        logger.info(f"OpenAI Version: {openai.__version__ if hasattr(openai, '__version__') else 'unbekannt'}")
-
-        # Überprüfe API-Schlüssel
-        if not OPENAI_API_KEY or (not OPENAI_API_KEY.startswith('sk-') and not OPENAI_API_KEY.startswith('sk-proj-')):
+        # Überprüfe API-Schlüssel (lokale Modelle und das Gateway brauchen keinen)
+        if needs_openai_key(model) and (not OPENAI_API_KEY or (not OPENAI_API_KEY.startswith('sk-') and not OPENAI_API_KEY.startswith('sk-proj-'))):
             logger.error("Ungültiger oder fehlender OpenAI-API-Schlüssel")
             raise ValueError("Ungültiger oder fehlender OpenAI-API-Schlüssel")
 
@@ -56,57 +54,10 @@ def call_openai_api(model, messages, temperature=0.7, max_tokens=None, **kwargs)
         # Logge weitere Parameter
         logger.info(f"Modell: {model}, Temperatur: {temperature}, Max Tokens: {max_tokens}")
 
-        # API-Schlüssel setzen und Client konfigurieren (neue OpenAI API)
-        logger.info("Verwende OpenAI API v1.0.0+")
-        client = openai.OpenAI(
-            api_key=OPENAI_API_KEY,
-            # Explizite Header-Konfiguration
-            default_headers={
-                "Authorization": f"Bearer {OPENAI_API_KEY}",
-                "OpenAI-Beta": "assistants=v2"
-            }
-        )
-
-        # Parameter für die Anfrage vorbereiten
-        params = {
-            "model": model,
-            "messages": messages,
-            "temperature": temperature
-        }
-
-        # Optionale Parameter hinzufügen
-        if max_tokens:
-            params["max_tokens"] = max_tokens
-
-        for key, value in kwargs.items():
-            params[key] = value
-
-        # Direkter API-Aufruf ohne async/await
-        response = client.chat.completions.create(**params)
-        
-        # Konvertiere die Response in ein Dictionary
-        if hasattr(response, 'model_dump'):
-            # Pydantic v2
-            response_dict = response.model_dump()
-        elif hasattr(response, 'dict'):
-            # Pydantic v1
-            response_dict = response.dict()
-        else:
-            # Manueller Fallback
-            response_dict = {
-                'id': response.id,
-                'model': response.model,
-                'choices': [
-                    {
-                        'index': choice.index,
-                        'message': {
-                            'role': choice.message.role,
-                            'content': choice.message.content
-                        },
-                        'finish_reason': choice.finish_reason
-                    } for choice in response.choices
-                ]
-            }
+        # Backend des Modells (OpenAI oder lokaler Server, siehe utils/llm_backend.py)
+        backend = get_llm_backend(model, api_key=OPENAI_API_KEY, max_retries=2)
+        logger.info(f"Verwende LLM-Backend: {backend.name}")
+        response_dict = backend.chat(model, messages, temperature=temperature, max_tokens=max_tokens, **kwargs)
         
         # Logge die Antwort
         logger.info("=== OPENAI ANTWORT ERHALTEN ===")
@@ -0,0 +1,10 @@
+"""
+Gemeinsame Test-Konfiguration für den Worker.
+
+Die Worker-Module importieren absolut (utils, tasks, redis_utils, config),
+daher liegt das Worker-Verzeichnis auf dem Suchpfad wie in app.py.
+"""
+import os
+import sys
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
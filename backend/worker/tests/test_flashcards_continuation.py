@@ -0,0 +1,58 @@
+"""
+Regressionstest: abgeschnittene Lernkarten-Antworten werden nachgefordert.
+
+Folgeanfragen tragen 'exclude' und keine vorberechnete Antwort; der Zweig für
+vorberechnete Antworten darf sie nicht abfangen (TypeError bei len(None)).
+Redis und OpenAI werden durch Platzhalter ersetzt.
+"""
+import json
+
+import pytest
+
+pytest.importorskip('redis')
+
+from tasks.flashcards import generation  # noqa: E402
+from utils import continuation  # noqa: E402
+
+TRUNCATED = ('{"flashcards": [{"question": "Was ist Photosynthese?", "answer": "Umwandlung von Licht in Energie."}, '
+             '{"question": "Wo findet sie statt?", "answer": "In den Chloroplasten."}, {"question": "Welches Gas')
+CONTINUED = json.dumps({'flashcards': [{'question': 'Welches Gas wird frei?', 'answer': 'Sauerstoff.'}]})
+
+
+def _response(content, finish_reason):
+    return {'choices': [{'message': {'content': content}, 'finish_reason': finish_reason}],
+            'usage': {'prompt_tokens': 100, 'completion_tokens': 50}}
+
+
+@pytest.fixture
+def openai_calls(monkeypatch):
+    calls = []
+    responses = [_response(TRUNCATED, 'length'), _response(CONTINUED, 'stop')]
+
+    def fake_call_openai_api(**request):
+        calls.append(request)
+        return responses[len(calls) - 1]
+
+    monkeypatch.setattr(generation, 'call_openai_api', fake_call_openai_api)
+    monkeypatch.setattr(generation, 'get_redis_client', lambda: None)
+    monkeypatch.setattr(generation, 'lookup_semantic_cache', lambda *args: None)
+    monkeypatch.setattr(generation, 'store_semantic_cache', lambda *args, **kwargs: None)
+    monkeypatch.setattr(generation, 'acquire_single_flight', lambda key: 'token')
+    monkeypatch.setattr(generation, 'release_single_flight', lambda key, token: None)
+    monkeypatch.setattr(continuation, 'get_redis_client', lambda: None)
+    return calls
+
+
+def test_truncated_flashcards_are_continued(openai_calls):
+    result = generation.generate_flashcards_with_openai('Photosynthese in Pflanzen. ' * 20, num_cards=3,
+                                                        language='de', model='gpt-4o-mini')
+
+    assert len(openai_calls) == 2
+    # Die Folgeanfrage nennt die bereits geretteten Karten
+    follow_up_prompt = json.dumps(openai_calls[1]['messages'], ensure_ascii=False)
+    assert 'Was ist Photosynthese?' in follow_up_prompt
+    assert 'Wo findet sie statt?' in follow_up_prompt
+
+    questions = [card['question'] for card in result['flashcards']]
+    assert questions == ['Was ist Photosynthese?', 'Wo findet sie statt?', 'Welches Gas wird frei?']
+    assert result['usage']['completion_tokens'] == 100
@@ -0,0 +1,75 @@
+"""
+_generate_flashcards_task mit Streaming: gespeicherte Karten entsprechen dem Ergebnis.
+
+Gestreamte Karten werden sofort gespeichert; sie durchlaufen denselben
+Duplikat-Index und dieselbe Obergrenze (num_cards) wie der Abschluss.
+Redis, Datenbank und OpenAI werden durch Platzhalter ersetzt.
+"""
+import pytest
+
+pytest.importorskip('celery')
+pytest.importorskip('sqlalchemy')
+
+from tasks import ai_tasks  # noqa: E402
+
+
+class FakeSession:
+    """Minimale DB-Session: merkt sich gespeicherte Objekte."""
+
+    def __init__(self):
+        self.saved = []
+        self.pending = []
+
+    def add(self, obj):
+        self.pending.append(obj)
+
+    def add_all(self, objects):
+        self.pending.extend(objects)
+
+    def commit(self):
+        self.saved.extend(self.pending)
+        self.pending = []
+
+    def rollback(self):
+        self.pending = []
+
+    def close(self):
+        pass
+
+
+EXISTING = {'question': 'Was ist Photosynthese?', 'answer': 'Die Umwandlung von Lichtenergie in chemische Energie.'}
+STREAMED = [
+    dict(EXISTING),
+    {'question': 'Wo findet die Photosynthese statt?', 'answer': 'In den Chloroplasten der Pflanzenzellen.'},
+    {'question': 'Welches Gas wird bei der Photosynthese frei?', 'answer': 'Sauerstoff wird freigesetzt.'},
+    {'question': 'Welches Pigment absorbiert das Licht?', 'answer': 'Das Chlorophyll in den Thylakoiden.'},
+]
+
+
+@pytest.fixture
+def session(monkeypatch):
+    db_session = FakeSession()
+
+    def fake_cascade(*args, on_card=None, **kwargs):
+        for card in STREAMED:
+            on_card({'question': f" {card['question']} ", 'answer': card['answer']})
+        return {'result': [dict(card) for card in STREAMED], 'attempts': []}
+
+    monkeypatch.setattr(ai_tasks, 'load_extracted_text', lambda *args, **kwargs: 'Photosynthese. ' * 20)
+    monkeypatch.setattr(ai_tasks, 'get_db_session', lambda: db_session)
+    monkeypatch.setattr(ai_tasks, 'existing_material', lambda *args: [dict(EXISTING)])
+    monkeypatch.setattr(ai_tasks, 'run_model_cascade', fake_cascade)
+    monkeypatch.setattr(ai_tasks, '_track_cascade_usage', lambda *args: {'input_tokens': 100, 'output_tokens': 50})
+    monkeypatch.setattr(ai_tasks, 'publish_session_event', lambda *args: None)
+    return db_session
+
+
+def test_streamed_cards_respect_duplicates_and_count(session):
+    result = ai_tasks._generate_flashcards_task('file-1', 'upload-1', 'session-1',
+                                                {'num_cards': 2, 'stream': True, 'task_id': 'task-1'})
+
+    assert result['status'] == 'completed'
+    questions = [card.question for card in session.saved]
+    # Die vorhandene Karte wird verworfen, danach nur num_cards Karten
+    assert questions == ['Wo findet die Photosynthese statt?', 'Welches Gas wird bei der Photosynthese frei?']
+    assert result['flashcards_saved'] == len(session.saved) == 2
@@ -0,0 +1,20 @@
+"""Idempotenzschlüssel der Generierungs-Tasks."""
+import pytest
+
+pytest.importorskip('sqlalchemy')
+
+from tasks.ledger import generation_idempotency_key  # noqa: E402
+
+OPTIONS = {'language': 'de', 'num_cards': 10, 'task_id': 'a', 'timestamp': '1', 'prompt_hash': 'p1'}
+
+
+def test_key_ignores_run_specific_options():
+    other_run = dict(OPTIONS, task_id='b', timestamp='2')
+    assert (generation_idempotency_key('flashcards', 'file-1', 'upload-1', OPTIONS)
+            == generation_idempotency_key('flashcards', 'file-1', 'upload-1', other_run))
+
+
+def test_key_changes_with_prompt_hash():
+    changed_prompt = dict(OPTIONS, prompt_hash='p2')
+    assert (generation_idempotency_key('flashcards', 'file-1', 'upload-1', OPTIONS)
+            != generation_idempotency_key('flashcards', 'file-1', 'upload-1', changed_prompt))
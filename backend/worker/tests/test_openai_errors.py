@@ -0,0 +1,37 @@
+"""Einstufung von Fehlern als vorübergehend (Wiederholung) oder fatal."""
+import pytest
+
+from utils.openai_errors import is_retryable_error
+from utils.llm_backend import LLMBackendError
+
+httpx = pytest.importorskip('httpx')
+
+
+def _wrapped(cause):
+    try:
+        raise cause
+    except Exception as e:
+        try:
+            raise LLMBackendError(f"Backend nicht erreichbar: {e}") from e
+        except LLMBackendError as wrapped:
+            return wrapped
+
+
+@pytest.mark.parametrize('error', [
+    TimeoutError(), ConnectionResetError(), httpx.ConnectTimeout('timeout'), httpx.ReadError('reset'),
+    LLMBackendError('Überlastet', status_code=503), LLMBackendError('Rate-Limit', status_code=429),
+])
+def test_transient_errors_are_retried(error):
+    assert is_retryable_error(error)
+
+
+def test_wrapped_transport_error_is_retried():
+    assert is_retryable_error(_wrapped(httpx.ConnectError('refused')))
+
+
+@pytest.mark.parametrize('error', [
+    KeyError('choices'), TypeError('NoneType'), AttributeError('usage'), ValueError('kein JSON'),
+    LLMBackendError('Ungültige Anfrage', status_code=400), LLMBackendError('Antwort ohne Status'),
+])
+def test_programming_and_request_errors_are_fatal(error):
+    assert not is_retryable_error(error)
@@ -0,0 +1,78 @@
+"""
+Regressionstest: _generate_questions_task läuft einmal vollständig durch.
+
+Der lokale Name der Schleifenvariable hatte den importierten Helfer
+question_text verdeckt (UnboundLocalError vor jeder Generierung).
+Redis, Datenbank und OpenAI werden durch Platzhalter ersetzt.
+"""
+import json
+
+import pytest
+
+pytest.importorskip('celery')
+pytest.importorskip('sqlalchemy')
+
+from tasks import ai_tasks  # noqa: E402
+
+
+class FakeSession:
+    """Minimale DB-Session: merkt sich hinzugefügte Objekte und Commits."""
+
+    def __init__(self):
+        self.added = []
+        self.commits = 0
+        self.closed = False
+
+    def add_all(self, objects):
+        self.added.extend(objects)
+
+    def commit(self):
+        self.commits += 1
+
+    def rollback(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+
+GENERATED_QUESTIONS = [
+    {'question': 'Was ist die Hauptstadt der Schweiz?', 'options': ['Zürich', 'Bern', 'Genf', 'Basel'],
+     'correct_answer': 1, 'explanation': 'Bern ist die Bundesstadt.'},
+    {'question': 'Welcher Fluss fließt durch Basel?', 'options': ['Rhein', 'Aare', 'Rhone', 'Inn'],
+     'correct_answer': 0, 'explanation': 'Basel liegt am Rhein.'},
+]
+
+
+@pytest.fixture
+def session(monkeypatch):
+    db_session = FakeSession()
+    monkeypatch.setattr(ai_tasks, 'load_extracted_text', lambda *args, **kwargs: 'Geografie der Schweiz. ' * 20)
+    monkeypatch.setattr(ai_tasks, 'get_db_session', lambda: db_session)
+    monkeypatch.setattr(ai_tasks, 'existing_material', lambda *args: [
+        {'question': 'Was ist die Hauptstadt der Schweiz?', 'options': ['Zürich', 'Bern', 'Genf', 'Basel'],
+         'correct_answer': 1},
+    ])
+    monkeypatch.setattr(ai_tasks, 'run_model_cascade', lambda *args, **kwargs: {
+        'result': [dict(question) for question in GENERATED_QUESTIONS]})
+    monkeypatch.setattr(ai_tasks, '_track_cascade_usage', lambda *args: {'input_tokens': 120, 'output_tokens': 80})
+    return db_session
+
+
+def test_generate_questions_task_saves_questions(session):
+    result = ai_tasks._generate_questions_task('file-1', 'upload-1', 'session-1',
+                                               {'num_questions': 2, 'task_id': 'task-1'})
+
+    assert result['status'] == 'completed'
+    assert result['questions_generated'] == 2
+    # Die bereits gespeicherte Frage wird als Beinahe-Duplikat verworfen
+    assert result['near_duplicates_rejected'] == 1
+    assert result['questions_saved'] == 1
+    assert (result['input_tokens'], result['output_tokens']) == (120, 80)
+
+    assert session.commits == 1 and session.closed
+    [question] = session.added
+    assert question.text == 'Welcher Fluss fließt durch Basel?'
+    assert question.upload_id == 'upload-1'
+    assert json.loads(question.options) == ['Rhein', 'Aare', 'Rhone', 'Inn']
+    assert question.correct_answer == 0
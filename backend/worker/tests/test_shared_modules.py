@@ -0,0 +1,11 @@
+"""Die gemeinsamen Module (backend/shared) stimmen mit den Kopien in API, Worker und Gateway überein."""
+import subprocess
+import sys
+from pathlib import Path
+
+SYNC_SCRIPT = Path(__file__).resolve().parents[2] / 'sync_shared.py'
+
+
+def test_shared_module_copies_are_in_sync():
+    result = subprocess.run([sys.executable, str(SYNC_SCRIPT), '--check'], capture_output=True, text=True)
+    assert result.returncode == 0, result.stdout
@@ -0,0 +1,59 @@
+"""
+Abschluss eines Uploads ohne Restzähler in Redis.
+
+Fehlt der Zähler (abgelaufen, beim Anlegen nicht erreichbar), zählt
+finalize_uploaded_file die offenen Dateien aus der Datenbank, statt den
+Upload im Status 'processing' stehen zu lassen.
+"""
+import pytest
+
+pytest.importorskip('sqlalchemy')
+
+from sqlalchemy import create_engine  # noqa: E402
+from sqlalchemy.orm import sessionmaker  # noqa: E402
+
+from tasks import upload_status  # noqa: E402
+from tasks.models import Base, Upload, UploadedFile, User  # noqa: E402
+
+
+class MissingCounterRedis:
+    """Redis ohne Restzähler: das Lua-Skript meldet -1."""
+
+    def eval(self, *args):
+        return [-1, 0]
+
+    def delete(self, *keys):
+        pass
+
+
+@pytest.fixture
+def db_session(monkeypatch):
+    engine = create_engine('sqlite://')
+    Base.metadata.create_all(engine, tables=[User.__table__, Upload.__table__, UploadedFile.__table__])
+    session = sessionmaker(bind=engine)()
+    session.add(Upload(id='upload-1', session_id='session-1', overall_processing_status='processing'))
+    for index in (1, 2):
+        session.add(UploadedFile(id=f'file-{index}', upload_id='upload-1', file_index=index,
+                                 file_name=f'datei{index}.pdf', file_content=b'%PDF', extraction_status='completed'))
+    session.commit()
+    monkeypatch.setattr(upload_status, 'get_redis_client', lambda: MissingCounterRedis())
+    yield session
+    session.close()
+
+
+def test_missing_counter_waits_for_open_files(db_session):
+    assert upload_status.finalize_uploaded_file(db_session, 'upload-1', 'file-1', summary=[]) is None
+    assert db_session.get(Upload, 'upload-1').overall_processing_status == 'processing'
+
+
+def test_missing_counter_finalizes_last_file_from_database(db_session):
+    upload_status.finalize_uploaded_file(db_session, 'upload-1', 'file-1', summary=[])
+    status = upload_status.finalize_uploaded_file(db_session, 'upload-1', 'file-2', failed=True,
+                                                  error_message='Generierung fehlgeschlagen')
+
+    upload = db_session.get(Upload, 'upload-1')
+    assert status == 'error'
+    assert upload.overall_processing_status == 'error'
+    assert upload.error_message == '1 Datei(en) fehlgeschlagen'
+    # Ein verspäteter zweiter Abschluss ändert nichts mehr
+    assert upload_status.finalize_uploaded_file(db_session, 'upload-1', 'file-2', failed=True) is None
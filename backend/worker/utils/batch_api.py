@@ -0,0 +1,259 @@
+"""
+Batch-API-Anbindung für Worker-Tasks
+------------------------------------
+
+Dieses Modul kapselt die Ausführung vieler Chat-Completions als Batch-Auftrag.
+Anfragen werden als JSONL-Datei gesammelt und über einen austauschbaren
+Provider eingereicht:
+
+- ``OpenAIBatchProvider``: OpenAI Batch-API (halbe Token-Kosten, eigenes Rate-Limit)
+- ``LocalBatchProvider``: Lokaler Ersatz, der die Zeilen direkt ausführt (für Tests/Entwicklung)
+
+Beide Provider liefern Ergebniszeilen im Format der OpenAI Batch-API:
+``{"custom_id": ..., "response": {"status_code": 200, "body": {...}}, "error": None}``
+"""
+
+import json
+import logging
+import os
+import tempfile
+import uuid
+from typing import Any, Callable, Dict, List, Optional
+
+from utils.call_openai import OPENAI_API_KEY, OpenAIRetryableError, call_openai_api
+
+logger = logging.getLogger(__name__)
+
+BATCH_PROVIDER = os.environ.get('BATCH_PROVIDER', 'openai')
+BATCH_WORK_DIR = os.environ.get('BATCH_WORK_DIR', os.path.join(tempfile.gettempdir(), 'hackthestudy_batches'))
+BATCH_COMPLETION_WINDOW = os.environ.get('BATCH_COMPLETION_WINDOW', '24h')
+BATCH_ENDPOINT = '/v1/chat/completions'
+
+# Endzustände eines Batch-Auftrags
+BATCH_TERMINAL_STATES = ('completed', 'failed', 'expired', 'cancelled')
+
+
+def write_batch_file(requests: List[Dict[str, Any]], path: Optional[str] = None) -> str:
+    """
+    Schreibt Chat-Completion-Anfragen als JSONL-Batch-Datei.
+
+    Args:
+        requests: Liste von {'custom_id': str, 'body': dict} (body = Completion-Parameter)
+        path: Optionaler Zielpfad, sonst eine neue Datei in BATCH_WORK_DIR
+
+    Returns:
+        str: Pfad zur geschriebenen Datei
+    """
+    if not path:
+        os.makedirs(BATCH_WORK_DIR, exist_ok=True)
+        path = os.path.join(BATCH_WORK_DIR, f"batch_input_{uuid.uuid4().hex}.jsonl")
+
+    with open(path, 'w', encoding='utf-8') as f:
+        for request in requests:
+            line = {
+                "custom_id": request['custom_id'],
+                "method": "POST",
+                "url": BATCH_ENDPOINT,
+                "body": request['body']
+            }
+            f.write(json.dumps(line, ensure_ascii=False) + "\n")
+
+    logger.info(f"[BATCH] Batch-Datei mit {len(requests)} Anfragen geschrieben: {path}")
+    return path
+
+
+def parse_batch_result_line(line: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Extrahiert Inhalt und Usage aus einer Ergebniszeile.
+
+    Args:
+        line: Ergebniszeile im Format der OpenAI Batch-API
+
+    Returns:
+        dict: {'custom_id', 'content', 'usage', 'error'}
+    """
+    custom_id = line.get('custom_id')
+    response = line.get('response') or {}
+    body = response.get('body') or {}
+
+    if line.get('error') or response.get('status_code', 200) != 200:
+        error = line.get('error') or body.get('error') or f"Status {response.get('status_code')}"
+        return {'custom_id': custom_id, 'content': None, 'usage': None, 'error': str(error)}
+
+    choices = body.get('choices') or [{}]
+    content = (choices[0].get('message') or {}).get('content')
+    raw_usage = body.get('usage') or {}
+    usage = {
+        "prompt_tokens": raw_usage.get('prompt_tokens', 0),
+        "completion_tokens": raw_usage.get('completion_tokens', 0),
+        "total_tokens": raw_usage.get('total_tokens', 0),
+        "cached_tokens": (raw_usage.get('prompt_tokens_details') or {}).get('cached_tokens', 0) or 0
+    }
+    return {'custom_id': custom_id, 'content': content, 'usage': usage, 'error': None}
+
+
+class BatchProvider:
+    """Schnittstelle für Batch-Provider."""
+
+    name = 'base'
+
+    def submit(self, input_path: str, metadata: Optional[Dict[str, str]] = None) -> str:
+        """Reicht eine JSONL-Datei ein und gibt die Batch-ID zurück."""
+        raise NotImplementedError
+
+    def get_status(self, batch_id: str) -> Dict[str, Any]:
+        """Gibt den Status des Batch-Auftrags zurück ({'status': ..., ...})."""
+        raise NotImplementedError
+
+    def get_results(self, batch_id: str) -> List[Dict[str, Any]]:
+        """Gibt die Ergebniszeilen eines abgeschlossenen Batch-Auftrags zurück."""
+        raise NotImplementedError
+
+
+class OpenAIBatchProvider(BatchProvider):
+    """Reicht Batch-Aufträge bei der OpenAI Batch-API ein."""
+
+    name = 'openai'
+
+    def __init__(self, api_key: Optional[str] = None):
+        self.api_key = api_key or OPENAI_API_KEY
+        self._client = None
+
+    @property
+    def client(self):
+        if self._client is None:
+            from openai import OpenAI
+            self._client = OpenAI(api_key=self.api_key)
+        return self._client
+
+    def submit(self, input_path: str, metadata: Optional[Dict[str, str]] = None) -> str:
+        with open(input_path, 'rb') as f:
+            input_file = self.client.files.create(file=f, purpose='batch')
+        batch = self.client.batches.create(
+            input_file_id=input_file.id,
+            endpoint=BATCH_ENDPOINT,
+            completion_window=BATCH_COMPLETION_WINDOW,
+            metadata=metadata or None
+        )
+        logger.info(f"[BATCH] OpenAI-Batch eingereicht: {batch.id} (Datei: {input_file.id})")
+        return batch.id
+
+    def get_status(self, batch_id: str) -> Dict[str, Any]:
+        batch = self.client.batches.retrieve(batch_id)
+        counts = batch.request_counts
+        return {
+            'status': batch.status,
+            'output_file_id': batch.output_file_id,
+            'error_file_id': batch.error_file_id,
+            'request_counts': {
+                'total': counts.total,
+                'completed': counts.completed,
+                'failed': counts.failed
+            } if counts else None
+        }
+
+    def get_results(self, batch_id: str) -> List[Dict[str, Any]]:
+        status = self.get_status(batch_id)
+        results = []
+        for file_id in (status.get('output_file_id'), status.get('error_file_id')):
+            if not file_id:
+                continue
+            text = self.client.files.content(file_id).text
+            results.extend(json.loads(line) for line in text.splitlines() if line.strip())
+        return results
+
+
+class LocalBatchProvider(BatchProvider):
+    """
+    Lokaler Ersatz für die Batch-API.
+
+    Führt jede Zeile beim Einreichen direkt mit ``completion_fn`` aus und legt
+    die Ergebnisse im Format der OpenAI Batch-API im Arbeitsverzeichnis ab.
+    """
+
+    name = 'local'
+
+    def __init__(self, completion_fn: Optional[Callable[..., Dict[str, Any]]] = None, work_dir: Optional[str] = None):
+        self.completion_fn = completion_fn or call_openai_api
+        self.work_dir = work_dir or BATCH_WORK_DIR
+
+    def _output_path(self, batch_id: str) -> str:
+        return os.path.join(self.work_dir, f"{batch_id}.output.jsonl")
+
+    def submit(self, input_path: str, metadata: Optional[Dict[str, str]] = None) -> str:
+        os.makedirs(self.work_dir, exist_ok=True)
+        batch_id = f"local_batch_{uuid.uuid4().hex}"
+        output_lines = []
+
+        with open(input_path, 'r', encoding='utf-8') as f:
+            for raw_line in f:
+                if not raw_line.strip():
+                    continue
+                request = json.loads(raw_line)
+                try:
+                    result = self.completion_fn(**request['body'])
+                except OpenAIRetryableError as e:
+                    # Als fehlgeschlagen markieren; der Eintrag wird als Live-Task mit Retry nachgeholt
+                    result = {'error': str(e)}
+                if result.get('error'):
+                    output_lines.append({
+                        'id': uuid.uuid4().hex,
+                        'custom_id': request['custom_id'],
+                        'response': None,
+                        'error': {'message': result['error']}
+                    })
+                else:
+                    output_lines.append({
+                        'id': uuid.uuid4().hex,
+                        'custom_id': request['custom_id'],
+                        'response': {'status_code': 200, 'body': result},
+                        'error': None
+                    })
+
+        with open(self._output_path(batch_id), 'w', encoding='utf-8') as f:
+            for line in output_lines:
+                f.write(json.dumps(line, ensure_ascii=False) + "\n")
+
+        logger.info(f"[BATCH] Lokaler Batch {batch_id} mit {len(output_lines)} Anfragen ausgeführt")
+        return batch_id
+
+    def get_status(self, batch_id: str) -> Dict[str, Any]:
+        if os.path.exists(self._output_path(batch_id)):
+            return {'status': 'completed'}
+        return {'status': 'failed'}
+
+    def get_results(self, batch_id: str) -> List[Dict[str, Any]]:
+        path = self._output_path(batch_id)
+        if not os.path.exists(path):
+            return []
+        with open(path, 'r', encoding='utf-8') as f:
+            return [json.loads(line) for line in f if line.strip()]
+
+
+_PROVIDERS = {
+    OpenAIBatchProvider.name: OpenAIBatchProvider,
+    LocalBatchProvider.name: LocalBatchProvider,
+}
+
+
+def register_batch_provider(name: str, provider_cls) -> None:
+    """Registriert eine weitere Provider-Klasse unter dem angegebenen Namen."""
+    _PROVIDERS[name] = provider_cls
+
+
+def get_batch_provider(name: Optional[str] = None) -> BatchProvider:
+    """
+    Gibt eine Instanz des konfigurierten Batch-Providers zurück.
+
+    Args:
+        name: Provider-Name ('openai', 'local', ...), Standard aus BATCH_PROVIDER
+
+    Returns:
+        BatchProvider: Provider-Instanz
+    """
+    name = name or BATCH_PROVIDER
+    provider_cls = _PROVIDERS.get(name)
+    if not provider_cls:
+        logger.warning(f"[BATCH] Unbekannter Batch-Provider '{name}', verwende 'local'")
+        provider_cls = LocalBatchProvider
+    return provider_cls()
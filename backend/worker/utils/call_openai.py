@@ -2,14 +2,24 @@
 OpenAI API Utility für Worker-Tasks
 ----------------------------------
 
-Dieses Modul stellt Funktionen für den Aufruf der OpenAI API bereit.
+Dieses Modul stellt Funktionen für den Aufruf der OpenAI API bereit. Die
+Anfragen laufen über das LLM-Backend des Modells (utils/llm_backend.py), also
+je nach Modell über OpenAI oder einen lokalen, OpenAI-kompatiblen Server.
+
+Vorübergehende Fehler (Rate-Limit, Timeout, Serverfehler) werden nicht im
+Prozess mit time.sleep wiederholt, sondern als OpenAIRetryableError an den
+Task weitergegeben, der sich über utils/retry_policy.py neu einplant und den
+Worker-Slot während der Wartezeit freigibt. Fatale Fehler (ungültige Anfrage,
+Kontextüberlauf) liefern sofort eine Fehlerantwort.
 """
 
 import os
-import json
 import logging
-import time
-from typing import Dict, List, Optional, Any, Union
+from typing import Any, Callable, Dict, List, Optional, Union
+
+from utils.json_repair import parse_json_response, record_parse_outcome
+from utils.llm_backend import get_llm_backend, needs_openai_key, normalize_usage
+from utils.openai_errors import is_retryable_error, retry_after_seconds
 
 # Logger konfigurieren
 logger = logging.getLogger(__name__)
@@ -17,8 +27,59 @@ logger = logging.getLogger(__name__)
 # OpenAI API-Konfiguration aus Umgebungsvariablen
 OPENAI_API_KEY = os.environ.get('OPENAI_API_KEY', '')
 DEFAULT_MODEL = os.environ.get('OPENAI_DEFAULT_MODEL', 'gpt-3.5-turbo')
-MAX_RETRIES = 3
-RETRY_BACKOFF_BASE = 2  # Exponentieller Backoff-Faktor
+
+
+class OpenAIRetryableError(Exception):
+    """Vorübergehender OpenAI-Fehler; der aufrufende Task soll später neu ausgeführt werden."""
+
+    def __init__(self, message: str, retry_after: Optional[float] = None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+def _failed_response(error: Exception, label: str) -> Dict[str, Any]:
+    """
+    Behandelt einen fehlgeschlagenen API-Aufruf.
+
+    Raises:
+        OpenAIRetryableError: Bei vorübergehenden Fehlern
+
+    Returns:
+        Dict: Fehlerantwort bei fatalen Fehlern
+    """
+    if is_retryable_error(error):
+        logger.warning(f"Vorübergehender Fehler bei {label}, Task wird neu eingeplant: {error}")
+        raise OpenAIRetryableError(str(error), retry_after=retry_after_seconds(error)) from error
+    logger.error(f"Fataler Fehler bei {label}, keine Wiederholung: {error}")
+    return {
+        "error": f"API-Anfrage fehlgeschlagen: {error}",
+        "choices": [{"message": {"content": f"Fehler: {error}"}}]
+    }
+
+def _usage_to_dict(usage) -> Dict[str, int]:
+    """
+    Wandelt das Usage-Objekt der OpenAI-Antwort in ein Dictionary um.
+
+    Enthält zusätzlich 'cached_tokens' (aus prompt_tokens_details), also den Teil
+    der Prompt-Tokens, der vom Provider-Präfix-Cache bedient wurde.
+
+    Args:
+        usage: Usage-Objekt der OpenAI-Bibliothek
+
+    Returns:
+        Dict: prompt_tokens, completion_tokens, total_tokens und cached_tokens
+    """
+    return normalize_usage(usage)
+
+def _missing_api_key(model: str) -> Optional[Dict[str, Any]]:
+    """Fehlerantwort, wenn ein OpenAI-Modell ohne API-Schlüssel angefragt wird (lokale Modelle und das Gateway brauchen keinen)."""
+    if OPENAI_API_KEY or not needs_openai_key(model):
+        return None
+    logger.error("Kein OpenAI API-Schlüssel konfiguriert")
+    return {
+        "error": "Kein API-Schlüssel konfiguriert",
+        "choices": [{"message": {"content": "Fehler: OpenAI API nicht verfügbar"}}]
+    }
 
 def call_openai_api(
     model: str = DEFAULT_MODEL,
@@ -29,10 +90,13 @@ def call_openai_api(
     default_headers: Dict[str, str] = None
 ) -> Dict[str, Any]:
     """
-    Ruft die OpenAI API mit Retry-Mechanismus auf (SYNCHRONE VERSION).
+    Ruft das LLM-Backend des Modells auf (SYNCHRONE VERSION).
+
+    OpenAI-Modelle laufen über die OpenAI API, Modelle mit dem Präfix 'local:'
+    (bzw. alle bei LLM_BACKEND=local) über den lokalen Server, siehe utils/llm_backend.py.
     
     Args:
-        model: Das zu verwendende OpenAI-Modell
+        model: Das zu verwendende Modell
         messages: Liste von Message-Objekten mit 'role' und 'content'
         temperature: Temperatur für die Kreativität (0.0-1.0)
         max_tokens: Maximale Token-Anzahl für die Antwort
@@ -41,109 +105,102 @@ def call_openai_api(
         
     Returns:
         Dict: API-Antwort als Dictionary
+
+    Raises:
+        OpenAIRetryableError: Bei vorübergehenden Fehlern (Rate-Limit, Timeout, Serverfehler)
     """
-    # Importiere den synchronen OpenAI-Client
-    # Stelle sicher, dass die korrekte OpenAI-Bibliothek installiert ist (v1.x+)
+    if not messages:
+        messages = [{"role": "user", "content": "Hallo"}]
+
+    missing_key = _missing_api_key(model)
+    if missing_key:
+        return missing_key
+
+    # Wiederholungen übernimmt der Task, nicht der Client
+    backend = get_llm_backend(model, api_key=OPENAI_API_KEY, max_retries=0, default_headers=default_headers)
     try:
-         from openai import OpenAI
+        logger.debug(f"Starte SYNC {backend.name}-Anfrage...")
+        result = backend.chat(model, messages, temperature=temperature, max_tokens=max_tokens,
+                              response_format=response_format)
     except ImportError:
-         logger.error("OpenAI-Bibliothek (openai>=1.0) nicht gefunden. Bitte installieren.")
-         return {"error": "OpenAI library not found"}
-    
+        logger.error("OpenAI-Bibliothek (openai>=1.0) nicht gefunden. Bitte installieren.")
+        return {"error": "OpenAI library not found"}
+    except Exception as e:
+        return _failed_response(e, f"{backend.name}-Anfrage")
+
+    logger.debug(f"{backend.name}-Antwort erhalten (sync)...")
+    return result
+
+def call_openai_api_stream(
+    model: str = DEFAULT_MODEL,
+    messages: List[Dict[str, str]] = None,
+    temperature: float = 0.7,
+    max_tokens: int = 2000,
+    response_format: Dict[str, str] = None,
+    default_headers: Dict[str, str] = None,
+    on_delta: Optional[Callable[[str], None]] = None
+) -> Dict[str, Any]:
+    """
+    Ruft das LLM-Backend des Modells im Streaming-Modus auf (SYNCHRONE VERSION).
+
+    Jeder empfangene Text-Abschnitt wird sofort an ``on_delta`` übergeben,
+    sodass der Aufrufer Teilergebnisse verarbeiten kann, bevor die Antwort
+    vollständig ist. Ein vorübergehender Fehler wird nur weitergegeben
+    (OpenAIRetryableError), solange noch kein Abschnitt ausgeliefert wurde, da
+    bereits verarbeitete Teilergebnisse sonst doppelt ankämen.
+
+    Args:
+        model: Das zu verwendende Modell
+        messages: Liste von Message-Objekten mit 'role' und 'content'
+        temperature: Temperatur für die Kreativität (0.0-1.0)
+        max_tokens: Maximale Token-Anzahl für die Antwort
+        response_format: Format der Antwort (optional, z.B. {"type": "json_object"})
+        default_headers: Zusätzliche Header für die API-Anfrage
+        on_delta: Callback, der mit jedem neuen Text-Abschnitt aufgerufen wird
+
+    Returns:
+        Dict: API-Antwort im selben Format wie call_openai_api (vollständiger Inhalt)
+
+    Raises:
+        OpenAIRetryableError: Bei vorübergehenden Fehlern vor dem ersten Abschnitt
+    """
     if not messages:
         messages = [{"role": "user", "content": "Hallo"}]
-    
-    if not OPENAI_API_KEY:
-        logger.error("Kein OpenAI API-Schlüssel konfiguriert")
-        return {
-            "error": "Kein API-Schlüssel konfiguriert",
-            "choices": [{"message": {"content": "Fehler: OpenAI API nicht verfügbar"}}]
-        }
-    
-    # Parameter für die Anfrage
-    params = {
-        "model": model,
-        "messages": messages,
-        "temperature": temperature,
-        "max_tokens": max_tokens
-    }
-    
-    # Optional: response_format hinzufügen (für JSON-Antworten)
-    if response_format:
-        params["response_format"] = response_format
-    
-    # Default-Header
-    headers = {
-        "OpenAI-Beta": "assistants=v2"
-    }
-    
-    # Zusätzliche Header hinzufügen
-    if default_headers:
-        headers.update(default_headers)
-    
-    # API-Client initialisieren (ist standardmäßig synchron)
-    client = OpenAI(
-        api_key=OPENAI_API_KEY,
-        default_headers=headers
-    )
-    
-    # API-Anfrage mit Retry-Logik
-    retry_count = 0
-    last_error = None
-    
-    while retry_count <= MAX_RETRIES:
-        try:
-            logger.debug(f"Starte SYNC OpenAI API-Anfrage...")
-            # Führe die API-Anfrage durch (OHNE await)
-            completion = client.chat.completions.create(**params)
-            
-            # Konvertiere die Antwort in ein Dictionary
-            result = {
-                "model": completion.model,
-                "choices": [
-                    {
-                        "message": {
-                            "role": completion.choices[0].message.role,
-                            "content": completion.choices[0].message.content
-                        },
-                        "index": 0,
-                        "finish_reason": completion.choices[0].finish_reason
-                    }
-                ],
-                "usage": {
-                    "prompt_tokens": completion.usage.prompt_tokens,
-                    "completion_tokens": completion.usage.completion_tokens,
-                    "total_tokens": completion.usage.total_tokens
-                }
+
+    missing_key = _missing_api_key(model)
+    if missing_key:
+        return missing_key
+
+    backend = get_llm_backend(model, api_key=OPENAI_API_KEY, max_retries=0, default_headers=default_headers)
+    try:
+        logger.debug(f"Starte SYNC {backend.name} Streaming-Anfrage...")
+        result = backend.chat_stream(model, messages, temperature=temperature, max_tokens=max_tokens,
+                                     response_format=response_format, on_delta=on_delta)
+    except ImportError:
+        logger.error("OpenAI-Bibliothek (openai>=1.0) nicht gefunden. Bitte installieren.")
+        return {"error": "OpenAI library not found"}
+    except Exception as e:
+        # Bereits ausgelieferte Teile können nicht zurückgenommen werden
+        partial = getattr(e, 'partial_content', '')
+        if partial:
+            logger.error(f"Streaming nach {len(partial)} Zeichen abgebrochen: {e}")
+            return {
+                "error": f"Streaming abgebrochen: {e}",
+                "choices": [{"message": {"content": partial}, "finish_reason": "error"}],
+                "usage": getattr(e, 'partial_usage', None)
             }
-            
-            logger.debug(f"OpenAI API-Antwort erhalten (sync)...")
-            return result
-        
-        except Exception as e:
-            retry_count += 1
-            last_error = str(e)
-            
-            if retry_count > MAX_RETRIES:
-                logger.error(f"Maximale Anzahl an Versuchen ({MAX_RETRIES}) überschritten: {e}")
-                break
-            
-            # Exponentieller Backoff
-            wait_time = RETRY_BACKOFF_BASE ** retry_count
-            logger.warning(f"Fehler bei OpenAI-Anfrage (Versuch {retry_count}/{MAX_RETRIES}): {e}")
-            logger.warning(f"Warte {wait_time} Sekunden vor dem nächsten Versuch...")
-            time.sleep(wait_time)
-    
-    # Wenn alle Versuche fehlschlagen
-    logger.error(f"OpenAI API-Anfrage nach {MAX_RETRIES} Versuchen fehlgeschlagen: {last_error}")
-    return {
-        "error": f"API-Anfrage fehlgeschlagen: {last_error}",
-        "choices": [{"message": {"content": f"Fehler: {last_error}"}}]
-    }
+        return _failed_response(e, f"{backend.name} Streaming-Anfrage")
+
+    logger.debug(f"{backend.name} Streaming-Antwort vollständig empfangen (sync)...")
+    return result
 
 def extract_json_from_response(response_content: str) -> Any:
     """
     Extrahiert JSON aus einer Antwort-Zeichenkette.
+
+    Formfehler (Code-Block, umgebender Text, abschließende Kommas,
+    abgeschnittenes Ende) werden über utils/json_repair.py repariert, statt die
+    ganze Antwort zu verwerfen.
     
     Args:
         response_content: Die API-Antwort als Text
@@ -151,53 +208,39 @@ def extract_json_from_response(response_content: str) -> Any:
     Returns:
         Der extrahierte JSON-Inhalt oder die unveränderte Antwort
     """
-    try:
-        # Versuche direktes Parsen
-        data = json.loads(response_content)
-        
-        # Prüfen auf verschiedene Formate und normalisieren
-        if isinstance(data, dict):
-            # Fall 1: Direktes Array von Karten im "cards"-Feld
-            if "cards" in data and isinstance(data["cards"], list):
-                return data
-                
-            # Fall 2: Falsch formatiert mit "question" als Hauptschlüssel und "answer" als Array
-            if "question" in data and "answer" in data and isinstance(data["answer"], list):
-                logger.warning("Falsch formatierte Antwort erkannt: 'question' und 'answer' auf oberster Ebene")
-                return data["answer"]  # Gib direkt das Answer-Array zurück
-                
-            # Fall 3: Falscher Schlüsselname, z.B. "flashcards" statt "cards"
-            for key in ["flashcards", "lernkarten", "results"]:
-                if key in data and isinstance(data[key], list):
-                    logger.warning(f"Alternativer Schlüssel gefunden: '{key}'")
-                    return {
-                        "cards": data[key]
-                    }
+    parsed = parse_json_response(response_content)
+    record_parse_outcome(parsed)
+    if parsed['error']:
+        # Kein JSON zu retten: Text unverändert zurückgeben
+        logger.warning(f"Kein JSON in der Antwort gefunden ({parsed['error']})")
+        return response_content
+    if parsed['repairs']:
+        logger.warning(f"JSON-Antwort repariert: {', '.join(parsed['repairs'])}")
+    data = parsed['data']
+
+    # Prüfen auf verschiedene Formate und normalisieren
+    if isinstance(data, dict):
+        # Fall 1: Direktes Array von Karten im "cards"-Feld
+        if "cards" in data and isinstance(data["cards"], list):
+            return data
             
-            # Fall 4: Direkt ein Objekt mit "question"/"answer" (einzelne Karte)
-            if "question" in data and "answer" in data and not isinstance(data["answer"], list):
-                logger.warning("Einzelne Karte erkannt, konvertiere zu Array")
-                return [data]
-        
-        # Wenn es bereits eine Liste ist, behalte es bei
-        return data
-    except json.JSONDecodeError:
-        # Suche nach JSON in Code-Blöcken
-        import re
-        json_match = re.search(r'```(?:json)?\s*([\s\S]*?)\s*```', response_content)
-        if json_match:
-            try:
-                return extract_json_from_response(json_match.group(1))  # Rekursiver Aufruf mit extrahiertem JSON
-            except json.JSONDecodeError:
-                pass
-        
-        # Suche nach JSON-Array
-        json_array_match = re.search(r'\[([\s\S]*)\]', response_content)
-        if json_array_match:
-            try:
-                return json.loads(f"[{json_array_match.group(1)}]")
-            except json.JSONDecodeError:
-                pass
+        # Fall 2: Falsch formatiert mit "question" als Hauptschlüssel und "answer" als Array
+        if "question" in data and "answer" in data and isinstance(data["answer"], list):
+            logger.warning("Falsch formatierte Antwort erkannt: 'question' und 'answer' auf oberster Ebene")
+            return data["answer"]  # Gib direkt das Answer-Array zurück
+            
+        # Fall 3: Falscher Schlüsselname, z.B. "flashcards" statt "cards"
+        for key in ["flashcards", "lernkarten", "results"]:
+            if key in data and isinstance(data[key], list):
+                logger.warning(f"Alternativer Schlüssel gefunden: '{key}'")
+                return {
+                    "cards": data[key]
+                }
         
-        # Wenn kein JSON gefunden wurde, gib den Text zurück
-        return response_content 
\ No newline at end of file
+        # Fall 4: Direkt ein Objekt mit "question"/"answer" (einzelne Karte)
+        if "question" in data and "answer" in data and not isinstance(data["answer"], list):
+            logger.warning("Einzelne Karte erkannt, konvertiere zu Array")
+            return [data]
+    
+    # Wenn es bereits eine Liste ist, behalte es bei
+    return data
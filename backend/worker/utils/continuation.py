@@ -0,0 +1,126 @@
+"""
+Fortsetzung abgeschnittener Completions (finish_reason == "length").
+
+Erreicht eine Antwort max_tokens, ist das JSON am Ende unvollständig. Statt
+die ganze Antwort zu verwerfen (und die Eingabe-Tokens erneut zu bezahlen),
+werden alle bereits vollständigen Einträge übernommen und nur der Rest in
+einer Folgeanfrage nachgefordert. Zähler für gerettete und verlorene
+Ausgabe-Tokens liegen im Redis-Hash TRUNCATION_STATS_KEY.
+"""
+import json
+import logging
+import os
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from redis_utils.client import get_redis_client
+from utils.fanout import merge_usage
+from utils.json_stream import IncrementalArrayItemParser
+
+logger = logging.getLogger(__name__)
+
+# Maximale Anzahl aufeinanderfolgender Folgeanfragen
+MAX_CONTINUATIONS = int(os.environ.get('MAX_CONTINUATIONS', 2))
+# Redis-Hash mit Zählern (truncated, continuations, salvaged_items, salvaged_tokens, wasted_tokens)
+TRUNCATION_STATS_KEY = 'stats:truncation'
+
+
+def finish_reason(response: Dict[str, Any]) -> Optional[str]:
+    """finish_reason der ersten Auswahl einer Antwort aus call_openai_api."""
+    try:
+        return (response.get('choices') or [{}])[0].get('finish_reason')
+    except (AttributeError, IndexError):
+        return None
+
+
+def salvage_items(response_content: str) -> Tuple[List[Dict[str, Any]], float]:
+    """
+    Vollständige Objekte aus einer abgeschnittenen JSON-Antwort.
+
+    Returns:
+        (list, float): Gerettete Objekte und Anteil des Textes, den sie abdecken
+    """
+    parser = IncrementalArrayItemParser()
+    items = parser.feed(response_content or '')
+    share = parser.last_item_end / len(response_content) if response_content else 0.0
+    return items, share
+
+
+def record_truncation(salvaged_items: int, salvaged_tokens: int, wasted_tokens: int, continued: bool):
+    """Erhöht die Zähler für abgeschnittene Antworten."""
+    client = get_redis_client()
+    if not client:
+        return
+    try:
+        pipe = client.pipeline(transaction=False)
+        pipe.hincrby(TRUNCATION_STATS_KEY, 'truncated', 1)
+        pipe.hincrby(TRUNCATION_STATS_KEY, 'salvaged_items', salvaged_items)
+        pipe.hincrby(TRUNCATION_STATS_KEY, 'salvaged_tokens', salvaged_tokens)
+        pipe.hincrby(TRUNCATION_STATS_KEY, 'wasted_tokens', wasted_tokens)
+        if continued:
+            pipe.hincrby(TRUNCATION_STATS_KEY, 'continuations', 1)
+        pipe.execute()
+    except Exception as e:
+        logger.debug("Truncation-Zähler konnten nicht erhöht werden: %s", e)
+
+
+def get_truncation_stats() -> Dict[str, int]:
+    """
+    Gibt die Zähler für abgeschnittene Antworten zurück.
+
+    Returns:
+        dict: {'truncated', 'continuations', 'salvaged_items', 'salvaged_tokens', 'wasted_tokens'}
+    """
+    stats = {'truncated': 0, 'continuations': 0, 'salvaged_items': 0, 'salvaged_tokens': 0, 'wasted_tokens': 0}
+    client = get_redis_client()
+    if not client:
+        return stats
+    try:
+        raw = client.hgetall(TRUNCATION_STATS_KEY) or {}
+    except Exception as e:
+        logger.debug("Truncation-Zähler konnten nicht gelesen werden: %s", e)
+        return stats
+    for field, value in raw.items():
+        field = field.decode('utf-8') if isinstance(field, bytes) else field
+        stats[field] = int(value)
+    return stats
+
+
+def complete_truncated(response_content: str, usage: Optional[Dict[str, Any]], result_key: str, requested: int,
+                       depth: int, continue_request: Callable[[int, List[Dict[str, Any]]], Dict[str, Any]]
+                       ) -> Tuple[str, Optional[Dict[str, Any]]]:
+    """
+    Rettet die vollständigen Einträge einer abgeschnittenen Antwort und fordert den Rest nach.
+
+    Args:
+        response_content: Abgeschnittener Antworttext
+        usage: Token-Nutzung der abgeschnittenen Antwort
+        result_key: Schlüssel des Arrays ('flashcards', 'questions')
+        requested: Ursprünglich angeforderte Anzahl
+        depth: Bisherige Folgeanfragen in dieser Kette
+        continue_request: Callable(rest, gerettete_einträge) -> {result_key: [...], 'usage': {...}}
+
+    Returns:
+        (str, dict): Vollständiges JSON ({result_key: [...]}) und summierte Token-Nutzung
+    """
+    items, share = salvage_items(response_content)
+    completion_tokens = int((usage or {}).get('completion_tokens', 0) or 0)
+    salvaged_tokens = int(round(completion_tokens * share))
+    remaining = requested - len(items)
+
+    continued: List[Dict[str, Any]] = []
+    continuation_usage = None
+    if remaining > 0 and depth < MAX_CONTINUATIONS:
+        logger.info(f"[CONTINUATION] Antwort bei max_tokens abgeschnitten: {len(items)} Einträge gerettet, "
+                    f"fordere {remaining} nach (Folgeanfrage {depth + 1}/{MAX_CONTINUATIONS})")
+        try:
+            result = continue_request(remaining, items) or {}
+            continued = result.get(result_key) or []
+            continuation_usage = result.get('usage')
+        except Exception as e:
+            logger.warning(f"[CONTINUATION] Folgeanfrage fehlgeschlagen: {e}")
+    else:
+        logger.info(f"[CONTINUATION] Antwort bei max_tokens abgeschnitten: {len(items)} von {requested} Einträgen gerettet")
+
+    record_truncation(len(items), salvaged_tokens, completion_tokens - salvaged_tokens, bool(continued))
+    content = json.dumps({result_key: items + continued}, ensure_ascii=False)
+    return content, merge_usage([usage, continuation_usage])
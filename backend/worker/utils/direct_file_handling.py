@@ -16,6 +16,8 @@ from typing import BinaryIO, Union, Dict, Any, Optional, Tuple
 from openai import OpenAI
 import traceback
 
+from utils.token_counter import count_tokens
+
 logger = logging.getLogger(__name__)
 
 def prepare_file_for_openai(file_content: bytes, file_name: str = None) -> str:
@@ -203,9 +205,8 @@ def send_file_to_openai(file_content: bytes, file_name: str) -> Tuple[str, int]:
             logger.warning(f"Text zu lang ({len(extracted_text)} Zeichen), wird auf {max_chars} Zeichen begrenzt")
             extracted_text = extracted_text[:max_chars] + "\n\n[Text wurde aufgrund der Längenbeschränkung gekürzt]"
         
-        # Grobe Token-Schätzung (4 Zeichen ≈ 1 Token)
-        tokens = len(extracted_text) // 4
-        logger.info(f"Geschätzte Token-Anzahl: ~{tokens}")
+        tokens = count_tokens(extracted_text)
+        logger.info(f"Token-Anzahl: {tokens}")
         logger.info("="*50)
         
         return extracted_text, tokens
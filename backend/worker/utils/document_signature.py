@@ -0,0 +1,42 @@
+"""
+MinHash-Signaturen ganzer Dokumente (für den semantischen Antwort-Cache).
+
+Dokumente werden normalisiert und in Wort-5-Gramme zerlegt; Deckblatt,
+Seitenzahlen oder abweichende Silbentrennung ändern nur einen kleinen Teil der
+Shingles. Die Signatur wird in LSH-Bänder geteilt, deren Hashes als
+Redis-Schlüssel dienen (redis_utils/semantic_cache.py).
+"""
+import hashlib
+from typing import List, Optional, Sequence, Tuple
+
+from utils.minhash import MinHasher, word_shingles
+
+# Signaturlänge und Banding: 16 Bänder × 8 Zeilen, Kandidaten ab etwa 0,7 Ähnlichkeit
+DOCUMENT_NUM_PERM = 128
+DOCUMENT_BANDS = 16
+DOCUMENT_SHINGLE_SIZE = 5
+
+_HASHER = MinHasher(num_perm=DOCUMENT_NUM_PERM)
+
+
+def document_signature(content: str) -> Optional[Tuple[int, ...]]:
+    """
+    MinHash-Signatur des normalisierten Dokumenttexts.
+
+    Returns:
+        tuple: Signatur oder None bei leerem Text
+    """
+    shingles = word_shingles(content, k=DOCUMENT_SHINGLE_SIZE)
+    if not shingles:
+        return None
+    return _HASHER.signature(shingles)
+
+
+def band_hashes(signature: Sequence[int], bands: int = DOCUMENT_BANDS) -> List[str]:
+    """Kurzer, deterministischer Hash je LSH-Band."""
+    rows = len(signature) // bands
+    return [
+        hashlib.blake2b(','.join(map(str, signature[band * rows:(band + 1) * rows])).encode('ascii'),
+                        digest_size=8).hexdigest()
+        for band in range(bands)
+    ]
@@ -0,0 +1,116 @@
+"""
+Paralleles Aufteilen großer Generierungsanfragen.
+
+Eine Completion ist auf max_tokens Ausgabe-Tokens begrenzt. Werden mehr
+Einträge angefordert, als erfahrungsgemäß hineinpassen, endet die Antwort mit
+abgeschnittenem JSON oder liefert zu wenige Einträge. Solche Anfragen werden
+in Teilanfragen mit disjunktem Fokus (Abschnitt i von N des Dokuments)
+aufgeteilt, parallel ausgeführt und zusammengeführt. Das Dokument-Präfix bleibt
+in allen Teilanfragen identisch, damit Prompt-Caching greift.
+"""
+import logging
+import math
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from utils.call_openai import OpenAIRetryableError
+
+logger = logging.getLogger(__name__)
+
+FANOUT_ENABLED = os.environ.get('FANOUT_ENABLED', 'true').lower() == 'true'
+# Maximal gleichzeitig laufende Teilanfragen einer Generierung
+FANOUT_MAX_PARALLEL = int(os.environ.get('FANOUT_MAX_PARALLEL', 6))
+# Anteil von max_tokens, der für Einträge eingeplant wird (Rest: JSON-Hülle, Ausreißer)
+FANOUT_OUTPUT_SHARE = 0.8
+
+
+def plan_fanout(count: int, tokens_per_item: int, max_tokens: int) -> List[int]:
+    """
+    Teilt eine angeforderte Anzahl auf Teilanfragen auf.
+
+    Args:
+        count: Angeforderte Einträge
+        tokens_per_item: Geschätzte Ausgabe-Tokens pro Eintrag
+        max_tokens: Ausgabe-Limit einer Completion
+
+    Returns:
+        list: Anzahl je Teilanfrage (ein Element: keine Aufteilung)
+    """
+    per_call = max(1, int(max_tokens * FANOUT_OUTPUT_SHARE) // max(tokens_per_item, 1))
+    if not FANOUT_ENABLED or count <= per_call:
+        return [count]
+    parts = math.ceil(count / per_call)
+    base, extra = divmod(count, parts)
+    return [base + (1 if i < extra else 0) for i in range(parts)]
+
+
+def merge_usage(usages: List[Optional[Dict[str, Any]]]) -> Optional[Dict[str, Any]]:
+    """Summiert die numerischen Felder mehrerer usage-Objekte."""
+    merged: Dict[str, Any] = {}
+    for usage in usages:
+        for key, value in (usage or {}).items():
+            if isinstance(value, (int, float)) and not isinstance(value, bool):
+                merged[key] = merged.get(key, 0) + value
+    return merged or None
+
+
+def run_fanout(generate: Callable[..., Dict[str, Any]], result_key: str, sizes: List[int],
+               count_kwarg: str, on_item_kwarg: Optional[str] = None, **kwargs) -> Dict[str, Any]:
+    """
+    Führt Teilanfragen parallel aus und führt die Ergebnisse zusammen.
+
+    Jede Teilanfrage erhält count_kwarg=<Anteil> und fanout_part=(i, N). Ein
+    Streaming-Callback (on_item_kwarg) wird serialisiert, da er z.B. auf eine
+    gemeinsame Datenbank-Session zugreift. Scheitert eine Teilanfrage an einem
+    vorübergehenden Fehler, wird dieser nach Abschluss aller Teile weitergegeben,
+    damit der Task neu eingeplant wird (erfolgreiche Teile liegen dann im Cache).
+
+    Args:
+        generate: Generierungsfunktion (z.B. generate_flashcards_with_openai)
+        result_key: Schlüssel der Einträge im Ergebnis ('flashcards', 'questions')
+        sizes: Anzahl je Teilanfrage (aus plan_fanout)
+        count_kwarg: Name des Anzahl-Parameters von generate
+        on_item_kwarg: Name eines Callback-Parameters, der serialisiert werden muss
+        **kwargs: Übrige Parameter für generate
+
+    Returns:
+        dict: {result_key: [...], 'usage': {...}, 'fanout': N}
+
+    Raises:
+        OpenAIRetryableError: Wenn eine Teilanfrage vorübergehend fehlgeschlagen ist
+    """
+    callback = kwargs.get(on_item_kwarg) if on_item_kwarg else None
+    if callable(callback):
+        lock = threading.Lock()
+
+        def serialized(item):
+            with lock:
+                return callback(item)
+
+        kwargs[on_item_kwarg] = serialized
+
+    parts = len(sizes)
+
+    def run_part(index: int) -> Tuple[List[Dict[str, Any]], Optional[Dict[str, Any]], Optional[Exception]]:
+        try:
+            result = generate(**{**kwargs, count_kwarg: sizes[index], 'fanout_part': (index + 1, parts)})
+        except OpenAIRetryableError as e:
+            logger.warning(f"[FANOUT] Teilanfrage {index + 1}/{parts} vorübergehend fehlgeschlagen: {e}")
+            return [], None, e
+        except Exception as e:
+            logger.warning(f"[FANOUT] Teilanfrage {index + 1}/{parts} fehlgeschlagen: {e}")
+            return [], None, None
+        return (result or {}).get(result_key) or [], (result or {}).get('usage'), None
+
+    logger.info(f"[FANOUT] {sum(sizes)} {result_key} in {parts} parallelen Teilanfragen ({sizes})")
+    with ThreadPoolExecutor(max_workers=min(parts, max(FANOUT_MAX_PARALLEL, 1))) as executor:
+        results = list(executor.map(run_part, range(parts)))
+
+    retryable = next((error for _, _, error in results if error is not None), None)
+    if retryable is not None:
+        raise retryable
+
+    items = [item for part_items, _, _ in results for item in part_items]
+    return {result_key: items, 'usage': merge_usage([usage for _, usage, _ in results]), 'fanout': parts}
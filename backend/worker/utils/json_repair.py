@@ -0,0 +1,251 @@
+"""
+Tolerantes Parsen von JSON-Antworten der Modelle.
+
+Eine Antwort mit einem einzigen Formfehler (Code-Block, Text vor oder nach dem
+JSON, abschließendes Komma, abgeschnittenes Ende) wurde bisher komplett
+verworfen und kostete eine erneute, bezahlte Anfrage. `repair_json` bringt
+solche Antworten in einem Durchlauf in gültiges JSON; bei abgeschnittenen
+Antworten bleibt alles bis zum letzten vollständigen Wert erhalten. Welche
+Einträge fachlich gültig sind, entscheidet anschließend die Validierung
+(utils/validation.py) pro Eintrag.
+
+Die Gründe jeder Reparatur bzw. des Scheiterns werden als Codes geliefert und
+im Redis-Hash JSON_REPAIR_STATS_KEY gezählt.
+"""
+import json
+import logging
+import re
+from typing import Any, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Redis-Hash mit Zählern je Reparatur- bzw. Fehlercode
+JSON_REPAIR_STATS_KEY = 'stats:json_repair'
+
+_FENCE = re.compile(r'```[A-Za-z]*[ \t]*\n?(.*?)(?:```|$)', re.DOTALL)
+_NUMBER = re.compile(r'-?(?:0|[1-9]\d*)(?:\.\d+)?(?:[eE][+-]?\d+)?')
+_WORD = re.compile(r'[A-Za-z_][A-Za-z0-9_]*')
+_PYTHON_LITERALS = {'True': 'true', 'False': 'false', 'None': 'null'}
+_ESCAPES = {'\n': '\\n', '\r': '\\r', '\t': '\\t'}
+
+
+def _strip_trailing_comma(out: List[str]) -> bool:
+    """Entfernt ein Komma (samt Leerraum) am Ende der Ausgabe."""
+    index = len(out) - 1
+    while index >= 0 and out[index].isspace():
+        index -= 1
+    if index >= 0 and out[index] == ',':
+        del out[index:]
+        return True
+    return False
+
+
+def _last_token(out: List[str]) -> str:
+    """Letztes Zeichen der Ausgabe außer Leerraum."""
+    for token in reversed(out):
+        if not token.isspace():
+            return token[-1]
+    return ''
+
+
+def repair_json(text: str) -> Tuple[Optional[str], List[str]]:
+    """
+    Repariert häufige Formfehler in einer JSON-Antwort.
+
+    Behandelt Code-Blöcke, Text vor/nach dem JSON, abschließende und doppelte
+    Kommas, unpassende Klammern, Steuerzeichen in Strings, Python-Literale,
+    Schlüssel ohne Anführungszeichen und abgeschnittene Antworten.
+
+    Args:
+        text: Antworttext des Modells
+
+    Returns:
+        (str|None, list): Repariertes JSON (None, falls nichts zu retten ist)
+            und die Codes der vorgenommenen Reparaturen bzw. des Fehlers
+    """
+    reasons: List[str] = []
+
+    def note(reason: str):
+        if reason not in reasons:
+            reasons.append(reason)
+
+    source = (text or '').strip().lstrip('\ufeff')
+    if not source:
+        return None, ['empty']
+    if source[0] not in '{[' and '```' in source:
+        match = _FENCE.search(source)
+        if match:
+            source = match.group(1).strip()
+            note('code_fence')
+
+    starts = [index for index in (source.find('{'), source.find('[')) if index >= 0]
+    if not starts:
+        return None, reasons + ['no_json']
+    start = min(starts)
+    if start > 0:
+        note('leading_text')
+
+    out: List[str] = []
+    stack: List[str] = []
+    # Letzte Stelle, an der alle bisherigen Werte vollständig sind: (Länge der Ausgabe, offene Klammern)
+    last_safe: Optional[Tuple[int, Tuple[str, ...]]] = None
+    in_string = False
+    escape = False
+    end = None
+    index = start
+    length = len(source)
+
+    while index < length:
+        char = source[index]
+        if in_string:
+            if escape:
+                escape = False
+                out.append(char)
+            elif char == '\\':
+                escape = True
+                out.append(char)
+            elif char == '"':
+                in_string = False
+                out.append(char)
+            elif char in _ESCAPES:
+                out.append(_ESCAPES[char])
+                note('control_character')
+            else:
+                out.append(char)
+            index += 1
+            continue
+
+        if char == '"':
+            in_string = True
+            out.append(char)
+        elif char in '{[':
+            stack.append('}' if char == '{' else ']')
+            out.append(char)
+            last_safe = (len(out), tuple(stack))
+        elif char in '}]':
+            if stack and char == stack[-1]:
+                if _strip_trailing_comma(out):
+                    note('trailing_comma')
+                stack.pop()
+                out.append(char)
+                if not stack:
+                    end = index + 1
+                    break
+                last_safe = (len(out), tuple(stack))
+            else:
+                note('stray_character')
+        elif char == ',':
+            if _last_token(out) in ',[{':
+                note('stray_character')
+            else:
+                last_safe = (len(out), tuple(stack))
+                out.append(char)
+        elif char == ':' or char.isspace():
+            out.append(char)
+        elif char == '-' or char.isdigit():
+            match = _NUMBER.match(source, index)
+            if match:
+                out.append(match.group(0))
+                index = match.end()
+                continue
+            note('stray_character')
+        elif char.isalpha() or char == '_':
+            word = _WORD.match(source, index).group(0)
+            following = source[index + len(word):].lstrip()[:1]
+            if word in ('true', 'false', 'null'):
+                out.append(word)
+            elif word in _PYTHON_LITERALS:
+                out.append(_PYTHON_LITERALS[word])
+                note('python_literal')
+            elif following == ':' and stack and stack[-1] == '}':
+                out.append(f'"{word}"')
+                note('unquoted_key')
+            else:
+                note('stray_character')
+            index += len(word)
+            continue
+        else:
+            note('stray_character')
+        index += 1
+
+    if end is None:
+        # Abgeschnitten: bis zum letzten vollständigen Wert zurückgehen und Klammern schließen
+        if last_safe is None:
+            return None, reasons + ['unparseable']
+        safe_length, open_brackets = last_safe
+        del out[safe_length:]
+        _strip_trailing_comma(out)
+        out.extend(reversed(open_brackets))
+        note('truncated')
+    elif source[end:].strip():
+        note('trailing_text')
+
+    return ''.join(out), reasons
+
+
+def parse_json_response(text: str) -> Dict[str, Any]:
+    """
+    Parst eine JSON-Antwort, bei Bedarf nach Reparatur.
+
+    Args:
+        text: Antworttext des Modells
+
+    Returns:
+        dict: {'data': geparster Wert oder None,
+               'repairs': Codes der Reparaturen,
+               'error': None oder 'empty' | 'no_json' | 'unparseable'}
+    """
+    try:
+        return {'data': json.loads(text), 'repairs': [], 'error': None}
+    except (TypeError, ValueError):
+        pass
+
+    repaired, reasons = repair_json(text if isinstance(text, str) else '')
+    if repaired is None:
+        return {'data': None, 'repairs': reasons[:-1], 'error': reasons[-1]}
+    try:
+        return {'data': json.loads(repaired), 'repairs': reasons, 'error': None}
+    except ValueError:
+        return {'data': None, 'repairs': reasons, 'error': 'unparseable'}
+
+
+def record_parse_outcome(result: Dict[str, Any]):
+    """Zählt Reparaturen und Fehler eines parse_json_response-Ergebnisses."""
+    codes = list(result.get('repairs') or [])
+    if result.get('error'):
+        codes.append(result['error'])
+    if not codes:
+        return
+    try:
+        from redis_utils.client import get_redis_client
+        client = get_redis_client()
+        if not client:
+            return
+        pipe = client.pipeline(transaction=False)
+        pipe.hincrby(JSON_REPAIR_STATS_KEY, 'repaired' if not result.get('error') else 'failed', 1)
+        for code in codes:
+            pipe.hincrby(JSON_REPAIR_STATS_KEY, code, 1)
+        pipe.execute()
+    except Exception as e:
+        logger.debug("JSON-Reparatur-Zähler konnten nicht erhöht werden: %s", e)
+
+
+def get_json_repair_stats() -> Dict[str, int]:
+    """
+    Gibt die Zähler der JSON-Reparatur zurück.
+
+    Returns:
+        dict: 'repaired', 'failed' und die Anzahl je Code (z.B. 'trailing_comma')
+    """
+    stats = {'repaired': 0, 'failed': 0}
+    try:
+        from redis_utils.client import get_redis_client
+        client = get_redis_client()
+        raw = (client.hgetall(JSON_REPAIR_STATS_KEY) or {}) if client else {}
+    except Exception as e:
+        logger.debug("JSON-Reparatur-Zähler konnten nicht gelesen werden: %s", e)
+        return stats
+    for field, value in raw.items():
+        field = field.decode('utf-8') if isinstance(field, bytes) else field
+        stats[field] = int(value)
+    return stats
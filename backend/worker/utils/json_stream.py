@@ -0,0 +1,96 @@
+"""
+Inkrementeller JSON-Parser für gestreamte KI-Antworten
+------------------------------------------------------
+
+Dieses Modul erkennt in einem schrittweise eintreffenden JSON-Text die
+Objekte innerhalb eines Arrays, sobald sie geschlossen sind. Damit lassen
+sich z.B. Lernkarten aus ``{"flashcards": [{...}, {...}]}`` verarbeiten,
+während die Antwort noch gestreamt wird.
+"""
+
+import json
+import logging
+from typing import Any, Dict, List
+
+logger = logging.getLogger(__name__)
+
+
+class IncrementalArrayItemParser:
+    """
+    Liefert vollständige Objekte, die direkt in einem JSON-Array stehen.
+
+    Es wird nur ein einfacher Zustandsautomat über Klammern und Strings
+    geführt; das eigentliche Parsen eines Objekts übernimmt ``json.loads``,
+    sobald die schließende Klammer eingetroffen ist. Verschachtelte Objekte
+    innerhalb eines gelieferten Objekts werden nicht separat ausgegeben.
+    """
+
+    def __init__(self):
+        self._stack: List[str] = []
+        self._in_string = False
+        self._escape = False
+        self._item_depth = None
+        self._pending: List[str] = []
+        # Anzahl verarbeiteter Zeichen und Ende des zuletzt gelieferten Objekts
+        self.position = 0
+        self.last_item_end = 0
+
+    def feed(self, text: str) -> List[Dict[str, Any]]:
+        """
+        Verarbeitet einen weiteren Text-Abschnitt.
+
+        Args:
+            text: Neuer Abschnitt der Antwort
+
+        Returns:
+            list: Alle Objekte, die mit diesem Abschnitt vollständig wurden
+        """
+        items = []
+        if not text:
+            return items
+
+        for char in text:
+            self.position += 1
+            if self._item_depth is not None:
+                self._pending.append(char)
+
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif char == '\\':
+                    self._escape = True
+                elif char == '"':
+                    self._in_string = False
+                continue
+
+            if char == '"':
+                self._in_string = True
+            elif char in '{[':
+                if (char == '{' and self._item_depth is None
+                        and self._stack and self._stack[-1] == '['):
+                    self._item_depth = len(self._stack)
+                    self._pending = [char]
+                self._stack.append(char)
+            elif char in '}]':
+                if self._stack:
+                    self._stack.pop()
+                if (char == '}' and self._item_depth is not None
+                        and len(self._stack) == self._item_depth):
+                    item = self._load_pending()
+                    if item is not None:
+                        items.append(item)
+                        self.last_item_end = self.position
+                    self._item_depth = None
+                    self._pending = []
+
+        return items
+
+    def _load_pending(self):
+        """Parst das aktuell gesammelte Objekt oder gibt None zurück."""
+        raw = "".join(self._pending)
+        try:
+            item = json.loads(raw)
+        except json.JSONDecodeError as e:
+            logger.warning(f"[STREAM] Objekt im Stream konnte nicht geparst werden: {e} - {raw[:100]}...")
+            return None
+        return item if isinstance(item, dict) else None
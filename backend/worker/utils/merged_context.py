@@ -0,0 +1,172 @@
+"""
+Zusammengeführter Kontext für die Upload-weite Generierung.
+
+Statt jede Datei eines Uploads einzeln zu verarbeiten, werden die Texte aller
+Dateien zu einem Kontext mit Token-Budget zusammengefasst. Absätze, die in
+mehreren Dateien vorkommen (z.B. wiederholte Folien), werden nur einmal
+übernommen. Das Budget und die gewünschten Mengen werden nach dem Textanteil
+der Dateien verteilt.
+"""
+import hashlib
+import logging
+import os
+import re
+from typing import Dict, List, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Token-Budget des zusammengeführten Kontexts
+MERGED_CONTEXT_MAX_TOKENS = int(os.environ.get('MERGED_CONTEXT_MAX_TOKENS', 12000))
+# Grobe Schätzung wie in der Extraktion: ~4 Zeichen pro Token
+CHARS_PER_TOKEN = 4
+# Kürzere Absätze (Überschriften, Seitenzahlen) werden nicht dedupliziert
+MIN_DEDUPE_PARAGRAPH_CHARS = 40
+
+_PARAGRAPH_SPLIT = re.compile(r'\n\s*\n')
+_WHITESPACE = re.compile(r'\s+')
+
+
+def _paragraph_key(paragraph: str) -> str:
+    """Normalisierter Hash eines Absatzes (Groß-/Kleinschreibung und Leerraum ignoriert)."""
+    normalized = _WHITESPACE.sub(' ', paragraph).strip().lower()
+    return hashlib.sha1(normalized.encode('utf-8')).hexdigest()
+
+
+def dedupe_paragraphs(texts: List[str]) -> List[str]:
+    """
+    Entfernt Absätze, die bereits in einem früheren Text vorkamen.
+
+    Args:
+        texts: Texte in Reihenfolge der Dateien
+
+    Returns:
+        list: Texte ohne dateiübergreifende Wiederholungen
+    """
+    seen = set()
+    result = []
+    for text in texts:
+        kept = []
+        for paragraph in _PARAGRAPH_SPLIT.split(text or ''):
+            if not paragraph.strip():
+                continue
+            if len(paragraph.strip()) >= MIN_DEDUPE_PARAGRAPH_CHARS:
+                key = _paragraph_key(paragraph)
+                if key in seen:
+                    continue
+                seen.add(key)
+            kept.append(paragraph.strip())
+        result.append('\n\n'.join(kept))
+    return result
+
+
+def allocate_budget(lengths: List[int], budget: int) -> List[int]:
+    """
+    Verteilt ein Zeichenbudget auf Texte (Water-Filling).
+
+    Kurze Texte werden vollständig übernommen; das übrige Budget wird gleichmäßig
+    auf die längeren Texte verteilt.
+
+    Args:
+        lengths: Länge der Texte
+        budget: Gesamtbudget
+
+    Returns:
+        list: Budget pro Text
+    """
+    allocation = [0] * len(lengths)
+    open_indices = sorted(range(len(lengths)), key=lambda i: lengths[i])
+    remaining = budget
+    while open_indices:
+        share = remaining // len(open_indices)
+        index = open_indices[0]
+        if lengths[index] > share:
+            # Alle übrigen Texte sind mindestens so lang: gleichmäßig aufteilen
+            for i in open_indices:
+                allocation[i] = share
+            break
+        allocation[index] = lengths[index]
+        remaining -= lengths[index]
+        open_indices.pop(0)
+    return allocation
+
+
+def truncate_at_paragraph(text: str, max_chars: int) -> str:
+    """Kürzt einen Text auf max_chars, möglichst an einer Absatz- oder Zeilengrenze."""
+    if len(text) <= max_chars:
+        return text
+    cut = text.rfind('\n', 0, max_chars)
+    if cut < max_chars // 2:
+        cut = max_chars
+    return text[:cut].rstrip()
+
+
+def distribute_counts(total: int, weights: List[float]) -> List[int]:
+    """
+    Verteilt eine Anzahl nach Gewichten (Verfahren der größten Reste).
+
+    Args:
+        total: Zu verteilende Anzahl
+        weights: Gewichte (z.B. Textanteile)
+
+    Returns:
+        list: Ganzzahlige Anteile, deren Summe total ergibt
+    """
+    weight_sum = sum(weights)
+    if not weights or weight_sum <= 0:
+        return [0] * len(weights)
+    exact = [total * weight / weight_sum for weight in weights]
+    counts = [int(value) for value in exact]
+    by_remainder = sorted(range(len(weights)), key=lambda i: exact[i] - counts[i], reverse=True)
+    for i in by_remainder[:total - sum(counts)]:
+        counts[i] += 1
+    return counts
+
+
+def build_merged_context(files: List[Dict[str, str]], counts: Dict[str, int],
+                         max_tokens: int = MERGED_CONTEXT_MAX_TOKENS) -> Tuple[str, List[Dict[str, object]]]:
+    """
+    Baut den zusammengeführten Kontext aller Dateien eines Uploads.
+
+    Args:
+        files: Liste von {'id', 'name', 'text'} in Upload-Reihenfolge
+        counts: Gewünschte Gesamtanzahl pro Materialtyp (z.B. {'Lernkarten': 10})
+        max_tokens: Token-Budget des Kontexts
+
+    Returns:
+        (str, list): Kontext und Verteilung pro Datei
+            ({'id', 'name', 'share', 'chars', 'truncated', 'counts'})
+    """
+    texts = dedupe_paragraphs([f.get('text') or '' for f in files])
+    lengths = [len(text) for text in texts]
+    total_length = sum(lengths)
+    shares = [length / total_length if total_length else 0 for length in lengths]
+    per_type = {label: distribute_counts(total, shares) for label, total in counts.items()}
+
+    # Budget abzüglich der Abschnittsüberschriften
+    header_reserve = 120 * len(files)
+    budgets = allocate_budget(lengths, max(max_tokens * CHARS_PER_TOKEN - header_reserve, 0))
+
+    sections = []
+    distribution = []
+    for index, (file_info, text) in enumerate(zip(files, texts)):
+        file_counts = {label: values[index] for label, values in per_type.items()}
+        section_text = truncate_at_paragraph(text, budgets[index])
+        distribution.append({
+            'id': file_info['id'],
+            'name': file_info.get('name'),
+            'share': round(shares[index], 4),
+            'chars': len(section_text),
+            'truncated': len(section_text) < len(text),
+            'counts': file_counts,
+        })
+        if not section_text:
+            continue
+        wanted = ', '.join(f"ca. {value} {label}" for label, value in file_counts.items() if value)
+        header = f"### Dokument {index + 1}: {file_info.get('name') or file_info['id']} (Anteil {round(shares[index] * 100)} %"
+        header += f"; {wanted})" if wanted else ")"
+        sections.append(f"{header}\n{section_text}")
+
+    merged = '\n\n'.join(sections)
+    logger.info(f"[MERGED] Kontext aus {len(files)} Dateien: {len(merged)} Zeichen "
+                f"(Budget {max_tokens} Tokens, {sum(1 for d in distribution if d['truncated'])} gekürzt)")
+    return merged, distribution
@@ -0,0 +1,182 @@
+"""
+MinHash-Signaturen und LSH-Index (rein lokal, ohne externe Abhängigkeiten).
+
+Texte werden normalisiert, in Shingles zerlegt und auf eine Signatur fester
+Länge abgebildet. Der Anteil übereinstimmender Positionen zweier Signaturen
+schätzt die Jaccard-Ähnlichkeit der Shingle-Mengen. Der LSH-Index teilt die
+Signatur in Bänder; nur Einträge mit mindestens einem identischen Band werden
+verglichen, Abfragen bleiben damit auch bei tausenden Einträgen schnell.
+
+Die Hashfunktionen sind deterministisch (crc32 + fester Seed), Signaturen
+können daher zwischen Prozessen geteilt und in Redis abgelegt werden.
+"""
+import random
+import re
+import unicodedata
+import zlib
+from collections import defaultdict
+from typing import Dict, Hashable, Iterable, List, Optional, Sequence, Set, Tuple
+
+# Anzahl der Hashfunktionen (Signaturlänge)
+DEFAULT_NUM_PERM = 64
+# Aufteilung der Signatur: Bänder × Zeilen = Signaturlänge
+DEFAULT_BANDS = 16
+
+_MASK32 = 0xFFFFFFFF
+_WORD = re.compile(r'\w+', re.UNICODE)
+
+# Häufige Funktionswörter (de/en), die für die Ähnlichkeit keine Rolle spielen
+STOPWORDS = frozenset("""
+der die das den dem des ein eine einer eines einem einen und oder aber ist sind war waren wird werden
+wie was wer wo wann warum welche welcher welches im in an am auf aus bei mit nach von vor zu zum zur
+für über unter durch gegen ohne um nicht kein keine man sich es er sie wir ihr ich du hat haben kann
+können soll sollen muss müssen als auch so noch nur sehr mehr dass the a an and or but is are was were
+be been being of to in on at by for with from as that this these those what which who whom whose when
+where why how do does did not no can could should would will it its into than then there their
+""".split())
+
+
+def normalize_text(text: str) -> str:
+    """Kleinschreibung, Unicode-Normalisierung und einheitlicher Leerraum."""
+    text = unicodedata.normalize('NFKC', str(text or '')).lower()
+    return ' '.join(_WORD.findall(text))
+
+
+def content_words(text: str) -> List[str]:
+    """Wörter eines Textes ohne Funktionswörter und Einzelzeichen."""
+    return [word for word in normalize_text(text).split() if len(word) > 1 and word not in STOPWORDS]
+
+
+def char_shingles(text: str, k: int = 5) -> Set[str]:
+    """
+    Zeichen-k-Gramme über die Inhaltswörter eines Textes.
+
+    Zeichen-Shingles sind robust gegen Flexion und kleine Umformulierungen
+    ("Photosynthese" / "der Photosynthese").
+    """
+    joined = ' '.join(content_words(text))
+    if not joined:
+        return set()
+    if len(joined) <= k:
+        return {joined}
+    return {joined[i:i + k] for i in range(len(joined) - k + 1)}
+
+
+def word_shingles(text: str, k: int = 5) -> Set[str]:
+    """Wort-k-Gramme eines Textes (für lange Dokumente)."""
+    words = normalize_text(text).split()
+    if len(words) <= k:
+        return {' '.join(words)} if words else set()
+    return {' '.join(words[i:i + k]) for i in range(len(words) - k + 1)}
+
+
+class MinHasher:
+    """
+    Erzeugt MinHash-Signaturen per One-Permutation-Hashing mit Densifizierung.
+
+    Statt num_perm Hashfunktionen pro Shingle wird jedes Shingle einmal gehasht
+    und einem von num_perm Fächern zugeordnet; pro Fach zählt das Minimum. Leere
+    Fächer übernehmen den Wert des nächsten belegten Fachs (Rotation). Die
+    Signatur schätzt die Jaccard-Ähnlichkeit wie klassisches MinHash, kostet
+    aber O(Shingles) statt O(Shingles × num_perm).
+    """
+
+    def __init__(self, num_perm: int = DEFAULT_NUM_PERM, seed: int = 1):
+        rng = random.Random(seed)
+        self.num_perm = num_perm
+        # Multiplikative Durchmischung (ungerader Faktor: Permutation der 32-Bit-Werte)
+        self._a = rng.getrandbits(32) | 1
+        self._b = rng.getrandbits(32)
+        self._bin_span = (_MASK32 + 1) // num_perm
+
+    def signature(self, shingles: Iterable[str]) -> Tuple[int, ...]:
+        """
+        Signatur einer Shingle-Menge.
+
+        Returns:
+            tuple: num_perm Werte (leere Menge: lauter 2^32-1)
+        """
+        num_perm, a, b = self.num_perm, self._a, self._b
+        bins = [None] * num_perm
+        for shingle in set(shingles):
+            h = (a * zlib.crc32(shingle.encode('utf-8')) + b) & _MASK32
+            index, value = divmod(h, self._bin_span)
+            if index >= num_perm:
+                index = num_perm - 1
+            current = bins[index]
+            if current is None or value < current:
+                bins[index] = value
+        if all(value is None for value in bins):
+            return (_MASK32,) * num_perm
+        # Densifizierung: leere Fächer übernehmen den nächsten belegten Wert (versetzt um die Distanz)
+        signature = []
+        for index in range(num_perm):
+            distance = 0
+            while bins[(index + distance) % num_perm] is None:
+                distance += 1
+            signature.append(bins[(index + distance) % num_perm] + distance * self._bin_span)
+        return tuple(signature)
+
+
+def estimated_similarity(sig_a: Sequence[int], sig_b: Sequence[int]) -> float:
+    """Geschätzte Jaccard-Ähnlichkeit zweier Signaturen."""
+    if not sig_a or len(sig_a) != len(sig_b):
+        return 0.0
+    return sum(1 for x, y in zip(sig_a, sig_b) if x == y) / len(sig_a)
+
+
+class MinHashLSH:
+    """
+    LSH-Index über MinHash-Signaturen (Banding).
+
+    Mit b Bändern zu je r Zeilen werden Paare ab einer Ähnlichkeit von etwa
+    (1/b)^(1/r) mit hoher Wahrscheinlichkeit Kandidaten.
+    """
+
+    def __init__(self, num_perm: int = DEFAULT_NUM_PERM, bands: int = DEFAULT_BANDS):
+        if num_perm % bands:
+            raise ValueError(f"num_perm ({num_perm}) muss durch bands ({bands}) teilbar sein")
+        self.num_perm = num_perm
+        self.bands = bands
+        self.rows = num_perm // bands
+        self._buckets: List[Dict[Tuple[int, ...], List[Hashable]]] = [defaultdict(list) for _ in range(bands)]
+        self._signatures: Dict[Hashable, Tuple[int, ...]] = {}
+
+    def __len__(self):
+        return len(self._signatures)
+
+    def _band_keys(self, signature: Sequence[int]):
+        for band in range(self.bands):
+            yield band, tuple(signature[band * self.rows:(band + 1) * self.rows])
+
+    def add(self, key: Hashable, signature: Sequence[int]):
+        """Fügt eine Signatur unter einem Schlüssel hinzu."""
+        signature = tuple(signature)
+        self._signatures[key] = signature
+        for band, band_key in self._band_keys(signature):
+            self._buckets[band][band_key].append(key)
+
+    def signature(self, key: Hashable) -> Optional[Tuple[int, ...]]:
+        return self._signatures.get(key)
+
+    def candidates(self, signature: Sequence[int]) -> Set[Hashable]:
+        """Schlüssel, die mindestens ein Band mit der Signatur teilen."""
+        found = set()
+        for band, band_key in self._band_keys(signature):
+            found.update(self._buckets[band].get(band_key, ()))
+        return found
+
+    def query(self, signature: Sequence[int], threshold: float) -> List[Tuple[Hashable, float]]:
+        """
+        Einträge mit geschätzter Ähnlichkeit ≥ threshold, absteigend sortiert.
+
+        Returns:
+            list: [(Schlüssel, Ähnlichkeit), ...]
+        """
+        matches = []
+        for key in self.candidates(signature):
+            similarity = estimated_similarity(signature, self._signatures[key])
+            if similarity >= threshold:
+                matches.append((key, similarity))
+        matches.sort(key=lambda match: match[1], reverse=True)
+        return matches
@@ -0,0 +1,168 @@
+"""
+Modell-Kaskade für die KI-Generierung.
+
+Führt eine Generierungsfunktion zuerst mit dem günstigsten Modell der Route aus,
+validiert das Ergebnis und eskaliert nur die ungültigen bzw. fehlenden Einträge
+an das nächste Modell. Pro Versuch werden Latenz, Token, Kosten und
+Validierungsergebnis festgehalten, damit sie in TokenUsage.request_metadata
+landen.
+"""
+import json
+import logging
+import time
+from typing import Any, Callable, Dict, List, Optional
+
+from utils.token_tracking import calculate_token_cost
+
+logger = logging.getLogger(__name__)
+
+
+def _normalize(value: Any) -> Any:
+    """Normalisiert Texte (Groß-/Kleinschreibung, Leerraum) für die Duplikaterkennung."""
+    if isinstance(value, str):
+        return ' '.join(value.lower().split())
+    if isinstance(value, dict):
+        return {key: _normalize(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [_normalize(item) for item in value]
+    return value
+
+
+def _item_key(item: Any) -> str:
+    """Schlüssel zur Duplikaterkennung innerhalb und zwischen den Versuchen."""
+    return json.dumps(_normalize(item), sort_keys=True, ensure_ascii=False, default=str)
+
+
+def _rejected_fields(errors: List[Any]) -> Dict[str, int]:
+    """Anzahl der Ablehnungen je Feld (aus utils.validation.rejection)."""
+    counts: Dict[str, int] = {}
+    for error in errors:
+        field = (error.get('field') if isinstance(error, dict) else None) or 'item'
+        counts[field] = counts.get(field, 0) + 1
+    return counts
+
+
+def run_model_cascade(
+    task_type: str,
+    generate_fn: Callable[..., Dict[str, Any]],
+    models: List[str],
+    validate_fn: Callable[[Any], tuple],
+    result_key: str,
+    count: Optional[int] = None,
+    count_kwarg: Optional[str] = None,
+    first_attempt_options: Optional[Dict[str, Any]] = None,
+    **generation_kwargs
+) -> Dict[str, Any]:
+    """
+    Generiert mit einer Modell-Kaskade.
+
+    Bei Listen-Ergebnissen (count/count_kwarg gesetzt) wird das nächste Modell
+    nur nach der fehlenden Anzahl gültiger Einträge gefragt. Bei Einzel-Ergebnissen
+    (z.B. Themen) wird eskaliert, wenn die Validierung None liefert.
+
+    Args:
+        task_type: Name der Route (für Logs und Metadaten)
+        generate_fn: Generierungsfunktion (z.B. generate_flashcards_with_openai)
+        models: Modelle in Eskalationsreihenfolge
+        validate_fn: Liefert (gültige Einträge bzw. Ergebnis oder None, Ablehnungsgründe)
+        result_key: Schlüssel des Ergebnisses im Rückgabe-Dict von generate_fn
+        count: Gewünschte Anzahl gültiger Einträge (nur Listen-Ergebnisse)
+        count_kwarg: Name des Anzahl-Parameters von generate_fn
+        first_attempt_options: Zusätzliche Optionen nur für den ersten Versuch
+            (z.B. vorberechnete Batch-Antwort)
+        **generation_kwargs: Weitere Argumente für generate_fn
+
+    Returns:
+        dict: {'result': Ergebnis, 'attempts': Liste der Versuche, 'escalated': bool}
+    """
+    attempts = []
+    collected = []
+    seen = set()
+    accepted = None
+    last_raw = None
+
+    for index, model in enumerate(models):
+        call_kwargs = dict(generation_kwargs, model=model)
+        if index == 0 and first_attempt_options:
+            call_kwargs.update(first_attempt_options)
+        if count_kwarg:
+            call_kwargs[count_kwarg] = count - len(collected)
+
+        started = time.monotonic()
+        result = generate_fn(**call_kwargs) or {}
+        latency_ms = int((time.monotonic() - started) * 1000)
+
+        raw = result.get(result_key)
+        last_raw = raw
+        valid, errors = validate_fn(raw)
+        usage = result.get('usage') or {}
+        input_tokens = usage.get('prompt_tokens', 0)
+        output_tokens = usage.get('completion_tokens', 0)
+
+        if count_kwarg:
+            for item in valid:
+                key = _item_key(item)
+                if key not in seen:
+                    seen.add(key)
+                    collected.append(item)
+            valid_count = len(valid)
+        else:
+            accepted = valid
+            valid_count = 1 if valid is not None else 0
+
+        attempts.append({
+            'route': task_type,
+            'attempt': index,
+            'model': model,
+            'latency_ms': latency_ms,
+            'usage': usage,
+            'cost': calculate_token_cost(model, input_tokens, output_tokens) if input_tokens else 0,
+            'valid_items': valid_count,
+            'invalid_items': len(errors),
+            'rejected_fields': _rejected_fields(errors),
+            'escalated': index > 0,
+        })
+        logger.info(f"[CASCADE] {task_type}: Versuch {index + 1} mit {model} in {latency_ms} ms, "
+                    f"{valid_count} gültig, {len(errors)} ungültig")
+
+        done = len(collected) >= count if count_kwarg else accepted is not None
+        if done:
+            break
+        if index + 1 < len(models):
+            logger.info(f"[CASCADE] {task_type}: Eskaliere an {models[index + 1]}")
+
+    if count_kwarg:
+        # Ohne ein einziges gültiges Ergebnis bleibt das Verhalten wie bisher (Rohergebnis)
+        final = collected[:count] if collected else (last_raw or [])
+    else:
+        final = accepted if accepted is not None else last_raw
+
+    return {'result': final, 'attempts': attempts, 'escalated': len(attempts) > 1}
+
+
+def cascade_usage_metadata(cascade: Dict[str, Any], attempt: Dict[str, Any], base: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    """
+    Baut die TokenUsage-Metadaten für einen Versuch der Kaskade.
+
+    Args:
+        cascade: Ergebnis von run_model_cascade
+        attempt: Der Versuch, für den die Nutzung gespeichert wird
+        base: Weitere Metadaten (z.B. Batch-Informationen)
+
+    Returns:
+        dict: Metadaten mit Route, Versuch, Latenz, Kosten und Eskalation
+    """
+    metadata = dict(base or {})
+    metadata.update({
+        'route': attempt['route'],
+        'route_models': [a['model'] for a in cascade['attempts']],
+        'attempt': attempt['attempt'],
+        'latency_ms': attempt['latency_ms'],
+        'cost': attempt['cost'],
+        'valid_items': attempt['valid_items'],
+        'invalid_items': attempt['invalid_items'],
+        'rejected_fields': attempt.get('rejected_fields', {}),
+        'escalated': attempt['escalated'],
+        'cascade_escalated': cascade['escalated'],
+    })
+    return metadata
@@ -0,0 +1,148 @@
+"""
+Erkennung von Beinahe-Duplikaten bei Lernkarten und Fragen.
+
+Wiederholtes "mehr generieren" liefert oft umformulierte Varianten bereits
+vorhandener Karten. Ein MinHash-Index pro Upload (utils/minhash.py) erkennt
+diese beim Speichern: Duplikate vorhandener Einträge werden verworfen,
+Duplikate innerhalb derselben Antwort werden zusammengeführt (der
+ausführlichere Eintrag bleibt). Statt roher Kartenvorderseiten bekommt der
+Prompt eine kompakte Liste der bereits abgedeckten Begriffe.
+"""
+import logging
+import os
+from collections import Counter
+from typing import Any, Callable, Dict, Hashable, Iterable, List, Optional, Tuple
+
+from utils.minhash import MinHasher, MinHashLSH, char_shingles, content_words, normalize_text
+
+logger = logging.getLogger(__name__)
+
+# Ab dieser geschätzten Jaccard-Ähnlichkeit gilt ein Eintrag als Duplikat
+NEAR_DUPLICATE_THRESHOLD = float(os.environ.get('NEAR_DUPLICATE_THRESHOLD', 0.5))
+# Anzahl Begriffe in der Zusammenfassung für den Prompt
+COVERED_CONCEPTS_MAX_TERMS = int(os.environ.get('COVERED_CONCEPTS_MAX_TERMS', 40))
+
+_HASHER = MinHasher()
+
+
+def flashcard_text(item: Dict[str, Any]) -> str:
+    """Vergleichstext einer Lernkarte (Vorder- und Rückseite)."""
+    return f"{item.get('question', item.get('front', ''))} {item.get('answer', item.get('back', ''))}"
+
+
+def question_text(item: Dict[str, Any]) -> str:
+    """Vergleichstext einer Frage (Fragetext und richtige Antwort)."""
+    text = item.get('question', item.get('text', ''))
+    options = item.get('options') or []
+    try:
+        correct = options[int(item.get('correct_answer', item.get('correct', 0)) or 0)]
+    except (IndexError, TypeError, ValueError):
+        correct = ''
+    return f"{text} {correct}"
+
+
+class NearDuplicateIndex:
+    """MinHash-LSH-Index über die Einträge eines Uploads."""
+
+    def __init__(self, threshold: float = NEAR_DUPLICATE_THRESHOLD):
+        self.threshold = threshold
+        self._lsh = MinHashLSH(num_perm=_HASHER.num_perm)
+        self._exact: Dict[str, Hashable] = {}
+        self._next_key = 0
+
+    @classmethod
+    def from_texts(cls, texts: Iterable[str], threshold: float = NEAR_DUPLICATE_THRESHOLD) -> 'NearDuplicateIndex':
+        """Baut einen Index aus vorhandenen Einträgen."""
+        index = cls(threshold)
+        for text in texts:
+            index.add(text)
+        return index
+
+    def __len__(self):
+        return len(self._lsh)
+
+    def add(self, text: str, key: Optional[Hashable] = None) -> Hashable:
+        """Fügt einen Text hinzu und gibt seinen Schlüssel zurück."""
+        if key is None:
+            key = self._next_key
+            self._next_key += 1
+        self._exact.setdefault(normalize_text(text), key)
+        self._lsh.add(key, _HASHER.signature(char_shingles(text)))
+        return key
+
+    def find(self, text: str) -> Optional[Tuple[Hashable, float]]:
+        """
+        Sucht das ähnlichste vorhandene Duplikat eines Textes.
+
+        Returns:
+            (Schlüssel, Ähnlichkeit) oder None
+        """
+        exact = self._exact.get(normalize_text(text))
+        if exact is not None:
+            return exact, 1.0
+        shingles = char_shingles(text)
+        if not shingles:
+            return None
+        matches = self._lsh.query(_HASHER.signature(shingles), self.threshold)
+        return matches[0] if matches else None
+
+
+def filter_near_duplicates(items: List[Dict[str, Any]], index: NearDuplicateIndex,
+                           text_of: Callable[[Dict[str, Any]], str]) -> Tuple[List[Dict[str, Any]], List[Dict[str, Any]]]:
+    """
+    Entfernt Beinahe-Duplikate aus neu generierten Einträgen und nimmt die übrigen in den Index auf.
+
+    Duplikate vorhandener Einträge werden verworfen. Duplikate innerhalb der
+    neuen Einträge werden zusammengeführt: der längere Eintrag bleibt.
+
+    Args:
+        items: Neu generierte Einträge
+        index: Index der vorhandenen Einträge (wird ergänzt)
+        text_of: Vergleichstext eines Eintrags (flashcard_text bzw. question_text)
+
+    Returns:
+        (list, list): Behaltene und verworfene Einträge
+    """
+    kept: List[Dict[str, Any]] = []
+    batch_keys: Dict[Hashable, int] = {}
+    rejected = []
+    for item in items:
+        text = text_of(item)
+        match = index.find(text)
+        if match is None:
+            batch_keys[index.add(text, key=('new', len(kept)))] = len(kept)
+            kept.append(item)
+            continue
+        position = batch_keys.get(match[0])
+        if position is not None and len(text) > len(text_of(kept[position])):
+            # Zusammenführen: ausführlichere Variante ersetzt den Eintrag aus derselben Antwort
+            rejected.append(kept[position])
+            kept[position] = item
+        else:
+            rejected.append(item)
+    if rejected:
+        logger.info(f"[NEAR-DUPLICATES] {len(rejected)} von {len(items)} Einträgen als Beinahe-Duplikat verworfen.")
+    return kept, rejected
+
+
+def covered_concepts_summary(texts: Iterable[str], max_terms: int = COVERED_CONCEPTS_MAX_TERMS) -> str:
+    """
+    Kompakte Liste der bereits abgedeckten Begriffe (häufigste Inhaltswörter und Wortpaare).
+
+    Args:
+        texts: Vorhandene Einträge (z.B. Kartenvorderseiten)
+        max_terms: Maximale Anzahl Begriffe
+
+    Returns:
+        str: "begriff (n), ..." oder leerer String
+    """
+    unigrams, bigrams = Counter(), Counter()
+    for text in texts:
+        words = [word for word in content_words(text) if len(word) > 3]
+        unigrams.update(set(words))
+        bigrams.update({f"{a} {b}" for a, b in zip(words, words[1:])})
+    # Wortpaare, die mehrfach vorkommen, ersetzen ihre Einzelwörter
+    terms = Counter({pair: n for pair, n in bigrams.items() if n > 1})
+    covered_words = {word for pair in terms for word in pair.split()}
+    terms.update({word: n for word, n in unigrams.items() if word not in covered_words})
+    return ', '.join(f"{term} ({n})" if n > 1 else term for term, n in terms.most_common(max_terms))
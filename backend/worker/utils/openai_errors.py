@@ -0,0 +1,108 @@
+"""
+Klassifizierung von OpenAI-Fehlern.
+
+Quelle ist backend/shared/openai_errors.py; die Kopien in API (main/utils),
+Worker (worker/utils) und Gateway (gateway/utils) erzeugt `python sync_shared.py`,
+damit alle Dienste dieselben Fehler wiederholen bzw. sofort aufgeben.
+Entschieden wird über Fehlercode, Meldung und HTTP-Status, damit die
+openai-Bibliothek nicht importiert werden muss. Fehler ohne HTTP-Status werden
+nur wiederholt, wenn sie (oder ihre Ursache) Transportfehler sind; alles andere
+(z.B. KeyError beim Auswerten der Antwort) ist ein Programmfehler und fatal.
+"""
+import asyncio
+from typing import Optional
+
+# Anfragen, die bei Wiederholung genauso scheitern (ungültige Anfrage, Authentifizierung, Modell)
+FATAL_STATUS_CODES = frozenset({400, 401, 403, 404, 422})
+FATAL_ERROR_CODES = frozenset({
+    'context_length_exceeded',
+    'string_above_max_length',
+    'invalid_api_key',
+    'insufficient_quota',
+    'model_not_found',
+    'invalid_request_error',
+})
+FATAL_MESSAGES = ('maximum context length', 'exceeded your quota', 'context_length_exceeded')
+
+# Transportfehler ohne HTTP-Antwort (Klassennamen aus openai, httpx und aiohttp, ohne Import der Bibliotheken)
+TRANSPORT_ERROR_NAMES = frozenset({
+    'APIConnectionError',     # openai (auch APITimeoutError)
+    'TransportError',         # httpx: Timeouts, Netzwerk- und Protokollfehler
+    'ClientConnectionError',  # aiohttp
+})
+TRANSPORT_ERROR_TYPES = (TimeoutError, ConnectionError, asyncio.TimeoutError)
+
+
+def error_status(exc: BaseException) -> Optional[int]:
+    """HTTP-Status eines API-Fehlers (None ohne Antwort)."""
+    status = getattr(exc, 'status_code', None)
+    if status is None:
+        status = getattr(getattr(exc, 'response', None), 'status_code', None)
+    return status if isinstance(status, int) else None
+
+
+def error_code(exc: BaseException) -> Optional[str]:
+    """Fehlercode bzw. -typ aus dem Fehlerobjekt der API."""
+    body = getattr(exc, 'body', None)
+    body = body if isinstance(body, dict) else {}
+    for value in (getattr(exc, 'code', None), body.get('code'), getattr(exc, 'type', None), body.get('type')):
+        if isinstance(value, str) and value:
+            return value
+    return None
+
+
+def is_transport_error(exc: BaseException) -> bool:
+    """Prüft, ob ein Fehler oder eine seiner Ursachen ein Timeout bzw. Verbindungsfehler ist."""
+    seen = set()
+    while exc is not None and id(exc) not in seen:
+        seen.add(id(exc))
+        if isinstance(exc, TRANSPORT_ERROR_TYPES):
+            return True
+        if any(cls.__name__ in TRANSPORT_ERROR_NAMES for cls in type(exc).__mro__):
+            return True
+        # Eigene Hüllen (z.B. LLMBackendError, UpstreamError) tragen den Transportfehler als Ursache
+        exc = exc.__cause__
+    return False
+
+
+def is_fatal_error(exc: BaseException) -> bool:
+    """
+    Prüft, ob eine Wiederholung sinnlos ist.
+
+    Fatal sind ungültige Anfragen (z.B. Kontextüberlauf), fehlende Berechtigung
+    und ein erschöpftes Kontingent. Rate-Limits, Timeouts, Verbindungs- und
+    Serverfehler gelten als vorübergehend.
+    """
+    code = error_code(exc)
+    if code in FATAL_ERROR_CODES:
+        return True
+    message = str(exc).lower()
+    if any(fragment in message for fragment in FATAL_MESSAGES):
+        return True
+    return error_status(exc) in FATAL_STATUS_CODES
+
+
+def is_retryable_error(exc: BaseException) -> bool:
+    """Prüft, ob ein Fehler vorübergehend ist und die Anfrage wiederholt werden sollte."""
+    if is_fatal_error(exc):
+        return False
+    status = error_status(exc)
+    if status is not None:
+        return status in (408, 409, 429) or status >= 500
+    # Ohne Antwort nur Timeouts und Verbindungsabbrüche wiederholen
+    return is_transport_error(exc)
+
+
+def retry_after_seconds(exc: BaseException) -> Optional[float]:
+    """Vom Server empfohlene Wartezeit (Retry-After-Header) in Sekunden."""
+    headers = getattr(getattr(exc, 'response', None), 'headers', None)
+    if not headers:
+        return None
+    try:
+        value = headers.get('retry-after-ms')
+        if value is not None:
+            return float(value) / 1000
+        value = headers.get('retry-after')
+        return float(value) if value is not None else None
+    except (TypeError, ValueError):
+        return None
@@ -0,0 +1,177 @@
+"""
+Token-Budget für Prompts.
+
+Quelle ist backend/shared/prompt_budget.py; die Kopien in API (main/utils) und
+Worker (worker/utils) erzeugt `python sync_shared.py`.
+Statt das Dokument mit einer festen Zeichenzahl zu kürzen (zu viel bei
+Schriften mit vielen Tokens pro Zeichen, zu wenig bei lateinischem Text),
+erhält es genau die Tokens, die im Kontextfenster des Modells neben
+System-Prompt, Anweisungen, Beispielen und der reservierten Antwort frei
+bleiben. Gekürzt wird an Abschnitts- bzw. Satzgrenzen.
+"""
+import logging
+import os
+import re
+from typing import Any, Dict, Iterable, Optional
+
+from utils.llm_backend import is_local_model
+from utils.token_counter import DEFAULT_MODEL, count_tokens_batch, truncate_to_tokens
+
+logger = logging.getLogger(__name__)
+
+# Kontextfenster (Tokens) je Modell; Varianten mit Datum (z.B. gpt-4o-2024-08-06) über das Präfix
+MODEL_CONTEXT_WINDOWS: Dict[str, int] = {
+    'gpt-4.1': 1047576,
+    'gpt-4.1-mini': 1047576,
+    'gpt-4.1-nano': 1047576,
+    'gpt-4o': 128000,
+    'gpt-4o-mini': 128000,
+    'gpt-4-turbo': 128000,
+    'gpt-4-32k': 32768,
+    'gpt-4': 8192,
+    'gpt-3.5-turbo': 16385,
+    'o1': 200000,
+    'o1-mini': 128000,
+    'o3': 200000,
+    'o3-mini': 200000,
+    'o4-mini': 200000,
+}
+# Kontextfenster für unbekannte Modelle
+DEFAULT_CONTEXT_WINDOW = int(os.environ.get('MODEL_CONTEXT_WINDOW_DEFAULT', 16385))
+# Kontextfenster lokaler Modelle (utils/llm_backend.py); muss zur Server-Einstellung passen (llama.cpp -c, Ollama num_ctx)
+LOCAL_CONTEXT_WINDOW = int(os.environ.get('LOCAL_LLM_CONTEXT_WINDOW', 8192))
+# Obergrenze für das Dokument unabhängig vom Kontextfenster (0 = nur Kontextfenster)
+PROMPT_DOCUMENT_MAX_TOKENS = int(os.environ.get('PROMPT_DOCUMENT_MAX_TOKENS', 0))
+# Sicherheitsabstand für Abweichungen zwischen Zählung und Abrechnung des Providers
+PROMPT_SAFETY_TOKENS = int(os.environ.get('PROMPT_SAFETY_TOKENS', 64))
+# Format-Overhead der Chat-API pro Nachricht und für den Beginn der Antwort
+MESSAGE_OVERHEAD_TOKENS = 4
+REPLY_PRIMING_TOKENS = 3
+# Grenzen werden nur im letzten Teil des Budgets gesucht, damit nicht zu viel verloren geht
+BOUNDARY_SEARCH_SHARE = 0.15
+
+# Abschnittsgrenzen: Leerzeile oder Zeile mit Markdown-Überschrift bzw. Nummerierung ("2.3 Titel")
+_SECTION_BOUNDARY = re.compile(r'\n[ \t]*\n|\n(?=#{1,6} |\d+(?:\.\d+)*\.? +\S)')
+# Satzende mit Leerraum danach bzw. ostasiatisches Satzzeichen
+_SENTENCE_BOUNDARY = re.compile(r'[.!?…]["\'»«“”)\]]*\s|[。！？]')
+_WHITESPACE = re.compile(r'\s')
+
+
+def context_window(model: Optional[str]) -> int:
+    """
+    Kontextfenster eines Modells in Tokens.
+
+    Args:
+        model: Modellname (auch mit Datums-Suffix)
+
+    Returns:
+        int: Größe des Kontextfensters (LOCAL_CONTEXT_WINDOW für lokale, DEFAULT_CONTEXT_WINDOW für unbekannte Modelle)
+    """
+    if is_local_model(model):
+        return LOCAL_CONTEXT_WINDOW
+    model = (model or DEFAULT_MODEL).lower()
+    if model in MODEL_CONTEXT_WINDOWS:
+        return MODEL_CONTEXT_WINDOWS[model]
+    # Längstes passendes Präfix: 'gpt-4o-mini-2024-07-18' -> 'gpt-4o-mini', nicht 'gpt-4o'
+    for name in sorted(MODEL_CONTEXT_WINDOWS, key=len, reverse=True):
+        if model.startswith(name + '-'):
+            return MODEL_CONTEXT_WINDOWS[name]
+    return DEFAULT_CONTEXT_WINDOW
+
+
+def prompt_tokens(parts: Iterable[Any], model: str = DEFAULT_MODEL) -> int:
+    """
+    Tokens der festen Prompt-Teile einschließlich Nachrichten-Overhead.
+
+    Args:
+        parts: Nachrichten ({"role", "content"}) oder Texte (z.B. System-Prompt, Beispiele)
+        model: Modell, dessen Encoder verwendet wird
+
+    Returns:
+        int: Tokens, die die Teile im Kontextfenster belegen
+    """
+    contents = [(part.get('content') or '') if isinstance(part, dict) else str(part or '') for part in parts]
+    counts = count_tokens_batch(contents, model)
+    return sum(counts) + MESSAGE_OVERHEAD_TOKENS * len(contents) + REPLY_PRIMING_TOKENS
+
+
+def document_budget(parts: Iterable[Any], model: str = DEFAULT_MODEL, reserved_output_tokens: int = 0,
+                    max_document_tokens: Optional[int] = None) -> int:
+    """
+    Tokens, die für das Dokument frei bleiben.
+
+    Args:
+        parts: Feste Prompt-Teile ohne das Dokument
+        model: Modell der Anfrage
+        reserved_output_tokens: Für die Antwort reservierte Tokens (max_tokens)
+        max_document_tokens: Optionale Obergrenze für das Dokument (sonst PROMPT_DOCUMENT_MAX_TOKENS)
+
+    Returns:
+        int: Token-Budget des Dokuments (mindestens 0)
+    """
+    budget = context_window(model) - reserved_output_tokens - prompt_tokens(parts, model) - PROMPT_SAFETY_TOKENS
+    limit = max_document_tokens if max_document_tokens is not None else PROMPT_DOCUMENT_MAX_TOKENS
+    if limit and limit > 0:
+        budget = min(budget, limit)
+    return max(budget, 0)
+
+
+def _last_match_end(pattern, text: str, start: int) -> Optional[int]:
+    """Ende des letzten Treffers ab start (None ohne Treffer)."""
+    end = None
+    for match in pattern.finditer(text, start):
+        end = match.end()
+    return end
+
+
+def truncate_at_boundary(text: str, max_tokens: int, model: str = DEFAULT_MODEL) -> str:
+    """
+    Kürzt einen Text auf höchstens max_tokens Tokens an einer Abschnitts- bzw. Satzgrenze.
+
+    Bevorzugt wird das Ende eines Abschnitts, dann ein Satzende, dann ein
+    Wortende, jeweils im letzten Teil des Budgets (BOUNDARY_SEARCH_SHARE).
+    Liegt dort keine Grenze, bleibt der tokengenaue Präfix erhalten.
+
+    Args:
+        text: Der Text
+        max_tokens: Maximale Anzahl Tokens
+        model: Modell, dessen Encoder verwendet wird
+
+    Returns:
+        str: Der (ggf. gekürzte) Text
+    """
+    prefix = truncate_to_tokens(text, max_tokens, model)
+    if len(prefix) >= len(text or ''):
+        return text or ''
+    start = int(len(prefix) * (1 - BOUNDARY_SEARCH_SHARE))
+    for pattern in (_SECTION_BOUNDARY, _SENTENCE_BOUNDARY, _WHITESPACE):
+        end = _last_match_end(pattern, prefix, start)
+        if end:
+            return prefix[:end].rstrip()
+    return prefix
+
+
+def fit_document(document: str, parts: Iterable[Any], model: str = DEFAULT_MODEL, reserved_output_tokens: int = 0,
+                 max_document_tokens: Optional[int] = None) -> str:
+    """
+    Passt ein Dokument in das Kontextfenster neben den festen Prompt-Teilen ein.
+
+    Args:
+        document: Text des Dokuments
+        parts: Feste Prompt-Teile ohne das Dokument (System-Prompt, Anweisungen, Beispiele)
+        model: Modell der Anfrage
+        reserved_output_tokens: Für die Antwort reservierte Tokens (max_tokens)
+        max_document_tokens: Optionale Obergrenze für das Dokument
+
+    Returns:
+        str: Das Dokument, bei Bedarf an einer Grenze gekürzt
+    """
+    if not document:
+        return document or ''
+    parts = list(parts)
+    budget = document_budget(parts, model, reserved_output_tokens, max_document_tokens)
+    fitted = truncate_at_boundary(document, budget, model)
+    if len(fitted) < len(document):
+        logger.info("[PROMPT BUDGET] Dokument für %s auf %s Tokens gekürzt (%s von %s Zeichen)",
+                    model, budget, len(fitted), len(document))
+    return fitted
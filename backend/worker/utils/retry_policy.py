@@ -0,0 +1,182 @@
+"""
+Nicht-blockierende Wiederholung von Generierungs-Tasks.
+
+Bei vorübergehenden OpenAI-Fehlern (Rate-Limit, Timeout, Serverfehler) wartet
+der Task nicht mehr mit time.sleep im Worker-Slot, sondern wird mit
+self.retry(countdown=...) neu eingeplant; der Slot ist während der Wartezeit
+frei. Die Wartezeit wächst exponentiell und wird zufällig gestreut, damit
+nach einem Ausfall nicht alle Tasks gleichzeitig zurückkehren. Zusätzlich hat
+jeder Upload ein Budget an Wiederholungen, sodass ein einzelner Upload die
+Queues während eines Ausfalls nicht dauerhaft belegt.
+
+Wartet ein Task nur auf die Lease einer anderen Ausführung (tasks/ledger.py),
+erhöht das ebenfalls request.retries. Solche Wartezyklen werden pro Task-ID
+gezählt (record_lease_wait) und nicht auf die Versuche angerechnet.
+"""
+import logging
+import os
+import random
+from typing import Any, Dict, Optional
+
+from redis_utils.client import get_redis_client
+
+logger = logging.getLogger(__name__)
+
+# Basis und Obergrenze der Wartezeit (Sekunden)
+RETRY_BASE_SECONDS = float(os.environ.get('OPENAI_RETRY_BASE_SECONDS', 10))
+RETRY_MAX_SECONDS = float(os.environ.get('OPENAI_RETRY_MAX_SECONDS', 300))
+# Wiederholungen über alle Tasks eines Uploads
+RETRY_BUDGET_PER_UPLOAD = int(os.environ.get('RETRY_BUDGET_PER_UPLOAD', 12))
+RETRY_BUDGET_TTL = 6 * 3600
+# Redis-Hash mit Zählern (scheduled, budget_exhausted, max_retries)
+RETRY_STATS_KEY = 'stats:retries'
+# Lebensdauer des Zählers der Lease-Wartezyklen eines Tasks (Sekunden)
+LEASE_WAITS_TTL = 6 * 3600
+
+
+def lease_waits_key(task_id) -> str:
+    """Anzahl der Wiederholungen eines Tasks, die nur auf eine Ledger-Lease gewartet haben."""
+    return f"ledger_lease_waits:{task_id}"
+
+
+def record_lease_wait(task_id) -> None:
+    """Zählt einen Wartezyklus auf eine Ledger-Lease (zählt nicht als Fehlversuch)."""
+    client = get_redis_client()
+    if not client or not task_id:
+        return
+    try:
+        pipe = client.pipeline(transaction=False)
+        pipe.incr(lease_waits_key(task_id))
+        pipe.expire(lease_waits_key(task_id), LEASE_WAITS_TTL)
+        pipe.execute()
+    except Exception as e:
+        logger.debug("Lease-Wartezähler für %s nicht verfügbar: %s", task_id, e)
+
+
+def lease_wait_count(task_id) -> int:
+    """Bisherige Lease-Wartezyklen eines Tasks (ohne Redis 0)."""
+    client = get_redis_client()
+    if not client or not task_id:
+        return 0
+    try:
+        return int(client.get(lease_waits_key(task_id)) or 0)
+    except Exception as e:
+        logger.debug("Lease-Wartezähler für %s nicht lesbar: %s", task_id, e)
+        return 0
+
+
+def retry_countdown(retries: int, retry_after: Optional[float] = None) -> int:
+    """
+    Wartezeit bis zur nächsten Ausführung (exponentiell, mit Jitter).
+
+    Args:
+        retries: Bisherige Wiederholungen des Tasks
+        retry_after: Vom Server empfohlene Mindestwartezeit (optional)
+
+    Returns:
+        int: Countdown in Sekunden
+    """
+    ceiling = min(RETRY_MAX_SECONDS, RETRY_BASE_SECONDS * (2 ** max(retries, 0)))
+    countdown = random.uniform(RETRY_BASE_SECONDS / 2, max(ceiling, RETRY_BASE_SECONDS / 2))
+    if retry_after:
+        countdown = max(countdown, retry_after)
+    return int(round(countdown))
+
+
+def consume_retry_budget(upload_id) -> bool:
+    """
+    Verbraucht eine Wiederholung aus dem Budget des Uploads.
+
+    Returns:
+        bool: True, wenn noch Budget vorhanden war (ohne Redis immer True)
+    """
+    client = get_redis_client()
+    if not client or not upload_id:
+        return True
+    key = f"retry_budget:{upload_id}"
+    try:
+        pipe = client.pipeline(transaction=False)
+        pipe.incr(key)
+        pipe.expire(key, RETRY_BUDGET_TTL)
+        used = pipe.execute()[0]
+    except Exception as e:
+        logger.debug("Retry-Budget für %s nicht verfügbar: %s", upload_id, e)
+        return True
+    return int(used) <= RETRY_BUDGET_PER_UPLOAD
+
+
+def _count(field: str):
+    """Erhöht einen Zähler in RETRY_STATS_KEY."""
+    client = get_redis_client()
+    if not client:
+        return
+    try:
+        client.hincrby(RETRY_STATS_KEY, field, 1)
+    except Exception as e:
+        logger.debug("Retry-Zähler konnte nicht erhöht werden: %s", e)
+
+
+def retry_generation(task, exc, task_type: str, uploaded_file_id, upload_id) -> Dict[str, Any]:
+    """
+    Plant einen Generierungs-Task nach einem vorübergehenden Fehler neu ein.
+
+    Löst celery.exceptions.Retry aus, solange Versuche und Budget des Uploads
+    reichen; danach wird ein Fehlerergebnis zurückgegeben.
+
+    Args:
+        task: Gebundener Celery-Task
+        exc: OpenAIRetryableError
+        task_type: 'flashcards', 'questions' oder 'topics'
+        uploaded_file_id: ID der Datei
+        upload_id: ID des Uploads
+
+    Returns:
+        dict: Fehlerergebnis, wenn nicht mehr wiederholt wird
+    """
+    # Wartezyklen auf eine Ledger-Lease sind keine Fehlversuche
+    lease_waits = min(lease_wait_count(task.request.id), task.request.retries or 0)
+    retries = (task.request.retries or 0) - lease_waits
+    if task.max_retries is not None and retries >= task.max_retries:
+        logger.error(f"[RETRY] {task_type} für {uploaded_file_id}: keine Versuche mehr ({retries}/{task.max_retries}): {exc}")
+        _count('max_retries')
+    elif not consume_retry_budget(upload_id):
+        logger.error(f"[RETRY] {task_type} für {uploaded_file_id}: Retry-Budget von Upload {upload_id} "
+                     f"({RETRY_BUDGET_PER_UPLOAD}) erschöpft: {exc}")
+        _count('budget_exhausted')
+    else:
+        countdown = retry_countdown(retries, getattr(exc, 'retry_after', None))
+        logger.warning(f"[RETRY] {task_type} für {uploaded_file_id}: {exc} - neuer Versuch in {countdown}s "
+                       f"({retries + 1}/{task.max_retries})")
+        _count('scheduled')
+        # Celery prüft max_retries gegen request.retries, das die Lease-Wartezyklen enthält
+        max_retries = task.max_retries + lease_waits if task.max_retries is not None else None
+        raise task.retry(exc=exc, countdown=countdown, max_retries=max_retries)
+
+    return {
+        'status': 'error',
+        'uploaded_file_id': uploaded_file_id,
+        'upload_id': upload_id,
+        'error': str(exc),
+    }
+
+
+def get_retry_stats() -> Dict[str, int]:
+    """
+    Gibt die Zähler der Task-Wiederholungen zurück.
+
+    Returns:
+        dict: {'scheduled', 'budget_exhausted', 'max_retries'}
+    """
+    stats = {'scheduled': 0, 'budget_exhausted': 0, 'max_retries': 0}
+    client = get_redis_client()
+    if not client:
+        return stats
+    try:
+        raw = client.hgetall(RETRY_STATS_KEY) or {}
+    except Exception as e:
+        logger.debug("Retry-Zähler konnten nicht gelesen werden: %s", e)
+        return stats
+    for field, value in raw.items():
+        field = field.decode('utf-8') if isinstance(field, bytes) else field
+        stats[field] = int(value)
+    return stats
@@ -6,6 +6,9 @@ import logging
 import uuid
 from datetime import datetime
 import json
+import os
+
+from utils.llm_backend import is_local_model
 
 # Worker-spezifische Imports
 from tasks.models import TokenUsage, User, get_db_session # Nutze Worker-Modelle und DB Session
@@ -18,6 +21,12 @@ GPT4_INPUT_COST_PER_1K = 10
 GPT4_OUTPUT_COST_PER_1K = 30
 GPT35_INPUT_COST_PER_1K = 1.5
 GPT35_OUTPUT_COST_PER_1K = 2
+GPT4O_MINI_INPUT_COST_PER_1K = 0.15
+GPT4O_MINI_OUTPUT_COST_PER_1K = 0.6
+# Lokale Modelle (utils/llm_backend.py) verursachen keine Provider-Kosten; Ein- und Ausgabe pro 1000 Tokens
+LOCAL_LLM_COST_PER_1K = float(os.environ.get('LOCAL_LLM_COST_PER_1K', 0))
+# Batch-API-Aufträge werden vom Provider mit 50 % Rabatt abgerechnet
+BATCH_COST_FACTOR = 0.5
 
 def calculate_token_cost(model: str, input_tokens: int, output_tokens: int) -> float:
     """Berechnet die Kosten in Credits basierend auf dem Modell und den Tokens."""
@@ -25,7 +34,11 @@ def calculate_token_cost(model: str, input_tokens: int, output_tokens: int) -> f
     model_lower = model.lower()
     
     # Vereinfachte Kostenberechnung (Modellnamen anpassen!)
-    if 'gpt-4'.casefold() in model_lower:
+    if is_local_model(model):
+        cost = (input_tokens + output_tokens) / 1000 * LOCAL_LLM_COST_PER_1K
+    elif 'gpt-4o-mini' in model_lower:
+        cost = (input_tokens / 1000 * GPT4O_MINI_INPUT_COST_PER_1K) + (output_tokens / 1000 * GPT4O_MINI_OUTPUT_COST_PER_1K)
+    elif 'gpt-4'.casefold() in model_lower:
         cost = (input_tokens / 1000 * GPT4_INPUT_COST_PER_1K) + (output_tokens / 1000 * GPT4_OUTPUT_COST_PER_1K)
     elif 'gpt-3.5-turbo'.casefold() in model_lower:
         cost = (input_tokens / 1000 * GPT35_INPUT_COST_PER_1K) + (output_tokens / 1000 * GPT35_OUTPUT_COST_PER_1K)
@@ -37,10 +50,16 @@ def calculate_token_cost(model: str, input_tokens: int, output_tokens: int) -> f
     return max(1, round(cost)) # Mindestens 1 Credit, aufrunden
 
 def update_token_usage(user_id: str, session_id: str, input_tokens: int, output_tokens: int, model: str,
-                       endpoint: str = None, function_name: str = None, is_cached: bool = False, metadata: dict = None) -> dict:
+                       endpoint: str = None, function_name: str = None, is_cached: bool = False, metadata: dict = None,
+                       cached_tokens: int = 0) -> dict:
     """
     Aktualisiert die Token-Nutzungsstatistik für einen Benutzer und zieht die Credits ab.
     Verwendet die Worker-DB-Session.
+
+    cached_tokens ist der Anteil der input_tokens, den der Provider aus seinem
+    Prompt-Cache bedient hat (usage.prompt_tokens_details.cached_tokens).
+    Nutzung aus Batch-Aufträgen (metadata['mode'] == 'batch') wird mit
+    BATCH_COST_FACTOR berechnet.
     """
     db_session = None
     credits_cost = 0 # Sicherstellen, dass definiert
@@ -49,6 +68,8 @@ def update_token_usage(user_id: str, session_id: str, input_tokens: int, output_
         
         # Kosten berechnen
         credits_cost = calculate_token_cost(model=model, input_tokens=input_tokens, output_tokens=output_tokens)
+        if metadata and metadata.get('mode') == 'batch':
+            credits_cost = max(1, round(credits_cost * BATCH_COST_FACTOR))
 
         user = db_session.query(User).get(user_id)
         if not user:
@@ -77,6 +98,7 @@ def update_token_usage(user_id: str, session_id: str, input_tokens: int, output_
             model=model,
             input_tokens=input_tokens,
             output_tokens=output_tokens,
+            cached_tokens=cached_tokens or 0,
             cost=credits_cost,
             endpoint=endpoint or "worker_task",
             function_name=function_name or "unknown_ai_task",
@@ -86,7 +108,7 @@ def update_token_usage(user_id: str, session_id: str, input_tokens: int, output_
         db_session.add(token_usage)
         db_session.commit()
 
-        logger.info(f"[Token Worker] Token-Nutzung für User {user_id} gespeichert (ID: {token_usage.id}). Kosten: {credits_cost}")
+        logger.info(f"[Token Worker] Token-Nutzung für User {user_id} gespeichert (ID: {token_usage.id}). Kosten: {credits_cost}, gecachte Prompt-Tokens: {cached_tokens or 0}")
 
         return {
             "success": True,
@@ -0,0 +1,157 @@
+"""
+Validierung generierter Lernmaterialien im Worker.
+Angepasst aus main/api/flashcards/validation.py und main/api/questions/validation.py
+(gleiche Regeln, aber auf die Feldnamen der Worker-Generierung abgebildet).
+"""
+import logging
+from typing import Any, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+def rejection(index: Optional[int], error: str) -> Dict[str, Any]:
+    """
+    Strukturierter Ablehnungsgrund eines Eintrags.
+
+    Args:
+        index: Position des Eintrags (None für Einzel-Ergebnisse)
+        error: Fehlermeldung der Validierung ("feld: Meldung" oder nur Meldung)
+
+    Returns:
+        dict: {'index', 'field', 'reason'}
+    """
+    field, separator, reason = error.partition(': ')
+    if not separator or not field.isidentifier():
+        field, reason = None, error
+    return {'index': index, 'field': field, 'reason': reason}
+
+
+def validate_flashcard_data(card: Dict[str, Any]) -> Tuple[bool, str]:
+    """
+    Validiert eine generierte Lernkarte ({'question', 'answer'}).
+
+    Returns:
+        (bool, str): Erfolgs-Flag und Fehlermeldung (falls vorhanden)
+    """
+    if not isinstance(card, dict):
+        return False, "Lernkarte ist kein Objekt"
+    question = (card.get('question') or '').strip()
+    answer = (card.get('answer') or '').strip()
+    if len(question) < 2 or len(question) > 500:
+        return False, "question: Die Vorderseite muss 2 bis 500 Zeichen lang sein."
+    if len(answer) < 2 or len(answer) > 1000:
+        return False, "answer: Die Rückseite muss 2 bis 1000 Zeichen lang sein."
+    return True, ""
+
+
+def validate_generated_flashcards(flashcards: Optional[List[Dict[str, Any]]]) -> Tuple[list, list]:
+    """
+    Validiert eine Liste von generierten Lernkarten.
+
+    Ungültige Lernkarten werden einzeln verworfen, die übrigen bleiben erhalten.
+
+    Returns:
+        (list, list): Gültige Lernkarten und Ablehnungsgründe (siehe rejection)
+    """
+    valid_flashcards = []
+    rejected = []
+
+    for i, flashcard in enumerate(flashcards or []):
+        is_valid, error = validate_flashcard_data(flashcard)
+        if is_valid:
+            valid_flashcards.append(flashcard)
+        else:
+            rejected.append(rejection(i, error))
+            logger.warning("Ungültige Lernkarte %d: %s", i + 1, error)
+
+    return valid_flashcards, rejected
+
+
+def validate_question_data(question: Dict[str, Any]) -> Tuple[bool, str]:
+    """
+    Validiert eine generierte Frage.
+
+    Multiple-Choice-Fragen ({'question', 'options', 'correct_answer'}) werden
+    wie im Main-Backend geprüft; offene und Wahr/Falsch-Fragen nur auf Pflichtfelder.
+
+    Returns:
+        (bool, str): Erfolgs-Flag und Fehlermeldung (falls vorhanden)
+    """
+    if not isinstance(question, dict):
+        return False, "Frage ist kein Objekt"
+    if question.get('fallback'):
+        return False, "Platzhalter-Frage statt generierter Frage"
+
+    if 'statement' in question:
+        if len((question.get('statement') or '').strip()) < 5:
+            return False, "statement: Die Aussage muss mindestens 5 Zeichen lang sein."
+        return True, ""
+
+    text = (question.get('question') or '').strip()
+    if len(text) < 5 or len(text) > 500:
+        return False, "question: Der Fragetext muss 5 bis 500 Zeichen lang sein."
+
+    if 'options' not in question:
+        if not (question.get('answer') or '').strip():
+            return False, "answer: Offene Fragen benötigen eine Musterantwort."
+        return True, ""
+
+    options = question.get('options') or []
+    if len(options) < 2 or len(options) > 10:
+        return False, "options: Es müssen 2 bis 10 Antwortmöglichkeiten angegeben werden."
+    for option in options:
+        if not isinstance(option, str) or not option.strip() or len(option) > 300:
+            return False, "options: Antwortmöglichkeiten müssen 1 bis 300 Zeichen lang sein."
+
+    correct = question.get('correct_answer')
+    if not isinstance(correct, int) or correct < 0 or correct >= len(options):
+        return False, "correct_answer: Der Index der korrekten Antwort ist ungültig."
+    return True, ""
+
+
+def validate_generated_questions(questions: Optional[List[Dict[str, Any]]]) -> Tuple[list, list]:
+    """
+    Validiert eine Liste von generierten Fragen.
+
+    Ungültige Fragen werden einzeln verworfen, die übrigen bleiben erhalten.
+
+    Returns:
+        (list, list): Gültige Fragen und Ablehnungsgründe (siehe rejection)
+    """
+    valid_questions = []
+    rejected = []
+
+    for i, question in enumerate(questions or []):
+        is_valid, error = validate_question_data(question)
+        if is_valid:
+            valid_questions.append(question)
+        else:
+            rejected.append(rejection(i, error))
+            logger.warning("Ungültige Frage %d: %s", i + 1, error)
+
+    return valid_questions, rejected
+
+
+def validate_generated_topics(topics_data: Optional[Dict[str, Any]]) -> Tuple[Optional[dict], list]:
+    """
+    Validiert das Ergebnis der Themenextraktion.
+
+    Returns:
+        (dict|None, list): Die Themen, falls gültig (sonst None), und Ablehnungsgründe (siehe rejection)
+    """
+    error_messages = []
+    if not isinstance(topics_data, dict):
+        return None, [rejection(None, "Themen-Ergebnis ist kein Objekt")]
+
+    main_topic = topics_data.get('main_topic') or {}
+    title = (main_topic.get('title') or '').strip() if isinstance(main_topic, dict) else ''
+    if not title or title == 'Hauptthema':
+        error_messages.append("main_topic: Kein Hauptthema extrahiert")
+    if not topics_data.get('subtopics'):
+        error_messages.append("subtopics: Keine Unterthemen extrahiert")
+
+    if error_messages:
+        for error in error_messages:
+            logger.warning("Ungültiges Themen-Ergebnis: %s", error)
+        return None, [rejection(None, error) for error in error_messages]
+    return topics_data, []